@@ -502,9 +502,12 @@ def acl():
     table.oacl.represent = lambda val: acl_represent(val,
                                                      auth.permission.PERMISSION_OPTS)
 
+    acl_onaccept = auth.permission.acl_onaccept
     s3db.configure(tablename,
                    create_next = URL(r=request),
-                   update_next = URL(r=request))
+                   update_next = URL(r=request),
+                   onaccept = acl_onaccept,
+                   ondelete = acl_onaccept)
 
     if "_next" in request.vars:
         next = request.vars._next
@@ -125,6 +125,10 @@ else:
 # Set up logger (before any module attempts to use it!)
 import s3log
 s3log.S3Log.setup()
+
+# Request profiler
+if settings.get_base_profile():
+    s3.profiler = s3base.S3Profiler(db)
     
 # AAA
 current.auth = auth = s3base.AuthS3()
@@ -215,4 +219,9 @@ def s3_auth_on_logout(user):
     """
     s3_clear_session()
 
+# -----------------------------------------------------------------------------
+if s3.profiler:
+    # (includes all model files before 00_db)
+    s3.profiler.checkpoint("00_db")
+
 # END =========================================================================
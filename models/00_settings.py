@@ -313,4 +313,8 @@ s3.crud_strings = Storage(
     name_nice = T("Record"),
     name_nice_plural = T("Records"))
 
+# -----------------------------------------------------------------------------
+if s3.profiler:
+    s3.profiler.checkpoint("00_settings")
+
 # END =========================================================================
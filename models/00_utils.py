@@ -315,6 +315,7 @@ def s3_rest_controller(prefix=None, resourcename=None, **attr):
     set_handler("map", s3base.S3Map)
     set_handler("profile", s3base.S3Profile)
     set_handler("report", s3base.S3Report)
+    set_handler("tile", s3base.S3MapTile)
     set_handler("timeplot", s3base.S3TimePlot) # temporary setting for testing
     set_handler("search_ac", s3base.search_ac)
     set_handler("summary", s3base.S3Summary)
@@ -416,4 +417,8 @@ def s3_rest_controller(prefix=None, resourcename=None, **attr):
 # Enable access to this function from modules
 current.rest_controller = s3_rest_controller
 
+# -----------------------------------------------------------------------------
+if s3.profiler:
+    s3.profiler.checkpoint("00_utils")
+
 # END =========================================================================
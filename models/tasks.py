@@ -194,6 +194,24 @@ def org_facility_geojson(user_id=None):
 
 tasks["org_facility_geojson"] = org_facility_geojson
 
+# -----------------------------------------------------------------------------
+def pr_rebuild_ancestors(pe_ids, user_id=None):
+    """
+        Update the Ancestor Index for person entities and their descendants
+            - will normally be done Asynchronously if there is a worker alive
+
+        @param pe_ids: the person entity IDs (in JSON format)
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task
+    s3db.pr_rebuild_ancestors(json.loads(pe_ids))
+    db.commit()
+
+tasks["pr_rebuild_ancestors"] = pr_rebuild_ancestors
+
 # -----------------------------------------------------------------------------
 if settings.has_module("msg"):
 
@@ -317,8 +335,8 @@ if settings.has_module("msg"):
             Asynchronous task to notify a subscriber about resource
             updates. This task is created by notify_check_subscriptions.
 
-            @param subscription: JSON with the subscription data
-            @param now: lookup date (@todo: remove this)
+            @param resource_id: the pr_subscription_resource record ID,
+                                or a list of record IDs (batch mode)
         """
         if user_id:
             auth.s3_impersonate(user_id)
@@ -489,6 +507,47 @@ if settings.has_module("sync"):
 
     tasks["sync_synchronize"] = sync_synchronize
 
+# -----------------------------------------------------------------------------
+def s3_find_duplicates(tablename, threshold=None, user_id=None):
+    """
+        Find duplicate records in a table (see S3DuplicateFinder),
+        candidate pairs can then be reviewed in the deduplicate method
+        of the table's controller
+
+        @param tablename: the table name
+        @param threshold: the minimum similarity score (percentage)
+        @param user_id: calling request's auth.user.id or None
+    """
+
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task & return the result
+    finder = s3base.S3DuplicateFinder(tablename, threshold=threshold)
+    result = finder.run()
+    db.commit()
+    return result
+
+tasks["s3_find_duplicates"] = s3_find_duplicates
+
+# -----------------------------------------------------------------------------
+def s3task_batch(task, calls=None, user_id=None):
+    """
+        Run a batch of queued calls of a task (see S3Task.enqueue)
+
+        @param task: the task name
+        @param calls: list of calls [args, vars]
+        @param user_id: not used (each call carries its own user_id)
+    """
+
+    if not calls:
+        return None
+    # Run the Task & return the metrics
+    result = s3task.run_batch(task, calls)
+    return json.dumps(result)
+
+tasks["s3task_batch"] = s3task_batch
+
 # -----------------------------------------------------------------------------
 # Instantiate Scheduler instance with the list of tasks
 s3.tasks = tasks
@@ -502,4 +561,8 @@ scheduler_task_id = S3ReusableField("scheduler_task_id",
                                     ondelete="CASCADE")
 s3.scheduler_task_id = scheduler_task_id
 
+# -----------------------------------------------------------------------------
+if s3.profiler:
+    s3.profiler.checkpoint("tasks")
+
 # END =========================================================================
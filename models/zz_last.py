@@ -44,3 +44,11 @@ if auth.permission.format in ("html"):
 
     # Add breadcrumbs
     menu.breadcrumbs = S3OptionsMenu.breadcrumbs
+
+# -----------------------------------------------------------------------------
+if s3.profiler:
+    s3.profiler.checkpoint("zz_last")
+    # Profile the controller
+    response._caller = s3.profiler.caller
+
+# END =========================================================================
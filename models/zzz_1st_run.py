@@ -5,17 +5,21 @@
 # Set settings.base.prepopulate to 0 in Production
 # (to save 1x DAL hit every page).
 pop_list = settings.get_base_prepopulate()
+resume = False
 if pop_list == 0:
     pop_list = []
 else:
     table = db[auth.settings.table_group_name]
     # The query used here takes 2/3 the time of .count().
     if db(table.id > 0).select(table.id, limitby=(0, 1)).first():
-        pop_list = []
+        # Resume an interrupted PrePopulate import?
+        resume = s3base.S3BulkImporter.interrupted()
+        if not resume:
+            pop_list = []
     if not isinstance(pop_list, (list, tuple)):
         pop_list = [pop_list]
 
-if len(pop_list) > 0:
+if len(pop_list) > 0 and not resume:
 
     # =========================================================================
     # Populate default roles and permissions
@@ -160,12 +164,43 @@ if len(pop_list) > 0:
     field = "last_name"
     db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
 
+    # Ancestor index lookups
+    tablename = "pr_ancestor"
+    field = "ancestor_pe_id"
+    db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
+    field = "descendant_pe_id"
+    db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
+
+    # Person name index lookups (key first to cover the search query)
+    tablename = "pr_person_name_key"
+    db.executesql("CREATE INDEX name_key__idx on %s(name_key, person_id);" % tablename)
+    db.executesql("CREATE INDEX name_key_person_id__idx on %s(person_id);" % tablename)
+
     # GIS
     # Add extra index on search field
     # Should work for our 3 supported databases: sqlite, MySQL & PostgreSQL
     tablename = "gis_location"
     field = "name"
     db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
+    # Simplified polygons store lookups
+    tablename = "gis_simplified"
+    db.executesql("CREATE INDEX simplified__idx on %s(tablename, record_id);" % tablename)
+
+    # Search key lookups (prefix queries, PostgreSQL can only use the
+    # index for LIKE with the pattern operator class)
+    tablename = "s3_search_key"
+    s3db.table(tablename)
+    if settings.get_database_type() == "postgres":
+        db.executesql("CREATE INDEX search_key__idx on %s(tablename, search_key varchar_pattern_ops);" % tablename)
+    else:
+        db.executesql("CREATE INDEX search_key__idx on %s(tablename, search_key);" % tablename)
+    db.executesql("CREATE INDEX search_key_record__idx on %s(tablename, record_id);" % tablename)
+
+    # Survey answer column lookups
+    if has_module("survey"):
+        tablename = "survey_answer_column"
+        s3db.table(tablename)
+        db.executesql("CREATE INDEX answer_column__idx on %s(series_id, question_id);" % tablename)
 
     # Messaging Module
     if has_module("msg"):
@@ -233,12 +268,27 @@ if len(pop_list) > 0:
     # Ensure DB population committed when running through shell
     db.commit()
 
+if len(pop_list) > 0:
+
+    if resume:
+        import sys
+        print >> sys.stdout, "Resuming the interrupted database population"
+        auth.override = True
+        s3db.load_all_models()
+        path_join = os.path.join
+        request_folder = request.folder
+        has_module = settings.has_module
+        map_admin = auth.get_system_roles().MAP_ADMIN
+
     # =========================================================================
     # PrePopulate import (from CSV)
     #
 
     # Create the bulk Importer object
     bi = s3base.S3BulkImporter()
+    if not resume:
+        # Discard any checkpoint of a previous database
+        bi.clear_checkpoint()
 
     s3.import_role = bi.import_role
     s3.import_user = bi.import_user
@@ -345,6 +395,9 @@ if len(pop_list) > 0:
         # older Python
         print >> sys.stdout, "Pre-populate completed in %s" % duration
 
+    # Pre-populate complete, nothing to resume
+    bi.clear_checkpoint()
+
     # Restore view
     response.view = "default/index.html"
 
@@ -66,6 +66,9 @@ from s3task import *
 # Hierarchy Handling
 from s3hierarchy import *
 
+# Request Profiler
+from s3profiler import *
+
 # Core Framework ==============================================================
 
 # Model Extensions
@@ -106,7 +109,7 @@ from s3sync import *
 from s3import import *
 
 # De-duplication
-from s3merge import S3Merge
+from s3merge import S3Merge, S3DuplicateFinder
 
 # Don't load S3PDF unless needed (very slow import with reportlab)
 #from s3pdf import S3PDF
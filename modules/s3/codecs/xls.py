@@ -75,6 +75,9 @@ class S3XLS(S3Codec):
 
             @param resource: the resource
             @param list_fields: fields to include in list views
+
+            @note: the rows are returned as generator which extracts
+                   the records batch-wise from the resource
         """
 
         title = self.crud_string(resource.tablename, "title_list")
@@ -87,18 +90,15 @@ class S3XLS(S3Codec):
         if orderby is None:
             orderby = resource.get_config("orderby", None)
 
-        result = resource.select(list_fields,
-                                 left=left,
-                                 limit=None,
-                                 count=True,
-                                 getids=True,
-                                 orderby=orderby,
-                                 represent=True,
-                                 show_links=False)
-
-        rfields = result["rfields"]
-        rows = result["rows"]
-        
+        rfields = resource.resolve_selectors(list_fields,
+                                             extra_fields=False)[0]
+        rows = resource.iter_select(list_fields,
+                                    left=left,
+                                    orderby=orderby,
+                                    represent=True,
+                                    show_links=False)
+
+
         types = []
         lfields = []
         heading = {}
@@ -181,7 +181,8 @@ class S3XLS(S3Codec):
             (title, types, lfields, headers, rows) = self.extractResource(data_source,
                                                                           list_fields)
         report_groupby = lfields[group] if group else None
-        if len(rows) > 0 and len(headers) != len(rows[0]):
+        if isinstance(rows, (list, tuple)) and \
+           len(rows) > 0 and len(headers) != len(rows[0]):
             msg = """modules/s3/codecs/xls: There is an error in the list_items, a field doesn't exist"
 requesting url %s
 Headers = %d, Data Items = %d
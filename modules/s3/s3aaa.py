@@ -38,7 +38,10 @@ __all__ = ["AuthS3",
            ]
 
 import datetime
+import hashlib
 #import re
+import threading
+import time
 from uuid import uuid4
 
 try:
@@ -3066,6 +3069,7 @@ S3OptionsFilter({
             db(pquery).update(deleted=True)
             # Remove the role
             db(gquery).update(role=None, deleted=True)
+            S3PermissionCache.invalidate()
 
     # -------------------------------------------------------------------------
     def s3_assign_role(self, user_id, group_id, for_pe=None):
@@ -3135,6 +3139,7 @@ S3OptionsFilter({
                 if for_pe is not None and str(group_id) not in unrestrictable:
                     membership["pe_id"] = for_pe
                 membership_id = mtable.insert(**membership)
+        S3PermissionCache.invalidate()
 
         # Update roles for current user if required
         if self.user and str(user_id) == str(self.user.id):
@@ -3208,6 +3213,7 @@ S3OptionsFilter({
                             deleted_fk=deleted_fk,
                             user_id=None,
                             group_id=None)
+        S3PermissionCache.invalidate()
 
         # Update roles for current user if required
         if self.user and str(user_id) == str(self.user.id):
@@ -3453,6 +3459,7 @@ S3OptionsFilter({
         for role_id in roles:
             for group_id in group_ids:
                 dtable.insert(role_id=role_id, group_id=group_id)
+        S3PermissionCache.invalidate()
 
         # Update roles for current user if required
         self.s3_set_roles()
@@ -3550,6 +3557,7 @@ S3OptionsFilter({
 
         # Maybe update the current user's delegations?
         if len(rmv):
+            S3PermissionCache.invalidate()
             self.s3_set_roles()
         return True
 
@@ -4735,6 +4743,14 @@ class S3Permission(object):
         self.page_acls = Storage()
         self.table_acls = Storage()
 
+        # Shared cache for compiled ACLs
+        if self.use_cacls:
+            self.cache = S3PermissionCache.get_cache()
+        else:
+            self.cache = None
+        # Cache keys for realms/delegations {(id, id): (realms, delegations, key)}
+        self.realm_keys = {}
+
         # Pages which never require permission:
         # Make sure that any data access via these pages uses
         # accessible_query explicitly!
@@ -4781,6 +4797,31 @@ class S3Permission(object):
                             *(s3_uid()+s3_timestamp()+s3_deletion_status()))
             self.table = db[self.tablename]
 
+        # Generation counter for the shared ACL cache
+        tablename = S3PermissionCache.TABLENAME
+        db = current.db
+        if tablename not in db:
+            db.define_table(tablename,
+                            Field("generation", "integer", default=0),
+                            migrate=migrate,
+                            fake_migrate=fake_migrate)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def acl_onaccept(form):
+        """
+            Invalidate the permission caches when ACLs are created,
+            updated or deleted via CRUD (used as both onaccept and
+            ondelete callback for the permissions table)
+
+            @param form: the form (or the deleted row)
+        """
+
+        s3 = current.response.s3
+        s3.pop("permissions", None)
+        s3.pop("restricted_tables", None)
+        S3PermissionCache.invalidate()
+
     # -------------------------------------------------------------------------
     # ACL Management
     # -------------------------------------------------------------------------
@@ -4824,6 +4865,7 @@ class S3Permission(object):
             del s3["permissions"]
         if "restricted_tables" in s3:
             del s3["restricted_tables"]
+        S3PermissionCache.invalidate()
 
         if c is None and f is None and t is None:
             return None
@@ -5799,6 +5841,64 @@ class S3Permission(object):
                         f=None,
                         t=None,
                         entity=[]):
+        """
+            Find all applicable ACLs for the specified situation for
+            the specified realms and delegations, using the shared
+            ACL cache if enabled
+
+            @param racl: the required ACL
+            @param realms: the realms
+            @param delegations: the delegations
+            @param c: the controller name, falls back to current request
+            @param f: the function name, falls back to current request
+            @param t: the tablename
+            @param entity: the realm entity
+
+            @return: None for no ACLs defined (allow),
+                      [] for no ACLs applicable (deny),
+                      or list of applicable ACLs
+        """
+
+        cache = self.cache
+        if cache is None or not self.use_cacls:
+            return self._applicable_acls(racl,
+                                         realms=realms,
+                                         delegations=delegations,
+                                         c=c,
+                                         f=f,
+                                         t=t,
+                                         entity=entity)
+
+        key = ("acls",
+               racl,
+               self.realm_key(realms, delegations),
+               c or self.controller,
+               f or self.function,
+               str(t) if t is not None else None,
+               entity,
+               )
+        acls = cache.get(key)
+        if acls is None:
+            acls = self._applicable_acls(racl,
+                                         realms=realms,
+                                         delegations=delegations,
+                                         c=c,
+                                         f=f,
+                                         t=t,
+                                         entity=entity)
+            cache.set(key, dict(acls))
+        else:
+            acls = Storage(acls)
+        return acls
+
+    # -------------------------------------------------------------------------
+    def _applicable_acls(self, racl,
+                         realms=None,
+                         delegations=None,
+                         c=None,
+                         f=None,
+                         t=None,
+                         entity=[]):
         """
             Find all applicable ACLs for the specified situation for
             the specified realms and delegations
@@ -5867,7 +5967,15 @@ class S3Permission(object):
             table_restricted = self.table_restricted(t)
 
         # Retrieve the ACLs
-        if q:
+        if q and self.cache is not None:
+            if page_restricted:
+                pc, pf = c, f if self.use_facls else None
+            else:
+                pc = pf = None
+            rows = self.compiled_acls(roles, pc, pf,
+                                      str(t) if t and self.use_tacls else None,
+                                      )
+        elif q:
             query &= q
             rows = db(query).select(table.group_id,
                                     table.controller,
@@ -6068,6 +6176,85 @@ class S3Permission(object):
 
         return result
 
+    # -------------------------------------------------------------------------
+    def compiled_acls(self, roles, c=None, f=None, t=None):
+        """
+            Select the ACLs for a page and/or table from the compiled
+            ACLs of a role set (equivalent of the query in
+            _applicable_acls, but without querying the database once
+            the ACLs of the role set are cached)
+
+            @param roles: the role set (group IDs)
+            @param c: the controller name (None to skip page ACLs)
+            @param f: the function name (None to skip function ACLs)
+            @param t: the tablename (None to skip table ACLs)
+        """
+
+        cache = self.cache
+        key = ("rows", tuple(sorted(roles)))
+        compiled = cache.get(key)
+        if compiled is None:
+            table = self.table
+            query = (table.deleted != True) & \
+                    (table.group_id.belongs(roles))
+            rows = current.db(query).select(table.group_id,
+                                            table.controller,
+                                            table.function,
+                                            table.tablename,
+                                            table.unrestricted,
+                                            table.entity,
+                                            table.uacl,
+                                            table.oacl,
+                                            )
+            compiled = [row.as_dict() for row in rows]
+            cache.set(key, compiled)
+
+        acls = []
+        append = acls.append
+        for acl in compiled:
+            controller = acl["controller"]
+            function = acl["function"]
+            if c is not None and controller == c and \
+               (function is None or f is not None and function == f):
+                append(Storage(acl))
+            elif t is not None and controller is None and \
+                 function is None and acl["tablename"] == t:
+                append(Storage(acl))
+        return acls
+
+    # -------------------------------------------------------------------------
+    def realm_key(self, realms, delegations):
+        """
+            Get a cache key for a set of realms and delegations (computed
+            only once per request)
+
+            @param realms: the realms {group_id: [pe_id, ...] or None}
+            @param delegations: the delegations
+                                {group_id: {receiver: [pe_id, ...]}}
+        """
+
+        realm_keys = self.realm_keys
+        k = (id(realms), id(delegations))
+        if k in realm_keys:
+            r, d, key = realm_keys[k]
+            if r is realms and d is delegations:
+                return key
+
+        def freeze(item):
+            if isinstance(item, dict):
+                return tuple(sorted((k, freeze(v)) for k, v in item.items()))
+            elif isinstance(item, (list, tuple, set)):
+                return tuple(sorted(freeze(i) for i in item))
+            else:
+                return item
+
+        key = hashlib.md5(repr((freeze(realms),
+                                freeze(delegations),
+                                self.policy,
+                                ))).hexdigest()
+        realm_keys[k] = (realms, delegations, key)
+        return key
+
     # -------------------------------------------------------------------------
     # Utilities
     # -------------------------------------------------------------------------
@@ -6101,13 +6288,19 @@ class S3Permission(object):
         s3 = current.response.s3
 
         if not "restricted_tables" in s3:
-            table = self.table
-            query = (table.deleted != True) & \
-                    (table.controller == None) & \
-                    (table.function == None)
-            rows = current.db(query).select(table.tablename,
-                                            groupby=table.tablename)
-            s3.restricted_tables = [row.tablename for row in rows]
+            cache = self.cache
+            restricted = cache.get(("restricted",)) if cache else None
+            if restricted is None:
+                table = self.table
+                query = (table.deleted != True) & \
+                        (table.controller == None) & \
+                        (table.function == None)
+                rows = current.db(query).select(table.tablename,
+                                                groupby=table.tablename)
+                restricted = [row.tablename for row in rows]
+                if cache:
+                    cache.set(("restricted",), restricted)
+            s3.restricted_tables = restricted
 
         return str(t) in s3.restricted_tables
 
@@ -6257,6 +6450,204 @@ class S3Permission(object):
                     del permissions[key]
         return
 
+# =============================================================================
+class S3PermissionCache(object):
+    """
+        Shared cache for compiled ACLs (the ACL records per role set,
+        and the applicable ACLs per role/realm/delegation set and page),
+        keeps them across requests.
+
+        The default backend is a process-wide dict, other backends can
+        be plugged in by name of a web2py cache model (e.g. "disk" for
+        current.cache.disk to share the cache between processes).
+
+        Entries are invalidated all at once (by incrementing the cache
+        generation) whenever ACLs, role assignments or delegations change.
+        The generation counter is stored in the database, so that all
+        processes see the change (with their next request) regardless
+        of the backend.
+    """
+
+    PREFIX = "s3acl"
+
+    # Table for the generation counter
+    TABLENAME = "s3_permission_generation"
+
+    # The currently configured instance
+    instance = None
+
+    def __init__(self, backend=None, maxsize=10000, expire=None):
+        """
+            Constructor
+
+            @param backend: name of the web2py cache model to use as
+                            backend, or None for a process-wide dict
+            @param maxsize: the maximum number of entries in the
+                            process-wide dict
+            @param expire: time in seconds after which entries expire
+                           (None for no expiry)
+        """
+
+        self.backend = backend
+        self.maxsize = maxsize
+        self.expire = expire
+
+        self.lock = threading.RLock()
+
+        # Process-wide entries {key: (value, timestamp)}
+        self.entries = OrderedDict()
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get_cache(cls):
+        """
+            Get the shared ACL cache as configured in deployment settings
+
+            @return: the S3PermissionCache instance, or None if disabled
+        """
+
+        settings = current.deployment_settings
+        backend = settings.get_security_acl_cache()
+        if not backend:
+            cls.instance = None
+            return None
+        if backend is True or backend == "ram":
+            backend = None
+        expire = settings.get_security_acl_cache_expire()
+
+        instance = cls.instance
+        if instance is None or instance.backend != backend:
+            instance = cls.instance = cls(backend=backend, expire=expire)
+        else:
+            instance.expire = expire
+        return instance
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def invalidate(cls):
+        """
+            Invalidate all cached ACLs, to be called whenever ACLs,
+            role assignments or delegations change
+        """
+
+        cache = cls.get_cache()
+        if cache is None:
+            return
+        table = cls._table()
+        with cache.lock:
+            if table is not None:
+                # Increment the generation for all processes
+                query = (table.id > 0)
+                if not current.db(query).update(generation=table.generation + 1):
+                    table.insert(generation=1)
+            else:
+                cache.generation += 1
+            cache.entries.clear()
+        current.response.pop(cache.PREFIX, None)
+        return
+
+    # -------------------------------------------------------------------------
+    def get(self, key):
+        """
+            Get a cached entry
+
+            @param key: the key (a tuple of simple types)
+            @return: the cached value, or None if not found
+        """
+
+        key = self._key(key)
+        backend = self._backend()
+        with self.lock:
+            if backend is not None:
+                value = backend(key, lambda: None, time_expire=self.expire)
+            else:
+                entry = self.entries.get(key)
+                value = None
+                if entry is not None:
+                    value, timestamp = entry
+                    expire = self.expire
+                    if expire is not None and time.time() - timestamp > expire:
+                        del self.entries[key]
+                        value = None
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    # -------------------------------------------------------------------------
+    def set(self, key, value):
+        """
+            Store an entry
+
+            @param key: the key (a tuple of simple types)
+            @param value: the value (must be picklable)
+        """
+
+        key = self._key(key)
+        backend = self._backend()
+        with self.lock:
+            if backend is not None:
+                backend(key, lambda: value, time_expire=0)
+            else:
+                entries = self.entries
+                entries[key] = (value, time.time())
+                while len(entries) > self.maxsize:
+                    entries.popitem(last=False)
+        return
+
+    # -------------------------------------------------------------------------
+    def _backend(self):
+        """ Get the web2py cache model for the configured backend """
+
+        backend = self.backend
+        if backend is None:
+            return None
+        return getattr(current.cache, backend)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _table(cls):
+        """ Get the generation counter table (None if not defined) """
+
+        db = current.db
+        tablename = cls.TABLENAME
+        return db[tablename] if tablename in db else None
+
+    # -------------------------------------------------------------------------
+    def _key(self, key):
+        """
+            Generate the cache key for an entry, including the current
+            generation (which is looked up only once per request)
+
+            @param key: the key (a tuple of simple types)
+        """
+
+        response = current.response
+        generation = response.get(self.PREFIX)
+        if generation is None:
+            table = self._table()
+            if table is not None:
+                row = current.db(table.id > 0).select(table.generation,
+                                                      limitby=(0, 1),
+                                                      orderby=table.id,
+                                                      ).first()
+                generation = row.generation if row else 0
+                with self.lock:
+                    if generation != self.generation:
+                        # Invalidated by another process
+                        self.generation = generation
+                        self.entries.clear()
+            else:
+                generation = self.generation
+            response[self.PREFIX] = generation
+        digest = hashlib.md5(repr(key)).hexdigest()
+        return "%s:%s:%s" % (self.PREFIX, generation, digest)
+
 # =============================================================================
 class S3Audit(object):
     """ S3 Audit Trail Writer Class """
@@ -1387,7 +1387,9 @@ class S3CRUD(S3Method):
             searchq, orderby, left = resource.datatable_filter(list_fields,
                                                                get_vars)
             if searchq is not None:
-                totalrows = resource.count()
+                settings = current.deployment_settings
+                expire = settings.get_ui_datatables_count_expire()
+                totalrows = resource.count(expire=expire)
                 resource.add_filter(searchq)
             else:
                 totalrows = None
@@ -1252,7 +1252,15 @@ class S3PivotTable(object):
                #"std": "Standard Deviation"
                }
 
-    def __init__(self, resource, rows, cols, layers, strict=True):
+    #: Methods which can be computed in the database
+    DB_METHODS = ("count", "min", "max", "sum", "avg")
+
+    #: Field types which can be aggregated numerically in the database
+    DB_NUMERIC = ("integer", "bigint", "double")
+
+    def __init__(self, resource, rows, cols, layers,
+                 strict=True,
+                 db_aggregate=None):
         """
             Constructor - extracts all unique records, generates a
             pivot table from them with the given dimensions and
@@ -1265,6 +1273,9 @@ class S3PivotTable(object):
                            for the value aggregation(s)
             @param strict: filter out dimension values which don't match
                            the resource filter
+            @param db_aggregate: compute the layers with GROUP BY in the
+                                 database where possible (None to use the
+                                 deployment setting)
         """
 
         # Initialize ----------------------------------------------------------
@@ -1293,6 +1304,8 @@ class S3PivotTable(object):
 
         self.empty = False
         """ Empty-flag (True if no records could be found) """
+        self.db_aggregate = False
+        """ Whether the layers have been computed in the database """
         self.numrows = None
         """ The number of rows in the pivot table """
         self.numcols = None
@@ -1349,7 +1362,15 @@ class S3PivotTable(object):
 
         # Retrieve the records ------------------------------------------------
         #
-        data = resource.select(self.rfields.keys(), limit=None)
+        if db_aggregate is None:
+            db_aggregate = current.deployment_settings \
+                                  .get_ui_report_db_aggregate()
+        if db_aggregate and self._db_aggregate_supported():
+            # Only the record keys and dimension values
+            self.db_aggregate = True
+            data = self._db_select()
+        else:
+            data = resource.select(self.rfields.keys(), limit=None)
         drows = data["rows"]
         if drows:
 
@@ -1422,10 +1443,12 @@ class S3PivotTable(object):
 
             # Add the layers --------------------------------------------------
             #
-            add_layer = self._add_layer
-            layers = list(self.layers)
-            for f, m in self.layers:
-                add_layer(matrix, f, m)
+            if self.db_aggregate:
+                self._db_add_layers(matrix, rnames, cnames)
+            else:
+                add_layer = self._add_layer
+                for f, m in self.layers:
+                    add_layer(matrix, f, m)
 
             #if DEBUG:
                 #duration = datetime.datetime.now() - _start
@@ -2503,6 +2526,315 @@ class S3PivotTable(object):
         else:
             return None
 
+    # -------------------------------------------------------------------------
+    def _db_aggregate_supported(self):
+        """
+            Check whether the pivot table can be computed with GROUP BY
+            in the database, which requires that all dimensions and facts
+            are single-valued real fields, that all methods are supported
+            and that there is no virtual filter.
+        """
+
+        if self.resource.get_filter() is not None:
+            return False
+
+        rfields = self.rfields
+        single_valued = self._single_valued
+
+        for dim in (self.rows, self.cols):
+            if dim and not single_valued(rfields[dim]):
+                return False
+
+        for fact, method in self.layers:
+            if method not in self.DB_METHODS:
+                return False
+            rfield = rfields[fact]
+            if not single_valued(rfield):
+                return False
+            if method != "count" and rfield.ftype not in self.DB_NUMERIC:
+                return False
+
+        return True
+
+    # -------------------------------------------------------------------------
+    def _single_valued(self, rfield):
+        """
+            Check whether a resource field has exactly one value per
+            master record, i.e. is a real, non-list field in either the
+            master table or a table referenced by foreign keys (component
+            and link table fields can have multiple values per record)
+
+            @param rfield: the S3ResourceField
+        """
+
+        if rfield.field is None or rfield.ftype[:5] == "list:":
+            return False
+
+        selector = rfield.selector
+        if "(" in selector:
+            # Context expression
+            return False
+        for prefix in ("~.", "%s." % self.resource.alias):
+            if selector.startswith(prefix):
+                selector = selector[len(prefix):]
+                break
+        return "." not in selector
+
+    # -------------------------------------------------------------------------
+    def _db_query(self, rfields):
+        """
+            Get the query and left joins to aggregate a set of fields
+            in the database
+
+            @param rfields: the S3ResourceFields to include
+
+            @return: tuple (query, left joins)
+        """
+
+        from s3resource import S3LeftJoins
+
+        resource = self.resource
+        table = resource.table
+
+        query = resource.get_query()
+
+        # Left joins for filters may produce multiple rows per record,
+        # so sub-select the record IDs instead
+        filter_joins = resource.rfilter.get_left_joins()
+        if filter_joins:
+            subquery = current.db(query)._select(table._id,
+                                                 left=filter_joins,
+                                                 distinct=True)
+            query = table._id.belongs(subquery)
+
+        # Left joins for the fields (applying the accessible query
+        # for each joined table)
+        left_joins = S3LeftJoins(resource.tablename)
+        for rfield in rfields:
+            left = rfield.left
+            if left:
+                for tn in left:
+                    left_joins.add(left[tn])
+        left = left_joins.as_list(aqueries={})
+
+        return query, left
+
+    # -------------------------------------------------------------------------
+    def _db_select(self):
+        """
+            Retrieve the record keys and dimension values (plus the fact
+            values for count-layers, needed for the JSON lookup table)
+            without representation or virtual fields.
+
+            @return: a dict like S3Resource.select, with the rows
+                     as dicts {colname: value}
+        """
+
+        rfields = self.rfields
+
+        selectors = [self.pkey, self.rows, self.cols]
+        selectors.extend([f for f, m in self.layers if m == "count"])
+
+        columns = []
+        colnames = set()
+        for selector in selectors:
+            if not selector:
+                continue
+            rfield = rfields[selector]
+            if rfield.colname not in colnames:
+                colnames.add(rfield.colname)
+                columns.append(rfield)
+
+        query, left = self._db_query(columns)
+        rows = current.db(query).select(left=left,
+                                        cacheable=True,
+                                        *[rfield.field for rfield in columns])
+
+        data = [dict((rfield.colname, rfield.extract(row))
+                     for rfield in columns) for row in rows]
+
+        return {"rfields": columns, "numrows": len(data), "rows": data}
+
+    # -------------------------------------------------------------------------
+    def _db_add_layers(self, matrix, rnames, cnames):
+        """
+            Compute all layers with a single GROUP BY query on the rows
+            and cols dimensions, updates the same attributes as _add_layer
+
+            @param matrix: the cell matrix
+            @param rnames: the row dimension values (in matrix order)
+            @param cnames: the column dimension values (in matrix order)
+        """
+
+        rfields = self.rfields
+        layers = self.layers
+
+        # Group by the dimension fields
+        dimensions = [rfields[dim] for dim in (self.rows, self.cols) if dim]
+        groupby = [rfield.field for rfield in dimensions]
+
+        # Aggregate expressions per layer (avg as sum+count, so that
+        # the totals can be computed from the cell values)
+        expressions = []
+        for fact, method in layers:
+            field = rfields[fact].field
+            if method == "count":
+                expressions.append((field.count(distinct=True),))
+            elif method == "avg":
+                expressions.append((field.sum(), field.count()))
+            else:
+                expressions.append((getattr(field, method)(),))
+
+        rfacts = [rfields[fact] for fact, method in layers]
+        query, left = self._db_query(dimensions + rfacts)
+
+        fields = list(groupby)
+        for expr in expressions:
+            fields.extend(expr)
+        rows = current.db(query).select(groupby=groupby,
+                                        left=left,
+                                        *fields)
+
+        # Map the groups to the cell matrix
+        rindex = dict((v, i) for i, v in enumerate(rnames))
+        cindex = dict((v, i) for i, v in enumerate(cnames))
+        rfield = rfields[self.rows] if self.rows else None
+        cfield = rfields[self.cols] if self.cols else None
+
+        partials = [{} for layer in layers]
+        for row in rows:
+            rvalue = rfield.extract(row) if rfield else None
+            cvalue = cfield.extract(row) if cfield else None
+            if rvalue not in rindex or cvalue not in cindex:
+                # Record added since the keys have been retrieved
+                continue
+            cell = (rindex[rvalue], cindex[cvalue])
+            for i, expr in enumerate(expressions):
+                if len(expr) == 1:
+                    partials[i][cell] = row[expr[0]]
+                else:
+                    partials[i][cell] = tuple(row[e] for e in expr)
+
+        for i, layer in enumerate(layers):
+            self._db_add_layer(matrix, layer, partials[i])
+        return
+
+    # -------------------------------------------------------------------------
+    def _db_add_layer(self, matrix, layer, partials):
+        """
+            Add a layer from the partial aggregates per cell, updates the
+            same attributes as _add_layer
+
+            @param matrix: the cell matrix
+            @param layer: the layer (fact, method)
+            @param partials: the partial aggregates as dict
+                             {(row index, col index): value}
+        """
+
+        fact, method = layer
+        merge = self._merge
+
+        RECORDS = "records"
+
+        rows = self.row
+        cols = self.col
+
+        numcols = len(cols)
+        numrows = len(rows)
+
+        # Initialize cells
+        if self.cell is None:
+            self.cell = [[Storage()
+                          for i in xrange(numcols)]
+                         for j in xrange(numrows)]
+        cells = self.cell
+
+        all_partials = []
+        col_partials = [[] for c in xrange(numcols)]
+
+        for r in xrange(numrows):
+
+            # Initialize row header
+            row = rows[r]
+            row[RECORDS] = []
+            row_records = row[RECORDS]
+            row_partials = []
+
+            for c in xrange(numcols):
+
+                # Initialize column header
+                col = cols[c]
+                if RECORDS not in col:
+                    col[RECORDS] = []
+                col_records = col[RECORDS]
+
+                # Get the records
+                cell = cells[r][c]
+                if RECORDS in cell and cell[RECORDS] is not None:
+                    ids = cell[RECORDS]
+                else:
+                    data = matrix[r][c]
+                    if data:
+                        ids = [i for i in data if i is not None]
+                    else:
+                        ids = []
+                    cell[RECORDS] = ids
+                row_records.extend(ids)
+                col_records.extend(ids)
+
+                # Cell value
+                if (r, c) in partials:
+                    partial = [partials[(r, c)]]
+                    row_partials.extend(partial)
+                    col_partials[c].extend(partial)
+                    all_partials.extend(partial)
+                else:
+                    partial = []
+                cell[layer] = merge(partial, method)
+
+            # Compute row total
+            row[layer] = merge(row_partials, method)
+
+        # Compute column totals
+        for c in xrange(numcols):
+            cols[c][layer] = merge(col_partials[c], method)
+
+        # Compute overall total
+        self.totals[layer] = merge(all_partials, method)
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _merge(partials, method):
+        """
+            Merge partial aggregates computed in the database, producing
+            the same results as _aggregate for the underlying values
+
+            @param partials: list of partial aggregates
+            @param method: the aggregation method
+        """
+
+        if method in ("count", "sum"):
+            return sum([p for p in partials if p is not None])
+
+        elif method in ("min", "max"):
+            values = [p for p in partials if p is not None]
+            if values:
+                return min(values) if method == "min" else max(values)
+            else:
+                return None
+
+        elif method == "avg":
+            total = sum([p[0] for p in partials if p[0] is not None])
+            count = sum([p[1] for p in partials if p[1] is not None])
+            if count:
+                return total / float(count)
+            else:
+                return 0.0
+
+        else:
+            return None
+
     # -------------------------------------------------------------------------
     @staticmethod
     def _sortdim(items, rfield, index=2):
@@ -33,8 +33,11 @@
 
 __all__ = ["S3Exporter"]
 
+from tempfile import TemporaryFile
+
 from gluon import current
 from gluon.storage import Storage
+from gluon.streamer import DEFAULT_CHUNK_SIZE
 
 from s3codec import S3Codec
 
@@ -66,8 +69,19 @@ class S3Exporter(object):
             response.headers["Content-Type"] = contenttype(".csv")
             response.headers["Content-disposition"] = "attachment; filename=%s" % filename
 
-        rows = resource.select(None, as_rows=True)
-        return str(rows)
+        # Write the rows batch-wise into a temporary file
+        fields = [f.name for f in resource.readable_fields()]
+        output = TemporaryFile()
+        write_colnames = True
+        for rows in resource.iter_select(fields, as_rows=True):
+            rows.export_to_csv_file(output, write_colnames=write_colnames)
+            write_colnames = False
+
+        if write_colnames:
+            # No records => column names only
+            output.write(str(resource.select(fields, limit=1, as_rows=True)))
+
+        return self.stream(output)
 
     # -------------------------------------------------------------------------
     def json(self, resource,
@@ -89,18 +103,55 @@ class S3Exporter(object):
         if fields is None:
             fields = [f.name for f in resource.table if f.readable]
 
-        # Get the rows and return as json
-        rows = resource.select(fields,
-                               start=start,
-                               limit=limit,
-                               orderby=orderby,
-                               as_rows=True)
-
         response = current.response
         if response:
             response.headers["Content-Type"] = "application/json"
 
-        return rows.json()
+        if limit is not None:
+            # Get the rows and return as json
+            rows = resource.select(fields,
+                                   start=start,
+                                   limit=limit,
+                                   orderby=orderby,
+                                   as_rows=True)
+            return rows.json()
+
+        # Write the rows batch-wise into a temporary file
+        output = TemporaryFile()
+        output.write("[")
+        separator = ""
+        for rows in resource.iter_select(fields,
+                                         orderby=orderby,
+                                         as_rows=True):
+            items = rows.json()[1:-1]
+            if items:
+                output.write(separator)
+                output.write(items)
+                separator = ","
+        output.write("]")
+
+        return self.stream(output)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def stream(output):
+        """
+            Stream the contents of a temporary file to the client, or
+            return them as string if there is no response (e.g. CLI)
+
+            @param output: the file
+        """
+
+        output.seek(0)
+        response = current.response
+        if response:
+            return response.stream(output,
+                                   chunk_size=DEFAULT_CHUNK_SIZE,
+                                   request=current.request)
+        else:
+            contents = output.read()
+            output.close()
+            return contents
 
     # -------------------------------------------------------------------------
     def pdf(self, *args, **kwargs):
@@ -30,10 +30,20 @@
 """
 
 import datetime
+import hashlib
 import sys
+import threading
+import time
 from itertools import chain
 from uuid import uuid4
 
+try:
+    # Python 2.7
+    from collections import OrderedDict
+except:
+    # Python 2.6
+    from gluon.contrib.simplejson.ordered_dict import OrderedDict
+
 from gluon import *
 # Here are dependencies listed for reference:
 #from gluon import current
@@ -45,7 +55,7 @@ from gluon.storage import Storage
 from gluon.languages import lazyT
 
 from s3navigation import S3ScriptItem
-from s3utils import S3DateTime, s3_auth_user_represent, s3_auth_user_represent_name, s3_unicode, S3MarkupStripper
+from s3utils import S3DateTime, s3_append_callback, s3_auth_user_represent, s3_auth_user_represent_name, s3_unicode, S3MarkupStripper
 from s3validators import IS_ONE_OF, IS_UTC_DATETIME
 from s3widgets import S3DateWidget, S3DateTimeWidget
 
@@ -206,7 +216,12 @@ class S3Represent(object):
         @group Internal Methods: _setup,
                                  _lookup
     """
-    
+
+    # Use the shared representation cache (S3RepresentCache) if enabled
+    # in deployment settings: None = only with the standard lookup,
+    # True/False to override in subclasses
+    shared_cache = None
+
     def __init__(self,
                  lookup=None,
                  key=None,
@@ -267,7 +282,10 @@ class S3Represent(object):
         self.lazy_show_link = False
 
         self.rows = {}
-        
+
+        self.rcache = None
+        self.rcache_key = None
+
         # Attributes to simulate being a function for sqlhtml's represent()
         # Make sure we indicate only 1 position argument
         self.func_code = Storage(co_argcount = 1)
@@ -588,6 +606,18 @@ class S3Represent(object):
         else:
             self.htemplate = "%s > %s"
 
+        # Shared representation cache
+        if self.table is not None and self.options is None:
+            shared_cache = self.shared_cache
+            if shared_cache is None:
+                shared_cache = not self.custom_lookup
+            if shared_cache:
+                rcache = S3RepresentCache.get_cache()
+                if rcache is not None:
+                    rcache.hook(self.tablename)
+                    self.rcache = rcache
+                    self.rcache_key = rcache.renderer_key(self)
+
         self.setup = True
         return
 
@@ -619,6 +649,17 @@ class S3Represent(object):
         if table is None or not lookup:
             return items
 
+        # Check whether values are in the shared cache
+        rcache = self.rcache
+        if rcache is not None:
+            cached = rcache.get(self.rcache_key, lookup.keys())
+            for k, v in cached.items():
+                items[k] = theset[k] = v
+                del lookup[k]
+            if not lookup:
+                return items
+            keys = lookup.keys()
+
         if table and self.hierarchy:
             # Does the lookup table have a hierarchy?
             from s3hierarchy import S3Hierarchy
@@ -683,7 +724,12 @@ class S3Represent(object):
                 for k, row in rows.items():
                     lookup.pop(k, None)
                     items[k] = theset[k] = represent_row(row)
-                    
+
+        # Store the new representations in the shared cache
+        if rcache is not None:
+            rcache.set(self.rcache_key,
+                       dict((k, items[k]) for k in keys if k in items))
+
         if lookup:
             for k in lookup:
                 items[k] = self.default
@@ -725,6 +771,371 @@ class S3Represent(object):
         theset[value] = result
         return result
 
+# =============================================================================
+class S3RepresentCache(object):
+    """
+        Shared cache for S3Represent lookups, keeps the representations
+        of lookup table records across requests.
+
+        The default backend is a process-wide LRU dict, other backends
+        can be plugged in by name of a web2py cache model (e.g. "disk"
+        for current.cache.disk to share the cache between processes).
+
+        Entries are invalidated per lookup table (by incrementing the
+        table generation), which is hooked into the onaccept/ondelete
+        callbacks of the lookup table. The generation counters are stored
+        in the database, so that all processes see the change (with their
+        next request) regardless of the backend.
+    """
+
+    PREFIX = "s3rc"
+
+    # Table for the generation counters
+    TABLENAME = "s3_represent_generation"
+
+    # Keys to install the invalidation callback for
+    HOOKS = ("onaccept", "create_onaccept", "update_onaccept", "ondelete")
+
+    # Renderer attributes which are not part of the configuration
+    RUNTIME = ("tablename", "table", "labels", "options", "linkto",
+               "show_link", "setup", "theset", "queries", "lazy",
+               "lazy_show_link", "rows", "rcache", "rcache_key",
+               "custom_lookup", "slabels", "clabels", "htemplate",
+               "func_code", "func_defaults")
+
+    # The currently configured instance
+    instance = None
+
+    def __init__(self, backend=None, maxsize=10000, expire=None):
+        """
+            Constructor
+
+            @param backend: name of the web2py cache model to use as
+                            backend, or None for a process-wide LRU dict
+            @param maxsize: the maximum number of entries in the cache
+            @param expire: time in seconds after which entries expire
+                           (None for no expiry)
+        """
+
+        self.backend = backend
+        self.maxsize = maxsize
+        self.expire = expire
+
+        self.lock = threading.RLock()
+
+        # LRU index {key: (value, timestamp)} (values only for the
+        # process-wide backend)
+        self.entries = OrderedDict()
+
+        # Table generations (if the counter table is not available)
+        self.generations = {}
+
+        # Invalidation callbacks {tablename: callback}
+        self.callbacks = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get_cache(cls):
+        """
+            Get the shared representation cache as configured in
+            deployment settings
+
+            @return: the S3RepresentCache instance, or None if disabled
+        """
+
+        settings = current.deployment_settings
+        backend = settings.get_base_represent_cache()
+        if not backend:
+            cls.instance = None
+            return None
+        if backend is True or backend == "ram":
+            backend = None
+
+        maxsize = settings.get_base_represent_cache_size()
+        expire = settings.get_base_represent_cache_expire()
+
+        instance = cls.instance
+        if instance is None or instance.backend != backend:
+            instance = cls.instance = cls(backend=backend,
+                                          maxsize=maxsize,
+                                          expire=expire)
+        else:
+            instance.maxsize = maxsize
+            instance.expire = expire
+        return instance
+
+    # -------------------------------------------------------------------------
+    def renderer_key(self, renderer):
+        """
+            Generate a key for the configuration of a renderer, so that
+            renderers with the same configuration share their entries
+
+            @param renderer: the S3Represent instance (after _setup)
+        """
+
+        labels = renderer.labels
+        if callable(labels):
+            code = getattr(labels, "func_code", None)
+            if code is not None:
+                labels = "%s:%s" % (code.co_filename, code.co_firstlineno)
+            else:
+                labels = labels.__class__.__name__
+
+        simple = (basestring, int, long, float, bool, type(None))
+        config = []
+        RUNTIME = self.RUNTIME
+        for k, v in sorted(renderer.__dict__.items()):
+            if k in RUNTIME:
+                continue
+            if isinstance(v, (list, tuple)) and \
+               all(isinstance(i, simple) for i in v):
+                config.append((k, tuple(v)))
+            elif isinstance(v, simple):
+                config.append((k, v))
+
+        cls = renderer.__class__
+        config = (cls.__module__,
+                  cls.__name__,
+                  labels,
+                  current.T.accepted_language,
+                  tuple(config),
+                  )
+        config = hashlib.md5(s3_unicode(config).encode("utf-8")).hexdigest()
+        return (renderer.tablename, config)
+
+    # -------------------------------------------------------------------------
+    def get(self, rkey, values):
+        """
+            Get cached representations
+
+            @param rkey: the renderer key
+            @param values: the values to look up
+
+            @return: dict {value: representation} of all values found
+        """
+
+        prefix = self._prefix(rkey)
+        backend = self._backend()
+        expire = self.expire
+        now = time.time()
+
+        items = {}
+        hits = misses = 0
+        entries = self.entries
+        with self.lock:
+            for value in values:
+                key = "%s:%s" % (prefix, s3_unicode(value))
+                entry = entries.get(key)
+                if backend is not None:
+                    if entry is not None:
+                        # Mark as recently used
+                        del entries[key]
+                        entries[key] = entry
+                    r = backend(key.encode("utf-8"),
+                                lambda: None,
+                                time_expire=expire)
+                elif entry is not None:
+                    del entries[key]
+                    r, timestamp = entry
+                    if expire is not None and now - timestamp > expire:
+                        r = None
+                    else:
+                        # Mark as recently used
+                        entries[key] = entry
+                else:
+                    r = None
+                if r is None:
+                    misses += 1
+                else:
+                    items[value] = r
+                    hits += 1
+            self.hits += hits
+            self.misses += misses
+        return items
+
+    # -------------------------------------------------------------------------
+    def set(self, rkey, items):
+        """
+            Store representations in the cache
+
+            @param rkey: the renderer key
+            @param items: dict {value: representation}
+        """
+
+        prefix = self._prefix(rkey)
+        backend = self._backend()
+        now = time.time()
+
+        entries = self.entries
+        with self.lock:
+            for value, r in items.items():
+                if not isinstance(r, basestring):
+                    # Only cache plain strings
+                    continue
+                key = "%s:%s" % (prefix, s3_unicode(value))
+                if key in entries:
+                    del entries[key]
+                if backend is not None:
+                    backend(key.encode("utf-8"), lambda: r, time_expire=0)
+                    entries[key] = (None, now)
+                else:
+                    entries[key] = (r, now)
+
+            # Evict least recently used entries
+            maxsize = self.maxsize
+            while len(entries) > maxsize:
+                key = entries.popitem(last=False)[0]
+                if backend is not None:
+                    backend(key.encode("utf-8"), None)
+                self.evictions += 1
+        return
+
+    # -------------------------------------------------------------------------
+    def invalidate(self, tablename):
+        """
+            Invalidate all cached representations for a lookup table
+
+            @param tablename: the name of the lookup table
+        """
+
+        table = self._table()
+        with self.lock:
+            if table is not None:
+                # Increment the generation for all processes
+                query = (table.tablename == tablename)
+                if not current.db(query).update(generation=table.generation + 1):
+                    table.insert(tablename=tablename, generation=1)
+            else:
+                generations = self.generations
+                generations[tablename] = generations.get(tablename, 0) + 1
+        current.response.pop(self.PREFIX, None)
+        return
+
+    # -------------------------------------------------------------------------
+    def clear(self):
+        """ Remove all entries from the cache, reset the counters """
+
+        backend = self._backend()
+        with self.lock:
+            if backend is not None:
+                backend.clear(regex="^%s:" % self.PREFIX)
+            self.entries.clear()
+            self.generations.clear()
+            self.hits = self.misses = self.evictions = 0
+        current.response.pop(self.PREFIX, None)
+        return
+
+    # -------------------------------------------------------------------------
+    def stats(self):
+        """
+            Cache statistics of this process, to tune maxsize and expiry
+            (reported by S3Profiler)
+
+            @return: Storage with hits, misses, evictions, size, maxsize
+        """
+
+        return Storage(hits = self.hits,
+                       misses = self.misses,
+                       evictions = self.evictions,
+                       size = len(self.entries),
+                       maxsize = self.maxsize,
+                       )
+
+    # -------------------------------------------------------------------------
+    def hook(self, tablename):
+        """
+            Install the invalidation callback for a lookup table, appends
+            the callback to existing onaccept/ondelete callbacks
+
+            @param tablename: the name of the lookup table
+        """
+
+        callbacks = self.callbacks
+        if tablename in callbacks:
+            invalidate = callbacks[tablename]
+        else:
+            def invalidate(*args, **kwargs):
+                self.invalidate(tablename)
+            callbacks[tablename] = invalidate
+
+        s3_append_callback(tablename, self.HOOKS, invalidate)
+        return
+
+    # -------------------------------------------------------------------------
+    def hook_all(self):
+        """
+            Re-install the invalidation callbacks for all lookup tables
+            which are currently defined (e.g. after loading a model)
+        """
+
+        db = current.db
+        for tablename in self.callbacks.keys():
+            if hasattr(db, tablename):
+                self.hook(tablename)
+        return
+
+    # -------------------------------------------------------------------------
+    def _prefix(self, rkey):
+        """
+            Get the key prefix for a renderer key, including the current
+            generation of the lookup table
+
+            @param rkey: the renderer key
+        """
+
+        tablename, config = rkey
+
+        generation = self._generations().get(tablename, 0)
+        return "%s:%s:%s:%s" % (self.PREFIX, tablename, generation, config)
+
+    # -------------------------------------------------------------------------
+    def _generations(self):
+        """
+            Get the current generations of all lookup tables (which are
+            looked up only once per request)
+
+            @return: dict {tablename: generation}
+        """
+
+        response = current.response
+        generations = response.get(self.PREFIX)
+        if generations is None:
+            table = self._table()
+            if table is not None:
+                rows = current.db(table.id > 0).select(table.tablename,
+                                                       table.generation,
+                                                       )
+                generations = {}
+                for row in rows:
+                    tablename = row.tablename
+                    generation = row.generation or 0
+                    if generation > generations.get(tablename, 0):
+                        generations[tablename] = generation
+            else:
+                generations = self.generations
+            response[self.PREFIX] = generations
+        return generations
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _table(cls):
+        """ Get the generation counter table (None if not defined) """
+
+        return current.s3db.table(cls.TABLENAME)
+
+    # -------------------------------------------------------------------------
+    def _backend(self):
+        """ Get the web2py cache model used as backend (None = LRU dict) """
+
+        backend = self.backend
+        if backend is None:
+            return None
+        return getattr(current.cache, backend)
+
 # =============================================================================
 class S3RepresentLazy(object):
     """
@@ -31,6 +31,7 @@
 
 __all__ = ["GIS",
            "S3Map",
+           "S3MapTile",
            "S3ExportPOI",
            "S3ImportPOI",
            ]
@@ -38,6 +39,8 @@ __all__ = ["GIS",
 import os
 import re
 import sys
+import threading
+import time
 #import logging
 import urllib           # Needed for urlencoding
 import urllib2          # Needed for quoting & error handling on fetch
@@ -1799,6 +1802,10 @@ class GIS(object):
             query &= (table.deleted == False)
         # @ToDo: Check AAA (do this as a resource filter?)
 
+        if S3SpatialIndex.get_index():
+            # Only consider the Locations within the bounds of the polygon
+            query &= self.query_features_by_bbox(*polygon.bounds)
+
         features = db(query).select(locations.wkt,
                                     locations.lat,
                                     locations.lon,
@@ -2134,6 +2141,248 @@ class GIS(object):
 
         return marker
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_geometries(table, ids, polygons=False, output="wkt",
+                       tolerance=None, decimals=4):
+        """
+            Lookup the geometries for a set of records in a table with
+            lat/lon/wkt fields (gis_location or Shapefile Layer data)
+            in a single query, rather than per record
+
+            @param table: the Table
+            @param ids: the record IDs
+            @param polygons: return simplified polygons rather than
+                             (lat, lon) tuples
+            @param output: output format for polygons ("wkt" or "geojson")
+            @param tolerance: the tolerance for the simplification
+                              (default: deployment setting)
+            @param decimals: the precision of the simplified polygons
+
+            @return: dict {record_id: geometry}
+        """
+
+        ids = [i for i in set(ids) if i]
+        if not ids:
+            return {}
+
+        if not polygons:
+            pkey = table._id
+            if len(ids) == 1:
+                query = (pkey == ids[0])
+            else:
+                query = (pkey.belongs(ids))
+            rows = current.db(query).select(pkey, table.lat, table.lon)
+            return dict((row[pkey], (row.lat, row.lon)) for row in rows)
+
+        if tolerance is None:
+            tolerance = GIS.get_simplify_tolerance()
+        if current.deployment_settings.get_gis_simplify_cache():
+            # Use the pre-computed polygons
+            return GIS.get_simplified(table, ids,
+                                      tolerance=tolerance,
+                                      output=output,
+                                      decimals=decimals)
+        else:
+            return GIS._simplify_records(table, ids,
+                                         tolerance=tolerance,
+                                         output=output,
+                                         decimals=decimals)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _simplify_records(table, ids, tolerance=None, output="wkt", decimals=4):
+        """
+            Simplify the polygons of a set of records in a single query
+
+            @param table: the Table (gis_location or Shapefile Layer data)
+            @param ids: the record IDs
+            @param tolerance: the tolerance for the simplification
+            @param output: output format ("wkt" or "geojson")
+            @param decimals: the precision of the output
+
+            @return: dict {record_id: geometry}
+        """
+
+        geometries = {}
+
+        db = current.db
+        pkey = table._id
+        if len(ids) == 1:
+            query = (pkey == ids[0])
+        else:
+            query = (pkey.belongs(ids))
+
+        if tolerance is None:
+            tolerance = GIS.get_simplify_tolerance()
+
+        if current.deployment_settings.get_gis_spatialdb():
+            # Do the Simplify (& GeoJSON) direct from the DB
+            if output == "geojson":
+                geometry = table.the_geom.st_simplify(tolerance).st_asgeojson(precision=decimals).with_alias("geometry")
+            else:
+                geometry = table.the_geom.st_simplify(tolerance).st_astext().with_alias("geometry")
+            rows = db(query).select(pkey, geometry)
+            tablename = table._tablename
+            for row in rows:
+                if row.geometry:
+                    geometries[row[tablename][pkey.name]] = row.geometry
+        else:
+            rows = db(query).select(pkey, table.wkt)
+            simplify = GIS.simplify
+            for row in rows:
+                wkt = row.wkt
+                if not wkt:
+                    continue
+                # Simplify the polygon to reduce download size
+                # & also to work around the recursion limit in libxslt
+                # http://blog.gmane.org/gmane.comp.python.lxml.devel/day=20120309
+                geometry = simplify(wkt,
+                                    tolerance=tolerance,
+                                    output=output,
+                                    decimals=decimals)
+                if geometry:
+                    geometries[row[pkey]] = geometry
+        return geometries
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_simplify_tolerance(zoom=None):
+        """
+            Get the tolerance to simplify polygons for a zoom level
+
+            @param zoom: the zoom level (None for the default tolerance)
+
+            @return: the tolerance (in degrees)
+        """
+
+        if zoom is not None:
+            try:
+                zoom = int(zoom)
+            except (ValueError, TypeError):
+                zoom = None
+        if zoom is None or zoom < 0:
+            return current.deployment_settings.get_gis_simplify_tolerance()
+
+        # The size of a pixel at this zoom level (256px tiles)
+        return 360.0 / (256 * 2 ** zoom)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_simplified(table, ids, tolerance=None, output="wkt", decimals=4):
+        """
+            Get simplified polygons from the gis_simplified store,
+            simplifying & storing any which have not been pre-computed
+
+            @param table: the Table (gis_location or Shapefile Layer data)
+            @param ids: the record IDs
+            @param tolerance: the tolerance for the simplification
+            @param output: output format ("wkt" or "geojson")
+            @param decimals: the precision of the output
+
+            @return: dict {record_id: geometry}
+        """
+
+        if tolerance is None:
+            tolerance = GIS.get_simplify_tolerance()
+
+        db = current.db
+        stable = current.s3db.gis_simplified
+        tablename = table._tablename
+
+        # Tolerance is a float, so match within a margin
+        query = (stable.tablename == tablename) & \
+                (stable.tolerance > tolerance * 0.999) & \
+                (stable.tolerance < tolerance * 1.001) & \
+                (stable.decimals == decimals) & \
+                (stable.output == output)
+        if len(ids) == 1:
+            rows = db(query & (stable.record_id == ids[0])).select(
+                                            stable.record_id, stable.geometry)
+        else:
+            rows = db(query & (stable.record_id.belongs(ids))).select(
+                                            stable.record_id, stable.geometry)
+
+        geometries = {}
+        for row in rows:
+            geometries[row.record_id] = row.geometry
+
+        missing = [i for i in ids if i not in geometries]
+        if missing:
+            simplified = GIS._simplify_records(table, missing,
+                                               tolerance=tolerance,
+                                               output=output,
+                                               decimals=decimals)
+            # Replace any entries which concurrent requests have stored
+            # in the meantime, to keep only one per record and key
+            db(query & (stable.record_id.belongs(missing))).delete()
+            # Store empty geometries too, so that points (or records
+            # without geometry) are not looked up again
+            stable.bulk_insert([{"tablename": tablename,
+                                 "record_id": i,
+                                 "tolerance": tolerance,
+                                 "decimals": decimals,
+                                 "output": output,
+                                 "geometry": simplified.get(i, ""),
+                                 } for i in missing])
+            geometries.update(simplified)
+
+        return dict((k, v) for k, v in geometries.items() if v)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def update_simplified(table, ids):
+        """
+            Pre-compute the simplified polygons of records for the default
+            tolerance and the zoom levels configured in deployment settings
+            (skips any which have already been computed)
+
+            @param table: the Table (gis_location or Shapefile Layer data)
+            @param ids: the record IDs
+        """
+
+        settings = current.deployment_settings
+        if not settings.get_gis_simplify_cache():
+            return
+
+        ids = [int(i) for i in ids if i]
+        if not ids:
+            return
+
+        get_tolerance = GIS.get_simplify_tolerance
+        tolerances = [get_tolerance()] + \
+                     [get_tolerance(z) for z in settings.get_gis_simplify_zoom_levels()]
+
+        get_simplified = GIS.get_simplified
+        for tolerance in tolerances:
+            for output in ("wkt", "geojson"):
+                get_simplified(table, ids, tolerance=tolerance, output=output)
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def clear_simplified(tablename, ids=None):
+        """
+            Remove the simplified polygons of records from the store,
+            to be called when their geometry changes
+
+            @param tablename: the tablename
+            @param ids: the record IDs (None for all records)
+        """
+
+        if not current.deployment_settings.get_gis_simplify_cache():
+            return
+
+        stable = current.s3db.gis_simplified
+        query = (stable.tablename == tablename)
+        if ids:
+            if len(ids) == 1:
+                query &= (stable.record_id == ids[0])
+            else:
+                query &= (stable.record_id.belongs(ids))
+        current.db(query).delete()
+        return
+
     # -------------------------------------------------------------------------
     @staticmethod
     def get_location_data(resource):
@@ -2159,6 +2408,7 @@ class GIS(object):
         ftable = s3db.gis_layer_feature
 
         layer = None
+        details = True
 
         layer_id = get_vars.get("layer", None)
         if layer_id:
@@ -2190,8 +2440,9 @@ class GIS(object):
             if len(layers) > 1:
                 layers.exclude(lambda row: row.style_default == False)
                 if len(layers) > 1:
-                    # We can't provide details for the whole layer, but need to do a per-record check
-                    return None
+                    # We can't provide details for the whole layer, but
+                    # can still lookup the geometries in bulk
+                    details = False
             if layers:
                 layer = layers.first()
 
@@ -2214,7 +2465,9 @@ class GIS(object):
             popup_fields = ["name"]
             trackable = False
             polygons = False
-        
+        if "polygons" in get_vars:
+            polygons = True
+
 
         table = resource.table
         tablename = resource.tablename
@@ -2226,7 +2479,7 @@ class GIS(object):
         _pkey = table[pkey]
         # Ensure there are no ID represents to confuse things
         _pkey.represent = None
-        if format == "geojson":
+        if format == "geojson" and details:
             if popup_fields or attr_fields:
                 # Build the Attributes &/Popup Tooltips now so that representations can be
                 # looked-up in bulk rather than as a separate lookup per record
@@ -2356,7 +2609,7 @@ class GIS(object):
                     markers = GIS.get_marker(c, f)
 
                 markers[tablename] = markers
-        else:
+        elif details:
             # KML, GeoRSS or GPX
             marker_fn = s3db.get_config(tablename, "marker_fn")
             if marker_fn:
@@ -2410,82 +2663,69 @@ class GIS(object):
                         (stable.location_id == gtable.id)
             elif tablename == "gis_location":
                 join = False
-                query = (table.id.belongs(resource._ids))
+            elif tablename.startswith("gis_layer_shapefile_"):
+                # Shapefile Layer data
+                join = False
+                polygons = True
             else:
                 # Can't display this resource on the Map
                 return None
 
-            if polygons:
-                settings = current.deployment_settings
-                tolerance = settings.get_gis_simplify_tolerance()
-                if settings.get_gis_spatialdb():
-                    if format == "geojson":
-                        # Do the Simplify & GeoJSON direct from the DB
-                        rows = db(query).select(table.id,
-                                                gtable.the_geom.st_simplify(tolerance).st_asgeojson(precision=4).with_alias("geojson"))
-                        for row in rows:
-                            geojsons[row[tablename].id] = row.geojson
-                    else:
-                        # Do the Simplify direct from the DB
-                        rows = db(query).select(table.id,
-                                                gtable.the_geom.st_simplify(tolerance).st_astext().with_alias("wkt"))
-                        for row in rows:
-                            wkts[row[tablename].id] = row.wkt
+            output = "geojson" if format == "geojson" else "wkt"
+            # Vary the simplification by zoom level (if provided)
+            tolerance = GIS.get_simplify_tolerance(get_vars.get("zoom", None))
+            if not join:
+                # Geometries in the resource table itself
+                geometries = GIS.get_geometries(table,
+                                                resource._ids,
+                                                polygons=polygons,
+                                                output=output,
+                                                tolerance=tolerance)
+                if not polygons:
+                    latlons = geometries
+                elif output == "geojson":
+                    geojsons = geometries
                 else:
-                    rows = db(query).select(table.id,
-                                            gtable.wkt)
-                    simplify = GIS.simplify
-                    if format == "geojson":
-                        # Simplify the polygon to reduce download size
-                        if join:
-                            for row in rows:
-                                geojson = simplify(row["gis_location"].wkt,
-                                                   tolerance=tolerance,
-                                                   output="geojson")
-                                if geojson:
-                                    geojsons[row[tablename].id] = geojson
-                        else:
-                            for row in rows:
-                                geojson = simplify(row.wkt,
-                                                   tolerance=tolerance,
-                                                   output="geojson")
-                                if geojson:
-                                    geojsons[row.id] = geojson
-                    else:
-                        # Simplify the polygon to reduce download size
-                        # & also to work around the recursion limit in libxslt
-                        # http://blog.gmane.org/gmane.comp.python.lxml.devel/day=20120309
-                        if join:
-                            for row in rows:
-                                wkt = simplify(row["gis_location"].wkt)
-                                if wkt:
-                                    wkts[row[tablename].id] = wkt
-                        else:
-                            for row in rows:
-                                wkt = simplify(row.wkt)
-                                if wkt:
-                                    wkts[row.id] = wkt
+                    wkts = geometries
+
+            elif polygons:
+                rows = db(query).select(table.id, gtable.id)
+                location_ids = dict((row[tablename].id, row["gis_location"].id)
+                                    for row in rows)
+                geometries = GIS.get_geometries(gtable,
+                                                location_ids.values(),
+                                                polygons=True,
+                                                output=output,
+                                                tolerance=tolerance)
+                if output == "geojson":
+                    _geometries = geojsons
+                else:
+                    _geometries = wkts
+                for record_id, location_id in location_ids.items():
+                    geometry = geometries.get(location_id)
+                    if geometry:
+                        _geometries[record_id] = geometry
 
             else:
                 # Points
                 rows = db(query).select(table.id,
                                         gtable.lat,
                                         gtable.lon)
-                if join:
-                    for row in rows:
-                        _location = row["gis_location"]
-                        latlons[row[tablename].id] = (_location.lat, _location.lon)
-                else:
-                    for row in rows:
-                        latlons[row.id] = (row.lat, row.lon)
+                for row in rows:
+                    _location = row["gis_location"]
+                    latlons[row[tablename].id] = (_location.lat, _location.lon)
 
+        # Only provide the data which has been looked up, so that
+        # gis_encode can tell points from polygons
         _latlons = {}
-        if latlons:
-            _latlons[tablename] = latlons
         _wkts = {}
-        _wkts[tablename] = wkts
         _geojsons = {}
-        _geojsons[tablename] = geojsons
+        if latlons or not polygons:
+            _latlons[tablename] = latlons
+        elif format == "geojson":
+            _geojsons[tablename] = geojsons
+        else:
+            _wkts[tablename] = wkts
 
         #if DEBUG:
         #    end = datetime.datetime.now()
@@ -2511,7 +2751,7 @@ class GIS(object):
 
             Called by S3REST: S3Resource.export_tree()
 
-            @ToDo: Vary simplification level & precision by Zoom level
+            @ToDo: Vary precision by Zoom level
                    - store this in the style?
         """
 
@@ -2529,8 +2769,25 @@ class GIS(object):
         attributes = {}
         geojsons = {}
         settings = current.deployment_settings
-        tolerance = settings.get_gis_simplify_tolerance()
-        if settings.get_gis_spatialdb():
+        # Vary the simplification by zoom level (if provided)
+        zoom = current.request.get_vars.get("zoom", None)
+        tolerance = GIS.get_simplify_tolerance(zoom)
+        if settings.get_gis_simplify_cache():
+            # Use the pre-computed polygons
+            fields = [f for f in fields if f not in ("the_geom", "wkt")]
+            rows = db(query).select(*[table[f] for f in fields])
+            for row in rows:
+                _attributes = {}
+                for f in fields:
+                    if f != "id":
+                        _attributes[f] = row[f]
+                attributes[row.id] = _attributes
+            if attributes:
+                geojsons = GIS.get_simplified(table,
+                                              attributes.keys(),
+                                              tolerance=tolerance,
+                                              output="geojson")
+        elif settings.get_gis_spatialdb():
             # Do the Simplify & GeoJSON direct from the DB
             fields.remove("the_geom")
             fields.remove("wkt")
@@ -4129,6 +4386,7 @@ class GIS(object):
             table = current.s3db.gis_location
         spatial = current.deployment_settings.get_gis_spatialdb()
         wkt_centroid = GIS.wkt_centroid
+        index = S3SpatialIndex.get_index()
 
         def bounds_centroid_wkt(feature):
             form = Storage()
@@ -4153,9 +4411,15 @@ class GIS(object):
                     if spatial:
                         _vars.update(the_geom = wkt)
                 db(table.id == feature.id).update(**_vars)
+                if index:
+                    index.update(feature.id,
+                                 S3SpatialIndex.get_bounds(Storage(_vars)))
 
         if not feature:
             # Do the whole database
+            if current.deployment_settings.get_gis_bulk_location_tree():
+                GIS.rebuild_location_tree()
+                return
             # Do in chunks to save memory and also do in correct order
             fields = [table.id, table.name, table.gis_feature_type,
                       table.L0, table.L1, table.L2, table.L3, table.L4,
@@ -4184,6 +4448,9 @@ class GIS(object):
             # Nothing we can do
             raise ValueError
 
+        # Pre-compute the simplified polygons
+        GIS.update_simplified(table, [id])
+
         # L0
         name = feature.get("name", False)
         level = feature.get("level", False)
@@ -5399,6 +5666,281 @@ class GIS(object):
 
         return _path
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def rebuild_location_tree(progress=None, batch_size=500):
+        """
+            Rebuild the Materialized paths, Lx names, inherited Lat/Lons and
+            the Bounds/Centroid/WKT of all Locations in bulk
+            - produces the same results as update_location_tree per feature,
+              but level by level, with the parents held in memory and the
+              changes written in set-based batches (one UPDATE per batch)
+
+            @param progress: callback function(level, done, total) to
+                             report the progress
+            @param batch_size: the number of records per batch
+
+            @return: the number of updated records
+        """
+
+        db = current.db
+        try:
+            table = db.gis_location
+        except:
+            table = current.s3db.gis_location
+        wkt_centroid = GIS.wkt_centroid
+        log = current.log
+
+        levels = ("L0", "L1", "L2", "L3", "L4", "L5")
+        geometry = ("gis_feature_type", "lat", "lon", "wkt", "inherited",
+                    "lat_min", "lat_max", "lon_min", "lon_max")
+        fields = [table.id, table.name, table.level, table.parent,
+                  table.path, table.gis_feature_type, table.wkt] + \
+                 [table[fn] for fn in levels] + \
+                 [table[fn] for fn in geometry[1:] if fn != "wkt"]
+
+        # The parents {id: (level, name, path, L0..L5, lat, lon)}
+        parents = {}
+        updated = 0
+
+        for level in levels + (None,):
+            query = (table.level == level) & (table.deleted != True)
+            total = db(query).count()
+            done = 0
+            last_id = 0
+            while True:
+                rows = db(query & (table.id > last_id)).select(orderby=table.id,
+                                                               limitby=(0, batch_size),
+                                                               *fields)
+                if not rows:
+                    break
+                last_id = rows.last().id
+
+                if level == "L1":
+                    # L1 locations take path, L0 and Lat/Lon from their
+                    # parent whatever its level (like update_location_tree)
+                    l1_parents = {}
+                    missing = set(row.parent for row in rows
+                                  if row.parent and \
+                                     (row.parent not in parents or \
+                                      parents[row.parent][0] != "L0"))
+                    if missing:
+                        prows = db(table.id.belongs(missing)).select(table.id,
+                                                                     table.name,
+                                                                     table.lat,
+                                                                     table.lon)
+                        for prow in prows:
+                            l1_parents[prow.id] = ("L0",
+                                                   prow.name,
+                                                   str(prow.id),
+                                                   prow.name,
+                                                   None, None, None, None, None,
+                                                   prow.lat,
+                                                   prow.lon,
+                                                   )
+
+                updates = {}
+                for row in rows:
+                    record_id = row.id
+                    name = row.name
+                    wkt = row.wkt
+                    if wkt and not wkt.startswith("POI"):
+                        # Polygons aren't inherited
+                        inherited = False
+                    else:
+                        inherited = row.inherited
+
+                    # Path & Lx
+                    values = {}
+                    parent_id = row.parent
+                    orphan = False
+                    if level == "L0":
+                        values = {"path": str(record_id), "L0": name}
+                    elif parent_id:
+                        if level == "L1" and parent_id in l1_parents:
+                            parent = l1_parents[parent_id]
+                        else:
+                            parent = parents.get(parent_id)
+                        if not parent:
+                            # Parent is not a hierarchy location
+                            orphan = True
+                        elif level and parent[0] >= level:
+                            log.error("Parent of %s Location ID %s has invalid level: %s is %s" % \
+                                      (level, record_id, parent_id, parent[0]))
+                            orphan = True
+                        if orphan:
+                            # Can't propagate path, Lx and Lat/Lon from the
+                            # parent, but still update the geometry below
+                            parent_lat = parent_lon = None
+                        else:
+                            plevel = parent[0]
+                            values["path"] = "%s/%s" % (parent[2], record_id)
+                            for i, fn in enumerate(levels):
+                                if fn < plevel:
+                                    values[fn] = parent[3 + i]
+                                elif fn == plevel:
+                                    values[fn] = parent[1]
+                                else:
+                                    values[fn] = name if fn == level else None
+                            parent_lat, parent_lon = parent[-2:]
+                    else:
+                        values["path"] = str(record_id)
+                        for fn in levels:
+                            values[fn] = name if fn == level else None
+                        parent_lat = parent_lon = None
+
+                    # Inherited Lat/Lon
+                    lat = row.lat
+                    lon = row.lon
+                    feature_type = None
+                    if level != "L0" and not orphan:
+                        if inherited and lat == parent_lat and lon == parent_lon:
+                            pass
+                        elif inherited or lat is None or lon is None:
+                            inherited = True
+                            lat = values["lat"] = parent_lat
+                            lon = values["lon"] = parent_lon
+                            values["inherited"] = True
+                            feature_type = "1"
+                        elif any(values[fn] != row[fn] for fn in values):
+                            values["inherited"] = False
+                    if not wkt or wkt.startswith("POI"):
+                        feature_type = "1"
+
+                    # Bounds/Centroid/WKT
+                    form_vars = Storage(id = record_id,
+                                        gis_feature_type = feature_type or \
+                                                           row.gis_feature_type,
+                                        lat = lat,
+                                        lon = lon,
+                                        wkt = wkt,
+                                        lat_min = row.lat_min,
+                                        lat_max = row.lat_max,
+                                        lon_min = row.lon_min,
+                                        lon_max = row.lon_max,
+                                        )
+                    form = Storage(vars = form_vars,
+                                   errors = Storage(),
+                                   record = row)
+                    wkt_centroid(form)
+                    for fn in geometry:
+                        if fn in form_vars:
+                            values[fn] = form_vars[fn]
+                    if wkt and not wkt.startswith("POI"):
+                        values["inherited"] = False
+
+                    # Only write what has changed
+                    changed = {}
+                    for fn, value in values.items():
+                        current_value = row[fn]
+                        if fn == "gis_feature_type":
+                            changed_value = str(value) != str(current_value)
+                        else:
+                            changed_value = value != current_value
+                        if changed_value:
+                            changed[fn] = value
+                    if changed:
+                        updates[record_id] = changed
+
+                    if level and not orphan:
+                        # Remember for the children
+                        parents[record_id] = (level,
+                                              name,
+                                              values.get("path", row.path),
+                                              ) + \
+                                             tuple(values.get(fn, row[fn])
+                                                   for fn in levels) + \
+                                             (values.get("lat", lat),
+                                              values.get("lon", lon),
+                                              )
+                    elif level:
+                        # Children of orphans use their stored path and
+                        # Lx names, or else the path returned by
+                        # update_location_tree for the orphan
+                        path = row.path
+                        if not path or \
+                           not all(row[fn] for fn in levels if fn < level):
+                            path = "%s/%s" % (parent_id, record_id)
+                        parents[record_id] = (level, name, path) + \
+                                             tuple(row[fn] for fn in levels) + \
+                                             (values.get("lat", lat),
+                                              values.get("lon", lon),
+                                              )
+
+                if updates:
+                    GIS._bulk_update(table, updates)
+                    updated += len(updates)
+                # Pre-compute the simplified polygons
+                GIS.update_simplified(table, [row.id for row in rows])
+
+                done += len(rows)
+                if progress:
+                    progress(level, done, total)
+                else:
+                    log.debug("Location Tree %s: %s/%s" % (level, done, total))
+
+        if current.deployment_settings.get_gis_spatialdb():
+            # Populate the spatial field of any records not updated above
+            db.executesql("UPDATE %s SET the_geom=ST_SetSRID(ST_GeomFromText(wkt),4326) "
+                          "WHERE the_geom IS NULL AND wkt IS NOT NULL AND wkt != '';" % \
+                          table._tablename)
+
+        return updated
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _bulk_update(table, updates):
+        """
+            Update multiple records with different values in a single
+            (set-based) UPDATE statement, using CASE expressions which
+            work in all supported databases
+
+            @param table: the Table
+            @param updates: dict {record_id: {fieldname: value}}
+        """
+
+        db = current.db
+        represent = db._adapter.represent
+        pkey = table._id.name
+        ids = updates.keys()
+
+        # Collect the values per field
+        columns = {}
+        for record_id, values in updates.items():
+            for fn, value in values.items():
+                if fn in columns:
+                    columns[fn][record_id] = value
+                else:
+                    columns[fn] = {record_id: value}
+        if "wkt" in columns and "the_geom" in table.fields and \
+           current.deployment_settings.get_gis_spatialdb():
+            # Keep the spatial field in sync
+            columns["the_geom"] = columns["wkt"]
+
+        assignments = []
+        append = assignments.append
+        for fn, values in columns.items():
+            ftype = table[fn].type
+            cases = " ".join("WHEN %s THEN %s" % (record_id,
+                                                   represent(value, ftype))
+                             for record_id, value in values.items())
+            append("%s=CASE %s %s ELSE %s END" % (fn, pkey, cases, fn))
+
+        # Update the meta-fields, like DAL would do
+        for field in table:
+            if field.update is not None and field.name not in columns:
+                value = field.update
+                if callable(value):
+                    value = value()
+                append("%s=%s" % (field.name, represent(value, field.type)))
+
+        sql = "UPDATE %s SET %s WHERE %s IN (%s);" % \
+              (table._tablename,
+               ", ".join(assignments),
+               pkey,
+               ",".join(str(i) for i in ids))
+        db.executesql(sql)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def wkt_centroid(form):
@@ -5507,10 +6049,20 @@ class GIS(object):
                 if "lat_max" not in form_vars or form_vars.lat_max is None:
                     form_vars.lat_max = form_vars.lat
 
-        if current.deployment_settings.get_gis_spatialdb():
+        settings = current.deployment_settings
+        if settings.get_gis_spatialdb():
             # Also populate the spatial field
             form_vars.the_geom = form_vars.wkt
 
+        if settings.get_gis_simplify_cache():
+            # Remove outdated simplified polygons
+            record = getattr(form, "record", None)
+            record_id = form_vars.get("id", None) or \
+                        getattr(record, "id", None)
+            if record_id and \
+               (not record or getattr(record, "wkt", None) != form_vars.wkt):
+                GIS.clear_simplified("gis_location", [record_id])
+
         return
 
     # -------------------------------------------------------------------------
@@ -5521,6 +6073,18 @@ class GIS(object):
         """
 
         table = current.s3db.gis_location
+
+        index = S3SpatialIndex.get_index()
+        if index:
+            # Use the in-process R-Tree
+            ids = index.search(lon_min, lat_min, lon_max, lat_max)
+            if not ids:
+                return (table.id < 0)
+            elif len(ids) == 1:
+                return (table.id == ids[0])
+            else:
+                return (table.id.belongs(ids))
+
         query = (table.lat_min <= lat_max) & \
                 (table.lat_max >= lat_min) & \
                 (table.lon_min <= lon_max) & \
@@ -5927,6 +6491,392 @@ class GIS(object):
                    plugins = plugins,
                    )
 
+# =============================================================================
+class S3SpatialIndex(object):
+    """
+        In-process R-Tree over the bounds of gis_location records, to find
+        the candidate Locations for bbox & shape queries in O(log n) when
+        there is no spatial database
+
+        - packed with the Sort-Tile-Recursive algorithm when built,
+          changes are held in a pending list until the next repack
+        - built lazily on first use, persisted to disk & reloaded if
+          another process has saved a newer version
+        - kept up to date from update_location_tree, and by looking up
+          all Locations modified since the last indexed change before
+          every search (covers imports, deletions & other processes)
+
+        Nodes are tuples (lon_min, lat_min, lon_max, lat_max, item), with
+        item being a list of child nodes, or the record ID for leaves.
+    """
+
+    # Maximum number of children per node
+    NODE_SIZE = 16
+
+    # Minimum number of pending changes before repacking
+    MAX_PENDING = 500
+
+    # Version of the persisted format
+    VERSION = 1
+
+    instance = None
+    lock = threading.RLock()
+
+    # -------------------------------------------------------------------------
+    def __init__(self, path=None):
+        """
+            Constructor
+
+            @param path: the file to persist the index in (None to not persist)
+        """
+
+        self.path = path
+        self.mtime = None
+
+        # Root node list
+        self.root = []
+        # Number of indexed records
+        self.size = 0
+        # Pending changes {record_id: bounds or None for removed}
+        self.pending = {}
+        # The latest modified_on of all indexed records
+        self.modified_on = None
+
+        self.loaded = False
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get_index(cls):
+        """
+            Get the spatial index for this process
+
+            @return: the S3SpatialIndex instance, or None if disabled
+        """
+
+        settings = current.deployment_settings
+        if not settings.get_gis_spatial_index() or \
+           settings.get_gis_spatialdb():
+            return None
+
+        if cls.instance is None:
+            with cls.lock:
+                if cls.instance is None:
+                    path = os.path.join(current.request.folder,
+                                        "cache",
+                                        "gis_location.rtree")
+                    cls.instance = cls(path=path)
+        return cls.instance
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_bounds(row):
+        """
+            Get the bounds of a gis_location record, falling back to the
+            Lat/Lon for records without bounds
+
+            @param row: the gis_location Row
+
+            @return: tuple (lon_min, lat_min, lon_max, lat_max), or None
+        """
+
+        if row.get("deleted"):
+            return None
+        bounds = (row.lon_min, row.lat_min, row.lon_max, row.lat_max)
+        if None in bounds:
+            lat = row.lat
+            lon = row.lon
+            if lat is None or lon is None:
+                return None
+            bounds = (lon, lat, lon, lat)
+        return bounds
+
+    # -------------------------------------------------------------------------
+    def search(self, lon_min, lat_min, lon_max, lat_max):
+        """
+            Find all Locations whose bounds intersect a bbox
+
+            @param lon_min: the western boundary
+            @param lat_min: the southern boundary
+            @param lon_max: the eastern boundary
+            @param lat_max: the northern boundary
+
+            @return: list of gis_location record IDs
+        """
+
+        self.refresh()
+
+        with self.lock:
+            root = self.root
+            pending = dict(self.pending)
+
+        items = []
+        append = items.append
+        stack = [root]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            for node in pop():
+                if node[0] <= lon_max and node[2] >= lon_min and \
+                   node[1] <= lat_max and node[3] >= lat_min:
+                    item = node[4]
+                    if type(item) is list:
+                        push(item)
+                    elif item not in pending:
+                        append(item)
+
+        for record_id, bounds in pending.items():
+            if bounds and \
+               bounds[0] <= lon_max and bounds[2] >= lon_min and \
+               bounds[1] <= lat_max and bounds[3] >= lat_min:
+                append(record_id)
+
+        return items
+
+    # -------------------------------------------------------------------------
+    def update(self, record_id, bounds):
+        """
+            Update the bounds of a Location in the index (if it is loaded,
+            otherwise the change will be picked up when it gets loaded)
+
+            @param record_id: the gis_location record ID
+            @param bounds: tuple (lon_min, lat_min, lon_max, lat_max),
+                           or None to remove the record from the index
+        """
+
+        if not self.loaded:
+            return
+        with self.lock:
+            self.pending[int(record_id)] = bounds
+            if len(self.pending) > max(self.MAX_PENDING, self.size / 8):
+                self.pack(save=True)
+        return
+
+    # -------------------------------------------------------------------------
+    def refresh(self):
+        """
+            Load or build the index if necessary, and add all Locations
+            which have been modified since the last indexed change
+        """
+
+        with self.lock:
+            if not self.loaded:
+                if not self.load():
+                    self.build()
+            elif self.path:
+                # Reload if another process has saved a newer version
+                try:
+                    mtime = os.path.getmtime(self.path)
+                except OSError:
+                    mtime = None
+                if mtime and mtime != self.mtime:
+                    self.load()
+
+            modified_on = self.modified_on
+            if modified_on is None:
+                return
+
+            table = current.s3db.gis_location
+            query = (table.modified_on >= modified_on)
+            rows = current.db(query).select(table.id,
+                                            table.deleted,
+                                            table.lat,
+                                            table.lon,
+                                            table.lat_min,
+                                            table.lat_max,
+                                            table.lon_min,
+                                            table.lon_max,
+                                            table.modified_on,
+                                            )
+            if not rows:
+                return
+            get_bounds = self.get_bounds
+            pending = self.pending
+            for row in rows:
+                pending[row.id] = get_bounds(row)
+                if row.modified_on > modified_on:
+                    modified_on = row.modified_on
+            self.modified_on = modified_on
+            if len(pending) > max(self.MAX_PENDING, self.size / 8):
+                self.pack(save=True)
+        return
+
+    # -------------------------------------------------------------------------
+    def build(self):
+        """
+            Build the index from the database
+        """
+
+        table = current.s3db.gis_location
+        query = (table.deleted != True)
+        rows = current.db(query).select(table.id,
+                                        table.lat,
+                                        table.lon,
+                                        table.lat_min,
+                                        table.lat_max,
+                                        table.lon_min,
+                                        table.lon_max,
+                                        table.modified_on,
+                                        )
+        leaves = []
+        append = leaves.append
+        get_bounds = self.get_bounds
+        modified_on = None
+        for row in rows:
+            bounds = get_bounds(row)
+            if bounds:
+                append(bounds + (row.id,))
+            if modified_on is None or \
+               row.modified_on and row.modified_on > modified_on:
+                modified_on = row.modified_on
+
+        with self.lock:
+            self.root = self.str_pack(leaves, self.NODE_SIZE)
+            self.size = len(leaves)
+            self.pending = {}
+            self.modified_on = modified_on or current.request.utcnow
+            self.loaded = True
+            self.save()
+        return
+
+    # -------------------------------------------------------------------------
+    def pack(self, save=False):
+        """
+            Merge the pending changes into the tree
+
+            @param save: persist the index afterwards
+        """
+
+        with self.lock:
+            pending = self.pending
+            leaves = [leaf for leaf in self.leaves() if leaf[4] not in pending]
+            append = leaves.append
+            for record_id, bounds in pending.items():
+                if bounds:
+                    append(bounds + (record_id,))
+            self.root = self.str_pack(leaves, self.NODE_SIZE)
+            self.size = len(leaves)
+            self.pending = {}
+            if save:
+                self.save()
+        return
+
+    # -------------------------------------------------------------------------
+    def leaves(self):
+        """
+            Generator for all leaves of the tree
+        """
+
+        stack = [self.root]
+        while stack:
+            for node in stack.pop():
+                if type(node[4]) is list:
+                    stack.append(node[4])
+                else:
+                    yield node
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def str_pack(nodes, size):
+        """
+            Pack nodes into a tree using the Sort-Tile-Recursive algorithm
+
+            @param nodes: the leaf nodes
+            @param size: the maximum number of children per node
+
+            @return: the list of root nodes
+        """
+
+        from math import ceil, sqrt
+
+        center_x = lambda node: node[0] + node[2]
+        center_y = lambda node: node[1] + node[3]
+
+        while len(nodes) > size:
+            num_nodes = len(nodes)
+            num_pages = int(ceil(float(num_nodes) / size))
+            num_slices = int(ceil(sqrt(num_pages)))
+            slice_size = size * int(ceil(float(num_pages) / num_slices))
+
+            nodes.sort(key=center_x)
+            parents = []
+            append = parents.append
+            for i in xrange(0, num_nodes, slice_size):
+                tile = sorted(nodes[i:i + slice_size], key=center_y)
+                for j in xrange(0, len(tile), size):
+                    children = tile[j:j + size]
+                    append((min(n[0] for n in children),
+                            min(n[1] for n in children),
+                            max(n[2] for n in children),
+                            max(n[3] for n in children),
+                            children))
+            nodes = parents
+        return nodes
+
+    # -------------------------------------------------------------------------
+    def load(self):
+        """
+            Load the index from disk
+
+            @return: True if successful, otherwise False
+        """
+
+        path = self.path
+        if not path or not os.path.exists(path):
+            return False
+
+        import cPickle
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path, "rb") as f:
+                data = cPickle.load(f)
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+            current.log.error("S3SpatialIndex: could not read %s" % path)
+            return False
+        if data.get("version") != self.VERSION:
+            return False
+
+        with self.lock:
+            self.root = data["root"]
+            self.size = data["size"]
+            self.modified_on = data["modified_on"]
+            # Changes from this process which are not yet in the file
+            # will be looked up again by refresh()
+            self.pending = {}
+            self.mtime = mtime
+            self.loaded = True
+        return True
+
+    # -------------------------------------------------------------------------
+    def save(self):
+        """
+            Persist the index (the pending changes are packed first)
+        """
+
+        path = self.path
+        if not path:
+            return
+
+        import cPickle
+        with self.lock:
+            if self.pending:
+                self.pack()
+            data = {"version": self.VERSION,
+                    "root": self.root,
+                    "size": self.size,
+                    "modified_on": self.modified_on,
+                    }
+            # Write to a temporary file & rename, so that other processes
+            # never read an incomplete index
+            tmp = "%s.%s" % (path, os.getpid())
+            try:
+                with open(tmp, "wb") as f:
+                    cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+                os.rename(tmp, path)
+                self.mtime = os.path.getmtime(path)
+            except (IOError, OSError):
+                current.log.error("S3SpatialIndex: could not write %s" % path)
+        return
+
 # =============================================================================
 class MAP(DIV):
     """
@@ -8367,6 +9317,496 @@ class S3Map(S3Method):
                            )
         return map
 
+# =============================================================================
+class S3MapTile(S3Method):
+    """
+        Vector Tile endpoint for Feature & Shapefile Layers
+        - returns the features within a (z, x, y) map tile as GeoJSON,
+          simplified for the zoom level & clipped to the tile, so that
+          large layers can be loaded incrementally as the map is panned
+
+        URL examples:
+            /org/office/tile.geojson?layer=<id>&z=<z>&x=<x>&y=<y>
+            /gis/layer_shapefile/<id>/data/tile.geojson?z=<z>&x=<x>&y=<y>
+
+        Additional URL options:
+            polygons=1      return polygons rather than points
+            attr=a,b        attributes to include (default: from the layer)
+    """
+
+    # Deepest zoom level supported
+    MAX_ZOOM = 22
+
+    # Margin (in pixels) around the tile when clipping polygons, so
+    # that their outlines don't show along the edges of the tiles
+    BUFFER = 4
+
+    # Maximum number of tiles in the process-wide tile cache (the
+    # least recently used tiles get removed first)
+    CACHE_SIZE = 1000
+
+    # Time (in seconds) to keep the bounds index of a Shapefile Layer
+    BOUNDS_EXPIRE = 3600
+
+    # Process-wide tile cache {key: (output, timestamp)}
+    cache = OrderedDict()
+    lock = threading.RLock()
+
+    # -------------------------------------------------------------------------
+    def apply_method(self, r, **attr):
+        """
+            Entry point to apply the tile method to S3Requests
+
+            @param r: the S3Request instance
+            @param attr: controller attributes for the request
+
+            @return: the GeoJSON FeatureCollection
+        """
+
+        if r.http != "GET":
+            r.error(405, current.ERROR.BAD_METHOD)
+        if r.representation not in ("geojson", "json"):
+            r.error(415, current.ERROR.BAD_FORMAT)
+
+        tile = self.parse_tile(r.get_vars)
+        if tile is None:
+            r.error(400, current.ERROR.BAD_REQUEST)
+
+        response = current.response
+        expire = current.deployment_settings.get_gis_tile_cache_expire()
+        key = None
+        if expire:
+            get_vars = r.get_vars
+            record = r.record
+            if record and "modified_on" in record:
+                # Invalidate the tiles of a Shapefile Layer upon re-upload
+                modified_on = record.modified_on
+            else:
+                modified_on = None
+            key = self.resource.cache_key("tile/%s/%s/%s" % tile,
+                                          get_vars.get("layer"),
+                                          get_vars.get("attr"),
+                                          "polygons" in get_vars,
+                                          modified_on,
+                                          )
+        if key:
+            output = self.cached(key, lambda: self.tile(r, *tile), expire)
+            response.headers["Cache-Control"] = "max-age=%s" % expire
+        else:
+            output = self.tile(r, *tile)
+
+        response.headers["Content-Type"] = "application/json"
+        return output
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def cached(cls, key, f, expire):
+        """
+            Look up a tile in the process-wide tile cache, which is
+            limited to CACHE_SIZE tiles
+
+            @param key: the cache key
+            @param f: function to produce the tile if not cached
+            @param expire: time (in seconds) after which the tile expires
+
+            @return: the tile
+        """
+
+        cache = cls.cache
+        now = time.time()
+        with cls.lock:
+            entry = cache.pop(key, None)
+            if entry is not None and now - entry[1] <= expire:
+                # Re-insert as most recently used
+                cache[key] = entry
+                return entry[0]
+
+        output = f()
+        with cls.lock:
+            cache[key] = (output, now)
+            while len(cache) > cls.CACHE_SIZE:
+                cache.popitem(last=False)
+        return output
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def parse_tile(cls, get_vars):
+        """
+            Parse the tile coordinates from the URL
+
+            @param get_vars: the GET vars
+
+            @return: tuple (z, x, y), or None if invalid
+        """
+
+        try:
+            z = int(get_vars["z"])
+            x = int(get_vars["x"])
+            y = int(get_vars["y"])
+        except (KeyError, ValueError, TypeError):
+            return None
+        if z < 0 or z > cls.MAX_ZOOM:
+            return None
+        size = 2 ** z
+        if not (0 <= x < size and 0 <= y < size):
+            return None
+        return (z, x, y)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def tile_bounds(z, x, y):
+        """
+            The bounds of a (Spherical Mercator) map tile
+
+            @param z: the zoom level
+            @param x: the column of the tile
+            @param y: the row of the tile (from the top)
+
+            @return: tuple (lon_min, lat_min, lon_max, lat_max) in degrees
+        """
+
+        from math import atan, degrees, pi, sinh
+
+        size = 2.0 ** z
+        lon_min = x / size * 360.0 - 180.0
+        lon_max = (x + 1) / size * 360.0 - 180.0
+        lat_max = degrees(atan(sinh(pi * (1 - 2 * y / size))))
+        lat_min = degrees(atan(sinh(pi * (1 - 2 * (y + 1) / size))))
+        return (lon_min, lat_min, lon_max, lat_max)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def bounds_query(gtable, bounds):
+        """
+            Query for locations whose bounds intersect the tile
+            - falls back to the (lat, lon) of locations without bounds
+
+            @param gtable: the gis_location Table
+            @param bounds: the tile bounds
+        """
+
+        lon_min, lat_min, lon_max, lat_max = bounds
+        query = (gtable.lat_min <= lat_max) & \
+                (gtable.lat_max >= lat_min) & \
+                (gtable.lon_min <= lon_max) & \
+                (gtable.lon_max >= lon_min)
+        no_bounds = (gtable.lat_min == None) & \
+                    (gtable.lat >= lat_min) & \
+                    (gtable.lat <= lat_max) & \
+                    (gtable.lon >= lon_min) & \
+                    (gtable.lon <= lon_max)
+        return query | no_bounds
+
+    # -------------------------------------------------------------------------
+    def tile(self, r, z, x, y):
+        """
+            Render a tile
+
+            @param r: the S3Request instance
+            @param z: the zoom level
+            @param x: the column of the tile
+            @param y: the row of the tile
+
+            @return: the GeoJSON FeatureCollection (string)
+        """
+
+        from math import ceil, log10
+
+        db = current.db
+        s3db = current.s3db
+        get_vars = r.get_vars
+
+        resource = self.resource
+        table = resource.table
+        tablename = resource.tablename
+
+        bounds = self.tile_bounds(z, x, y)
+        tolerance = GIS.get_simplify_tolerance(z)
+        # Enough decimals to not lose detail at this zoom level
+        decimals = max(4, int(ceil(-log10(tolerance))) + 1)
+
+        polygons = "polygons" in get_vars
+        attr_fields = get_vars.get("attr")
+        attr_fields = attr_fields.split(",") if attr_fields else []
+        layer_id = get_vars.get("layer")
+        if layer_id:
+            ftable = s3db.gis_layer_feature
+            layer = db(ftable.id == layer_id).select(ftable.polygons,
+                                                     ftable.attr_fields,
+                                                     limitby=(0, 1)
+                                                     ).first()
+            if layer:
+                polygons = polygons or layer.polygons
+                if not attr_fields:
+                    attr_fields = layer.attr_fields or []
+
+        limit = current.deployment_settings.get_gis_max_features()
+
+        if tablename[:20] == "gis_layer_shapefile_":
+            # Shapefile Layer data: the records hold the geometries
+            gtable = table
+            polygons = True
+            locations, attributes = self.shapefile_features(r, bounds, limit)
+        else:
+            gtable = s3db.gis_location
+            locations = self.location_features(r, bounds, limit)
+            if attr_fields and locations:
+                attributes = self.attributes(attr_fields, limit)
+            else:
+                attributes = {}
+
+        # Lookup the geometries in bulk
+        location_ids = set(locations.values())
+        if polygons:
+            geometries = GIS.get_geometries(gtable, location_ids,
+                                            polygons=True,
+                                            output="wkt",
+                                            tolerance=tolerance,
+                                            decimals=decimals)
+            missing = [i for i in location_ids if i not in geometries]
+        else:
+            geometries = {}
+            missing = location_ids
+        points = GIS.get_geometries(gtable, missing)
+
+        try:
+            from shapely.geometry import box
+            from shapely.wkt import loads as wkt_loads
+        except ImportError:
+            current.log.error("S3MapTile: Shapely required for polygons")
+            geometries = {}
+            clip = None
+        else:
+            margin = tolerance * self.BUFFER
+            lon_min, lat_min, lon_max, lat_max = bounds
+            clip = box(lon_min - margin, lat_min - margin,
+                       lon_max + margin, lat_max + margin)
+        from ..geojson import dumps
+
+        features = []
+        append = features.append
+        for record_id, location_id in locations.items():
+            geometry = None
+            wkt = geometries.get(location_id)
+            if wkt:
+                try:
+                    shape = wkt_loads(wkt)
+                except:
+                    shape = None
+                if shape is not None:
+                    if shape.geom_type != "Point":
+                        shape = shape.intersection(clip)
+                    if not shape.is_empty:
+                        geometry = dumps(shape, separators=SEPARATORS)
+            if geometry is None:
+                point = points.get(location_id)
+                if not point or point[0] is None or point[1] is None:
+                    continue
+                lat, lon = point
+                geometry = '{"type":"Point","coordinates":[%s,%s]}' % (lon, lat)
+            properties = attributes.get(record_id, {})
+            properties["id"] = record_id
+            append('{"type":"Feature","id":%s,"geometry":%s,"properties":%s}' % \
+                   (record_id,
+                    geometry,
+                    json.dumps(properties, separators=SEPARATORS)))
+
+        return '{"type":"FeatureCollection","features":[%s]}' % \
+               ",".join(features)
+
+    # -------------------------------------------------------------------------
+    def location_features(self, r, bounds, limit):
+        """
+            Find the records of the resource with a location in the tile
+
+            @param r: the S3Request instance
+            @param bounds: the tile bounds
+            @param limit: the maximum number of records
+
+            @return: dict {record_id: location_id}
+        """
+
+        s3db = current.s3db
+
+        resource = self.resource
+        table = resource.table
+        gtable = s3db.gis_location
+
+        query = self.bounds_query(gtable, bounds)
+        if resource.tablename == "gis_location":
+            lfield = table._id
+        else:
+            fname = sname = None
+            for f in table.fields:
+                ftype = str(table[f].type)
+                if ftype == "reference gis_location":
+                    fname = f
+                    break
+                elif not sname and ftype == "reference org_site":
+                    sname = f
+            if fname:
+                lfield = table[fname]
+                query &= (gtable.id == lfield)
+            elif sname:
+                stable = s3db.org_site
+                lfield = stable.location_id
+                query &= (stable.site_id == table[sname]) & \
+                         (gtable.id == lfield)
+            else:
+                r.error(400, current.ERROR.BAD_RESOURCE)
+        resource.add_filter(query)
+
+        pkey = table._id
+        left = resource.rfilter.get_left_joins()
+        rows = current.db(resource.get_query()).select(pkey,
+                                                       lfield,
+                                                       left=left,
+                                                       limitby=(0, limit))
+        return dict((row[pkey], row[lfield]) for row in rows)
+
+    # -------------------------------------------------------------------------
+    def attributes(self, attr_fields, limit):
+        """
+            Lookup the attributes of the features in bulk
+
+            @param attr_fields: the attribute selectors
+            @param limit: the maximum number of records
+
+            @return: dict {record_id: {fieldname: value}}
+        """
+
+        NONE = current.messages["NONE"]
+
+        resource = self.resource
+        pkey = resource._id.name
+        fields = [pkey] + [f for f in attr_fields if f != pkey]
+        data = resource.select(fields,
+                               limit=limit,
+                               represent=True,
+                               raw_data=True)
+
+        cols = []
+        for rfield in data["rfields"]:
+            if rfield.fname in attr_fields or rfield.selector in attr_fields:
+                # Keep numbers as numbers (for styling)
+                numeric = rfield.ftype in ("integer", "double")
+                cols.append((rfield.colname, rfield.fname, numeric))
+
+        attributes = {}
+        _pkey = str(resource._id)
+        for row in data["rows"]:
+            raw = row["_row"]
+            attribute = {}
+            for colname, fname, numeric in cols:
+                if numeric:
+                    value = raw[colname]
+                else:
+                    value = row[colname]
+                    if value == NONE:
+                        value = None
+                if value is not None and value != "":
+                    attribute[fname] = value
+            attributes[raw[_pkey]] = attribute
+        return attributes
+
+    # -------------------------------------------------------------------------
+    def shapefile_features(self, r, bounds, limit):
+        """
+            Find the features of a Shapefile Layer which intersect the tile
+
+            @param r: the S3Request instance
+            @param bounds: the tile bounds
+            @param limit: the maximum number of features
+
+            @return: tuple ({record_id: record_id}, {record_id: attributes})
+        """
+
+        db = current.db
+
+        resource = self.resource
+        table = resource.table
+        query = resource.get_query()
+
+        lon_min, lat_min, lon_max, lat_max = bounds
+        if current.deployment_settings.get_gis_spatialdb():
+            polygon = "POLYGON((%s %s, %s %s, %s %s, %s %s, %s %s))" % \
+                      (lon_min, lat_min,
+                       lon_min, lat_max,
+                       lon_max, lat_max,
+                       lon_max, lat_min,
+                       lon_min, lat_min)
+            query &= table.the_geom.st_intersects(polygon)
+        else:
+            # Filter by the bounds of the features, which are computed
+            # once per upload of the layer
+            index = self.shapefile_bounds(r)
+            ids = [record_id for record_id, b in index.items()
+                   if b[0] <= lon_max and b[2] >= lon_min and
+                      b[1] <= lat_max and b[3] >= lat_min]
+            if not ids:
+                return {}, {}
+            query &= table._id.belongs(ids)
+
+        fields = [table[f] for f in table.fields
+                  if f not in ("layer_id", "lat", "lon", "wkt", "the_geom")]
+        rows = db(query).select(limitby=(0, limit), *fields)
+
+        locations = {}
+        attributes = {}
+        for row in rows:
+            record_id = row.id
+            locations[record_id] = record_id
+            attributes[record_id] = dict((f.name, row[f.name])
+                                         for f in fields if f.name != "id")
+        return locations, attributes
+
+    # -------------------------------------------------------------------------
+    def shapefile_bounds(self, r):
+        """
+            Bounds index of the features of a Shapefile Layer
+
+            @param r: the S3Request instance
+
+            @return: dict {record_id: (lon_min, lat_min, lon_max, lat_max)}
+        """
+
+        table = self.resource.table
+        record = r.record
+        if record and "modified_on" in record:
+            modified_on = record.modified_on
+        else:
+            modified_on = None
+        prefix = "gis_tile_bounds_%s_" % table._tablename
+        key = "%s%s" % (prefix, modified_on)
+        ram = current.cache.ram
+
+        def lookup():
+            # Remove the index for previous uploads
+            ram.clear(regex="^%s" % prefix)
+            try:
+                from shapely.wkt import loads as wkt_loads
+            except ImportError:
+                wkt_loads = None
+            index = {}
+            rows = current.db(table.id > 0).select(table.id,
+                                                   table.lat,
+                                                   table.lon,
+                                                   table.wkt)
+            for row in rows:
+                bounds = None
+                if wkt_loads and row.wkt:
+                    try:
+                        bounds = wkt_loads(row.wkt).bounds
+                    except:
+                        pass
+                if not bounds and row.lat is not None and row.lon is not None:
+                    bounds = (row.lon, row.lat, row.lon, row.lat)
+                if bounds:
+                    index[row.id] = bounds
+            return index
+
+        return ram(key, lookup, time_expire=self.BOUNDS_EXPIRE)
+
 # =============================================================================
 class S3ExportPOI(S3Method):
     """ Export point-of-interest resources for a location """
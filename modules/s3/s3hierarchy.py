@@ -40,7 +40,7 @@ except ImportError:
         import gluon.contrib.simplejson as json # fallback to pure-Python module
 
 from gluon import *
-from s3utils import s3_unicode
+from s3utils import s3_append_callback, s3_unicode
 
 DEFAULT = lambda: None
 
@@ -48,6 +48,16 @@ DEFAULT = lambda: None
 class S3Hierarchy(object):
     """ Class representing an object hierarchy """
 
+    # Number of changes after which the hierarchy gets stored in full
+    # again (rather than applying the changes upon every load)
+    MAX_DELTA = 50
+
+    # Keys to install the update callbacks for
+    HOOKS = ("onaccept", "create_onaccept", "update_onaccept", "ondelete")
+
+    # Update callbacks {tablename: callback}
+    callbacks = {}
+
     # -------------------------------------------------------------------------
     def __init__(self, tablename=None, hierarchy=None, represent=None):
         """
@@ -67,6 +77,7 @@ class S3Hierarchy(object):
         self.__roots = None
         self.__nodes = None
         self.__flags = None
+        self.__index = None
         
     # -------------------------------------------------------------------------
     @property
@@ -92,6 +103,8 @@ class S3Hierarchy(object):
             self.__connect()
         if self.__status("dirty"):
             self.read()
+        if self.__status("dbupdate"):
+            self.save()
         return self.__nodes
 
     # -------------------------------------------------------------------------
@@ -100,9 +113,51 @@ class S3Hierarchy(object):
         """ Dict of status flags """
 
         if self.__flags is None:
-            nodes = self.nodes
+            self.__connect()
         return self.__flags
 
+    # -------------------------------------------------------------------------
+    @property
+    def index(self):
+        """
+            Nested-set index of the hierarchy, to find all descendants
+            of a node without walking the tree, like:
+
+                {"order": [<node_id>, ...] (pre-order),
+                 "left": {<node_id>: <position of the node in order>},
+                 "right": {<node_id>: <position after its last descendant>}
+                 }
+        """
+
+        nodes = self.nodes
+        index = self.__index
+        if not index:
+            order = []
+            left = {}
+            right = {}
+            append = order.append
+            for root_id in self.__roots:
+                stack = [(root_id, False)]
+                pop = stack.pop
+                push = stack.append
+                while stack:
+                    node_id, done = pop()
+                    if done:
+                        right[node_id] = len(order)
+                        continue
+                    if node_id in left:
+                        # Circular reference
+                        continue
+                    left[node_id] = len(order)
+                    append(node_id)
+                    push((node_id, True))
+                    node = nodes.get(node_id)
+                    if node and node["s"]:
+                        for child_id in node["s"]:
+                            push((child_id, False))
+            index.update(order=order, left=left, right=right)
+        return index
+
     # -------------------------------------------------------------------------
     @property
     def config(self):
@@ -128,19 +183,25 @@ class S3Hierarchy(object):
                 self.__roots = hierarchy["roots"]
                 self.__nodes = hierarchy["nodes"]
                 self.__flags = hierarchy["flags"]
+                if "index" not in hierarchy:
+                    hierarchy["index"] = {}
+                self.__index = hierarchy["index"]
             else:
                 self.__roots = set()
                 self.__nodes = dict()
                 self.__flags = dict()
-                self.load()
+                self.__index = dict()
                 hierarchy = {"roots": self.__roots,
                              "nodes": self.__nodes,
-                             "flags": self.__flags}
+                             "flags": self.__flags,
+                             "index": self.__index}
                 hierarchies[tablename] = hierarchy
+                self.load()
         else:
             self.__roots = set()
             self.__nodes = dict()
             self.__flags = dict()
+            self.__index = dict()
         return
 
     # -------------------------------------------------------------------------
@@ -168,7 +229,10 @@ class S3Hierarchy(object):
 
     # -------------------------------------------------------------------------
     def load(self):
-        """ Try loading the hierarchy from s3_hierarchy """
+        """
+            Try loading the hierarchy from s3_hierarchy, and apply the
+            changes from s3_hierarchy_delta since it was stored
+        """
 
         if not self.config:
             return
@@ -179,11 +243,13 @@ class S3Hierarchy(object):
             self.__status(dirty=True)
             return
 
-        htable = current.s3db.s3_hierarchy
+        db = current.db
+        s3db = current.s3db
+        htable = s3db.s3_hierarchy
         query = (htable.tablename == tablename)
-        row = current.db(query).select(htable.dirty,
-                                        htable.hierarchy,
-                                        limitby=(0, 1)).first()
+        row = db(query).select(htable.dirty,
+                               htable.hierarchy,
+                               limitby=(0, 1)).first()
         if row and not row.dirty:
             data = row.hierarchy
             nodes = self.__nodes
@@ -196,9 +262,36 @@ class S3Hierarchy(object):
             roots = self.__roots
             roots.clear()
             roots.update(set(data["roots"]))
+            self.__index.clear()
             self.__status(dirty=False,
-                                 dbupdate=None,
-                                 dbstatus=True)
+                          dbupdate=None,
+                          dbstatus=True)
+
+            # Apply the changes since the hierarchy was stored
+            last = data.get("delta", 0)
+            dtable = s3db.s3_hierarchy_delta
+            query = (dtable.tablename == tablename) & \
+                    (dtable.id > last)
+            rows = db(query).select(dtable.id,
+                                    dtable.node_id,
+                                    dtable.parent_id,
+                                    dtable.category,
+                                    dtable.removed,
+                                    orderby=dtable.id)
+            for delta in rows:
+                if delta.removed:
+                    self.__remove(delta.node_id)
+                elif not self.__set(delta.node_id,
+                                    delta.parent_id,
+                                    delta.category):
+                    # Inconsistent change => rebuild
+                    self.__status(dirty=True)
+                    return
+                last = delta.id
+            self.__status(delta=last)
+            if len(rows) > self.MAX_DELTA:
+                # Store in full again
+                self.__status(dbupdate=True)
             return
         else:
             self.__status(dirty=True,
@@ -214,9 +307,13 @@ class S3Hierarchy(object):
             return
         tablename = self.tablename
 
-        nodes = self.nodes
+        if self.__nodes is None:
+            self.__connect()
+        if self.__status("dirty"):
+            self.read()
         if not self.__status("dbupdate"):
             return
+        nodes = self.__nodes
             
         # Serialize the nodes
         nodes_dict = dict()
@@ -227,18 +324,22 @@ class S3Hierarchy(object):
                                         if node["s"] else []}
 
         # Generate record
+        last = self.__status("delta", 0)
         data = {"tablename": tablename,
                 "dirty": False,
                 "hierarchy": {"roots": list(self.__roots),
-                              "nodes": nodes_dict
+                              "nodes": nodes_dict,
+                              "delta": last,
                              }
                 }
 
         # Get current entry
-        htable = current.s3db.s3_hierarchy
+        db = current.db
+        s3db = current.s3db
+        htable = s3db.s3_hierarchy
         query = (htable.tablename == tablename)
-        row = current.db(query).select(htable.id,
-                                       limitby=(0, 1)).first()
+        row = db(query).select(htable.id,
+                               limitby=(0, 1)).first()
 
         if row:
             # Update record
@@ -247,6 +348,12 @@ class S3Hierarchy(object):
             # Create new record
             htable.insert(**data)
 
+        # Remove the changes which are now included
+        dtable = s3db.s3_hierarchy_delta
+        query = (dtable.tablename == tablename) & \
+                (dtable.id <= last)
+        db(query).delete()
+
         # Update status
         self.__status(dirty=False, dbupdate=None, dbstatus=True)
         return
@@ -277,7 +384,8 @@ class S3Hierarchy(object):
             flags = {}
             hierarchies[tablename] = {"roots": set(),
                                       "nodes": dict(),
-                                      "flags": flags}
+                                      "flags": flags,
+                                      "index": dict()}
         flags["dirty"] = True
 
         dbstatus = flags.get("dbstatus", True)
@@ -302,46 +410,37 @@ class S3Hierarchy(object):
         if not tablename:
             return
 
+        db = current.db
         s3db = current.s3db
         table = s3db[tablename]
         
         config = s3db.get_config(tablename, "hierarchy")
         if not config:
             return
-            
-        if isinstance(config, tuple):
-            parent, category = config[:2]
-        else:
-            parent, category = config, None
-        if parent is None:
-            pkey = table._id.name
-            parent_field = None
-            for field in table:
-                ftype = str(field.type)
-                if ftype[:9] == "reference":
-                    key = ftype[10:].split(".")
-                    if key[0] == tablename and \
-                       (len(key) == 1 or key[1] == pkey):
-                        parent = field.name
-                        parent_field = field
-                        break
-        else:
-            parent_field = table[parent]
-        if not parent_field:
-            raise AttributeError
+
+        parent, category = self.__keys(table, config)
+        parent_field = table[parent]
             
         fields = [table._id, parent_field]
         if category is not None:
             fields.append(table[category])
 
+        # All changes recorded so far are included in the table
+        dtable = s3db.s3_hierarchy_delta
+        query = (dtable.tablename == tablename)
+        last = db(query).select(dtable.id,
+                                orderby=~dtable.id,
+                                limitby=(0, 1)).first()
+
         if "deleted" in table:
             query = (table.deleted != True)
         else:
             query = (table.id > 0)
-        rows = current.db(query).select(*fields)
+        rows = db(query).select(*fields)
 
         self.__nodes.clear()
         self.__roots.clear()
+        self.__index.clear()
         
         add = self.add
         for row in rows:
@@ -354,7 +453,266 @@ class S3Hierarchy(object):
             add(n, parent_id=p, category=c)
 
         # Update status: memory is clean, db needs update
-        self.__status(dirty=False, dbupdate=True)
+        self.__status(dirty=False,
+                      dbupdate=True,
+                      delta=last.id if last else 0)
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def __keys(table, config):
+        """
+            Get the names of the parent and category fields
+
+            @param table: the target table
+            @param config: the hierarchy configuration of the table
+
+            @return: tuple (parent, category)
+        """
+
+        if isinstance(config, tuple):
+            parent, category = config[:2]
+        else:
+            parent, category = config, None
+        if parent is None:
+            tablename = table._tablename
+            pkey = table._id.name
+            for field in table:
+                ftype = str(field.type)
+                if ftype[:9] == "reference":
+                    key = ftype[10:].split(".")
+                    if key[0] == tablename and \
+                       (len(key) == 1 or key[1] == pkey):
+                        parent = field.name
+                        break
+        if parent is None or parent not in table.fields:
+            raise AttributeError
+        return parent, category
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def hook(cls, tablename):
+        """
+            Install the callbacks to update the hierarchy when records in
+            the target table are created, updated or deleted (appends the
+            callback to existing onaccept/ondelete callbacks)
+
+            @param tablename: the name of the target table
+        """
+
+        callbacks = cls.callbacks
+        if tablename in callbacks:
+            update = callbacks[tablename]
+        else:
+            def update(record, *args, **kwargs):
+                if "vars" in record:
+                    record = record.vars
+                record_id = record.get("id")
+                if record_id:
+                    cls.update_node(tablename, record_id)
+            callbacks[tablename] = update
+
+        s3_append_callback(tablename, cls.HOOKS, update)
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def update_node(cls, tablename, node_id):
+        """
+            Update a node in the hierarchy from the target table,
+            to be called after a record has been created, updated
+            or deleted
+
+            @param tablename: the name of the target table
+            @param node_id: the record ID
+        """
+
+        hierarchy = cls(tablename)
+        config = hierarchy.config
+        if not config:
+            return
+
+        table = current.s3db.table(tablename)
+        parent, category = hierarchy.__keys(table, config)
+
+        fields = [table._id, table[parent]]
+        if category:
+            fields.append(table[category])
+        if "deleted" in table.fields:
+            fields.append(table.deleted)
+        row = current.db(table._id == node_id).select(limitby=(0, 1),
+                                                      *fields).first()
+        if not row or row.get("deleted"):
+            hierarchy.remove(node_id)
+        else:
+            hierarchy.insert(node_id,
+                             parent_id=row[parent],
+                             category=row[category] if category else None)
+        return
+
+    # -------------------------------------------------------------------------
+    def insert(self, node_id, parent_id=None, category=None):
+        """
+            Add a node to the hierarchy (or update its parent and category
+            if it already exists), and store the change
+
+            @param node_id: the node ID
+            @param parent_id: the parent node ID
+            @param category: the category
+        """
+
+        if self.__connected():
+            if not self.__set(node_id, parent_id, category):
+                # Would create a circular reference
+                S3Hierarchy.dirty(self.tablename)
+                return
+        self.__delta(node_id, parent_id=parent_id, category=category)
+        return
+
+    # -------------------------------------------------------------------------
+    def move(self, node_id, parent_id):
+        """
+            Move a node to another parent node, and store the change
+
+            @param node_id: the node ID
+            @param parent_id: the new parent node ID (None for root)
+        """
+
+        self.insert(node_id,
+                    parent_id=parent_id,
+                    category=self.category(node_id))
+        return
+
+    # -------------------------------------------------------------------------
+    def remove(self, node_id):
+        """
+            Remove a node from the hierarchy, and store the change
+
+            @param node_id: the node ID
+        """
+
+        if self.__connected():
+            self.__remove(node_id)
+        self.__delta(node_id, removed=True)
+        return
+
+    # -------------------------------------------------------------------------
+    def __connected(self):
+        """
+            Check whether the hierarchy has already been loaded in this
+            request (and connect this instance to it if so)
+        """
+
+        if self.__nodes is None:
+            if self.tablename in current.model.hierarchies:
+                self.__connect()
+            else:
+                return False
+        return True
+
+    # -------------------------------------------------------------------------
+    def __set(self, node_id, parent_id, category):
+        """
+            Patch the nodes dict: add or move a node
+
+            @param node_id: the node ID
+            @param parent_id: the parent node ID
+            @param category: the category
+
+            @return: False if the change would create a circular
+                     reference (nothing changed), otherwise True
+        """
+
+        nodes = self.__nodes
+
+        # Check for circular references
+        ancestor = parent_id
+        while ancestor:
+            if ancestor == node_id:
+                return False
+            node = nodes.get(ancestor)
+            ancestor = node["p"] if node else None
+
+        node = nodes.get(node_id)
+        if node:
+            old = node["p"]
+            if old == parent_id:
+                node["c"] = category
+                return True
+            self.__detach(node_id, old)
+        self.add(node_id, parent_id=parent_id, category=category)
+        nodes[node_id]["c"] = category
+        self.__index.clear()
+        return True
+
+    # -------------------------------------------------------------------------
+    def __remove(self, node_id):
+        """
+            Patch the nodes dict: remove a node
+
+            @param node_id: the node ID
+        """
+
+        nodes = self.__nodes
+        node = nodes.get(node_id)
+        if not node:
+            return
+        self.__detach(node_id, node["p"])
+        if node["s"]:
+            # Keep as (uncategorized) root node for the children,
+            # just like when reading the hierarchy from the table
+            node["p"] = None
+            node["c"] = None
+            self.__roots.add(node_id)
+        else:
+            del nodes[node_id]
+        self.__index.clear()
+        return
+
+    # -------------------------------------------------------------------------
+    def __detach(self, node_id, parent_id):
+        """
+            Detach a node from its parent node
+
+            @param node_id: the node ID
+            @param parent_id: the parent node ID
+        """
+
+        if parent_id:
+            parent = self.__nodes.get(parent_id)
+            if parent:
+                parent["s"].discard(node_id)
+        else:
+            self.__roots.discard(node_id)
+        return
+
+    # -------------------------------------------------------------------------
+    def __delta(self, node_id, parent_id=None, category=None, removed=False):
+        """
+            Store a change of the hierarchy in s3_hierarchy_delta
+            (only needed if the hierarchy is currently stored)
+
+            @param node_id: the node ID
+            @param parent_id: the parent node ID
+            @param category: the category
+            @param removed: whether the node has been removed
+        """
+
+        if not self.config:
+            return
+        tablename = self.tablename
+
+        s3db = current.s3db
+        htable = s3db.s3_hierarchy
+        query = (htable.tablename == tablename)
+        row = current.db(query).select(htable.dirty,
+                                       limitby=(0, 1)).first()
+        if row and not row.dirty:
+            s3db.s3_hierarchy_delta.insert(tablename=tablename,
+                                           node_id=node_id,
+                                           parent_id=parent_id,
+                                           category=category,
+                                           removed=removed)
         return
 
     # -------------------------------------------------------------------------
@@ -607,19 +965,23 @@ class S3Hierarchy(object):
                                   classify=classify,
                                   inclusive=inclusive)
             return result
+
         nodes = self.nodes
-        node = nodes.get(node_id)
-        if not node:
+        index = self.index
+        left = index["left"].get(node_id)
+        if left is None:
             return result
-        if node["s"]:
-            result |= findall(node["s"],
-                              category=category,
-                              classify=classify,
-                              inclusive=True)
+
+        # Use the nested-set index
         if inclusive:
-            this = (node_id, node["c"]) if classify else node_id
-            if category is DEFAULT or category == node["c"]:
-                result.add(this)
+            subtree = index["order"][left:index["right"][node_id]]
+        else:
+            subtree = index["order"][left + 1:index["right"][node_id]]
+        add = result.add
+        for n in subtree:
+            c = nodes[n]["c"]
+            if category is DEFAULT or category == c:
+                add((n, c) if classify else n)
         return result
 
     # -------------------------------------------------------------------------
@@ -65,6 +65,7 @@ from gluon import *
 from gluon.storage import Storage, Messages
 from gluon.tools import callback, fetch
 
+from s3fields import s3_all_meta_field_names
 from s3rest import S3Method
 from s3resource import S3Resource
 from s3utils import s3_mark_required, s3_has_foreign_key, s3_get_foreign_key, s3_unicode
@@ -1756,6 +1757,8 @@ class S3ImportItem(object):
         self.load_references = []
         self.parent = None
         self.skip = False
+        self.deduplicated = False
+        self.duplicate_of = None
 
         # Conflict handling
         self.mci = 2
@@ -1828,8 +1831,8 @@ class S3ImportItem(object):
         self.tablename = table._tablename
 
         if original is None:
-            original = S3Resource.original(table, element,
-                                           mandatory=self._mandatory_fields())
+            original = self.job.original(table, element,
+                                         mandatory=self._mandatory_fields())
         postprocess = s3db.get_config(self.tablename, "xml_post_parse")
         data = xml.record(table, element,
                           files=files,
@@ -1890,15 +1893,33 @@ class S3ImportItem(object):
 
         if table is None:
             return
+
+        data = self.data
+        duplicate = self.duplicate_of
+        if duplicate is not None and duplicate.id and \
+           data and not data[DELETED]:
+            # Duplicate of a new record created earlier in the same
+            # import job (batch mode)
+            self.id = duplicate.id
+            self.method = UPDATE
+            if duplicate.uid and UID in table.fields:
+                self.uid = duplicate.uid
+                data.update({UID:self.uid})
+            fields = S3Resource.import_fields(table, data,
+                                              mandatory=mandatory)
+            self.original = current.db(table._id == self.id) \
+                                   .select(limitby=(0, 1),
+                                           *fields).first()
+            return
+
         if self.original is not None:
             original = self.original
         elif self.data:
-            original = S3Resource.original(table, self.data,
-                                           mandatory=mandatory)
+            original = self.job.original(table, self.data,
+                                         mandatory=mandatory)
         else:
             original = None
 
-        data = self.data
         if original is not None:
             self.original = original
             self.id = original[table._id.name]
@@ -1921,7 +1942,12 @@ class S3ImportItem(object):
                     self.method = DELETE
             else:
                 resolve = current.s3db.get_config(self.tablename, RESOLVER)
-                if data and resolve:
+                if data and resolve and not self.deduplicated:
+                    job = self.job
+                    if job.batch:
+                        # Insert the new records of this table from earlier
+                        # in the job first, so that the resolver finds them
+                        job.flush(tablename=self.tablename)
                     resolve(self)
                 if self.id and self.method in (UPDATE, DELETE, MERGE):
                     fields = S3Resource.import_fields(table, data,
@@ -2381,6 +2407,10 @@ class S3ImportItem(object):
                     data[MCI] = self.mci
 
                 # Insert the new record
+                if job.batch:
+                    # Defer to S3ImportJob.flush (bulk_insert)
+                    job.defer(self, dict(data))
+                    return True
                 try:
                     success = table.insert(**dict(data))
                 except:
@@ -2478,6 +2508,28 @@ class S3ImportItem(object):
         else:
             raise RuntimeError("unknown import method: %s" % method)
 
+        self.postprocess()
+        return True
+
+    # -------------------------------------------------------------------------
+    def postprocess(self):
+        """
+            Audit, onaccept and update of referencing items after
+            this item has been committed (separate from commit() since
+            S3ImportJob.flush needs this after bulk inserts)
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        METHOD = self.METHOD
+        CREATE = METHOD.CREATE
+        UPDATE = METHOD.UPDATE
+
+        table = self.table
+        tablename = self.tablename
+        method = self.method
+
         # Audit + onaccept on successful commits
         if self.committed:
             form = Storage()
@@ -2527,7 +2579,7 @@ class S3ImportItem(object):
         _debug("Success: %s, id=%s %sd" % (tablename, self.id,
                                            self.skip and "skippe" or \
                                            method))
-        return True
+        return
 
     # -------------------------------------------------------------------------
     def _dynamic_defaults(self, data):
@@ -2549,32 +2601,7 @@ class S3ImportItem(object):
     # -------------------------------------------------------------------------
     def _mandatory_fields(self):
 
-        job = self.job
-
-        mandatory = None
-        tablename = self.tablename
-
-        mfields = job.mandatory_fields
-        if tablename in mfields:
-            mandatory = mfields[tablename]
-
-        if mandatory is None:
-            mandatory = []
-            for field in self.table:
-                if field.default is not None:
-                    continue
-                requires = field.requires
-                if requires:
-                    if not isinstance(requires, (list, tuple)):
-                        requires = [requires]
-                    if isinstance(requires[0], IS_EMPTY_OR):
-                        continue
-                    value, error = field.validate("")
-                    if error:
-                        mandatory.append(field.name)
-            mfields[tablename] = mandatory
-
-        return mandatory
+        return self.job.get_mandatory_fields(self.table)
 
     # -------------------------------------------------------------------------
     def _resolve_references(self):
@@ -2816,6 +2843,9 @@ class S3ImportJob():
     JOB_TABLE_NAME = "s3_import_job"
     ITEM_TABLE_NAME = "s3_import_item"
 
+    # Maximum number of values per belongs() query in batch mode
+    BATCH_SIZE = 500
+
     # -------------------------------------------------------------------------
     def __init__(self, table,
                  tree=None,
@@ -2891,6 +2921,13 @@ class S3ImportJob():
         self.last_sync = last_sync
         self.onconflict = onconflict
 
+        # Batch mode
+        self.batch = current.deployment_settings.get_base_import_batch()
+        self.originals = None
+        self.deferred = []
+        self.ignore_errors = False
+        self.flush_failed = False
+
         if job_id:
             self.__define_tables()
             jobtable = self.job_table
@@ -3311,6 +3348,169 @@ class S3ImportJob():
             item.lock = False
         return True
 
+    # -------------------------------------------------------------------------
+    def original(self, table, record, mandatory=None):
+        """
+            Find the original record for a possible duplicate, in batch
+            mode from the originals pre-fetched for the whole import tree
+            (same rules as S3Resource.original, which is used as fallback)
+
+            @param table: the table
+            @param record: the record as dict or S3XML Element
+            @param mandatory: the mandatory fields of the table
+        """
+
+        lookup = None
+        if self.batch:
+            if self.originals is None:
+                self.prefetch()
+            lookup = self.originals.get(table._tablename)
+        if lookup is None:
+            return S3Resource.original(table, record, mandatory=mandatory)
+
+        UID = current.xml.UID
+        pkey = table._id.name
+        key = self.__key
+
+        pvalues = S3Resource.unique_values(table, record)
+        keys = Storage()
+        for fn in pvalues:
+            index = lookup.get(fn)
+            k = key(fn, pvalues[fn])
+            if index is None or k not in index:
+                # Value has not been pre-fetched
+                return S3Resource.original(table, record, mandatory=mandatory)
+            keys[fn] = k
+
+        # Try to find exactly one match by non-UID unique keys
+        matches = Storage()
+        for fn in keys:
+            if fn != UID:
+                for row in lookup[fn][keys[fn]]:
+                    matches[row[pkey]] = row
+        if len(matches) == 1:
+            return matches.values()[0]
+
+        # If no match, then try to find a UID-match
+        if UID in keys:
+            rows = lookup[UID][keys[UID]]
+            if rows:
+                return rows[0]
+
+        # No match or multiple matches
+        return None
+
+    # -------------------------------------------------------------------------
+    def prefetch(self):
+        """
+            Look up the originals for all elements in the import tree
+            with one belongs() query per unique field and BATCH_SIZE
+            values (batch mode), rather than one query per element
+        """
+
+        originals = self.originals = Storage()
+
+        tree = self.tree
+        if tree is None:
+            return
+        if isinstance(tree, etree._Element):
+            root = tree
+        else:
+            root = tree.getroot()
+
+        db = current.db
+        s3db = current.s3db
+        xml = current.xml
+        NAME = xml.ATTRIBUTE.name
+        key = self.__key
+
+        # Collect the values for unique fields per table
+        tables = {}
+        values = {}
+        for element in root.iter(xml.TAG.resource):
+            tablename = element.get(NAME, None)
+            if tablename not in tables:
+                tables[tablename] = s3db.table(tablename)
+            table = tables[tablename]
+            if table is None:
+                continue
+            pvalues = S3Resource.unique_values(table, element)
+            if not pvalues:
+                continue
+            fvalues = values.setdefault(tablename, {})
+            for fn in pvalues:
+                fvalues.setdefault(fn, set()).add(key(fn, pvalues[fn]))
+
+        # Look them up
+        size = self.BATCH_SIZE
+        for tablename, fvalues in values.items():
+            table = tables[tablename]
+            fields = S3Resource.import_fields(table, fvalues,
+                            mandatory=self.get_mandatory_fields(table))
+            lookup = originals[tablename] = Storage()
+            for fn, keys in fvalues.items():
+                index = lookup[fn] = dict((k, []) for k in keys)
+                field = table[fn]
+                keys = list(keys)
+                for i in xrange(0, len(keys), size):
+                    query = field.belongs(keys[i:i+size])
+                    rows = db(query).select(*fields)
+                    for row in rows:
+                        k = key(fn, row[fn])
+                        if k in index:
+                            index[k].append(row)
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def __key(fieldname, value):
+        """
+            Lookup key for a unique field value in pre-fetched originals
+
+            @param fieldname: the field name
+            @param value: the field value
+        """
+
+        xml = current.xml
+        if fieldname == xml.UID:
+            return xml.import_uid(value)
+        else:
+            return s3_unicode(value)
+
+    # -------------------------------------------------------------------------
+    def get_mandatory_fields(self, table):
+        """
+            Get the names of all fields in a table which require a value
+            for new records (cached per job)
+
+            @param table: the table
+        """
+
+        mandatory = None
+        tablename = table._tablename
+
+        mfields = self.mandatory_fields
+        if tablename in mfields:
+            mandatory = mfields[tablename]
+
+        if mandatory is None:
+            mandatory = []
+            for field in table:
+                if field.default is not None:
+                    continue
+                requires = field.requires
+                if requires:
+                    if not isinstance(requires, (list, tuple)):
+                        requires = [requires]
+                    if isinstance(requires[0], IS_EMPTY_OR):
+                        continue
+                    value, error = field.validate("")
+                    if error:
+                        mandatory.append(field.name)
+            mfields[tablename] = mandatory
+
+        return mandatory
+
     # -------------------------------------------------------------------------
     def commit(self, ignore_errors=False, log_items=None):
         """
@@ -3333,31 +3533,15 @@ class S3ImportJob():
                 import_list.append(item_id)
         # Commit the items
         items = self.items
-        count = 0
-        mtime = None
-        created = []
-        cappend = created.append
-        updated = []
-        deleted = []
+        stats = Storage(count = 0,
+                        mtime = None,
+                        created = [],
+                        updated = [],
+                        deleted = [],
+                        )
         tablename = self.table._tablename
 
-        self.log = log_items
-        failed = False
-        for item_id in import_list:
-            item = items[item_id]
-            error = None
-            
-            if item.accepted is not False:
-                logged = False
-                success = item.commit(ignore_errors=ignore_errors)
-            else:
-                # Field validation failed
-                logged = True
-                success = ignore_errors
-
-            if not success:
-                failed = True
-                
+        def report(item, logged):
             error = item.error
             if error:
                 current.log.error(error)
@@ -3368,29 +3552,280 @@ class S3ImportJob():
                         element.set(ATTRIBUTE.error, str(self.error))
                     if not logged:
                         self.error_tree.append(deepcopy(element))
-                    
+
             elif item.tablename == tablename:
-                count += 1
+                stats.count += 1
+                mtime = stats.mtime
                 if mtime is None or item.mtime > mtime:
-                    mtime = item.mtime
+                    stats.mtime = item.mtime
                 if item.id:
                     if item.method == METHOD.CREATE:
-                        cappend(item.id)
+                        stats.created.append(item.id)
                     elif item.method == METHOD.UPDATE:
-                        updated.append(item.id)
+                        stats.updated.append(item.id)
                     elif item.method in (METHOD.MERGE, METHOD.DELETE):
-                        deleted.append(item.id)
-                        
-        if failed:
+                        stats.deleted.append(item.id)
+
+        self.ignore_errors = ignore_errors
+        self.flush_failed = False
+        if self.batch:
+            self.deduplicate(import_list)
+            layers = self.layers(import_list)
+        else:
+            layers = [import_list]
+
+        self.log = log_items
+        failed = False
+        for layer in layers:
+            # Items deferred in this layer (may get flushed earlier
+            # than at the end of the layer, see S3ImportItem.deduplicate)
+            deferred = []
+            for item_id in layer:
+                item = items[item_id]
+
+                if item.accepted is not False:
+                    logged = False
+                    success = item.commit(ignore_errors=ignore_errors)
+                else:
+                    # Field validation failed
+                    logged = True
+                    success = ignore_errors
+
+                if not success:
+                    failed = True
+
+                if self.deferred and self.deferred[-1][0] is item:
+                    # Reported after flush
+                    deferred.append(item)
+                    continue
+                report(item, logged)
+
+            self.flush()
+            for item in deferred:
+                report(item, False)
+
+        if failed or self.flush_failed:
             return False
-            
-        self.count = count
-        self.mtime = mtime
-        self.created = created
-        self.updated = updated
-        self.deleted = deleted
+
+        self.count = stats.count
+        self.mtime = stats.mtime
+        self.created = stats.created
+        self.updated = stats.updated
+        self.deleted = stats.deleted
         return True
 
+    # -------------------------------------------------------------------------
+    def deduplicate(self, import_list):
+        """
+            Run the batch deduplicators (deduplicate_batch table setting)
+            for all new items, and look up the originals of all matched
+            items with one query per table and BATCH_SIZE items (batch
+            mode)
+
+            A batch deduplicator receives the list of all new items for
+            its table, and sets item.id and item.method for the items it
+            has identified as duplicates (like a deduplicate resolver),
+            or item.duplicate_of for items which duplicate an earlier new
+            item in the list. Items passed to the batch deduplicator will
+            not be passed to the deduplicate resolver again.
+
+            New items with the same UID or unique field values as an
+            earlier new item of the job are marked as duplicates of that
+            item, and get committed as updates of its record.
+
+            @param import_list: the ordered list of items (UIDs) to import
+        """
+
+        db = current.db
+        get_config = current.s3db.get_config
+        DELETED = current.xml.DELETED
+        key = self.__key
+
+        # Group the items by table
+        items = self.items
+        tablenames = []
+        titems = {}
+        for item_id in import_list:
+            item = items[item_id]
+            if item.accepted is False or \
+               not item.table or item.data is None:
+                continue
+            tablename = item.tablename
+            if tablename not in titems:
+                tablenames.append(tablename)
+                titems[tablename] = [item]
+            else:
+                titems[tablename].append(item)
+
+        size = self.BATCH_SIZE
+        for tablename in tablenames:
+
+            # In-job index of the unique keys of new records
+            index = {}
+            for item in titems[tablename]:
+                if item.id or item.original is not None or \
+                   item.data.get(DELETED):
+                    continue
+                table = item.table
+                original = self.original(table, item.data,
+                                mandatory=self.get_mandatory_fields(table))
+                if original is not None:
+                    item.original = original
+                    continue
+                pvalues = S3Resource.unique_values(table, item.data)
+                keys = [(fn, key(fn, pvalues[fn])) for fn in pvalues]
+                duplicate = None
+                for k in keys:
+                    if k in index:
+                        duplicate = item.duplicate_of = index[k]
+                        break
+                else:
+                    duplicate = item
+                for k in keys:
+                    index.setdefault(k, duplicate)
+
+            # Batch deduplication
+            resolve = get_config(tablename, "deduplicate_batch")
+            if resolve:
+                new = [item for item in titems[tablename]
+                       if not item.id and item.original is None and \
+                          item.duplicate_of is None and \
+                          not item.data.get(DELETED)]
+                if new:
+                    resolve(new)
+                    for item in new:
+                        item.deduplicated = True
+
+            # Look up the originals
+            missing = [item for item in titems[tablename]
+                       if item.id and item.original is None]
+            if not missing:
+                continue
+            table = missing[0].table
+            fnames = set()
+            for item in missing:
+                fnames |= set(item.data.keys())
+            fields = S3Resource.import_fields(table, fnames,
+                            mandatory=self.get_mandatory_fields(table))
+            pkey = table._id.name
+            ids = list(set(item.id for item in missing))
+            originals = {}
+            for i in xrange(0, len(ids), size):
+                query = table._id.belongs(ids[i:i+size])
+                rows = db(query).select(*fields)
+                for row in rows:
+                    originals[row[pkey]] = row
+            for item in missing:
+                item.original = originals.get(item.id)
+        return
+
+    # -------------------------------------------------------------------------
+    def layers(self, import_list):
+        """
+            Group the items of the import list into layers of items
+            which do not reference each other, in dependency order
+            (batch mode)
+
+            @param import_list: the ordered list of items (UIDs) to import,
+                                as generated by resolve()
+        """
+
+        items = self.items
+        levels = {}
+        layers = []
+        for item_id in import_list:
+            # References to later items are circular and get resolved
+            # by writeback (S3ImportItem.update) anyway
+            item = items[item_id]
+            level = 0
+            for reference in item.references:
+                ritem_id = reference.entry.item_id
+                if ritem_id in levels:
+                    level = max(level, levels[ritem_id] + 1)
+            # Duplicates update the record created by the original item
+            duplicate = item.duplicate_of
+            if duplicate is not None and duplicate.item_id in levels:
+                level = max(level, levels[duplicate.item_id] + 1)
+            levels[item_id] = level
+            if level == len(layers):
+                layers.append([item_id])
+            else:
+                layers[level].append(item_id)
+        return layers
+
+    # -------------------------------------------------------------------------
+    def defer(self, item, data):
+        """
+            Defer the insertion of a new record until flush (batch mode)
+
+            @param item: the S3ImportItem
+            @param data: the record data
+        """
+
+        self.deferred.append((item, data))
+
+    # -------------------------------------------------------------------------
+    def flush(self, ignore_errors=None, tablename=None):
+        """
+            Insert all deferred new records, with one bulk_insert per table,
+            and then audit and postprocess (onaccept) them item by item
+            (batch mode)
+
+            @param ignore_errors: skip items which fail to insert (defaults
+                                  to the setting for the current commit)
+            @param tablename: insert only the deferred records for this table
+
+            @return: True if successful, otherwise False (failures are
+                     also recorded in self.flush_failed)
+        """
+
+        if ignore_errors is None:
+            ignore_errors = self.ignore_errors
+
+        deferred = self.deferred
+        if tablename is not None:
+            self.deferred = [d for d in deferred if d[0].tablename != tablename]
+            deferred = [d for d in deferred if d[0].tablename == tablename]
+        else:
+            self.deferred = []
+        if not deferred:
+            return True
+
+        # Group by table
+        tablenames = []
+        groups = {}
+        for item, data in deferred:
+            tablename = item.tablename
+            if tablename not in groups:
+                tablenames.append(tablename)
+                groups[tablename] = [(item, data)]
+            else:
+                groups[tablename].append((item, data))
+
+        success = True
+        for tablename in tablenames:
+            group = groups[tablename]
+            table = group[0][0].table
+            try:
+                ids = table.bulk_insert([data for item, data in group])
+            except:
+                error = sys.exc_info()[1]
+                for item, data in group:
+                    item.error = error
+                    item.skip = True
+                if not ignore_errors:
+                    success = False
+                    self.flush_failed = True
+                continue
+            if not ids:
+                continue
+            for (item, data), record_id in zip(group, ids):
+                item.id = record_id
+                item.committed = True
+                item.postprocess()
+
+        return success
+
     # -------------------------------------------------------------------------
     def __define_tables(self):
         """
@@ -3580,6 +4015,9 @@ class S3BulkImporter(object):
         http://eden.sahanafoundation.org/wiki/DeveloperGuidelines/PrePopulate
     """
 
+    # Checkpoint file (in the cache folder) to resume interrupted imports
+    CHECKPOINT = "prepopulate.chk"
+
     def __init__(self):
         """ Constructor """
 
@@ -4147,13 +4585,374 @@ class S3BulkImporter(object):
         """
             Load and then execute the import jobs that are listed in the
             descriptor file (tasks.cfg)
+
+            Completed tasks are recorded in a checkpoint file, and skipped
+            when an interrupted pre-populate is resumed. With
+            settings.base.prepopulate_workers > 1 (and a database server),
+            independent import tasks run in parallel processes.
         """
 
         self.load_descriptor(path)
-        for task in self.tasks:
+
+        keys = self.task_keys(path, self.tasks)
+
+        workers = current.deployment_settings.get_base_prepopulate_workers()
+        if workers > 1 and \
+           current.deployment_settings.get_database_type() != "sqlite":
+            self.perform_parallel(workers, keys)
+            return
+
+        completed = self.load_checkpoint()
+        for task, key in zip(self.tasks, keys):
+            if key in completed:
+                continue
+            results = len(self.resultList)
             if task[0] == 1:
                 self.execute_import_task(task)
             elif task[0] == 2:
                 self.execute_special_task(task)
+            self.checkpoint(key)
+            for msg in self.resultList[results:]:
+                print >> sys.stdout, msg
+
+    # -------------------------------------------------------------------------
+    def perform_parallel(self, workers, keys):
+        """
+            Execute the import tasks in up to workers parallel processes,
+            in the order of a dependency graph which is derived from the
+            order of the tasks and the tables they write to (see
+            task_dependencies)
+
+            @param workers: the maximum number of worker processes
+            @param keys: the checkpoint keys of the tasks (see task_keys)
+        """
+
+        import multiprocessing
+        from Queue import Empty
+
+        db = current.db
+
+        tasks = self.tasks
+        dependencies = self.task_dependencies(tasks)
+
+        completed = self.load_checkpoint()
+        done = set()
+        pending = []
+        for index, key in enumerate(keys):
+            if key in completed:
+                done.add(index)
+            else:
+                pending.append(index)
+
+        queue = multiprocessing.Queue()
+        running = {}
+        while pending or running:
+
+            # Start all tasks which are ready
+            for index in list(pending):
+                if len(running) >= workers:
+                    break
+                if not dependencies[index] <= done:
+                    continue
+                pending.remove(index)
+                task = tasks[index]
+                if task[0] == 2:
+                    # Specialist tasks are barriers, so nothing else
+                    # is running: execute them in this process
+                    results = len(self.resultList)
+                    self.execute_special_task(task)
+                    self.checkpoint(keys[index])
+                    for msg in self.resultList[results:]:
+                        print >> sys.stdout, msg
+                    done.add(index)
+                    continue
+                # Workers must see everything written so far
+                db.commit()
+                process = multiprocessing.Process(target=self._run_task,
+                                                  args=(index, task, queue))
+                process.start()
+                running[index] = process
+
+            if not running:
+                continue
+
+            # Wait for a task to finish
+            try:
+                index, errors, results = queue.get(timeout=1)
+            except Empty:
+                # Check for workers which died without reporting
+                failed = set()
+                for index, process in running.items():
+                    if not process.is_alive() and process.exitcode:
+                        del running[index]
+                        failed.add(index)
+                        self.errorList.append("prepopulate error: task %s failed (exit code %s)" %
+                                              (tasks[index][1:4], process.exitcode))
+                # Don't run the tasks which depend on failed tasks
+                # (neither is checkpointed, so a resumed run will
+                # retry all of them)
+                for index in self.blocked_tasks(dependencies, pending, failed):
+                    pending.remove(index)
+                    self.errorList.append("prepopulate error: task %s skipped (depends on a failed task)" %
+                                          (tasks[index][1:4],))
+                continue
+            process = running.pop(index)
+            process.join()
+            done.add(index)
+            self.errorList.extend(errors)
+            self.resultList.extend(results)
+            self.checkpoint(keys[index])
+            for msg in results:
+                print >> sys.stdout, msg
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def blocked_tasks(dependencies, pending, failed):
+        """
+            Find all pending tasks which depend, directly or via other
+            pending tasks, on failed tasks and can therefore never run
+
+            @param dependencies: the dependency graph (see task_dependencies)
+            @param pending: the indexes of the pending tasks
+            @param failed: the indexes of the failed tasks
+
+            @return: sorted list of task indexes
+        """
+
+        if not failed:
+            return []
+
+        # Tasks only depend on earlier tasks, so a single pass
+        # in index order is sufficient
+        failed = set(failed)
+        blocked = []
+        for index in sorted(pending):
+            if dependencies[index] & failed:
+                failed.add(index)
+                blocked.append(index)
+        return blocked
+
+    # -------------------------------------------------------------------------
+    def _run_task(self, index, task, queue):
+        """
+            Execute an import task in a worker process
+
+            @param index: the index of the task in self.tasks
+            @param task: the task
+            @param queue: the queue to report errors and results
+        """
+
+        db = current.db
+
+        # Do not use the connection(s) of the parent process
+        adapter = db._adapter
+        adapter.pool_size = 0
+        adapter.connection = None
+        adapter.reconnect()
+
+        errors = len(self.errorList)
+        results = len(self.resultList)
+        try:
+            self.execute_import_task(task)
+            db.commit()
+        except:
+            db.rollback()
+            self.errorList.append("prepopulate error: %s (task: %s)" %
+                                  (sys.exc_info()[1], task[1:4]))
+        queue.put((index,
+                   self.errorList[errors:],
+                   self.resultList[results:]))
+
+    # -------------------------------------------------------------------------
+    def task_dependencies(self, tasks):
+        """
+            Derive the dependency graph of import tasks: a task depends
+            on all earlier tasks which write to any of the same tables -
+            the task table and all tables it references (transitively,
+            except via meta-fields and super-entity links), which is
+            where the stylesheets create records. Specialist tasks depend
+            on all earlier tasks, and all later tasks depend on them.
+
+            @param tasks: the list of tasks
+
+            @return: list of sets of task indexes, one per task
+        """
+
+        task_tables = self.task_tables
+
+        tables = []
+        for task in tasks:
+            if task[0] == 1:
+                tables.append(task_tables(self.task_tablename(task)))
+            else:
+                tables.append(None)
+
+        dependencies = []
+        barrier = None
+        for index, tablenames in enumerate(tables):
+            if tablenames is None:
+                # Specialist task
+                depends = set(range(index))
+                barrier = index
+            else:
+                depends = set()
+                start = 0
+                if barrier is not None:
+                    depends.add(barrier)
+                    start = barrier + 1
+                for i in xrange(start, index):
+                    if tables[i] & tablenames:
+                        depends.add(i)
+            dependencies.append(depends)
+        return dependencies
+
+    # -------------------------------------------------------------------------
+    def task_tablename(self, task):
+        """
+            Get the name of the table an import task imports into
+
+            @param task: the import task
+        """
+
+        tablename = "%s_%s" % (task[1], task[2])
+        details = self.alternateTables.get(tablename)
+        if details and "tablename" in details:
+            tablename = details["tablename"]
+        return tablename
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def task_tables(tablename):
+        """
+            Get the names of all tables an import into a table can write
+            to: the table, its components, and all tables they reference
+            (transitively, except via meta-fields and super-entity links)
+
+            @param tablename: the table name
+        """
+
+        s3db = current.s3db
+        meta = set(s3_all_meta_field_names())
+
+        tablenames = set()
+        queue = [tablename]
+        table = s3db.table(tablename)
+        if table is not None:
+            components = s3db.get_components(table)
+            for alias in components:
+                component = components[alias]
+                queue.append(component.tablename)
+                if component.linktable:
+                    queue.append(component.linktable._tablename)
+
+        while queue:
+            tn = queue.pop()
+            if tn in tablenames:
+                continue
+            tablenames.add(tn)
+            table = s3db.table(tn)
+            if table is None:
+                continue
+            supertables = s3db.get_config(tn, "super_entity")
+            if not supertables:
+                supertables = ()
+            elif not isinstance(supertables, (list, tuple)):
+                supertables = (supertables,)
+            for field in table:
+                if field.name in meta:
+                    continue
+                ktablename = s3_get_foreign_key(field)[0]
+                if ktablename and ktablename not in supertables:
+                    queue.append(ktablename)
+        return tablenames
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def task_keys(path, tasks):
+        """
+            Unique keys for the tasks of a template (to record them in the
+            checkpoint file), including the template path (as the same
+            task can appear in several templates) and the occurrence of
+            identical tasks within the template
+
+            @param path: the template path
+            @param tasks: the tasks
+
+            @return: list of keys, in the order of the tasks
+        """
+
+        keys = []
+        seen = {}
+        for task in tasks:
+            key = json.dumps(task)
+            occurrence = seen[key] = seen.get(key, 0) + 1
+            keys.append(json.dumps([path, occurrence, task]))
+        return keys
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def checkpoint_path(cls):
+        """ Path of the checkpoint file """
+
+        return os.path.join(current.request.folder, "cache", cls.CHECKPOINT)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def interrupted(cls):
+        """
+            Check whether there is an interrupted pre-populate to resume
+        """
+
+        return os.path.exists(cls.checkpoint_path())
+
+    # -------------------------------------------------------------------------
+    def load_checkpoint(self):
+        """
+            Load the keys of all completed tasks from the checkpoint file
+
+            @return: set of task keys
+        """
+
+        completed = set()
+        try:
+            checkpoint = open(self.checkpoint_path(), "r")
+        except IOError:
+            # Create the checkpoint
+            self.checkpoint(None)
+        else:
+            for line in checkpoint:
+                line = line.strip()
+                if line:
+                    completed.add(line)
+            checkpoint.close()
+        return completed
+
+    # -------------------------------------------------------------------------
+    def checkpoint(self, key):
+        """
+            Record a completed task in the checkpoint file
+
+            @param key: the task key
+        """
+
+        # Make sure the completed task has been committed
+        current.db.commit()
+
+        checkpoint = open(self.checkpoint_path(), "a")
+        if key:
+            checkpoint.write("%s\n" % key)
+        checkpoint.close()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def clear_checkpoint(cls):
+        """
+            Remove the checkpoint file (when pre-populate is complete,
+            or before starting a new pre-populate)
+        """
+
+        path = cls.checkpoint_path()
+        if os.path.exists(path):
+            os.remove(path)
 
 # END =========================================================================
@@ -29,9 +29,13 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
-__all__ = ["S3Merge"]
+__all__ = ["S3Merge",
+           "S3DuplicateFinder",
+           "s3_duplicate_scores",
+           ]
 
 import sys
+import unicodedata
 
 from gluon import *
 from gluon.html import BUTTON
@@ -40,8 +44,10 @@ from s3rest import S3Method
 from s3resource import S3FieldSelector
 from s3widgets import *
 from s3validators import *
-from s3utils import s3_unicode, s3_represent_value
+from s3utils import s3_unicode, s3_represent_value, \
+                    s3_jaro_winkler_distance_row, soundex
 from s3data import S3DataTable
+from s3fields import S3Represent
 
 # =============================================================================
 class S3Merge(S3Method):
@@ -72,7 +78,9 @@ class S3Merge(S3Method):
             r.unauthorized()
 
         if r.method == "deduplicate":
-            if r.http in ("GET", "POST"):
+            if r.http == "GET" and "pair" in r.get_vars:
+                output = self.review(r, **attr)
+            elif r.http in ("GET", "POST"):
                 if "remove" in r.get_vars:
                     remove = r.get_vars["remove"].lower() in ("1", "true")
                 else:
@@ -167,6 +175,44 @@ class S3Merge(S3Method):
             bookmarks.pop(tablename)
         return success
 
+    # -------------------------------------------------------------------------
+    def review(self, r, **attr):
+        """
+            Bookmark a candidate pair found by S3DuplicateFinder for
+            merge (or dismiss it if "dismiss" is in the URL vars), then
+            go back to the duplicate bookmark list
+
+            @param r: the S3Request
+            @param attr: the controller parameters for the request
+        """
+
+        db = current.db
+        tablename = self.tablename
+
+        table = current.s3db.s3_duplicate
+        query = (table.id == r.get_vars["pair"]) & \
+                (table.tablename == tablename)
+        pair = db(query).select(table.id,
+                                table.original_id,
+                                table.duplicate_id,
+                                limitby=(0, 1)).first()
+        if not pair:
+            r.error(404, current.ERROR.BAD_RECORD)
+
+        if "dismiss" in r.get_vars:
+            pair.update_record(dismissed=True)
+        else:
+            s3 = current.session.s3
+            DEDUPLICATE = self.DEDUPLICATE
+            if DEDUPLICATE not in s3:
+                bookmarks = s3[DEDUPLICATE] = Storage()
+            else:
+                bookmarks = s3[DEDUPLICATE]
+            bookmarks[tablename] = [str(pair.original_id),
+                                    str(pair.duplicate_id)]
+
+        redirect(r.url(method="deduplicate", id=0, vars={}))
+
     # -------------------------------------------------------------------------
     @classmethod
     def bookmark(cls, r, tablename, record_id):
@@ -353,7 +399,8 @@ class S3Merge(S3Method):
                          # @ToDo: Move to CSS
                          _style="float:left;padding-right:10px;"),
                     A(T("Find more"),
-                      _href=r.url(method="", id=0, component_id=0, vars={}))
+                      _href=r.url(method="", id=0, component_id=0, vars={})),
+                    self.suggestions(r),
                 )
             else:
                 output["add_btn"] = DIV(
@@ -368,6 +415,50 @@ class S3Merge(S3Method):
 
         return output
 
+    # -------------------------------------------------------------------------
+    def suggestions(self, r, limit=10):
+        """
+            Render a list of the best candidate pairs found by
+            S3DuplicateFinder for this table (if any)
+
+            @param r: the S3Request
+            @param limit: the maximum number of pairs to show
+        """
+
+        tablename = self.tablename
+        if not current.s3db.get_config(tablename, "deduplicate_blocking"):
+            return ""
+        pairs = S3DuplicateFinder.candidates(tablename, limit=limit)
+        if not pairs:
+            return ""
+
+        T = current.T
+        record_ids = [pair[key] for pair in pairs
+                      for key in ("original_id", "duplicate_id")]
+        if "name" in self.table.fields:
+            labels = S3Represent(lookup=tablename).bulk(record_ids)
+        else:
+            labels = dict((record_id, "#%s" % record_id)
+                          for record_id in record_ids)
+
+        items = []
+        for pair in pairs:
+            url = r.url(method="deduplicate", id=0,
+                        vars={"pair": pair.id})
+            items.append(LI("%s / %s (%d%%) " % (labels.get(pair.original_id),
+                                                  labels.get(pair.duplicate_id),
+                                                  pair.score),
+                            A(T("Review"), _href=url, _class="action-lnk"),
+                            A(T("Dismiss"),
+                              _href=r.url(method="deduplicate", id=0,
+                                          vars={"pair": pair.id,
+                                                "dismiss": 1}),
+                              _class="action-lnk"),
+                            ))
+        return DIV(H4(T("Suggested Duplicates")),
+                   UL(items),
+                   _class="merge-suggestions")
+
     # -------------------------------------------------------------------------
     def merge(self, r, **attr):
         """
@@ -592,6 +683,9 @@ class S3Merge(S3Method):
                             sys.exc_info()[1],
                         next=r.url())
             else:
+                # Remove the candidate pairs of the merged record
+                S3DuplicateFinder.merged(tablename, duplicate[table._id])
+
                 # Cleanup bookmark list
                 if mode == "Inclusive":
                     bookmarks[tablename] = [i for i in record_ids if i not in ids]
@@ -748,4 +842,327 @@ class S3Merge(S3Method):
 
         return inp
 
+# =============================================================================
+def s3_duplicate_scores(batch):
+    """
+        Score a batch of candidate pairs (in a worker process)
+
+        @param batch: list of tuples (id1, id2, values1, values2)
+
+        @return: list of tuples (id1, id2, score)
+    """
+
+    distance = s3_jaro_winkler_distance_row
+    return [(id1, id2, distance(values1, values2))
+            for id1, id2, values1, values2 in batch]
+
+# =============================================================================
+class S3DuplicateFinder(object):
+    """
+        Blocking-based discovery of duplicate records across a table,
+        writes ranked candidate pairs into s3_duplicate for review and
+        merge with S3Merge
+
+        Blocking is configured per table with the "deduplicate_blocking"
+        setting (s3db.configure), a dict with:
+
+            - fields: list of field selectors to compare
+            - key: function(row) returning the blocking key for a record
+                   (row being a Storage of the field values by selector),
+                   or None to skip the record
+
+        Only records with the same blocking key are compared.
+    """
+
+    # Maximum block size for pairwise comparison, larger blocks are
+    # compared within a sliding window over the sorted records
+    MAX_BLOCK = 100
+    WINDOW = 10
+
+    # Number of records per query
+    CHUNK_SIZE = 5000
+
+    # Number of candidate pairs per scoring batch
+    BATCH_SIZE = 1000
+
+    # Minimum score (percentage) for candidate pairs
+    THRESHOLD = 85
+
+    # -------------------------------------------------------------------------
+    def __init__(self, tablename, threshold=None, workers=None):
+        """
+            Constructor
+
+            @param tablename: the table name
+            @param threshold: the minimum score (percentage) for pairs
+            @param workers: the number of worker processes to score the
+                            pairs (defaults to settings.base.merge_workers)
+        """
+
+        self.tablename = tablename
+        if threshold is None:
+            threshold = self.THRESHOLD
+        self.threshold = threshold
+        if workers is None:
+            workers = current.deployment_settings.get_base_merge_workers()
+        self.workers = max(1, workers or 1)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def normalize(value):
+        """
+            Normalize a string value for blocking (lowercase, without
+            accents, whitespace and punctuation)
+
+            @param value: the value
+        """
+
+        if not value:
+            return ""
+        value = unicodedata.normalize("NFKD", s3_unicode(value).lower())
+        return "".join(c for c in value if c.isalnum())
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def phonetic(value):
+        """
+            Phonetic key of the first word of a string value for blocking
+            (Soundex for latin characters, otherwise the normalized word)
+
+            @param value: the value
+        """
+
+        if not value:
+            return ""
+        words = s3_unicode(value).split()
+        if not words:
+            return ""
+        word = S3DuplicateFinder.normalize(words[0])
+        if word.isalpha() and all(c < u"\x80" for c in word):
+            return soundex(word)
+        return word
+
+    # -------------------------------------------------------------------------
+    def run(self):
+        """
+            Find the duplicates, replacing all unreviewed candidate pairs
+            for the table
+
+            @return: the number of candidate pairs found
+        """
+
+        tablename = self.tablename
+        config = current.s3db.get_config(tablename, "deduplicate_blocking")
+        if not config:
+            raise SyntaxError("No blocking configured for %s" % tablename)
+
+        blocks = self.blocks(config["fields"], config["key"])
+        results = self.score(self.pairs(blocks))
+        return self.store(results)
+
+    # -------------------------------------------------------------------------
+    def blocks(self, fields, key):
+        """
+            Read all records in chunks and group them by blocking key
+
+            @param fields: the field selectors
+            @param key: the key function
+
+            @return: dict {key: [(record_id, values)]}
+        """
+
+        s3db = current.s3db
+        tablename = self.tablename
+        table = s3db[tablename]
+        pkey = table._id.name
+        selectors = [pkey] + [f for f in fields if f != pkey]
+
+        blocks = {}
+        last_id = 0
+        while True:
+            resource = s3db.resource(tablename,
+                                     filter=(S3FieldSelector(pkey) > last_id))
+            data = resource.select(selectors,
+                                   limit=self.CHUNK_SIZE,
+                                   orderby=table._id,
+                                   virtual=False)
+            rows = data["rows"]
+            if not rows:
+                break
+            colnames = [rfield.colname for rfield in data["rfields"]]
+            idcol = colnames[0]
+            for row in rows:
+                record = Storage(zip(selectors, [row[c] for c in colnames]))
+                k = key(record)
+                if k is None:
+                    continue
+                values = tuple(s3_unicode(record[f]).lower()
+                               if record[f] is not None else None
+                               for f in fields)
+                item = (row[idcol], values)
+                if k in blocks:
+                    blocks[k].append(item)
+                else:
+                    blocks[k] = [item]
+            last_id = rows[-1][idcol]
+            if len(rows) < self.CHUNK_SIZE:
+                break
+        return blocks
+
+    # -------------------------------------------------------------------------
+    def pairs(self, blocks):
+        """
+            Generate the candidate pairs within each block
+
+            @param blocks: the blocks (from blocks())
+
+            @return: generator of tuples (id1, id2, values1, values2)
+        """
+
+        MAX_BLOCK = self.MAX_BLOCK
+        WINDOW = self.WINDOW
+        for items in blocks.itervalues():
+            size = len(items)
+            if size < 2:
+                continue
+            if size > MAX_BLOCK:
+                # Sliding window over the sorted records
+                items = sorted(items, key=lambda item: item[1])
+                window = WINDOW
+            else:
+                window = size
+            for i in xrange(size):
+                id1, values1 = items[i]
+                for j in xrange(i + 1, min(i + window, size)):
+                    id2, values2 = items[j]
+                    yield (id1, id2, values1, values2)
+
+    # -------------------------------------------------------------------------
+    def score(self, pairs):
+        """
+            Score the candidate pairs in batches (using a process pool
+            if more than one worker is configured)
+
+            @param pairs: the candidate pairs (from pairs())
+
+            @return: list of tuples (id1, id2, score) for all pairs
+                     with at least the threshold score
+        """
+
+        def batches():
+            batch = []
+            for pair in pairs:
+                batch.append(pair)
+                if len(batch) >= self.BATCH_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        if self.workers > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(self.workers)
+            try:
+                scored = pool.imap_unordered(s3_duplicate_scores, batches())
+                results = self._filter(scored)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = self._filter(s3_duplicate_scores(batch)
+                                   for batch in batches())
+        return results
+
+    # -------------------------------------------------------------------------
+    def _filter(self, scored):
+        """
+            Collect the pairs with at least the threshold score
+
+            @param scored: iterable of scored batches
+        """
+
+        threshold = self.threshold
+        results = []
+        for batch in scored:
+            results.extend(item for item in batch if item[2] >= threshold)
+        return results
+
+    # -------------------------------------------------------------------------
+    def store(self, results):
+        """
+            Replace the unreviewed candidate pairs for the table, keeping
+            the dismissed pairs
+
+            @param results: the scored pairs (from score())
+
+            @return: the number of new candidate pairs
+        """
+
+        db = current.db
+        table = current.s3db.s3_duplicate
+        tablename = self.tablename
+
+        query = (table.tablename == tablename)
+        db(query & (table.dismissed != True)).delete()
+        rows = db(query & (table.dismissed == True)).select(table.original_id,
+                                                             table.duplicate_id)
+        dismissed = set((row.original_id, row.duplicate_id) for row in rows)
+
+        records = []
+        append = records.append
+        for id1, id2, score in results:
+            if id1 > id2:
+                id1, id2 = id2, id1
+            if (id1, id2) in dismissed:
+                continue
+            append({"tablename": tablename,
+                    "original_id": id1,
+                    "duplicate_id": id2,
+                    "score": score,
+                    })
+        if records:
+            table.bulk_insert(records)
+        return len(records)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def candidates(tablename, limit=None):
+        """
+            Get the unreviewed candidate pairs for a table, best first
+
+            @param tablename: the table name
+            @param limit: the maximum number of pairs
+
+            @return: the s3_duplicate Rows
+        """
+
+        table = current.s3db.s3_duplicate
+        query = (table.tablename == tablename) & \
+                (table.dismissed != True)
+        return current.db(query).select(table.id,
+                                        table.original_id,
+                                        table.duplicate_id,
+                                        table.score,
+                                        orderby=~table.score,
+                                        limitby=(0, limit) if limit else None,
+                                        )
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def merged(tablename, record_id):
+        """
+            Remove all candidate pairs with a record that has been
+            merged into another record
+
+            @param tablename: the table name
+            @param record_id: the ID of the removed record
+        """
+
+        table = current.s3db.s3_duplicate
+        query = (table.tablename == tablename) & \
+                ((table.original_id == record_id) | \
+                 (table.duplicate_id == record_id))
+        current.db(query).delete()
+        return
+
 # END =========================================================================
@@ -29,6 +29,11 @@
 
 __all__ = ["S3Model"]
 
+import os
+import threading
+
+from types import ModuleType
+
 from gluon import *
 from gluon.dal import Table
 # Here are dependencies listed for reference:
@@ -38,6 +43,8 @@ from gluon.dal import Table
 from gluon.storage import Storage
 from gluon.tools import callback
 
+from s3fields import S3RepresentCache
+from s3hierarchy import S3Hierarchy
 from s3navigation import S3ScriptItem
 from s3resource import S3Resource
 from s3validators import IS_ONE_OF
@@ -100,11 +107,21 @@ class S3Model(object):
             self.__lock()
             if module in mandatory_models or \
                current.deployment_settings.has_module(module):
-                env = self.model()
+                profiler = response.s3.profiler
+                if profiler:
+                    env = profiler.measure(profiler.MODEL,
+                                           self.__class__.__name__,
+                                           self.model)
+                else:
+                    env = self.model()
             else:
                 env = self.defaults()
             if isinstance(env, (Storage, dict)):
                 response.s3.update(env)
+            rcache = S3RepresentCache.instance
+            if rcache is not None:
+                # Re-install representation cache invalidation hooks
+                rcache.hook_all()
             self.__loaded(True)
             self.__unlock()
 
@@ -210,7 +227,21 @@ class S3Model(object):
             return ogetattr(db, tablename)
         else:
             prefix, name = tablename.split("_", 1)
-            if hasattr(models, prefix):
+            registry = S3ModelRegistry.registry()
+            entry = registry.lookup(tablename) if registry else None
+            if entry:
+                # Load exactly the model class defining the name
+                p, n = entry
+                model = models.__dict__[p].__dict__[n]
+                if hasattr(model, "_s3model"):
+                    model(p)
+                else:
+                    s3db.classes[tablename] = (p, n)
+                    found = model
+            elif registry and not registry.generic.get(prefix):
+                # No model defines this name
+                pass
+            elif hasattr(models, prefix):
                 module = models.__dict__[prefix]
                 loaded = False
                 generic = []
@@ -264,7 +295,22 @@ class S3Model(object):
         elif "_" in name:
             prefix = name.split("_", 1)[0]
             models = current.models
-            if hasattr(models, prefix):
+            registry = S3ModelRegistry.registry()
+            entry = registry.lookup(name) if registry else None
+            if entry:
+                # Load exactly the model class defining the name
+                p, n = entry
+                model = models.__dict__[p].__dict__[n]
+                if type(model).__name__ == "type":
+                    model(p)
+                else:
+                    s3[n] = model
+            elif registry:
+                # Only generic models could define this name
+                module = models.__dict__.get(prefix)
+                for n in registry.generic.get(prefix, []):
+                    module.__dict__[n](prefix)
+            elif hasattr(models, prefix):
                 module = models.__dict__[prefix]
                 loaded = False
                 generic = []
@@ -382,6 +428,16 @@ class S3Model(object):
         if tn not in config:
             config[tn] = Storage()
         config[tn].update(attr)
+
+        rcache = S3RepresentCache.instance
+        if rcache is not None and tn in rcache.callbacks:
+            # Preserve representation cache invalidation hooks
+            rcache.hook(tn)
+
+        if config[tn].get("hierarchy") and \
+           ("hierarchy" in attr or tn in S3Hierarchy.callbacks):
+            # Install/preserve the hierarchy update hooks
+            S3Hierarchy.hook(tn)
         return
 
     # -------------------------------------------------------------------------
@@ -1243,4 +1299,213 @@ class S3Model(object):
                 return (prefix, name, record.id)
         return (None, None, None)
 
+# =============================================================================
+class S3ModelRegistry(object):
+    """
+        Registry of the names (tables, response.s3 names and functions)
+        defined in the model modules, to load exactly the model class
+        which defines a name rather than scanning the modules and
+        instantiating model classes until one of them defines it
+
+        - built from the "names" attributes of the model classes,
+          persisted on disk, and rebuilt when a model file changes
+    """
+
+    VERSION = 1
+    FILENAME = "s3model.registry"
+    KEY = "s3_model_registry"
+
+    # Process-wide registry
+    instance = None
+    lock = threading.Lock()
+
+    def __init__(self, mtimes, names, generic):
+        """
+            Constructor
+
+            @param mtimes: the modification times of the model files
+                           the registry has been built from {prefix: mtime}
+            @param names: the names defined in the models
+                          {name: (prefix, name of the model class)}
+            @param generic: the model classes without a names attribute
+                            {prefix: [name of the model class]}
+        """
+
+        self.mtimes = mtimes
+        self.names = names
+        self.generic = generic
+
+    # -------------------------------------------------------------------------
+    def lookup(self, name):
+        """
+            Find the model class or function which defines a name
+
+            @param name: the name (tablename or response.s3 name)
+            @return: tuple (prefix, name of the class), or None if
+                     not defined by any model with a names attribute
+        """
+
+        return self.names.get(name)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def registry(cls):
+        """
+            Get the current model registry (once per request)
+
+            @return: the S3ModelRegistry, or None if disabled
+        """
+
+        response = current.response
+        registry = response.get(cls.KEY)
+        if registry is None:
+            registry = False
+            if current.deployment_settings.get_base_model_registry():
+                models = current.models
+                if models is not None:
+                    registry = cls.current(models) or False
+            response[cls.KEY] = registry
+        return registry or None
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def current(cls, models):
+        """
+            Get an up-to-date registry for the models, read it from disk
+            or (re-)build it if necessary
+
+            @param models: the models package
+        """
+
+        mtimes = cls.modified(models)
+        with cls.lock:
+            registry = cls.instance
+            if registry is None or registry.mtimes != mtimes:
+                registry = cls.read(mtimes)
+                if registry is None:
+                    registry = cls.build(models, mtimes)
+                    registry.write()
+                cls.instance = registry
+        return registry
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def modified(models):
+        """
+            Get the modification times of the model files
+
+            @param models: the models package
+            @return: dict {prefix: mtime}
+        """
+
+        mtimes = {}
+        for prefix, module in models.__dict__.items():
+            if not isinstance(module, ModuleType):
+                continue
+            path = getattr(module, "__file__", None)
+            if not path:
+                continue
+            path = "%s.py" % os.path.splitext(path)[0]
+            try:
+                mtimes[prefix] = os.path.getmtime(path)
+            except OSError:
+                pass
+        return mtimes
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def build(cls, models, mtimes):
+        """
+            Build the registry (without loading any models)
+
+            @param models: the models package
+            @param mtimes: the modification times of the model files
+        """
+
+        names = {}
+        generic = {}
+
+        def register(name, prefix, n):
+            # Names are looked up in the module of their prefix first,
+            # and in the order of __all__
+            if name in names:
+                if names[name][0] == prefix or \
+                   name.split("_", 1)[0] != prefix:
+                    return
+            names[name] = (prefix, n)
+
+        for prefix in mtimes:
+            module = models.__dict__[prefix]
+            for n in getattr(module, "__all__", []):
+                model = module.__dict__.get(n)
+                if model is None:
+                    continue
+                if hasattr(model, "_s3model"):
+                    if hasattr(model, "names"):
+                        for name in model.names:
+                            register(name, prefix, n)
+                    else:
+                        generic.setdefault(prefix, []).append(n)
+                else:
+                    register(n, prefix, n)
+
+        return cls(mtimes, names, generic)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def path(cls):
+        """ The path of the registry file """
+
+        return os.path.join(current.request.folder, "cache", cls.FILENAME)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def read(cls, mtimes):
+        """
+            Read the registry from disk
+
+            @param mtimes: the current modification times of the model files
+            @return: the S3ModelRegistry, or None if not available or outdated
+        """
+
+        path = cls.path()
+        if not os.path.exists(path):
+            return None
+
+        import cPickle
+        try:
+            with open(path, "rb") as f:
+                data = cPickle.load(f)
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+            current.log.error("S3ModelRegistry: could not read %s" % path)
+            return None
+        if data.get("version") != cls.VERSION or \
+           data.get("mtimes") != mtimes:
+            return None
+
+        return cls(mtimes, data["names"], data["generic"])
+
+    # -------------------------------------------------------------------------
+    def write(self):
+        """ Persist the registry """
+
+        path = self.path()
+
+        import cPickle
+        data = {"version": self.VERSION,
+                "mtimes": self.mtimes,
+                "names": self.names,
+                "generic": self.generic,
+                }
+        # Write to a temporary file & rename, so that other processes
+        # never read an incomplete registry
+        tmp = "%s.%s" % (path, os.getpid())
+        try:
+            with open(tmp, "wb") as f:
+                cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            current.log.error("S3ModelRegistry: could not write %s" % path)
+        return
+
 # END =========================================================================
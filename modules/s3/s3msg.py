@@ -42,7 +42,11 @@ __all__ = ["S3Msg",
 import base64
 import datetime
 import os
+import Queue
+import smtplib
 import string
+import threading
+import time
 import urllib
 import urllib2
 
@@ -451,16 +455,16 @@ class S3Msg(object):
                 # task fail permanently
                 raise ValueError("No Twitter API available!")
 
-        def dispatch_to_pe_id(pe_id,
-                              subject,
-                              message,
-                              outbox_id,
-                              message_id,
-                              contact_method=contact_method):
+        def dispatch(address,
+                     subject,
+                     message,
+                     outbox_id,
+                     message_id,
+                     contact_method=contact_method):
             """
-                Helper method to send messages by pe_id
+                Helper method to send a message to an address
 
-                @param pe_id: the pe_id
+                @param address: the recipient's address (pr_contact.value)
                 @param subject: the message subject
                 @param message: the message body
                 @param outbox_id: the outbox record ID
@@ -468,17 +472,7 @@ class S3Msg(object):
                 @param contact_method: the contact method
             """
 
-            # Get the recipient's contact info
-            table = s3db.pr_contact
-            query = (table.pe_id == pe_id) & \
-                    (table.contact_method == contact_method) & \
-                    (table.deleted == False)
-            contact_info = db(query).select(table.value,
-                                            orderby=table.priority,
-                                            limitby=(0, 1)).first()
-            # Send the message
-            if contact_info:
-                address = contact_info.value
+            if address:
                 if contact_method == "EMAIL":
                     return self.send_email(address,
                                            subject,
@@ -503,6 +497,48 @@ class S3Msg(object):
 
             return False
 
+        def dispatch_to_pe_id(pe_id,
+                              subject,
+                              message,
+                              outbox_id,
+                              message_id,
+                              contact_method=contact_method):
+            """
+                Helper method to send messages by pe_id
+
+                @param pe_id: the pe_id
+                @param subject: the message subject
+                @param message: the message body
+                @param outbox_id: the outbox record ID
+                @param message_id: the message_id
+                @param contact_method: the contact method
+            """
+
+            # Get the recipient's contact info
+            table = s3db.pr_contact
+            query = (table.pe_id == pe_id) & \
+                    (table.contact_method == contact_method) & \
+                    (table.deleted == False)
+            contact_info = db(query).select(table.value,
+                                            orderby=table.priority,
+                                            limitby=(0, 1)).first()
+            # Send the message
+            if contact_info:
+                return dispatch(contact_info.value,
+                                subject,
+                                message,
+                                outbox_id,
+                                message_id,
+                                contact_method=contact_method)
+
+            return False
+
+        batch_size = current.deployment_settings.get_msg_outbox_batch_size()
+        if batch_size:
+            return self.process_outbox_batch(contact_method,
+                                             batch_size,
+                                             dispatch)
+
         outbox = s3db.msg_outbox
 
         petable = s3db.pr_pentity
@@ -679,6 +715,278 @@ class S3Msg(object):
 
         return
 
+    # -------------------------------------------------------------------------
+    def process_outbox_batch(self, contact_method, batch_size, dispatch):
+        """
+            Send pending messages from outbox in batches: resolves the
+            contacts for a page of outbox entries with a single query,
+            sends emails through persistent SMTP connections with bounded
+            concurrency, and records the status updates in bulk
+
+            @param contact_method: the output channel (see pr_contact.method)
+            @param batch_size: the number of outbox entries per page
+            @param dispatch: function to send a single message to an
+                             address (for channels other than EMAIL),
+                             see process_outbox
+        """
+
+        db = current.db
+        s3db = current.s3db
+        settings = current.deployment_settings
+
+        outbox = s3db.msg_outbox
+        petable = s3db.pr_pentity
+        ctable = s3db.pr_contact
+
+        # Re-queue the messages to groups and organisations for
+        # their members, so they can be sent in the same run
+        self.expand_outbox(contact_method)
+
+        join = petable.on(petable.pe_id == outbox.pe_id)
+
+        fields = [outbox.id,
+                  outbox.message_id,
+                  outbox.pe_id,
+                  outbox.retries,
+                  ]
+
+        if contact_method == "EMAIL":
+            mailbox = s3db.msg_email
+            fields.extend([mailbox.subject, mailbox.body])
+        elif contact_method == "SMS":
+            mailbox = s3db.msg_sms
+            fields.append(mailbox.body)
+        elif contact_method == "TWITTER":
+            mailbox = s3db.msg_twitter
+            fields.append(mailbox.body)
+        else:
+            # @ToDo
+            raise
+        left = mailbox.on(mailbox.message_id == outbox.message_id)
+        tablename = mailbox._tablename
+
+        rate = settings.get_msg_outbox_rate(contact_method)
+        limiter = S3RateLimiter(rate) if rate else None
+
+        if contact_method == "EMAIL":
+            mailer = S3BulkMailer(workers=settings.get_msg_outbox_workers(),
+                                  limiter=limiter)
+            limit = settings.get_mail_limit()
+            ltable = s3db.msg_channel_limit
+        else:
+            mailer = None
+            limit = None
+
+        base_query = (outbox.contact_method == contact_method) & \
+                     (outbox.status == 1) & \
+                     (outbox.deleted == False) & \
+                     (petable.instance_type == "pr_person")
+
+        last_id = 0
+        try:
+            while True:
+
+                query = base_query & (outbox.id > last_id)
+                rows = db(query).select(join=join,
+                                        left=left,
+                                        orderby=outbox.id,
+                                        limitby=(0, batch_size),
+                                        *fields)
+                if not rows:
+                    break
+                last_id = rows.last()["msg_outbox.id"]
+
+                # Daily limit for emails
+                if limit:
+                    day = datetime.timedelta(hours=24)
+                    cutoff = current.request.utcnow - day
+                    quota = limit - db(ltable.created_on > cutoff).count()
+                    if quota <= 0:
+                        break
+                    if quota < len(rows):
+                        # Leave the rest for the next run
+                        rows = rows[:quota]
+
+                # Get the recipients' contact info
+                pe_ids = set(row["msg_outbox.pe_id"] for row in rows)
+                query = (ctable.pe_id.belongs(pe_ids)) & \
+                        (ctable.contact_method == contact_method) & \
+                        (ctable.deleted == False)
+                contacts = {}
+                for contact in db(query).select(ctable.pe_id,
+                                                ctable.value,
+                                                orderby=ctable.priority):
+                    if contact.pe_id not in contacts:
+                        contacts[contact.pe_id] = contact.value
+
+                # Send the messages
+                retries = {}
+                jobs = []
+                status = {}
+                for row in rows:
+                    entry = row["msg_outbox"]
+                    retries[entry.id] = entry.retries
+                    address = contacts.get(entry.pe_id)
+                    if not address:
+                        status[entry.id] = False
+                        continue
+                    record = row[tablename]
+                    if contact_method == "EMAIL":
+                        jobs.append((entry.id,
+                                     address,
+                                     record.subject or "",
+                                     record.body or ""))
+                        continue
+                    if limiter:
+                        limiter.wait()
+                    try:
+                        status[entry.id] = dispatch(address,
+                                                    None,
+                                                    record.body or "",
+                                                    entry.id,
+                                                    entry.message_id)
+                    except:
+                        status[entry.id] = False
+                if jobs:
+                    status.update(mailer.send(jobs))
+
+                # Update the status
+                sent, retry, failed = [], [], []
+                for outbox_id, success in status.items():
+                    if success:
+                        sent.append(outbox_id)
+                    else:
+                        r = retries[outbox_id]
+                        if r > 0:
+                            retry.append(outbox_id)
+                        elif r is not None:
+                            failed.append(outbox_id)
+                if sent:
+                    db(outbox.id.belongs(sent)).update(status = 2) # Sent
+                    if limit and contact_method == "EMAIL":
+                        # Log the sending
+                        ltable.bulk_insert([{} for outbox_id in sent])
+                if retry:
+                    db(outbox.id.belongs(retry)).update(
+                                            retries = outbox.retries - 1)
+                if failed:
+                    db(outbox.id.belongs(failed)).update(status = 5) # Failed
+                db.commit()
+
+        finally:
+            if mailer:
+                mailer.close()
+
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def expand_outbox(contact_method):
+        """
+            Re-queue pending outbox messages to groups, organisations and
+            deployment alerts for each of their member persons, with one
+            lookup per entity type (rather than per message)
+
+            @param contact_method: the output channel (see pr_contact.method)
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        outbox = s3db.msg_outbox
+        petable = s3db.pr_pentity
+
+        query = (outbox.contact_method == contact_method) & \
+                (outbox.status == 1) & \
+                (outbox.deleted == False) & \
+                (petable.instance_type != "pr_person")
+        rows = db(query).select(outbox.id,
+                                outbox.pe_id,
+                                outbox.message_id,
+                                petable.instance_type,
+                                join=petable.on(petable.pe_id == outbox.pe_id))
+        if not rows:
+            return
+
+        htable = s3db.hrm_human_resource
+        ptable = db.pr_person
+
+        # Lookups of the member persons per entity type
+        lookups = {}
+
+        gtable = s3db.pr_group
+        mtable = db.pr_group_membership
+        lookups["pr_group"] = (gtable,
+                               [mtable.on((mtable.group_id == gtable.id) &
+                                          (mtable.person_id != None) &
+                                          (mtable.deleted != True)),
+                                ptable.on((ptable.id == mtable.person_id) &
+                                          (ptable.deleted != True))
+                                ])
+
+        otable = db.org_organisation
+        lookups["org_organisation"] = (otable,
+                                       [htable.on((htable.organisation_id == otable.id) &
+                                                  (htable.person_id != None) &
+                                                  (htable.deleted != True)),
+                                        ptable.on((ptable.id == htable.person_id) &
+                                                  (ptable.deleted != True))
+                                        ])
+
+        atable = s3db.table("deploy_alert", None)
+        if atable:
+            ltable = db.deploy_alert_recipient
+            lookups["deploy_alert"] = (atable,
+                                       [ltable.on(ltable.alert_id == atable.id),
+                                        htable.on((htable.id == ltable.human_resource_id) &
+                                                  (htable.person_id != None) &
+                                                  (htable.deleted != True)),
+                                        ptable.on((ptable.id == htable.person_id) &
+                                                  (ptable.deleted != True))
+                                        ])
+
+        # Group the outbox entries by entity type
+        entries = {}
+        invalid = []
+        for row in rows:
+            instance_type = row["pr_pentity.instance_type"]
+            if not instance_type:
+                current.log.warning("s3msg", "Entity type unknown")
+            elif instance_type in lookups:
+                entries.setdefault(instance_type, []).append(row["msg_outbox"])
+            else:
+                # Unsupported entity type
+                invalid.append(row["msg_outbox.id"])
+
+        requeued = []
+        items = []
+        for instance_type, entities in entries.items():
+            table, left = lookups[instance_type]
+            pe_ids = set(entry.pe_id for entry in entities)
+            members = {}
+            for member in db(table.pe_id.belongs(pe_ids)).select(table.pe_id,
+                                                                 ptable.pe_id,
+                                                                 left=left):
+                pe_id = member[ptable.pe_id]
+                if pe_id:
+                    members.setdefault(member[table.pe_id], set()).add(pe_id)
+            for entry in entities:
+                for pe_id in members.get(entry.pe_id, ()):
+                    items.append({"message_id": entry.message_id,
+                                  "pe_id": pe_id,
+                                  "contact_method": contact_method,
+                                  "system_generated": True,
+                                  })
+                requeued.append(entry.id)
+
+        if items:
+            outbox.bulk_insert(items)
+        if requeued:
+            db(outbox.id.belongs(requeued)).update(status = 2) # Sent
+        if invalid:
+            db(outbox.id.belongs(invalid)).update(status = 4) # Invalid
+        db.commit()
+
     # -------------------------------------------------------------------------
     # Send Email
     # -------------------------------------------------------------------------
@@ -2092,6 +2400,265 @@ class S3Msg(object):
         else:
             return hashdef["defs"]["def"]["text"]
 
+# =============================================================================
+class S3BulkMailer(object):
+    """
+        Helper to send many emails through a pool of persistent SMTP
+        connections, with a bounded number of concurrent connections
+        - uses the server settings of the web2py mailer (current.mail)
+    """
+
+    def __init__(self,
+                 workers=1,
+                 limiter=None,
+                 reply_to=None,
+                 encoding="utf-8"):
+        """
+            Constructor
+
+            @param workers: the maximum number of concurrent connections
+            @param limiter: S3RateLimiter to limit the rate of sending
+            @param reply_to: the Reply-To address
+            @param encoding: the encoding of the messages
+        """
+
+        mail_settings = current.mail.settings
+
+        self.server = mail_settings.server or ""
+        self.login = mail_settings.login
+        self.tls = mail_settings.tls
+        self.ssl = mail_settings.get("ssl", False)
+        self.hostname = mail_settings.get("hostname")
+        self.timeout = mail_settings.get("timeout") or 60
+        self.sender = mail_settings.sender
+
+        self.reply_to = reply_to
+        self.encoding = encoding
+
+        self.workers = max(1, workers or 1)
+        self.limiter = limiter
+
+        # Pool of open connections, re-used across send() calls
+        self.connections = Queue.Queue()
+
+        # Errors of the last send() call
+        self.errors = []
+
+    # -------------------------------------------------------------------------
+    def send(self, jobs):
+        """
+            Send emails
+
+            @param jobs: list of tuples (key, to, subject, message)
+            @return: dict {key: True|False} with the result per job
+        """
+
+        results = {}
+        errors = self.errors = []
+        if not self.sender:
+            current.log.warning("Email sending disabled until the Sender address has been set in models/000_config.py")
+            for job in jobs:
+                results[job[0]] = False
+            return results
+
+        if ":" not in self.server:
+            # Not an SMTP server (e.g. "logging"), fall back to the
+            # standard mailer, which can not run in parallel threads
+            mail = current.mail
+            for key, to, subject, message in jobs:
+                if self.limiter:
+                    self.limiter.wait()
+                result = mail.send(to,
+                                   subject=subject,
+                                   message=message,
+                                   reply_to=self.reply_to,
+                                   encoding=self.encoding)
+                if not result:
+                    errors.append(mail.error)
+                results[key] = bool(result)
+            self._errors()
+            return results
+
+        queue = Queue.Queue()
+        for job in jobs:
+            queue.put(job)
+
+        threads = []
+        for i in xrange(min(self.workers, len(jobs))):
+            thread = threading.Thread(target=self._worker,
+                                      args=(queue, results))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        self._errors()
+        return results
+
+    # -------------------------------------------------------------------------
+    def _errors(self):
+        """
+            Log the errors of the last send() call and report them in
+            the session like S3Msg.send_email (not possible in the
+            worker threads, which have no access to current)
+        """
+
+        errors = [s3_unicode(e) for e in self.errors if e]
+        if errors:
+            for error in set(errors):
+                current.log.error("Email sending failed: %s" % error)
+            current.session.error = errors[-1]
+        else:
+            current.session.error = None
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """ Close all connections """
+
+        connections = self.connections
+        while True:
+            try:
+                connection = connections.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                connection.quit()
+            except:
+                pass
+
+    # -------------------------------------------------------------------------
+    def _worker(self, queue, results):
+        """
+            Worker thread: send jobs from the queue through one connection
+
+            @param queue: the job Queue
+            @param results: dict to store the results
+        """
+
+        try:
+            connection = self.connections.get_nowait()
+        except Queue.Empty:
+            connection = None
+
+        limiter = self.limiter
+        while True:
+            try:
+                key, to, subject, message = queue.get_nowait()
+            except Queue.Empty:
+                break
+            if limiter:
+                limiter.wait()
+            msg = self._message(to, subject, message)
+            success = False
+            error = None
+            for attempt in (1, 2):
+                try:
+                    if connection is None:
+                        connection = self._connect()
+                    connection.sendmail(self.sender, [to], msg)
+                except smtplib.SMTPRecipientsRefused, e:
+                    error = e
+                    break
+                except Exception, e:
+                    # Connection lost => reconnect and try once more
+                    error = e
+                    try:
+                        connection.close()
+                    except:
+                        pass
+                    connection = None
+                else:
+                    success = True
+                    break
+            results[key] = success
+            if not success:
+                # list.append is thread-safe
+                self.errors.append(error)
+
+        if connection is not None:
+            self.connections.put(connection)
+
+    # -------------------------------------------------------------------------
+    def _connect(self):
+        """ Open a new SMTP connection, like the web2py mailer does """
+
+        host, port = self.server.rsplit(":", 1)
+        if self.ssl:
+            connection = smtplib.SMTP_SSL(host, int(port),
+                                          timeout=self.timeout)
+        else:
+            connection = smtplib.SMTP(host, int(port),
+                                      timeout=self.timeout)
+        if self.tls and not self.ssl:
+            connection.ehlo(self.hostname)
+            connection.starttls()
+            connection.ehlo(self.hostname)
+        if self.login:
+            username, password = self.login.split(":", 1)
+            connection.login(username, password)
+        return connection
+
+    # -------------------------------------------------------------------------
+    def _message(self, to, subject, message):
+        """
+            Build the MIME message
+
+            @param to: the recipient address
+            @param subject: the subject
+            @param message: the message body (text or HTML)
+        """
+
+        from email.header import Header
+        from email.mime.text import MIMEText
+
+        encoding = self.encoding
+
+        body = s3_unicode(message)
+        text = body.strip()
+        if text.startswith("<html") and text.endswith("</html>"):
+            subtype = "html"
+        else:
+            subtype = "plain"
+
+        msg = MIMEText(body.encode(encoding), subtype, encoding)
+        msg["Subject"] = Header(s3_unicode(subject), encoding)
+        msg["From"] = self.sender
+        msg["To"] = to
+        if self.reply_to:
+            msg["Reply-To"] = self.reply_to
+        return msg.as_string()
+
+# =============================================================================
+class S3RateLimiter(object):
+    """ Thread-safe limiter for the rate of sending messages """
+
+    def __init__(self, rate):
+        """
+            Constructor
+
+            @param rate: maximum number of messages per second
+        """
+
+        self.interval = 1.0 / rate
+        self.next = 0
+        self.lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    def wait(self):
+        """ Wait until the next message can be sent """
+
+        lock = self.lock
+        lock.acquire()
+        try:
+            now = time.time()
+            slot = max(now, self.next)
+            self.next = slot + self.interval
+        finally:
+            lock.release()
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
 # =============================================================================
 class S3Compose(S3CRUD):
     """ RESTful method for messaging """
@@ -81,13 +81,24 @@ class S3Notifications(object):
 
         subscriptions = cls._subscriptions(now)
         if subscriptions:
+            db = current.db
             async = current.s3task.async
-            for row in subscriptions:
-                # Create asynchronous notification task.
-                row.update_record(locked=True)
-                async("notify_notify", args=[row.id])
-            message = "%s notifications scheduled." % len(subscriptions)
-            current.db.commit()
+            if current.deployment_settings.get_msg_notify_batch():
+                # One task per group of equivalent subscriptions
+                rtable = db.pr_subscription_resource
+                groups = cls._groups(subscriptions)
+                for group in groups:
+                    db(rtable.id.belongs(group)).update(locked=True)
+                    async("notify_notify", args=[group])
+                message = "%s notifications scheduled in %s batches." % \
+                          (len(subscriptions), len(groups))
+            else:
+                for row in subscriptions:
+                    # Create asynchronous notification task.
+                    row.update_record(locked=True)
+                    async("notify_notify", args=[row.id])
+                message = "%s notifications scheduled." % len(subscriptions)
+            db.commit()
         else:
             message = "No notifications to schedule."
 
@@ -103,11 +114,19 @@ class S3Notifications(object):
             controller which extracts the data and renders and sends
             the notification message (see send()).
 
-            @param resource_id: the pr_subscription_resource record ID
+            @param resource_id: the pr_subscription_resource record ID,
+                                or a list of record IDs to notify a group
+                                of equivalent subscriptions (see _groups)
+                                with a single lookup request
+
+            @return: the result message, or - for groups - a dict with
+                     the result message and metrics of this run
         """
 
         _debug("S3Notifications.notify(resource_id=%s)" % resource_id)
 
+        start = datetime.datetime.utcnow()
+
         db = current.db
         s3db = current.s3db
 
@@ -115,27 +134,37 @@ class S3Notifications(object):
         rtable = db.pr_subscription_resource
         ftable = s3db.pr_filter
 
+        if isinstance(resource_id, (list, tuple)):
+            batch = True
+            query = (rtable.id.belongs(resource_id))
+        else:
+            batch = False
+            query = (rtable.id == resource_id)
+
         # Extract the subscription data
         join = stable.on(rtable.subscription_id == stable.id)
         left = ftable.on(ftable.id == stable.filter_id)
 
         # @todo: should not need rtable.resource here
-        row = db(rtable.id == resource_id).select(stable.id,
-                                                  stable.pe_id,
-                                                  stable.frequency,
-                                                  stable.notify_on,
-                                                  stable.method,
-                                                  stable.email_format,
-                                                  rtable.id,
-                                                  rtable.resource,
-                                                  rtable.url,
-                                                  rtable.last_check_time,
-                                                  ftable.query,
-                                                  join=join,
-                                                  left=left).first()
-        if not row:
+        rows = db(query).select(stable.id,
+                                stable.pe_id,
+                                stable.frequency,
+                                stable.notify_on,
+                                stable.method,
+                                stable.email_format,
+                                rtable.id,
+                                rtable.resource,
+                                rtable.url,
+                                rtable.last_check_time,
+                                ftable.query,
+                                join=join,
+                                left=left)
+        if not rows:
             return True
 
+        # The first subscription leads the lookup request, the group
+        # shares its resource, URL, filter, notify_on and permissions
+        row = rows.first()
         s = getattr(row, "pr_subscription")
         r = getattr(row, "pr_subscription_resource")
         f = getattr(row, "pr_filter")
@@ -158,7 +187,28 @@ class S3Notifications(object):
         purl = list(urlparse.urlparse(lookup_url))
 
         # Subscription parameters
-        last_check_time = current.xml.encode_iso_datetime(r.last_check_time)
+        encode_iso_datetime = current.xml.encode_iso_datetime
+        if batch:
+            # Look up the updates since the earliest last check
+            # of the group, send() filters them per subscriber
+            subscribers = []
+            check_times = []
+            for row in rows:
+                srow = row.pr_subscription
+                rrow = row.pr_subscription_resource
+                check_time = rrow.last_check_time
+                check_times.append(check_time)
+                subscribers.append({
+                    "resource_id": rrow.id,
+                    "pe_id": srow.pe_id,
+                    "method": srow.method,
+                    "email_format": srow.email_format,
+                    "last_check_time": encode_iso_datetime(check_time),
+                    })
+            last_check_time = encode_iso_datetime(min(check_times))
+        else:
+            subscribers = None
+            last_check_time = encode_iso_datetime(r.last_check_time)
         query = {"subscription": auth_token, "format": "msg"}
         if "upd" in s.notify_on:
             query["~.modified_on__ge"] = last_check_time
@@ -198,27 +248,36 @@ class S3Notifications(object):
                                         ])
                                        
         # Serialize data for send (avoid second lookup in send)
-        data = json.dumps({"pe_id": s.pe_id,
-                           "notify_on": s.notify_on,
-                           "method": s.method,
-                           "email_format": s.email_format,
-                           "resource": r.resource,
-                           "last_check_time": last_check_time,
-                           "filter_query": query_nice,
-                           "page_url": lookup_url,
-                           "item_url": None,
-                           })
+        data = {"pe_id": s.pe_id,
+                "notify_on": s.notify_on,
+                "method": s.method,
+                "email_format": s.email_format,
+                "resource": r.resource,
+                "last_check_time": last_check_time,
+                "filter_query": query_nice,
+                "page_url": lookup_url,
+                "item_url": None,
+                }
+        if subscribers:
+            data["subscribers"] = subscribers
+        data = json.dumps(data)
 
         # Send the request
         _debug("Requesting %s" % page_url)
         req = urllib2.Request(page_url, data=data)
         req.add_header("Content-Type", "application/json")
         success = False
+        results = {}
+        metrics = {}
+        deferred = set()
         try:
             response = json.loads(urllib2.urlopen(req).read())
             message = response["message"]
             if response["status"] == "success":
                 success = True
+            results = response.get("results") or {}
+            metrics = response.get("metrics") or {}
+            deferred = set(response.get("deferred") or [])
         except urllib2.HTTPError, e:
             message = ("HTTP %s: %s" % (e.code, e.read()))
         except:
@@ -228,21 +287,45 @@ class S3Notifications(object):
 
         # Update time stamps and unlock, invalidate auth token
         intervals = s3db.pr_subscription_check_intervals
-        interval = datetime.timedelta(minutes=intervals.get(s.frequency, 0))
-        if success:
-            last_check_time = datetime.datetime.utcnow()
-            next_check_time = last_check_time + interval
-            r.update_record(auth_token=None,
-                            locked=False,
-                            last_check_time=last_check_time,
-                            next_check_time=next_check_time)
-        else:
-            r.update_record(auth_token=None,
-                            locked=False)
+        last_check_time = datetime.datetime.utcnow()
+        for row in rows:
+            s = row.pr_subscription
+            r = row.pr_subscription_resource
+            if r.id in deferred:
+                # Notified separately (below)
+                continue
+            if batch:
+                notified = results.get(str(r.id), success)
+            else:
+                notified = success
+            if notified:
+                interval = datetime.timedelta(
+                                minutes=intervals.get(s.frequency, 0))
+                db(rtable.id == r.id).update(
+                                auth_token=None,
+                                locked=False,
+                                last_check_time=last_check_time,
+                                next_check_time=last_check_time + interval)
+            else:
+                db(rtable.id == r.id).update(auth_token=None,
+                                             locked=False)
         db.commit()
 
+        # Subscribers who can see other records than the group leader
+        # need their own lookup request
+        for deferred_id in deferred:
+            cls.notify(deferred_id)
+
         # Done
-        return message
+        if batch:
+            duration = datetime.datetime.utcnow() - start
+            metrics.update(subscriptions=len(rows),
+                           queries=1 + len(deferred),
+                           duration=duration.seconds +
+                                    duration.microseconds / 1000000.0)
+            return {"message": message, "metrics": metrics}
+        else:
+            return message
 
     # -------------------------------------------------------------------------
     @classmethod
@@ -273,10 +356,13 @@ class S3Notifications(object):
                     #subscription["resource"],
                     #subscription["last_check_time"]))
 
+        # Group of subscribers?
+        subscribers = subscription.get("subscribers")
+
         # Check notification settings
         notify_on = subscription["notify_on"]
         methods = subscription["method"]
-        if not notify_on or not methods:
+        if not notify_on or not subscribers and not methods:
             return json_message(message="No notifications configured "
                                         "for this subscription")
 
@@ -286,10 +372,25 @@ class S3Notifications(object):
         if not auth.s3_logged_in() or auth.user.pe_id != pe_id:
             r.unauthorised()
 
+        # Subscribers who may not see the same records as the current
+        # user must not receive these results, notify() runs separate
+        # lookups for them
+        if subscribers:
+            deferred = cls._check_access(resource.table, subscribers, pe_id)
+        else:
+            deferred = set()
+
         # Fields to extract
         fields = resource.list_fields(key="notify_fields")
         if "created_on" not in fields:
             fields.append("created_on")
+        modified_on_selector = resource.prefix_selector("modified_on")
+        if subscribers and "modified_on" not in fields:
+            # Needed to filter the records per subscriber
+            fields.append("modified_on")
+            strip = True
+        else:
+            strip = False
 
         # Extract the data
         data = resource.select(fields,
@@ -300,10 +401,36 @@ class S3Notifications(object):
         # How many records do we have?
         numrows = len(rows)
         if not numrows:
+            if deferred:
+                return json_message(message="No records found",
+                                    deferred=list(deferred))
             return json_message(message="No records found")
 
         #_debug("%s rows:" % numrows)
 
+        # Which time stamp to filter the records per subscriber
+        if subscribers:
+            if "upd" in notify_on:
+                time_selector = modified_on_selector
+            else:
+                time_selector = resource.prefix_selector("created_on")
+            time_colname = None
+            for rfield in data["rfields"]:
+                if rfield.selector == time_selector:
+                    time_colname = rfield.colname
+                    break
+            if strip:
+                data["rfields"] = [rfield for rfield in data["rfields"]
+                                   if rfield.selector != modified_on_selector]
+        else:
+            subscribers = [{"resource_id": None,
+                            "pe_id": pe_id,
+                            "method": methods,
+                            "email_format": subscription["email_format"],
+                            "last_check_time": subscription["last_check_time"],
+                            }]
+            time_colname = None
+
         # Prepare meta-data
         get_config = resource.get_config
         settings = current.deployment_settings
@@ -316,12 +443,8 @@ class S3Notifications(object):
         else:
             resource_name = string.capwords(resource.name, "_")
 
-        last_check_time = current.xml.decode_iso_datetime(
-                                subscription["last_check_time"])
-
-        email_format = subscription["email_format"]
-        if not email_format:
-            email_format = settings.get_msg_notify_email_format()
+        decode_iso_datetime = current.xml.decode_iso_datetime
+        as_utc = current.xml.as_utc
 
         filter_query = subscription.get("filter_query")
 
@@ -330,9 +453,7 @@ class S3Notifications(object):
                      "resource": resource_name,
                      "page_url": page_url,
                      "notify_on": notify_on,
-                     "last_check_time": last_check_time,
                      "filter_query": filter_query,
-                     "total_rows": numrows,
                     }
 
         # Render contents for the message template(s)
@@ -342,14 +463,6 @@ class S3Notifications(object):
         if not renderer:
             renderer = cls._render
 
-        contents = {}
-        if email_format == "html" and "EMAIL" in methods:
-            contents["html"] = renderer(resource, data, meta_data, "html")
-            contents["default"] = contents["html"]
-        if email_format != "html" or "EMAIL" not in methods or len(methods) > 1:
-            contents["text"] = renderer(resource, data, meta_data, "text")
-            contents["default"] = contents["text"]
-        
         # Subject line
         subject = get_config("notify_subject")
         if not subject:
@@ -376,78 +489,314 @@ class S3Notifications(object):
         # Render and send the message(s)
         theme = settings.get_template()
         prefix = resource.get_config("notify_template", "notify")
-        
+        default_email_format = settings.get_msg_notify_email_format()
+
         send = current.msg.send_by_pe_id
 
+        # Subscribers with the same last check time receive the same
+        # records, so contents and messages are rendered only once
+        # per format (and last check time) for the whole group
+        contents = {}
+        messages = {}
+
         success = False
         errors = []
+        results = {}
+        metrics = {"records": numrows,
+                   "rendered": 0,
+                   "sent": 0,
+                   "failed": 0,
+                   }
 
-        for method in methods:
+        for subscriber in subscribers:
 
-            error = None
-            
-            # Get the message template
-            template = None
-            filenames = ["%s_%s.html" % (prefix, method.lower())]
-            if method == "EMAIL" and email_format:
-                filenames.insert(0, "%s_email_%s.html" % (prefix, email_format))
-            if theme != "default":
-                path = join("private", "templates", theme, "views", "msg")
-                template = get_template(path, filenames)
-            if template is None:
-                path = join("views", "msg")
-                template = get_template(path, filenames)
-            if template is None:
-                template = StringIO(T("New updates are available."))
-
-            # Select contents format
-            if method == "EMAIL" and email_format == "html":
-                output = contents["html"]
-            else:
-                output = contents["text"]
-                
-            # Render the message
-            try:
-                message = current.response.render(template, output)
-            except:
-                exc_info = sys.exc_info()[:2]
-                error = ("%s: %s" % (exc_info[0].__name__, exc_info[1]))
-                errors.append(error)
+            if subscriber["resource_id"] in deferred:
                 continue
 
-            # Send the message
-            #_debug("Sending message per %s" % method)
-            #_debug(message)
-            try:
-                sent = send(pe_id,
-                            subject=s3_truncate(subject, 78),
-                            message=message,
-                            contact_method=method,
-                            system_generated=True)
-            except:
-                exc_info = sys.exc_info()[:2]
-                error = ("%s: %s" % (exc_info[0].__name__, exc_info[1]))
-                sent = False
-                
-            if sent:
-                # Successful if at least one notification went out
-                success = True
+            methods = subscriber["method"]
+            if not methods:
+                continue
+
+            email_format = subscriber["email_format"]
+            if not email_format:
+                email_format = default_email_format
+
+            check_time = subscriber["last_check_time"]
+            last_check_time = decode_iso_datetime(check_time)
+
+            # Records for this subscriber
+            if time_colname:
+                srows = []
+                for row in rows:
+                    try:
+                        timestmp = row["_row"][time_colname]
+                    except (KeyError, AttributeError):
+                        timestmp = None
+                    if timestmp is None or \
+                       as_utc(timestmp) >= last_check_time:
+                        srows.append(row)
+                if not srows:
+                    # Nothing new for this subscriber
+                    results[subscriber["resource_id"]] = True
+                    continue
             else:
-                if not error:
-                    error = current.session.error
-                    if isinstance(error, list):
-                        error = "/".join(error)
-                if error:
-                    errors.append(error)
+                srows = rows
+
+            def get_contents(fmt):
+                key = (fmt, check_time)
+                if key not in contents:
+                    sdata = dict(data, rows=srows)
+                    smeta_data = dict(meta_data,
+                                      last_check_time=last_check_time,
+                                      total_rows=len(srows))
+                    contents[key] = renderer(resource, sdata, smeta_data, fmt)
+                return contents[key]
+
+            sent_any = False
+            for method in methods:
+
+                error = None
+
+                # Select contents format
+                if method == "EMAIL" and email_format == "html":
+                    fmt = "html"
+                else:
+                    fmt = "text"
+
+                key = (method, email_format, fmt, check_time)
+                if key in messages:
+                    message = messages[key]
+                else:
+                    # Get the message template
+                    template = None
+                    filenames = ["%s_%s.html" % (prefix, method.lower())]
+                    if method == "EMAIL" and email_format:
+                        filenames.insert(0, "%s_email_%s.html" % (prefix, email_format))
+                    if theme != "default":
+                        path = join("private", "templates", theme, "views", "msg")
+                        template = get_template(path, filenames)
+                    if template is None:
+                        path = join("views", "msg")
+                        template = get_template(path, filenames)
+                    if template is None:
+                        template = StringIO(T("New updates are available."))
+
+                    # Render the message
+                    try:
+                        message = current.response.render(template,
+                                                          get_contents(fmt))
+                    except:
+                        exc_info = sys.exc_info()[:2]
+                        error = ("%s: %s" % (exc_info[0].__name__, exc_info[1]))
+                        errors.append(error)
+                        message = None
+                    messages[key] = message
+                    metrics["rendered"] += 1
+                if message is None:
+                    continue
+
+                # Send the message
+                #_debug("Sending message per %s" % method)
+                #_debug(message)
+                try:
+                    sent = send(subscriber["pe_id"],
+                                subject=s3_truncate(subject, 78),
+                                message=message,
+                                contact_method=method,
+                                system_generated=True)
+                except:
+                    exc_info = sys.exc_info()[:2]
+                    error = ("%s: %s" % (exc_info[0].__name__, exc_info[1]))
+                    sent = False
+
+                if sent:
+                    # Successful if at least one notification went out
+                    sent_any = True
+                    metrics["sent"] += 1
+                else:
+                    metrics["failed"] += 1
+                    if not error:
+                        error = current.session.error
+                        if isinstance(error, list):
+                            error = "/".join(error)
+                    if error:
+                        errors.append(error)
+
+            results[subscriber["resource_id"]] = sent_any
+            if sent_any:
+                success = True
 
         # Done
         if errors:
             message = ", ".join(errors)
         else:
             message = "Success"
-        return json_message(success=success,
-                            statuscode=200 if success else 403,
-                            message=message)
+        if "subscribers" in subscription:
+            return json_message(success=success,
+                                statuscode=200 if success else 403,
+                                message=message,
+                                results=results,
+                                metrics=metrics,
+                                deferred=list(deferred))
+        else:
+            return json_message(success=success,
+                                statuscode=200 if success else 403,
+                                message=message)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _check_access(table, subscribers, pe_id):
+        """
+            Helper method to find the subscribers in a group who do not
+            have exactly the same read permission for the table as the
+            current user (=the subscriber who leads the lookup request),
+            e.g. due to record ownership or realms
+
+            @param table: the table
+            @param subscribers: the subscriber dicts (see notify)
+            @param pe_id: the pe_id of the current user
+
+            @return: set of pr_subscription_resource record IDs of the
+                     subscribers to notify separately
+        """
+
+        auth = current.auth
+        accessible_query = auth.s3_accessible_query
+
+        expected = str(accessible_query("read", table))
+        user_id = auth.user.id
+
+        pe_ids = set(s["pe_id"] for s in subscribers if s["pe_id"] != pe_id)
+        if not pe_ids:
+            return set()
+        ltable = current.s3db.pr_person_user
+        rows = current.db(ltable.pe_id.belongs(pe_ids)).select(ltable.pe_id,
+                                                                ltable.user_id)
+        users = dict((row.pe_id, row.user_id) for row in rows)
+
+        same = {pe_id: True}
+        deferred = set()
+        try:
+            for subscriber in subscribers:
+                spe_id = subscriber["pe_id"]
+                if spe_id not in same:
+                    suser_id = users.get(spe_id)
+                    if suser_id is None:
+                        same[spe_id] = False
+                    else:
+                        auth.s3_impersonate(suser_id)
+                        query = accessible_query("read", table)
+                        same[spe_id] = str(query) == expected
+                if not same[spe_id]:
+                    deferred.add(subscriber["resource_id"])
+        finally:
+            # Restore the current user
+            auth.s3_impersonate(user_id)
+
+        return deferred
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _groups(cls, subscriptions):
+        """
+            Helper method to group due subscriptions which can be
+            notified with a single lookup request: same resource, URL,
+            filter and trigger, subscribers with the same roles and
+            language, and last check times within the same check
+            interval
+
+            @param subscriptions: Rows with the pr_subscription_resource
+                                  record IDs (as returned by _subscriptions)
+            @return: list of lists of pr_subscription_resource record IDs
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        stable = s3db.pr_subscription
+        rtable = db.pr_subscription_resource
+        ftable = s3db.pr_filter
+
+        join = stable.on(rtable.subscription_id == stable.id)
+        left = ftable.on(ftable.id == stable.filter_id)
+
+        resource_ids = [row.id for row in subscriptions]
+        rows = db(rtable.id.belongs(resource_ids)).select(
+                                                  rtable.id,
+                                                  rtable.resource,
+                                                  rtable.url,
+                                                  rtable.last_check_time,
+                                                  stable.pe_id,
+                                                  stable.frequency,
+                                                  stable.notify_on,
+                                                  ftable.query,
+                                                  join=join,
+                                                  left=left)
+
+        # Roles and language of the subscribers: the lookup request runs
+        # as the first subscriber of the group, so the others should have
+        # the same permissions (send() checks that they see exactly the
+        # same records) and receive messages in the same language
+        ltable = s3db.pr_person_user
+        utable = db.auth_user
+        mtable = db.auth_membership
+        pe_ids = set(row.pr_subscription.pe_id for row in rows)
+        query = (ltable.pe_id.belongs(pe_ids)) & \
+                (utable.id == ltable.user_id)
+        left = mtable.on((mtable.user_id == ltable.user_id) & \
+                         (mtable.deleted != True))
+        users = db(query).select(ltable.pe_id,
+                                 utable.language,
+                                 mtable.group_id,
+                                 mtable.pe_id,
+                                 left=left)
+        roles = {}
+        languages = {}
+        for user in users:
+            pe_id = user[ltable.pe_id]
+            languages[pe_id] = user[utable.language]
+            role = roles.setdefault(pe_id, set())
+            group_id = user[mtable.group_id]
+            if group_id:
+                role.add((group_id, user[mtable.pe_id]))
+
+        intervals = s3db.pr_subscription_check_intervals
+        epoch = datetime.datetime(1970, 1, 1)
+
+        groups = {}
+        for row in rows:
+            s = row.pr_subscription
+            r = row.pr_subscription_resource
+            f = row.pr_filter
+
+            pe_id = s.pe_id
+            role = roles.get(pe_id)
+            if role is not None:
+                role = frozenset(role)
+
+            # Check interval window of the last check time
+            last_check_time = r.last_check_time
+            if last_check_time:
+                interval = intervals.get(s.frequency, 0) or 1
+                delta = last_check_time - epoch
+                window = (delta.days * 1440 + delta.seconds // 60) // interval
+            else:
+                window = None
+
+            key = (r.resource,
+                   r.url,
+                   f.query,
+                   tuple(sorted(s.notify_on or [])),
+                   role,
+                   languages.get(pe_id),
+                   window,
+                   )
+            if key in groups:
+                groups[key].append(r.id)
+            else:
+                groups[key] = [r.id]
+
+        return groups.values()
 
     # -------------------------------------------------------------------------
     @classmethod
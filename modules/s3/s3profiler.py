@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+
+""" S3 Request Profiler
+
+    Records wall time and number of DB queries for the model files,
+    the instantiation of model classes, the resource customisation
+    hooks and the controller of each request, and aggregates these
+    records into a report (to find out where the request time goes),
+    together with the statistics of the shared representation cache
+
+    Enable with:
+
+        settings.base.profile = True
+
+    @copyright: 2013 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+
+    @status: experimental
+"""
+
+__all__ = ["S3Profiler"]
+
+import os
+import time
+
+try:
+    import json # try stdlib (Python 2.6)
+except ImportError:
+    try:
+        import simplejson as json # try external module
+    except:
+        import gluon.contrib.simplejson as json # fallback to pure-Python module
+
+from gluon import current
+from gluon.storage import Storage
+
+from s3fields import S3RepresentCache
+
+# =============================================================================
+class S3Profiler(object):
+    """
+        Per-request profiler
+
+        Each record has the wall time and the number of DB queries
+        both including and excluding the nested records (e.g. models
+        loaded by other models or by customise-hooks), so that the
+        self-times of all records of a request add up to the request
+        time.
+    """
+
+    FILENAME = "s3profile.log"
+
+    # Record categories
+    FILE = "file"
+    MODEL = "model"
+    CUSTOMISE = "customise"
+    CONTROLLER = "controller"
+
+    def __init__(self, db=None):
+        """
+            Constructor
+
+            @param db: the DAL instance to count the queries for
+        """
+
+        now = current.request.now
+        if now:
+            # Request start (includes the models which have been run
+            # before the profiler has been instantiated)
+            self.start = time.mktime(now.timetuple()) + \
+                         now.microsecond / 1000000.0
+        else:
+            self.start = time.time()
+
+        self.queries = 0
+        if db is not None:
+            self.count_queries(db)
+
+        self.records = []
+
+        # Time and queries of nested records [[time, queries], ...]
+        self.stack = []
+        # Time and queries of top-level records since the last checkpoint
+        self.nested = [0.0, 0]
+
+        self.last = self.start
+        self.last_queries = 0
+
+    # -------------------------------------------------------------------------
+    def count_queries(self, db):
+        """
+            Install a hook in the DB adapter to count the queries
+
+            @param db: the DAL instance
+        """
+
+        adapter = db._adapter
+        execute = adapter.execute
+
+        def counted(*args, **kwargs):
+            self.queries += 1
+            return execute(*args, **kwargs)
+
+        adapter.execute = counted
+        return
+
+    # -------------------------------------------------------------------------
+    def checkpoint(self, name):
+        """
+            Record the time since the last checkpoint, to be called at
+            the end of each model file
+
+            @param name: the name of the model file
+        """
+
+        now = time.time()
+        duration = now - self.last
+        queries = self.queries - self.last_queries
+        nested_time, nested_queries = self.nested
+
+        self.records.append((self.FILE,
+                             name,
+                             duration,
+                             duration - nested_time,
+                             queries,
+                             queries - nested_queries,
+                             ))
+
+        self.last = now
+        self.last_queries = self.queries
+        self.nested = [0.0, 0]
+        return
+
+    # -------------------------------------------------------------------------
+    def measure(self, category, name, function, *args, **kwargs):
+        """
+            Call a function and record its wall time and queries
+
+            @param category: the record category
+            @param name: the record name
+            @param function: the function
+            @param args: positional arguments for the function
+            @param kwargs: keyword arguments for the function
+
+            @return: the return value of the function
+        """
+
+        stack = self.stack
+        stack.append([0.0, 0])
+        queries = self.queries
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            duration = time.time() - start
+            queries = self.queries - queries
+            nested_time, nested_queries = stack.pop()
+            outer = stack[-1] if stack else self.nested
+            outer[0] += duration
+            outer[1] += queries
+            self.records.append((category,
+                                 name,
+                                 duration,
+                                 duration - nested_time,
+                                 queries,
+                                 queries - nested_queries,
+                                 ))
+
+    # -------------------------------------------------------------------------
+    def caller(self, function):
+        """
+            Run the controller function (to be installed as
+            response._caller), and save the records of the request
+
+            @param function: the controller function
+        """
+
+        request = current.request
+        name = "%s/%s" % (request.controller, request.function)
+        try:
+            return self.measure(self.CONTROLLER, name, function)
+        finally:
+            self.save(name)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def path(cls):
+        """ The path of the profile log """
+
+        return os.path.join(current.request.folder, "cache", cls.FILENAME)
+
+    # -------------------------------------------------------------------------
+    def save(self, name):
+        """
+            Append the records of this request to the profile log
+
+            @param name: the request name (controller/function)
+        """
+
+        data = {"request": name,
+                "time": time.time() - self.start,
+                "queries": self.queries,
+                "records": self.records,
+                }
+        rcache = S3RepresentCache.instance
+        if rcache is not None:
+            # Snapshot of the (process-wide) cache statistics
+            stats = rcache.stats()
+            data["rcache"] = [os.getpid(),
+                              stats.hits,
+                              stats.misses,
+                              stats.evictions,
+                              stats.size,
+                              ]
+        # One write per request, so that concurrent requests
+        # don't interleave their records
+        line = "%s\n" % json.dumps(data)
+        try:
+            with open(self.path(), "a") as f:
+                f.write(line)
+        except (IOError, OSError):
+            current.log.error("S3Profiler: could not write %s" % self.path())
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def clear(cls):
+        """ Remove the profile log """
+
+        path = cls.path()
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def report(cls, request=None):
+        """
+            Aggregate the profile log
+
+            @param request: limit the report to requests with this
+                            name (controller/function)
+
+            @return: tuple (summary, items), where summary is a Storage
+                     with the number of requests, their average time and
+                     queries, and items a list of Storages (one per
+                     category and name) with the number of calls, the
+                     total, average and maximum times, the average number
+                     of queries and the share in the total request time,
+                     ordered by total self-time; summary.rcache has the
+                     statistics of the representation cache (hits, misses,
+                     evictions, size), summed up over all processes
+        """
+
+        summary = Storage(requests=0, time=0.0, queries=0, rcache=None)
+        items = {}
+
+        # Latest representation cache statistics per process
+        rcache = {}
+
+        path = cls.path()
+        if not os.path.exists(path):
+            return summary, []
+
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    # Incomplete line
+                    continue
+                stats = data.get("rcache")
+                if stats:
+                    rcache[stats[0]] = stats[1:]
+                if request and data["request"] != request:
+                    continue
+                summary.requests += 1
+                summary.time += data["time"]
+                summary.queries += data["queries"]
+
+                for category, name, t, s, q, sq in data["records"]:
+                    key = (category, name)
+                    item = items.get(key)
+                    if item is None:
+                        item = items[key] = Storage(category=category,
+                                                    name=name,
+                                                    calls=0,
+                                                    time=0.0,
+                                                    self_time=0.0,
+                                                    max=0.0,
+                                                    queries=0,
+                                                    self_queries=0,
+                                                    )
+                    item.calls += 1
+                    item.time += t
+                    item.self_time += s
+                    item.max = max(item.max, t)
+                    item.queries += q
+                    item.self_queries += sq
+
+        total = summary.time
+        requests = summary.requests
+        if requests:
+            summary.time = total / requests
+            summary.queries = float(summary.queries) / requests
+        for item in items.values():
+            item.mean = item.time / item.calls
+            item.share = item.self_time / total if total else 0.0
+
+        if rcache:
+            hits, misses, evictions, size = [sum(s) for s in zip(*rcache.values())]
+            summary.rcache = Storage(hits = hits,
+                                     misses = misses,
+                                     evictions = evictions,
+                                     size = size,
+                                     )
+
+        items = sorted(items.values(),
+                       key=lambda item: item.self_time,
+                       reverse=True)
+        return summary, items
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def render(cls, request=None, limit=None):
+        """
+            Render the aggregated profile log as text table
+
+            @param request: limit the report to requests with this
+                            name (controller/function)
+            @param limit: the maximum number of items to show
+        """
+
+        summary, items = cls.report(request=request)
+        if limit:
+            items = items[:limit]
+
+        output = ["Requests: %s, average %.1f ms, %.1f queries" % \
+                  (summary.requests, summary.time * 1000, summary.queries),
+                  "",
+                  "%-10s %-50s %7s %10s %10s %10s %8s %7s" % \
+                  ("Category", "Name", "Calls", "Mean ms", "Max ms",
+                   "Self ms", "Queries", "Share"),
+                  ]
+        for item in items:
+            output.append("%-10s %-50s %7d %10.2f %10.2f %10.1f %8.1f %6.1f%%" % \
+                          (item.category,
+                           item.name[:50],
+                           item.calls,
+                           item.mean * 1000,
+                           item.max * 1000,
+                           item.self_time * 1000,
+                           float(item.queries) / item.calls,
+                           item.share * 100,
+                           ))
+
+        rcache = summary.rcache
+        if rcache:
+            lookups = rcache.hits + rcache.misses
+            output.extend(["",
+                           "Represent cache: %s hits, %s misses (%.1f%% hits), %s evictions, %s entries" % \
+                           (rcache.hits,
+                            rcache.misses,
+                            100.0 * rcache.hits / lookups if lookups else 0.0,
+                            rcache.evictions,
+                            rcache.size,
+                            ),
+                           ])
+        return "\n".join(output)
+
+# END =========================================================================
@@ -38,6 +38,7 @@
 
 import collections
 import datetime
+import hashlib
 import re
 import sys
 import time
@@ -76,7 +77,7 @@ from gluon.tools import callback
 
 from s3data import S3DataTable, S3DataList, S3PivotTable
 from s3fields import S3Represent, S3RepresentLazy, s3_all_meta_field_names
-from s3utils import s3_has_foreign_key, s3_get_foreign_key, s3_unicode, S3TypeConverter, s3_get_last_record_id, s3_remove_last_record_id
+from s3utils import s3_has_foreign_key, s3_get_foreign_key, s3_orderby_fields, s3_unicode, S3TypeConverter, s3_get_last_record_id, s3_remove_last_record_id
 from s3validators import IS_ONE_OF
 from s3xml import S3XMLFormat
 
@@ -498,21 +499,57 @@ class S3Resource(object):
     # -------------------------------------------------------------------------
     # Data access (new API)
     # -------------------------------------------------------------------------
-    def count(self, left=None, distinct=False):
+    def count(self, left=None, distinct=False, expire=None):
         """
             Get the total number of available records in this resource
 
             @param left: left outer joins, if required
             @param distinct: only count distinct rows
+            @param expire: cache the number across requests for this
+                           number of seconds (same filter query only)
         """
 
         if self.rfilter is None:
             self.build_query()
         if self._length is None:
-            self._length = self.rfilter.count(left=left,
-                                              distinct=distinct)
+            key = self.cache_key("count", left, distinct) if expire else None
+            if key:
+                length = current.cache.ram(key, lambda: None,
+                                           time_expire=expire)
+                if length is None:
+                    length = self.rfilter.count(left=left,
+                                                distinct=distinct)
+                    current.cache.ram(key, lambda: length, time_expire=0)
+                self._length = length
+            else:
+                self._length = self.rfilter.count(left=left,
+                                                  distinct=distinct)
         return self._length
 
+    # -------------------------------------------------------------------------
+    def cache_key(self, *args):
+        """
+            Generate a key to cache query results across requests, which
+            is unique for the current filter (including the accessible
+            query) and the given arguments
+
+            @param args: additional arguments to distinguish the results
+                         (e.g. left joins, orderby)
+
+            @return: the key, or None if the filter contains a virtual
+                     filter (which can not be serialized)
+        """
+
+        if self.get_filter() is not None:
+            return None
+
+        left = self.rfilter.get_left_joins()
+        items = [str(self.get_query())] + \
+                [str(j) for j in left] + \
+                [str(a) for a in args]
+        return "%s_%s" % (self.tablename,
+                          hashlib.md5("|".join(items)).hexdigest())
+
     # -------------------------------------------------------------------------
     def select(self,
                fields,
@@ -1194,6 +1231,143 @@ class S3Resource(object):
 
         return records
 
+    # -------------------------------------------------------------------------
+    def iter_select(self,
+                    fields,
+                    batch_size=1000,
+                    left=None,
+                    orderby=None,
+                    as_rows=False,
+                    **attr):
+        """
+            Generator to extract data from this resource in batches, so
+            that - unlike select - memory consumption does not depend on
+            the total number of records
+
+            @param fields: the fields to extract (selector strings)
+            @param batch_size: the maximum number of records per batch
+            @param left: additional left joins required for filters
+            @param orderby: orderby-expression for DAL - without orderby,
+                            the records are paged by primary key (keyset),
+                            otherwise the ordered record IDs are retrieved
+                            beforehand and then processed in batches
+            @param as_rows: yield the DAL Rows of each batch rather than
+                            the extracted rows
+            @param attr: additional parameters for select (e.g. virtual,
+                         represent, show_links, raw_data)
+
+            @return: a generator of extracted rows (or of Rows per batch
+                     if as_rows is True)
+        """
+
+        db = current.db
+        table = self.table
+        pkey = table._id
+
+        rfilter = self.rfilter
+        if rfilter is None:
+            rfilter = self.build_query()
+
+        select = self.__select_batch
+
+        if orderby is not None:
+
+            if rfilter.get_filter() is not None:
+                # Virtual filter => can not retrieve the ordered IDs
+                # separately, so fall back to a single batch
+                batches = [None]
+            else:
+                # Retrieve the ordered record IDs
+                ids = self.select([pkey.name],
+                                  left=left,
+                                  orderby=orderby,
+                                  limit=1,
+                                  getids=True,
+                                  virtual=False)["ids"]
+                if not ids:
+                    return
+                batches = (ids[i:i + batch_size]
+                           for i in xrange(0, len(ids), batch_size))
+
+            for ids in batches:
+                rows = select(fields, ids, left, orderby, as_rows, attr)
+                if as_rows:
+                    yield rows
+                else:
+                    for row in rows:
+                        yield row
+            return
+
+        # Keyset pagination by primary key
+        query = rfilter.get_query()
+
+        left_joins = S3LeftJoins(self.tablename, left)
+        left_joins.add(rfilter.get_left_joins())
+        left_joins = left_joins.as_list()
+        groupby = pkey if left_joins else None
+
+        last = None
+        while True:
+            if last is not None:
+                q = query & (pkey > last)
+            else:
+                q = query
+            rows = db(q).select(pkey,
+                                left=left_joins,
+                                groupby=groupby,
+                                orderby=pkey,
+                                limitby=(0, batch_size))
+            ids = [row[pkey] for row in rows]
+            if not ids:
+                break
+
+            rows = select(fields, ids, left, pkey, as_rows, attr)
+            if as_rows:
+                yield rows
+            else:
+                for row in rows:
+                    yield row
+
+            if len(ids) < batch_size:
+                break
+            last = ids[-1]
+
+    # -------------------------------------------------------------------------
+    def __select_batch(self, fields, ids, left, orderby, as_rows, attr):
+        """
+            Helper method for iter_select to extract a batch of records
+
+            @param fields: the fields to extract
+            @param ids: the record IDs of the batch (None for all records)
+            @param left: additional left joins required for filters
+            @param orderby: orderby-expression for DAL
+            @param as_rows: return the rows (don't extract)
+            @param attr: additional parameters for select
+
+            @return: the Rows (as_rows), or the extracted rows
+        """
+
+        rfilter = self.rfilter
+        if ids is not None:
+            # Temporarily restrict the filter to the batch
+            rfilter.queries.append(self.table._id.belongs(ids))
+            rfilter.query = None
+        try:
+            data = self.select(fields,
+                               left=left,
+                               limit=None,
+                               orderby=orderby,
+                               as_rows=as_rows,
+                               **attr)
+        finally:
+            if ids is not None:
+                rfilter.queries.pop()
+                rfilter.query = None
+        if as_rows:
+            return data
+        else:
+            return data["rows"]
+
     # -------------------------------------------------------------------------
     def insert(self, **fields):
         """
@@ -1771,18 +1945,94 @@ class S3Resource(object):
         id_repr = table._id.represent
         table._id.represent = None
 
+        # Cached number of records and keyset pagination
+        settings = current.deployment_settings
+        expire = settings.get_ui_datatables_count_expire()
+        keyset = settings.get_ui_datatables_keyset() and \
+                 limit and not getids and self.linked is None
+
+        numrows = None
+        cache_key = None
+        if expire or keyset:
+            cache_key = self.cache_key("datatable", left, distinct)
+        if cache_key and expire:
+            numrows = current.cache.ram("%s_count" % cache_key,
+                                        lambda: None,
+                                        time_expire=expire)
+
+        dt_orderby = orderby
+        seek_fields = None
+        seek_query = None
+        if cache_key and keyset:
+            seek_fields = self.__seek_fields(orderby)
+        if seek_fields is not None:
+            # Order by record ID as tie-breaker (=unique sort key)
+            orderby = [f for f in s3_orderby_fields(table, orderby,
+                                                    expr=True)]
+            orderby.append(table._id)
+            cursor_key = "%s_%s_%%s" % (cache_key,
+                                        ",".join([str(o) for o in orderby]))
+            if start:
+                cursor = current.cache.ram(cursor_key % start,
+                                           lambda: None,
+                                           time_expire=expire or 60)
+                if cursor:
+                    values, last_id, numrows = cursor
+                    seek_query = self.__seek_query(seek_fields,
+                                                   values,
+                                                   last_id)
+
         # Extract the data
-        data = self.select(selectors,
-                           start=start,
-                           limit=limit,
-                           orderby=orderby,
-                           left=left,
-                           distinct=distinct,
-                           count=True,
-                           getids=getids,
-                           represent=True)
+        if seek_query is not None:
+            # Temporarily restrict the filter to the records after the cursor
+            rfilter = self.rfilter
+            rfilter.queries.append(seek_query)
+            rfilter.query = None
+            try:
+                data = self.select(selectors,
+                                   start=0,
+                                   limit=limit,
+                                   orderby=orderby,
+                                   left=left,
+                                   distinct=distinct,
+                                   represent=True)
+            finally:
+                rfilter.queries.pop()
+                rfilter.query = None
+        else:
+            data = self.select(selectors,
+                               start=start,
+                               limit=limit,
+                               orderby=orderby,
+                               left=left,
+                               distinct=distinct,
+                               count=numrows is None,
+                               getids=getids,
+                               represent=True)
 
         rows = data["rows"]
+        if numrows is None:
+            numrows = data["numrows"]
+            if cache_key and expire:
+                current.cache.ram("%s_count" % cache_key,
+                                  lambda: numrows,
+                                  time_expire=0)
+        else:
+            data["numrows"] = numrows
+
+        # Remember the cursor for the next page
+        if seek_fields is not None and rows and len(rows) == limit:
+            last_id = int(rows[-1][str(table._id)])
+            fields = [f for f, desc in seek_fields]
+            record = current.db(table._id == last_id).select(limitby=(0, 1),
+                                                             *fields).first()
+            if record:
+                values = [record[f] for f in fields]
+                if None not in values:
+                    cursor = (values, last_id, numrows)
+                    current.cache.ram(cursor_key % ((start or 0) + len(rows)),
+                                      lambda: cursor,
+                                      time_expire=0)
 
         # Restore ID representation
         table._id.represent = id_repr
@@ -1801,10 +2051,72 @@ class S3Resource(object):
                 
         # Generate the data table
         rfields = data["rfields"]
-        dt = S3DataTable(rfields, rows, orderby=orderby, empty=empty)
+        dt = S3DataTable(rfields, rows, orderby=dt_orderby, empty=empty)
         
         return dt, data["numrows"], data["ids"]
 
+    # -------------------------------------------------------------------------
+    def __seek_fields(self, orderby):
+        """
+            Helper method for datatable to determine the sort fields for
+            keyset pagination, which is only possible if all sort fields
+            are non-nullable fields in the master table (otherwise the
+            datatable falls back to offset pagination)
+
+            @param orderby: the orderby expression
+
+            @return: list of tuples (Field, descending), or None if keyset
+                     pagination is not possible for this orderby
+        """
+
+        table = self.table
+        tablename = self.tablename
+        INVERT = current.db._adapter.INVERT
+
+        fields = []
+        for item in s3_orderby_fields(table, orderby, expr=True, skip=False):
+            if item is None:
+                # Not a field (e.g. a function of a field)
+                return None
+            if type(item) is Expression:
+                if item.op != INVERT:
+                    return None
+                field, desc = item.first, True
+            else:
+                field, desc = item, False
+            if field.tablename != tablename or \
+               str(field.type)[:5] == "list:" or \
+               not (field.notnull or field.type == "id"):
+                return None
+            fields.append((field, desc))
+        return fields
+
+    # -------------------------------------------------------------------------
+    def __seek_query(self, fields, values, last_id):
+        """
+            Helper method for datatable to construct the query for all
+            records after the cursor (in sort order, with the record ID as
+            tie-breaker)
+
+            @param fields: the sort fields, list of tuples (Field, descending)
+            @param values: the sort field values of the last record
+            @param last_id: the record ID of the last record
+        """
+
+        keys = list(zip(fields, values))
+        keys.append(((self.table._id, False), last_id))
+
+        query = None
+        equal = None
+        for (field, desc), value in keys:
+            q = (field < value) if desc else (field > value)
+            if equal is not None:
+                q = equal & q
+            query = q if query is None else query | q
+            q = (field == value)
+            equal = q if equal is None else equal & q
+        return query
+
     # -------------------------------------------------------------------------
     def datalist(self,
                  fields=None,
@@ -1872,7 +2184,7 @@ class S3Resource(object):
         return dl, numrows, data["ids"]
 
     # -------------------------------------------------------------------------
-    def pivottable(self, rows, cols, layers, strict=True):
+    def pivottable(self, rows, cols, layers, strict=True, db_aggregate=None):
         """
             Generate a pivot table of this resource.
 
@@ -1882,13 +2194,17 @@ class S3Resource(object):
                            the aggregation layers
             @param strict: filter out dimension values which don't match
                            the resource filter
+            @param db_aggregate: compute the layers in the database where
+                                 possible (None for deployment setting)
 
             @return: an S3PivotTable instance
 
             Supported methods: see S3PivotTable
         """
 
-        return S3PivotTable(self, rows, cols, layers, strict=strict)
+        return S3PivotTable(self, rows, cols, layers,
+                            strict=strict,
+                            db_aggregate=db_aggregate)
 
     # -------------------------------------------------------------------------
     def json(self,
@@ -2308,6 +2624,7 @@ class S3Resource(object):
                    maxbounds=False,
                    filters=None,
                    pretty_print=False,
+                   orderby=None,
                    **args):
         """
             Export this resource as S3XML
@@ -2329,6 +2646,7 @@ class S3Resource(object):
             @param filters: additional URL filters (Sync), as dict
                             {tablename: {url_var: string}}
             @param pretty_print: insert newlines/indentation in the output
+            @param orderby: orderby-expression for the master records
             @param args: dict of arguments to pass to the XSLT stylesheet
         """
 
@@ -2355,7 +2673,8 @@ class S3Resource(object):
                                 references=references,
                                 filters=filters,
                                 maxbounds=maxbounds,
-                                xmlformat=xmlformat)
+                                xmlformat=xmlformat,
+                                orderby=orderby)
         #if DEBUG:
             #end = datetime.datetime.now()
             #duration = end - _start
@@ -2416,7 +2735,8 @@ class S3Resource(object):
                     rcomponents=None,
                     filters=None,
                     maxbounds=False,
-                    xmlformat=None):
+                    xmlformat=None,
+                    orderby=None):
         """
             Export the resource as element tree
 
@@ -2436,6 +2756,8 @@ class S3Resource(object):
                             {tablename: {url_var: string}}
             @param maxbounds: include lat/lon boundaries in the top
                               level element (off by default)
+            @param orderby: orderby-expression for the master records
+                            (default: by modification date if msince)
         """
 
         xml = current.xml
@@ -2469,10 +2791,9 @@ class S3Resource(object):
         self.results = 0
 
         # Load slice
-        if msince is not None and "modified_on" in table.fields:
+        if orderby is None and \
+           msince is not None and "modified_on" in table.fields:
             orderby = "%s ASC" % table["modified_on"]
-        else:
-            orderby = None
 
         # Fields to load
         if xmlformat:
@@ -2988,6 +3309,7 @@ class S3Resource(object):
                    conflict_policy=None,
                    last_sync=None,
                    onconflict=None,
+                   chunk_size=None,
                    **args):
         """
             XML Importer
@@ -3009,6 +3331,10 @@ class S3Resource(object):
             @param conflict_policy: policy for conflict resolution (sync)
             @param last_sync: last synchronization datetime (sync)
             @param onconflict: callback hook for conflict resolution (sync)
+            @param chunk_size: import XML/CSV sources incrementally in chunks
+                               of this number of elements/rows, committing
+                               each chunk separately (see import_chunks),
+                               defaults to settings.base.import_chunk_size
             @param args: parameters to pass to the transformation stylesheet
         """
 
@@ -3023,6 +3349,11 @@ class S3Resource(object):
         tree = None
         self.job = None
 
+        if chunk_size is None:
+            chunk_size = current.deployment_settings.get_base_import_chunk_size()
+        chunked = chunk_size and not job_id and commit_job and id is None and \
+                  format in ("xml", "csv")
+
         if not job_id:
 
             # Resource data
@@ -3043,45 +3374,47 @@ class S3Resource(object):
             # Build import tree
             if not isinstance(source, (list, tuple)):
                 source = [source]
-            for item in source:
-                if isinstance(item, (list, tuple)):
-                    resourcename, s = item[:2]
-                else:
-                    resourcename, s = None, item
-                if isinstance(s, etree._ElementTree):
-                    t = s
-                elif format == "json":
-                    if isinstance(s, basestring):
-                        source = StringIO(s)
-                        t = xml.json2tree(s)
+            if not chunked:
+                # Otherwise see import_chunks
+                for item in source:
+                    if isinstance(item, (list, tuple)):
+                        resourcename, s = item[:2]
                     else:
-                        t = xml.json2tree(s)
-                elif format == "csv":
-                    t = xml.csv2tree(s,
-                                     resourcename=resourcename,
-                                     extra_data=extra_data)
-                elif format == "xls":
-                    t = xml.xls2tree(s,
-                                     resourcename=resourcename,
-                                     extra_data=extra_data)
-                else:
-                    t = xml.parse(s)
-                if not t:
-                    if xml.error:
-                        raise SyntaxError(xml.error)
+                        resourcename, s = None, item
+                    if isinstance(s, etree._ElementTree):
+                        t = s
+                    elif format == "json":
+                        if isinstance(s, basestring):
+                            source = StringIO(s)
+                            t = xml.json2tree(s)
+                        else:
+                            t = xml.json2tree(s)
+                    elif format == "csv":
+                        t = xml.csv2tree(s,
+                                         resourcename=resourcename,
+                                         extra_data=extra_data)
+                    elif format == "xls":
+                        t = xml.xls2tree(s,
+                                         resourcename=resourcename,
+                                         extra_data=extra_data)
                     else:
-                        raise SyntaxError("Invalid source")
-
-                if stylesheet is not None:
-                    t = xml.transform(t, stylesheet, **args)
-                    _debug(t)
+                        t = xml.parse(s)
                     if not t:
-                        raise SyntaxError(xml.error)
+                        if xml.error:
+                            raise SyntaxError(xml.error)
+                        else:
+                            raise SyntaxError("Invalid source")
 
-                if not tree:
-                    tree = t.getroot()
-                else:
-                    tree.extend(list(t.getroot()))
+                    if stylesheet is not None:
+                        t = xml.transform(t, stylesheet, **args)
+                        _debug(t)
+                        if not t:
+                            raise SyntaxError(xml.error)
+
+                    if not tree:
+                        tree = t.getroot()
+                    else:
+                        tree.extend(list(t.getroot()))
 
             if files is not None and isinstance(files, dict):
                 self.files = Storage(files)
@@ -3093,16 +3426,30 @@ class S3Resource(object):
         response = current.response
         # Flag to let onvalidation/onaccept know this is coming from a Bulk Import
         response.s3.bulk = True
-        success = self.import_tree(id, tree,
-                                   ignore_errors=ignore_errors,
-                                   job_id=job_id,
-                                   commit_job=commit_job,
-                                   delete_job=delete_job,
-                                   strategy=strategy,
-                                   update_policy=update_policy,
-                                   conflict_policy=conflict_policy,
-                                   last_sync=last_sync,
-                                   onconflict=onconflict)
+        if chunked:
+            success = self.import_chunks(source,
+                                         format=format,
+                                         stylesheet=stylesheet,
+                                         extra_data=extra_data,
+                                         chunk_size=chunk_size,
+                                         ignore_errors=ignore_errors,
+                                         strategy=strategy,
+                                         update_policy=update_policy,
+                                         conflict_policy=conflict_policy,
+                                         last_sync=last_sync,
+                                         onconflict=onconflict,
+                                         **args)
+        else:
+            success = self.import_tree(id, tree,
+                                       ignore_errors=ignore_errors,
+                                       job_id=job_id,
+                                       commit_job=commit_job,
+                                       delete_job=delete_job,
+                                       strategy=strategy,
+                                       update_policy=update_policy,
+                                       conflict_policy=conflict_policy,
+                                       last_sync=last_sync,
+                                       onconflict=onconflict)
         response.s3.bulk = False
 
         self.files = Storage()
@@ -3139,6 +3486,115 @@ class S3Resource(object):
             return xml.json_message(False, 400,
                                     message=self.error, tree=tree)
 
+    # -------------------------------------------------------------------------
+    def import_chunks(self, source,
+                      format="xml",
+                      stylesheet=None,
+                      extra_data=None,
+                      chunk_size=1000,
+                      ignore_errors=False,
+                      strategy=None,
+                      update_policy=None,
+                      conflict_policy=None,
+                      last_sync=None,
+                      onconflict=None,
+                      **args):
+        """
+            Import XML/CSV sources incrementally: read the source in chunks
+            of chunk_size elements (XML) or rows (CSV), transform and
+            import each chunk as a separate import job, and commit the
+            database transaction after each chunk - so that memory use
+            does not grow with the size of the source.
+
+            NB Each chunk is transformed separately, hence references
+               by tuid can only be resolved within the same chunk
+               (which is always the case for CSV stylesheets)
+            NB If a chunk fails (and ignore_errors is False), the import
+               stops and rolls back only that chunk
+
+            @param source: list of sources (as for import_xml, after the
+                           stylesheet parameters have been added to args)
+            @param format: type of source = "xml" or "csv"
+            @param stylesheet: stylesheet to use for transformation
+            @param extra_data: for CSV imports, dict of extra cols to add
+                               to each row
+            @param chunk_size: the number of elements/rows per chunk
+            @param ignore_errors: skip invalid records silently
+            @param strategy: tuple of allowed import methods
+            @param update_policy: policy for updates (sync)
+            @param conflict_policy: policy for conflict resolution (sync)
+            @param last_sync: last synchronization datetime (sync)
+            @param onconflict: callback hook for conflict resolution (sync)
+            @param args: parameters to pass to the transformation stylesheet
+
+            @return: True if successful, otherwise False
+        """
+
+        db = current.db
+        xml = current.xml
+
+        # Parse the stylesheet only once
+        if stylesheet is not None and \
+           not isinstance(stylesheet, (etree._ElementTree, etree._Element)):
+            stylesheet = xml.parse(stylesheet)
+            if stylesheet is None:
+                raise SyntaxError(xml.error)
+
+        error = None
+        error_tree = None
+        success = True
+        for item in source:
+            if isinstance(item, (list, tuple)):
+                resourcename, s = item[:2]
+            else:
+                resourcename, s = None, item
+            if isinstance(s, etree._ElementTree):
+                chunks = [s]
+            elif format == "csv":
+                chunks = xml.csv2trees(s,
+                                       resourcename=resourcename,
+                                       extra_data=extra_data,
+                                       chunk_size=chunk_size)
+            else:
+                chunks = xml.iterparse(s, chunk_size=chunk_size)
+
+            for t in chunks:
+                if stylesheet is not None:
+                    t = xml.transform(t, stylesheet, **args)
+                    _debug(t)
+                    if not t:
+                        raise SyntaxError(xml.error)
+
+                success = self.import_tree(None, t.getroot(),
+                                           ignore_errors=ignore_errors,
+                                           strategy=strategy,
+                                           update_policy=update_policy,
+                                           conflict_policy=conflict_policy,
+                                           last_sync=last_sync,
+                                           onconflict=onconflict)
+
+                # Collect the errors of all chunks
+                if self.error:
+                    error = self.error
+                if self.error_tree is not None:
+                    if error_tree is None:
+                        error_tree = self.error_tree
+                    else:
+                        error_tree.extend(list(self.error_tree))
+                if not success:
+                    break
+                db.commit()
+
+            if format != "csv" and xml.error:
+                # Parser error
+                raise SyntaxError(xml.error)
+            if not success:
+                break
+
+        self.error = error
+        self.error_tree = error_tree
+        return success
+
     # -------------------------------------------------------------------------
     def import_tree(self, id, tree,
                     job_id=None,
@@ -3520,6 +3976,55 @@ class S3Resource(object):
         """
 
         db = current.db
+        xml = current.xml
+        UID = xml.UID
+
+        # Get the values for unique fields from the record
+        pvalues = cls.unique_values(table, record)
+
+        # Build match query
+        query = None
+        for f in pvalues:
+            if f == UID:
+                continue
+            _query = (table[f] == pvalues[f])
+            if query is not None:
+                query = query | _query
+            else:
+                query = _query
+
+        fields = cls.import_fields(table, pvalues, mandatory=mandatory)
+
+        # Try to find exactly one match by non-UID unique keys
+        if query is not None:
+            original = db(query).select(limitby=(0, 2), *fields)
+            if len(original) == 1:
+                return original.first()
+
+        # If no match, then try to find a UID-match
+        if UID in pvalues:
+            uid = xml.import_uid(pvalues[UID])
+            query = (table[UID] == uid)
+            original = db(query).select(limitby=(0, 1), *fields).first()
+            if original:
+                return original
+
+        # No match or multiple matches
+        return None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def unique_values(table, record):
+        """
+            Get the values for all unique fields (including the UID) from
+            a record, helper for original()
+
+            @param table: the table
+            @param record: the record as dict or S3XML Element
+
+            @return: a Storage {fieldname: value}
+        """
+
         xml = current.xml
         xml_decode = xml.xml_decode
 
@@ -3556,35 +4061,7 @@ class S3Resource(object):
         else:
             raise TypeError
 
-        # Build match query
-        query = None
-        for f in pvalues:
-            if f == UID:
-                continue
-            _query = (table[f] == pvalues[f])
-            if query is not None:
-                query = query | _query
-            else:
-                query = _query
-
-        fields = cls.import_fields(table, pvalues, mandatory=mandatory)
-
-        # Try to find exactly one match by non-UID unique keys
-        if query is not None:
-            original = db(query).select(limitby=(0, 2), *fields)
-            if len(original) == 1:
-                return original.first()
-
-        # If no match, then try to find a UID-match
-        if UID in pvalues:
-            uid = xml.import_uid(pvalues[UID])
-            query = (table[UID] == uid)
-            original = db(query).select(limitby=(0, 1), *fields).first()
-            if original:
-                return original
-
-        # No match or multiple matches
-        return None
+        return pvalues
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -1570,7 +1570,12 @@ class S3Request(object):
                 table = db.table(tablename)
             customise = current.deployment_settings.customise_resource(tablename)
             if customise:
-                customise(self, tablename)
+                profiler = current.response.s3.profiler
+                if profiler:
+                    profiler.measure(profiler.CUSTOMISE, tablename,
+                                     customise, self, tablename)
+                else:
+                    customise(self, tablename)
         return
 
 # =============================================================================
@@ -30,6 +30,7 @@
 import sys
 import urllib, urllib2
 import datetime
+import gzip
 import time
 import traceback
 
@@ -69,6 +70,9 @@ if DEBUG:
 else:
     _debug = lambda m: None
 
+# Time format for page cursors (with microseconds)
+CURSOR_TFMT = "%Y-%m-%dT%H:%M:%S.%f"
+
 # =============================================================================
 class S3Sync(S3Method):
     """ Synchronization Handler """
@@ -200,6 +204,12 @@ class S3Sync(S3Method):
                       message=error)
             return False
 
+        # Fetch the data for independent pull tasks concurrently
+        workers = current.deployment_settings.get_base_sync_workers()
+        if workers > 1:
+            connector.prefetch([task for task in tasks if task.mode in (1, 3)],
+                               workers)
+
         success = True
         for task in tasks:
             
@@ -373,17 +383,35 @@ class S3Sync(S3Method):
         if not filters:
             filters = None
 
+        headers = current.response.headers
+
         # Export the resource
-        output = resource.export_xml(start=start,
-                                     limit=limit,
-                                     filters=filters,
-                                     msince=msince)
+        if "cursor" in _vars and limit:
+            # Keyset pagination
+            cursor = self.decode_cursor(_vars["cursor"])
+            output, cursor = self.export_page(resource,
+                                              msince=msince,
+                                              cursor=cursor,
+                                              limit=limit,
+                                              filters=filters)
+            headers["X-Sync-Cursor"] = self.encode_cursor(cursor)
+        else:
+            output = resource.export_xml(start=start,
+                                         limit=limit,
+                                         filters=filters,
+                                         msince=msince)
         count = resource.results
 
         # Set content type header
-        headers = current.response.headers
         headers["Content-Type"] = "text/xml"
 
+        # Compress the output if the peer accepts it
+        accept_encoding = current.request.env.http_accept_encoding
+        if accept_encoding and "gzip" in accept_encoding:
+            output = self.compress(output)
+            headers["Content-Encoding"] = "gzip"
+        headers["Accept-Encoding"] = "gzip"
+
         # Log the operation
         log = self.log
         log.write(repository_id=repository_id,
@@ -475,7 +503,17 @@ class S3Sync(S3Method):
         ignore_errors = True
 
         # Get the source
-        source = r.read_body()
+        content_encoding = r.env.http_content_encoding
+        if content_encoding and content_encoding.lower() == "gzip":
+            body = r.body
+            body.seek(0)
+            try:
+                source = StringIO(self.decompress(body.read()))
+            except IOError:
+                r.error(400, "Invalid gzip-encoded request body")
+        else:
+            source = r.read_body()
+        current.response.headers["Accept-Encoding"] = "gzip"
 
         # Import resource
         resource = r.resource
@@ -537,6 +575,137 @@ class S3Sync(S3Method):
 
         return output
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def export_page(resource, msince=None, cursor=None, limit=None,
+                    filters=None):
+        """
+            Export a page of records for synchronization, ordered by
+            modification date and record ID; the position of the page
+            is given by the last record of the previous page (cursor)
+            rather than by an offset, so that records which are modified
+            while paging through the resource can not shift the pages
+
+            @param resource: the S3Resource
+            @param msince: export only records modified after this datetime
+            @param cursor: the cursor returned for the previous page
+            @param limit: the page size
+            @param filters: sync filters, as dict {tablename: {url_var: string}}
+
+            @return: tuple (output, cursor), where cursor is None if this
+                     is the last page
+        """
+
+        table = resource.table
+        if "modified_on" in table.fields:
+            MTIME = table.modified_on
+            orderby = "%s ASC, %s ASC" % (MTIME, table._id)
+            if msince is not None:
+                # Same as the per-record check in the exporter, but
+                # skipping unmodified records must not consume the page
+                resource.add_filter(MTIME > msince)
+        else:
+            MTIME = None
+            orderby = "%s ASC" % table._id
+
+        if cursor:
+            mtime, record_id = cursor
+            if MTIME is not None and mtime is not None:
+                query = (MTIME > mtime) | \
+                        ((MTIME == mtime) & (table._id > record_id))
+            else:
+                query = (table._id > record_id)
+            resource.add_filter(query)
+
+        output = resource.export_xml(limit=limit,
+                                     msince=msince,
+                                     filters=filters,
+                                     orderby=orderby)
+
+        rows = resource._rows
+        if limit and rows and len(rows) >= limit:
+            last = rows[-1]
+            mtime = last.modified_on if MTIME is not None else None
+            cursor = (mtime, last[table._id.name])
+        else:
+            cursor = None
+
+        return output, cursor
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def encode_cursor(cursor):
+        """
+            Encode a page cursor for transmission
+
+            @param cursor: tuple (modified_on, record ID), or None
+            @return: the cursor as string (empty string for None)
+        """
+
+        if not cursor:
+            return ""
+        mtime, record_id = cursor
+        if mtime is not None:
+            mtime = mtime.strftime(CURSOR_TFMT)
+        else:
+            mtime = ""
+        return "%s|%s" % (mtime, record_id)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def decode_cursor(value):
+        """
+            Decode a page cursor
+
+            @param value: the cursor string (as sent to the peer)
+            @return: tuple (modified_on, record ID), or None
+        """
+
+        if not value or "|" not in value:
+            return None
+        mtime, record_id = value.rsplit("|", 1)
+        try:
+            record_id = long(record_id)
+            if mtime:
+                mtime = datetime.datetime.strptime(mtime, CURSOR_TFMT)
+            else:
+                mtime = None
+        except ValueError:
+            return None
+        return (mtime, record_id)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def compress(data):
+        """
+            Compress data for transmission (gzip content-encoding)
+
+            @param data: the data (str)
+        """
+
+        stream = StringIO()
+        f = gzip.GzipFile(fileobj=stream, mode="wb")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        return stream.getvalue()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def decompress(data):
+        """
+            Decompress gzip-encoded data
+
+            @param data: the compressed data (str)
+        """
+
+        f = gzip.GzipFile(fileobj=StringIO(data), mode="rb")
+        try:
+            return f.read()
+        finally:
+            f.close()
+
     # -------------------------------------------------------------------------
     def onconflict(self, item, repository, resource):
         """
@@ -843,6 +1012,18 @@ class S3SyncBaseAdapter(object):
 
         raise NotImplementedError
 
+    # -------------------------------------------------------------------------
+    def prefetch(self, tasks, workers):
+        """
+            Start fetching the data for the pull tasks in the background,
+            to be overridden by adapters which support it
+
+            @param tasks: the sync_task Rows
+            @param workers: the maximum number of concurrent requests
+        """
+
+        pass
+
     # -------------------------------------------------------------------------
     def push(self, task):
 
@@ -54,7 +54,7 @@ except ImportError:
     except:
         import gluon.contrib.simplejson as json # fallback to pure-Python module
 
-from gluon import current, HTTP, IS_EMPTY_OR
+from gluon import current, IS_EMPTY_OR
 from gluon.storage import Storage
 
 from s3utils import S3DateTime
@@ -67,6 +67,19 @@ class S3Task(object):
 
     TASK_TABLENAME = "scheduler_task"
 
+    # Task to run batches of calls (see enqueue)
+    BATCH = "s3task_batch"
+    # Maximum number of calls per batch
+    BATCH_SIZE = 500
+    # Maximum timeout (in seconds) for a batch
+    BATCH_TIMEOUT = 3600
+
+    # Priorities: seconds to move a task ahead in the queue
+    PRIORITY = Storage(HIGH = 3600,
+                       NORMAL = 0,
+                       LOW = -60,
+                       )
+
     # -------------------------------------------------------------------------
     def __init__(self):
 
@@ -224,7 +237,14 @@ class S3Task(object):
     # -------------------------------------------------------------------------
     # API Function run within the main flow of the application
     # -------------------------------------------------------------------------
-    def async(self, task, args=[], vars={}, timeout=300):
+    def async(self,
+              task,
+              args=[],
+              vars={},
+              timeout=300,
+              priority=None,
+              coalesce=False,
+              batch=False):
         """
             Wrapper to call an asynchronous task.
             - run from the main request
@@ -235,6 +255,14 @@ class S3Task(object):
             @param vars: The list of named vars to send to the function
             @param timeout: The length of time available for the task to complete
                             - default 300s (5 mins)
+            @param priority: move the task this number of seconds ahead
+                             in the queue (negative numbers to defer it),
+                             see PRIORITY
+            @param coalesce: don't queue the task if an identical task
+                             (same args and vars) is already queued, but
+                             return the ID of the queued task instead
+            @param batch: add the call to a queued batch of calls of the
+                          same task (see enqueue)
         """
 
         # Check that task is defined
@@ -247,42 +275,227 @@ class S3Task(object):
         # Check that worker is alive
         if not self._is_alive():
             # Run the task synchronously
-            _args = []
-            for arg in args:
-                if isinstance(arg, (int, long, float)):
-                    _args.append(str(arg))
-                elif isinstance(arg, basestring):
-                    _args.append("%s" % str(json.dumps(arg)))
-                else:
-                    raise HTTP(501, "Unhandled arg type")
-            args = ",".join(_args)
-            _vars = ",".join(["%s=%s" % (str(var),
-                                         str(vars[var])) for var in vars])
-            if args:
-                statement = "tasks['%s'](%s,%s)" % (task, args, _vars)
-            else:
-                statement = "tasks['%s'](%s)" % (task, _vars)
-            # Handle JSON
-            null = None
-            exec(statement)
+            tasks[task](*args, **self._vars(vars))
             return None
 
+        vars = dict(vars)
         auth = current.auth
         if auth.is_logged_in():
             # Add the current user to the vars
             vars["user_id"] = auth.user.id
 
+        if batch:
+            return self._enqueue(task, [(args, vars)], timeout, priority)
+
+        db = current.db
+        ttable = db.scheduler_task
+
+        if coalesce:
+            _args = json.dumps(args)
+            _vars = json.dumps(vars, sort_keys=True)
+            query = (ttable.function_name == task) & \
+                    (ttable.args == _args) & \
+                    (ttable.vars == _vars) & \
+                    (ttable.status == "QUEUED")
+            row = db(query).select(ttable.id, limitby=(0, 1)).first()
+            if row:
+                return row.id
+        else:
+            _args = json.dumps(args)
+            _vars = json.dumps(vars)
+
+        kwargs = {}
+        if priority:
+            kwargs["next_run_time"] = datetime.datetime.now() - \
+                                      datetime.timedelta(seconds=priority)
+
         # Run the task asynchronously
-        record = current.db.scheduler_task.insert(application_name="%s/default" % current.request.application,
-                                                  task_name=task,
-                                                  function_name=task,
-                                                  args=json.dumps(args),
-                                                  vars=json.dumps(vars),
-                                                  timeout=timeout)
+        record = ttable.insert(application_name="%s/default" % current.request.application,
+                               task_name=task,
+                               function_name=task,
+                               args=_args,
+                               vars=_vars,
+                               timeout=timeout,
+                               **kwargs)
 
         # Return record so that status can be polled
         return record
 
+    # -------------------------------------------------------------------------
+    def enqueue(self, task, calls, timeout=300, priority=None):
+        """
+            Queue multiple calls of a task to be run in batches by a
+            single worker job (see run_batch) - identical calls are
+            only run once per batch
+            - run from the main request
+
+            @param task: The function which should be run
+            @param calls: list of calls, each call either a list of args
+                          or a tuple (args, vars)
+            @param timeout: The length of time available for each call
+                            to complete - default 300s (5 mins)
+            @param priority: move the batch this number of seconds ahead
+                             in the queue, see async
+
+            @return: the scheduler_task record ID of the (last) batch,
+                     None if the calls have been run synchronously,
+                     False if the task is not defined
+        """
+
+        # Check that task is defined
+        tasks = current.response.s3.tasks
+        if not tasks:
+            return False
+        if task not in tasks:
+            return False
+
+        user_id = None
+        auth = current.auth
+        if auth.is_logged_in():
+            user_id = auth.user.id
+
+        items = []
+        for call in calls:
+            if isinstance(call, tuple):
+                args, vars = call
+            else:
+                args, vars = call, {}
+            items.append((list(args), dict(vars)))
+
+        # Check that worker is alive
+        if not self._is_alive():
+            # Run the calls synchronously
+            function = tasks[task]
+            for args, vars in items:
+                function(*args, **self._vars(vars))
+            return None
+
+        if user_id:
+            for args, vars in items:
+                # Add the current user to the vars
+                vars["user_id"] = user_id
+
+        return self._enqueue(task, items, timeout, priority)
+
+    # -------------------------------------------------------------------------
+    def _enqueue(self, task, calls, timeout, priority):
+        """
+            Add calls to a queued batch of the task, or queue a new batch
+
+            @param task: the task name
+            @param calls: list of tuples (args, vars)
+            @param timeout: the timeout for each call
+            @param priority: the priority (see async)
+
+            @return: the scheduler_task record ID of the (last) batch
+        """
+
+        db = current.db
+        ttable = db.scheduler_task
+
+        task_name = "%s:%s" % (self.BATCH, task)
+        query = (ttable.task_name == task_name) & \
+                (ttable.status == "QUEUED")
+        # Lock the queued batch, so that concurrent requests can't
+        # overwrite each other's calls (not supported by all databases,
+        # so _store_batch also checks that the batch is still queued)
+        row = db(query).select(ttable.id,
+                               ttable.vars,
+                               orderby=~ttable.id,
+                               limitby=(0, 1),
+                               for_update=True).first()
+        if row:
+            pending = json.loads(row.vars).get("calls", [])
+        else:
+            pending = []
+
+        dumps = lambda call: json.dumps(call, sort_keys=True)
+        seen = set(dumps(call) for call in pending)
+
+        batch_size = self.BATCH_SIZE
+        record_id = None
+        for args, vars in calls:
+            call = [args, vars]
+            key = dumps(call)
+            if key in seen:
+                # Coalesce with the queued call
+                continue
+            if len(pending) >= batch_size:
+                record_id = self._store_batch(row, task, pending,
+                                              timeout, priority)
+                if record_id is None:
+                    # Batch picked up by a worker in the meantime, start
+                    # over (nothing else has been stored yet)
+                    return self._enqueue(task, calls, timeout, priority)
+                row = None
+                pending = []
+                seen = set()
+            pending.append(call)
+            seen.add(key)
+
+        if pending:
+            record_id = self._store_batch(row, task, pending,
+                                          timeout, priority)
+            if record_id is None:
+                # Batch picked up by a worker in the meantime
+                return self._enqueue(task, calls, timeout, priority)
+        elif row:
+            record_id = row.id
+
+        return record_id
+
+    # -------------------------------------------------------------------------
+    def _store_batch(self, row, task, calls, timeout, priority):
+        """
+            Store a batch of calls in the scheduler_task table
+
+            @param row: the queued batch record (to update), or None
+                        to insert a new batch
+            @param task: the task name
+            @param calls: all calls of the batch
+            @param timeout: the timeout for each call
+            @param priority: the priority (see async)
+
+            @return: the scheduler_task record ID, or None if the batch
+                     to update is no longer queued
+        """
+
+        vars = json.dumps({"calls": calls})
+        # Most calls take much less than their timeout, so allow
+        # at most BATCH_TIMEOUT for the whole batch
+        timeout = min(timeout * len(calls), max(timeout, self.BATCH_TIMEOUT))
+        if row:
+            ttable = current.db.scheduler_task
+            query = (ttable.id == row.id) & \
+                    (ttable.status == "QUEUED")
+            if current.db(query).update(vars=vars, timeout=timeout):
+                return row.id
+            return None
+
+        kwargs = {}
+        if priority:
+            kwargs["next_run_time"] = datetime.datetime.now() - \
+                                      datetime.timedelta(seconds=priority)
+        ttable = current.db.scheduler_task
+        return ttable.insert(application_name="%s/default" % current.request.application,
+                             task_name="%s:%s" % (self.BATCH, task),
+                             function_name=self.BATCH,
+                             args=json.dumps([task]),
+                             vars=vars,
+                             timeout=timeout,
+                             **kwargs)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _vars(vars):
+        """
+            Convert the vars for a task call into keyword arguments
+
+            @param vars: the vars (dict)
+        """
+
+        return dict((str(k), v) for k, v in vars.items())
+
     # -------------------------------------------------------------------------
     def schedule_task(self,
                       task,
@@ -449,9 +662,117 @@ class S3Task(object):
         if task:
             task.update_record(status="QUEUED")
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def metrics():
+        """
+            Get queue metrics for monitoring
+            - run from the main request
+
+            @return: dict with
+                     depth: number of queued tasks per task name
+                     wait: seconds the oldest queued task is overdue
+                     latency: average seconds between scheduled time and
+                              start of the tasks run within the last hour
+                     duration: average run time of these tasks in seconds
+        """
+
+        db = current.db
+        ttable = db.scheduler_task
+        rtable = db.scheduler_run
+
+        now = datetime.datetime.now()
+
+        # Queue depth
+        count = ttable.id.count()
+        query = (ttable.status == "QUEUED")
+        rows = db(query).select(ttable.function_name,
+                                count,
+                                groupby=ttable.function_name)
+        depth = dict((row[ttable.function_name], row[count]) for row in rows)
+
+        # Longest wait
+        oldest = ttable.next_run_time.min()
+        row = db(query & (ttable.next_run_time <= now)).select(oldest).first()
+        if row and row[oldest]:
+            delta = now - row[oldest]
+            wait = delta.days * 86400 + delta.seconds
+        else:
+            wait = 0
+
+        # Latency and duration of recent runs
+        query = (rtable.task_id == ttable.id) & \
+                (rtable.start_time > now - datetime.timedelta(hours=1))
+        rows = db(query).select(ttable.next_run_time,
+                                ttable.period,
+                                rtable.start_time,
+                                rtable.stop_time)
+        latencies = []
+        durations = []
+        seconds = lambda delta: delta.days * 86400 + delta.seconds + \
+                                delta.microseconds / 1000000.0
+        for row in rows:
+            task = row[ttable._tablename]
+            run = row[rtable._tablename]
+            if not task.period or task.next_run_time <= run.start_time:
+                # For one-off tasks, next_run_time is the scheduled time
+                latencies.append(seconds(run.start_time - task.next_run_time))
+            if run.stop_time:
+                durations.append(seconds(run.stop_time - run.start_time))
+        average = lambda values: sum(values) / len(values) if values else None
+
+        return {"depth": depth,
+                "wait": wait,
+                "latency": average(latencies),
+                "duration": average(durations),
+                }
+
     # =========================================================================
     # Functions run within the Task itself
     # =========================================================================
+    @staticmethod
+    def run_batch(task, calls):
+        """
+            Run a batch of calls of a task (see enqueue)
+            - run from within the task
+
+            @param task: the task name
+            @param calls: list of calls [args, vars]
+
+            @return: dict with the number of calls, failed calls and
+                     the total run time
+        """
+
+        db = current.db
+        auth = current.auth
+
+        function = current.response.s3.tasks.get(task)
+        if not function:
+            raise ValueError("Undefined task: %s" % task)
+
+        start = datetime.datetime.now()
+        failed = 0
+        for args, vars in calls:
+            vars = S3Task._vars(vars)
+            if "user_id" not in vars:
+                auth.s3_impersonate(None)
+            try:
+                function(*args, **vars)
+            except Exception, e:
+                db.rollback()
+                failed += 1
+                current.log.error("Task %s failed" % task, value=e)
+            else:
+                db.commit()
+        duration = datetime.datetime.now() - start
+
+        return {"task": task,
+                "calls": len(calls),
+                "failed": failed,
+                "duration": duration.seconds +
+                            duration.microseconds / 1000000.0,
+                }
+
     def authenticate(self, user_id):
         """
             Activate the authentication passed from the caller to this new request
@@ -340,6 +340,49 @@ def s3_set_default_filter(selector, value, tablename=None):
     filter_defaults[selector] = value
     return
     
+# =============================================================================
+def s3_append_callback(tablename, keys, callback):
+    """
+        Append a callback to the existing callbacks of a table (e.g.
+        onaccept/ondelete) in the model configuration, without
+        replacing them
+
+        @param tablename: the tablename
+        @param keys: the configuration keys of the callbacks to extend,
+                     missing onaccept/ondelete callbacks are added
+        @param callback: the callback
+    """
+
+    config = current.model.config
+    if tablename not in config:
+        config[tablename] = Storage()
+    config = config[tablename]
+
+    for key in keys:
+        actions = config.get(key)
+        if actions is None:
+            if key in ("onaccept", "ondelete"):
+                config[key] = callback
+            continue
+        if isinstance(actions, dict):
+            # Component callbacks (per tablename)
+            actions = actions.get(tablename)
+            if actions is None:
+                continue
+        if actions is callback:
+            continue
+        if isinstance(actions, (list, tuple)):
+            if callback in actions:
+                continue
+            actions = list(actions) + [callback]
+        else:
+            actions = [actions, callback]
+        if isinstance(config[key], dict):
+            config[key][tablename] = actions
+        else:
+            config[key] = actions
+    return
+
 # =============================================================================
 def s3_dev_toolbar():
     """
@@ -1177,7 +1220,7 @@ def s3_flatlist(nested):
             yield item
 
 # =============================================================================
-def s3_orderby_fields(table, orderby, expr=False):
+def s3_orderby_fields(table, orderby, expr=False, skip=True):
     """
         Introspect and yield all fields involved in a DAL orderby
         expression.
@@ -1186,6 +1229,8 @@ def s3_orderby_fields(table, orderby, expr=False):
         @param orderby: the orderby expression
         @param expr: True to yield asc/desc expressions as they are,
                      False to yield only Fields
+        @param skip: False to yield None for items which can not be
+                     resolved into fields, rather than skipping them
     """
 
     if not orderby:
@@ -1205,7 +1250,7 @@ def s3_orderby_fields(table, orderby, expr=False):
                 return expand(e.first) + expand(e.second)
             elif e.op == INVERT:
                 return [e] if expr else [e.first]
-            return []
+            return [] if skip else [e]
         items = expand(orderby)
     elif not isinstance(orderby, (list, tuple)):
         items = [orderby]
@@ -1217,6 +1262,8 @@ def s3_orderby_fields(table, orderby, expr=False):
     for item in items:
         if type(item) is Expression:
             if not isinstance(item.first, Field):
+                if not skip:
+                    yield None
                 continue
             f = item if expr else item.first
         elif isinstance(item, Field):
@@ -1228,16 +1275,22 @@ def s3_orderby_fields(table, orderby, expr=False):
                 try:
                     f = s3db.table(tn)[fn]
                 except (AttributeError, KeyError):
+                    if not skip:
+                        yield None
                     continue
             else:
                 if current.response.s3.debug:
                     raise SyntaxError('Tablename prefix required for orderby="%s"' % item)
                 else:
                     # Ignore
+                    if not skip:
+                        yield None
                     continue
             if expr and direction[:3] == "des":
                 f = ~f
         else:
+            if not skip:
+                yield None
             continue
         yield f
 
@@ -1442,6 +1495,85 @@ def s3_jaro_winkler(str1, str2):
         wn = 1.0
     return wn
 
+# =============================================================================
+def s3_jaro_winkler_similarity(str1, str2):
+    """
+        Return Jaro_Winkler similarity of two strings (between 0.0 and 1.0),
+        using the standard matching of common characters (each character
+        can match only once), for ranking in the person name index - unlike
+        s3_jaro_winkler, which is kept for the existing duplicate checks
+
+        @see http://en.wikipedia.org/wiki/Jaro-Winkler_distance
+
+        @param str1: the first string
+        @param str2: the second string
+    """
+
+    if (str1 == str2):
+        return 1.0
+
+    if str1 is None or str2 is None:
+        return 0.0
+
+    if not isinstance(str1, basestring):
+        str1 = s3_unicode(str1)
+    if not isinstance(str2, basestring):
+        str2 = s3_unicode(str2)
+
+    len1 = len(str1)
+    len2 = len(str2)
+    if not len1 or not len2:
+        return 0.0
+    halflen = max(max(len1, len2) / 2 - 1, 0)
+
+    # Find the common characters (within halflen of each other)
+    assigned1 = [False] * len1
+    assigned2 = [False] * len2
+    common = 0
+    for i in xrange(len1):
+        char = str1[i]
+        start = max(0, i - halflen)
+        end = min(i + halflen + 1, len2)
+        for j in xrange(start, end):
+            if not assigned2[j] and str2[j] == char:
+                assigned1[i] = assigned2[j] = True
+                common += 1
+                break
+    if not common:
+        return 0.0
+
+    # Compute number of transpositions
+    transposition = 0
+    j = 0
+    for i in xrange(len1):
+        if assigned1[i]:
+            while not assigned2[j]:
+                j += 1
+            if str1[i] != str2[j]:
+                transposition += 1
+            j += 1
+    transposition = transposition / 2.0
+
+    # Compute number of characters common to beginning of both strings,
+    # for Jaro-Winkler distance
+    same = 0
+    for i in xrange(min(len1, len2, 4)):
+        if str1[i] != str2[i]:
+            break
+        same += 1
+
+    common = float(common)
+    w = 1. / 3. * (common / len1 + \
+                   common / len2 + \
+                   (common - transposition) / common)
+
+    wn = w + same * 0.1 * (1.0 - w)
+    if (wn < 0.0):
+        wn = 0.0
+    elif (wn > 1.0):
+        wn = 1.0
+    return wn
+
 # =============================================================================
 def s3_jaro_winkler_distance_row(row1, row2):
     """
@@ -2403,6 +2535,162 @@ class S3MultiPath:
             else:
                 return False
 
+# =============================================================================
+class S3SearchKey(object):
+    """
+        Normalized (lower-case, unaccented) search keys for the names
+        of records in lookup tables (e.g. organisations, locations),
+        stored in s3_search_key, to answer autocomplete requests with
+        an indexed prefix query instead of a LIKE-scan of the table.
+
+        Maintained in the onaccept/ondelete of the respective table if
+        settings.search.key_index is enabled, use rebuild() to index
+        existing records.
+    """
+
+    # Maximum length of a key (longer texts are indexed by their start)
+    LENGTH = 128
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def normalize(cls, text):
+        """
+            Normalize a text for indexing and lookup
+
+            @param text: the text
+            @return: the normalized text (unicode)
+        """
+
+        if not text:
+            return u""
+
+        import unicodedata
+
+        text = unicodedata.normalize("NFKD", s3_unicode(text).lower())
+        text = u"".join(c for c in text if not unicodedata.combining(c))
+        return text.strip()[:cls.LENGTH]
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def update(cls, table, record_ids, fieldnames):
+        """
+            Update the search keys for records
+
+            @param table: the Table
+            @param record_ids: a record ID or list of record IDs
+            @param fieldnames: names of the fields to index the records by
+        """
+
+        if not isinstance(record_ids, (list, tuple, set)):
+            record_ids = [record_ids]
+        if not record_ids:
+            return
+
+        db = current.db
+        ktable = current.s3db.s3_search_key
+        tablename = table._tablename
+
+        query = (ktable.tablename == tablename) & \
+                (ktable.record_id.belongs(record_ids))
+        db(query).delete()
+
+        query = (table._id.belongs(record_ids))
+        if "deleted" in table.fields:
+            query &= (table.deleted != True)
+        fields = [table._id] + [table[fn] for fn in fieldnames]
+        rows = db(query).select(*fields)
+        cls._index(table, rows, fieldnames)
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def rebuild(cls, table, fieldnames, chunk_size=1000):
+        """
+            Rebuild the search keys for all records in a table
+
+            @param table: the Table
+            @param fieldnames: names of the fields to index the records by
+            @param chunk_size: number of records to index per query
+        """
+
+        db = current.db
+        ktable = current.s3db.s3_search_key
+
+        db(ktable.tablename == table._tablename).delete()
+
+        pkey = table._id
+        fields = [pkey] + [table[fn] for fn in fieldnames]
+        last_id = 0
+        while True:
+            query = (pkey > last_id)
+            if "deleted" in table.fields:
+                query &= (table.deleted != True)
+            rows = db(query).select(orderby=pkey,
+                                    limitby=(0, chunk_size),
+                                    *fields)
+            if not rows:
+                break
+            cls._index(table, rows, fieldnames)
+            last_id = rows.last()[pkey.name]
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _index(cls, table, rows, fieldnames):
+        """
+            Write the search keys for rows
+
+            @param table: the Table
+            @param rows: the Rows
+            @param fieldnames: names of the fields to index the rows by
+        """
+
+        tablename = table._tablename
+        pkey = table._id.name
+        normalize = cls.normalize
+
+        records = []
+        append = records.append
+        for row in rows:
+            record_id = row[pkey]
+            keys = set()
+            for fn in fieldnames:
+                key = normalize(row[fn])
+                if key and key not in keys:
+                    keys.add(key)
+                    append({"tablename": tablename,
+                            "record_id": record_id,
+                            "search_key": key,
+                            })
+        if records:
+            current.s3db.s3_search_key.bulk_insert(records)
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def query(cls, table, prefix, field=None):
+        """
+            Query for records with a search key starting with prefix,
+            resolved by a sub-select from s3_search_key
+
+            @param table: the indexed Table
+            @param prefix: the prefix (will be normalized)
+            @param field: the Field to match the record IDs against
+                          (defaults to the primary key of table), e.g.
+                          a foreign key in a link table
+
+            @return: a Query
+        """
+
+        if field is None:
+            field = table._id
+        tablename = table._tablename
+
+        ktable = current.s3db.s3_search_key
+        query = (ktable.tablename == tablename) & \
+                (ktable.search_key.like(cls.normalize(prefix) + "%"))
+        return field.belongs(current.db(query)._select(ktable.record_id))
+
 # =============================================================================
 class S3MarkupStripper(HTMLParser.HTMLParser):
     """ Simple markup stripper """
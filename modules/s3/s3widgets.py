@@ -72,6 +72,7 @@ __all__ = ["S3ACLWidget",
            "s3_comments_widget",
            "s3_richtext_widget",
            "search_ac",
+           "search_ac_select",
            ]
 
 import datetime
@@ -5885,21 +5886,12 @@ def search_ac(r, **attr):
 
     resource.add_filter(query)
 
-    output = None
-    if filter == "~":
-        MAX_SEARCH_RESULTS = current.deployment_settings.get_search_max_results()
-        if (not limit or limit > MAX_SEARCH_RESULTS) and \
-           resource.count() > MAX_SEARCH_RESULTS:
-            output = json.dumps([
-                dict(label=str(current.T("There are more than %(max)s results, please input more characters.") % dict(max=MAX_SEARCH_RESULTS)))
-                ], separators=SEPARATORS)
-
+    rows, output = search_ac_select(resource, fields,
+                                    limit=limit,
+                                    check=filter == "~",
+                                    orderby=field,
+                                    as_rows=True)
     if output is None:
-        rows = resource.select(fields,
-                               start=0,
-                               limit=limit,
-                               orderby=field,
-                               as_rows=True)
         output = []
         append = output.append
         for row in rows:
@@ -5911,4 +5903,42 @@ def search_ac(r, **attr):
     current.response.headers["Content-Type"] = "application/json"
     return json.dumps(output, separators=SEPARATORS)
 
+# =============================================================================
+def search_ac_select(resource, fields, limit=None, check=True, **attr):
+    """
+        Select the matches for an autocomplete search: rather than counting
+        the matches in a separate query, this retrieves one more row than
+        the maximum number of results, to detect whether there are too many
+
+        @param resource: the S3Resource (filtered)
+        @param fields: the fields to select
+        @param limit: the limit requested by the client (0/None for default)
+        @param check: whether to check for too many results
+        @param attr: further keyword arguments for S3Resource.select
+
+        @return: tuple (rows, message), where message is None or - if
+                 there are too many results - a list with the message to
+                 return to the client instead of the rows
+    """
+
+    MAX_SEARCH_RESULTS = current.deployment_settings.get_search_max_results()
+    if check and (not limit or limit > MAX_SEARCH_RESULTS):
+        select_limit = MAX_SEARCH_RESULTS + 1
+    else:
+        select_limit = limit
+        check = False
+
+    data = resource.select(fields, start=0, limit=select_limit, **attr)
+    if attr.get("as_rows"):
+        rows = data
+    else:
+        rows = data["rows"]
+
+    if check and len(rows) > MAX_SEARCH_RESULTS:
+        message = [
+            dict(label=str(current.T("There are more than %(max)s results, please input more characters.") % dict(max=MAX_SEARCH_RESULTS)))
+            ]
+        return None, message
+    return rows, None
+
 # END =========================================================================
@@ -214,6 +214,9 @@ class S3XML(S3Codec):
         self.show_ids = False
         self.show_urls = True
 
+        # Geometries looked up by gis_encode
+        self.geometries = {}
+
     # XML+XSLT tools ==========================================================
     #
     def parse(self, source):
@@ -239,6 +242,61 @@ class S3XML(S3Codec):
             self.error = e
             return None
 
+    # -------------------------------------------------------------------------
+    def iterparse(self, source, chunk_size=1000):
+        """
+            Parse an XML source incrementally, in chunks of elements
+            at the first level below the root element (i.e. top-level
+            <resource> elements), so that the whole document never needs
+            to be held in memory
+
+            @param source: the XML source (file-like object or filename)
+            @param chunk_size: the maximum number of elements per chunk
+
+            @return: generator of element trees, each with a copy of the
+                     root element with up to chunk_size child elements;
+                     parse errors terminate the generator and set
+                     self.error
+        """
+
+        self.error = None
+
+        root = None
+        chunk = None
+        depth = 0
+        count = 0
+        chunks = 0
+        try:
+            for event, element in etree.iterparse(source,
+                                                  events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if root is None:
+                        root = element
+                    continue
+                depth -= 1
+                if depth != 1:
+                    continue
+                if chunk is None:
+                    chunk = etree.Element(root.tag, attrib=dict(root.attrib))
+                # Move the element from the parsed document into the chunk
+                chunk.append(element)
+                count += 1
+                if count == chunk_size:
+                    yield etree.ElementTree(chunk)
+                    chunk = None
+                    count = 0
+                    chunks += 1
+        except etree.XMLSyntaxError:
+            self.error = sys.exc_info()[1]
+            return
+        if chunk is not None:
+            yield etree.ElementTree(chunk)
+        elif root is not None and not chunks:
+            # Empty document
+            yield etree.ElementTree(etree.Element(root.tag,
+                                                  attrib=dict(root.attrib)))
+
     # -------------------------------------------------------------------------
     def transform(self, tree, stylesheet_path, **args):
         """
@@ -766,7 +824,6 @@ class S3XML(S3Codec):
             @param master: True if this is the master resource
         """
 
-        db = current.db
         gis = current.gis
         auth = current.auth
         request = current.request
@@ -819,46 +876,16 @@ class S3XML(S3Codec):
                                 _attr = "[%s]=[%s]" % (a, attrs[a])
                         if _attr:
                             attr[ATTRIBUTE.attributes] = _attr
-            elif tablename in wkts:
-                # Nothing gets here currently
-                # tbc: KML Polygons (or we should also do these outside XSLT)
-                wkt = wkts[tablename][record_id]
-                # Convert the WKT in XSLT
-                attr[ATTRIBUTE.wkt] = wkt
             else:
-                # Lookup record by record :/
-                query = (table._id == record_id)
-                #fields = []
-                #fappend = fields.append
-                #for f in table.fields:
-                #    if f not in ("id", "layer_id", "lat", "lon", "wkt"):
-                #        fappend(f)
-                if settings.get_gis_spatialdb():
-                    # Do the Simplify direct from the DB
-                    #fields.remove("the_geom")
-                    #_fields = [table[f] for f in fields]
-                    row = db(query).select(table.the_geom.st_simplify(0.01).st_astext().with_alias("wkt"),
-                                           #*_fields,
-                                           limitby=(0, 1)).first()
-                    if row:
-                        # Convert the WKT in XSLT
-                        attr[ATTRIBUTE.wkt] = row.wkt
-                        # Locate the attributes
-                        #row = row[tablename]
+                if tablename in wkts:
+                    wkt = wkts[tablename].get(record_id, None)
                 else:
-                    # _fields = [table[f] for f in fields]
-                    row = db(query).select(table[WKTFIELD],
-                                           #*_fields,
-                                           limitby=(0, 1)).first()
-                    if row:
-                        wkt = row[WKTFIELD]
-                        if wkt:
-                            # Simplify the polygon to reduce download size
-                            # & also to work around the recursion limit in libxslt
-                            # http://blog.gmane.org/gmane.comp.python.lxml.devel/day=20120309
-                            wkt = gis.simplify(wkt)
-                            # Convert the WKT in XSLT
-                            attr[ATTRIBUTE.wkt] = wkt
+                    # Not pre-fetched => lookup all records in bulk
+                    wkt = self.get_geometry(resource, table, table._id.name,
+                                            record_id, polygons=True)
+                if wkt:
+                    # Convert the WKT in XSLT
+                    attr[ATTRIBUTE.wkt] = wkt
 
             # End: Shapefile data
             return
@@ -872,17 +899,32 @@ class S3XML(S3Codec):
                 if geojson:
                     geometry = etree.SubElement(element, "geometry")
                     geometry.set("value", geojson)
-                    #if tablename in attributes:
-                    #    # Add Attributes
-                    #    _attr = ""
-                    #    attrs = attributes[tablename][record_id]
-                    #    for a in attrs:
-                    #        if _attr:
-                    #            _attr = "%s,[%s]=[%s]" % (_attr, a, attrs[a])
-                    #        else:
-                    #            _attr = "[%s]=[%s]" % (a, attrs[a])
-                    #    if _attr:
-                    #        attr[ATTRIBUTE.attributes] = _attr
+            elif tablename in wkts:
+                # These have been looked-up in bulk
+                wkt = wkts[tablename].get(record_id, None)
+                if wkt:
+                    # Convert the WKT in XSLT
+                    attr[ATTRIBUTE.wkt] = wkt
+            elif tablename not in latlons:
+                # Not pre-fetched => lookup all records in bulk
+                wkt = self.get_geometry(resource, table, table._id.name,
+                                        record_id, polygons=True)
+                if wkt:
+                    # Convert the WKT in XSLT
+                    attr[ATTRIBUTE.wkt] = wkt
+
+            if locations:
+                #if tablename in attributes:
+                #    # Add Attributes
+                #    _attr = ""
+                #    attrs = attributes[tablename][record_id]
+                #    for a in attrs:
+                #        if _attr:
+                #            _attr = "%s,[%s]=[%s]" % (_attr, a, attrs[a])
+                #        else:
+                #            _attr = "[%s]=[%s]" % (a, attrs[a])
+                #    if _attr:
+                #        attr[ATTRIBUTE.attributes] = _attr
                 if tablename in tooltips:
                     # Retrieve the HTML for the onHover Tooltip
                     tooltip = tooltips[tablename][record_id]
@@ -903,37 +945,6 @@ class S3XML(S3Codec):
                 url = "%s/%i.plain" % (url, record_id)
                 attr[ATTRIBUTE.popup_url] = url
 
-            elif tablename in wkts:
-                # Nothing gets here currently
-                # tbc: KML Polygons (or we should also do these outside XSLT)
-                wkt = wkts[tablename][record_id]
-                # Convert the WKT in XSLT
-                attr[ATTRIBUTE.wkt] = wkt
-            else:
-                # Lookup record by record :/
-                query = (table._id == record_id)
-                if settings.get_gis_spatialdb():
-                    # Do the Simplify direct from the DB
-                    row = db(query).select(table.the_geom.st_simplify(0.01).st_astext().with_alias("wkt"),
-                                           limitby=(0, 1)).first()
-                    if row:
-                        # Convert the WKT in XSLT
-                        attr[ATTRIBUTE.wkt] = row.wkt
-                        # Locate the attributes
-                        #row = row[tablename]
-                else:
-                    row = db(query).select(table[WKTFIELD],
-                                           limitby=(0, 1)).first()
-                    if row:
-                        wkt = row[WKTFIELD]
-                        if wkt:
-                            # Simplify the polygon to reduce download size
-                            # & also to work around the recursion limit in libxslt
-                            # http://blog.gmane.org/gmane.comp.python.lxml.devel/day=20120309
-                            wkt = gis.simplify(wkt)
-                            # Convert the WKT in XSLT
-                            attr[ATTRIBUTE.wkt] = wkt
-
             if format == "kml":
                 # GIS marker
                 marker = current.gis.get_marker() # Default Marker
@@ -1019,65 +1030,38 @@ class S3XML(S3Codec):
                     geometry = etree.SubElement(element, "geometry")
                     geometry.set("value", geojson)
             elif tablename in wkts:
-                # Nothing gets here currently
-                # tbc: KML Polygons (or we should also do these outside XSLT)
                 polygon = True
-                wkt = wkts[tablename][record_id]
-                # Convert the WKT in XSLT
-                attr[ATTRIBUTE.wkt] = wkt
+                wkt = wkts[tablename].get(record_id, None)
+                if wkt:
+                    # Convert the WKT in XSLT
+                    attr[ATTRIBUTE.wkt] = wkt
             elif "polygons" in request.get_vars:
-                # Calculate the Polygons 1/feature since we didn't do it earlier
-                # - no current case for this
+                # Polygons have not been pre-fetched
+                # => lookup for all records in bulk
                 if WKTFIELD in fields:
-                    query = (ktable._id == r_id)
-                    if settings.get_gis_spatialdb():
-                        if format == "geojson":
-                            # Do the Simplify & GeoJSON direct from the DB
-                            row = db(query).select(ktable.the_geom.st_simplify(0.01).st_asgeojson(precision=4).with_alias("geojson"),
-                                                   limitby=(0, 1)).first()
-                            if row:
-                                # Output the GeoJSON directly into the XML, so that XSLT can simply drop in
-                                geometry = etree.SubElement(element, "geometry")
-                                geometry.set("value", row.geojson)
-                                polygon = True
-                        else:
-                            # Do the Simplify direct from the DB
-                            row = db(query).select(ktable.the_geom.st_simplify(0.01).st_astext().with_alias("wkt"),
-                                                   limitby=(0, 1)).first()
-                            if row:
-                                # Convert the WKT in XSLT
-                                attr[ATTRIBUTE.wkt] = row.wkt
-                                polygon = True
+                    if format == "geojson":
+                        geojson = self.get_geometry(resource, ktable, r.field,
+                                                    r_id, polygons=True,
+                                                    output="geojson")
+                        if geojson:
+                            # Output the GeoJSON directly into the XML, so that XSLT can simply drop in
+                            geometry = etree.SubElement(element, "geometry")
+                            geometry.set("value", geojson)
+                            polygon = True
                     else:
-                        row = db(query).select(ktable[WKTFIELD],
-                                               limitby=(0, 1)).first()
-                        if row:
-                            wkt = row[WKTFIELD]
-                            if wkt:
-                                polygon = True
-                                if format == "geojson":
-                                    # Simplify the polygon to reduce download size
-                                    geojson = gis.simplify(wkt, output="geojson")
-                                    # Output the GeoJSON directly into the XML, so that XSLT can simply drop in
-                                    geometry = etree.SubElement(element, "geometry")
-                                    geometry.set("value", geojson)
-                                else:
-                                    # Simplify the polygon to reduce download size
-                                    # & also to work around the recursion limit in libxslt
-                                    # http://blog.gmane.org/gmane.comp.python.lxml.devel/day=20120309
-                                    wkt = gis.simplify(wkt)
-                                    # Convert the WKT in XSLT
-                                    attr[ATTRIBUTE.wkt] = wkt
+                        wkt = self.get_geometry(resource, ktable, r.field,
+                                                r_id, polygons=True)
+                        if wkt:
+                            # Convert the WKT in XSLT
+                            attr[ATTRIBUTE.wkt] = wkt
+                            polygon = True
 
             if not LatLon and not polygon:
-                # Normal Location lookup
+                # Normal Location lookup (for all records in bulk)
                 # e.g. Feature Queries
-                LatLon = db(ktable.id == r_id).select(ktable[LATFIELD],
-                                                      ktable[LONFIELD],
-                                                      limitby=(0, 1)).first()
+                LatLon = self.get_geometry(resource, ktable, r.field, r_id)
                 if LatLon:
-                    lat = LatLon[LATFIELD]
-                    lon = LatLon[LONFIELD]
+                    lat, lon = LatLon
 
             if LatLon:
                 if lat is None or lon is None:
@@ -1159,6 +1143,59 @@ class S3XML(S3Codec):
                     if _attr:
                         attr[ATTRIBUTE.attributes] = _attr
 
+    # -------------------------------------------------------------------------
+    def get_geometry(self, resource, ktable, field, record_id,
+                     polygons=False, output="wkt"):
+        """
+            Lookup the geometry of a record which has not been pre-fetched
+            by gis.get_location_data(): looks up the geometries for all
+            loaded records of the resource in a single query, and keeps
+            them for subsequent calls
+
+            @param resource: the S3Resource
+            @param ktable: the table containing the geometries
+            @param field: the name of the field in the resource table
+                          which holds the record IDs of ktable
+            @param record_id: the record ID in ktable
+            @param polygons: lookup simplified polygons rather than lat/lon
+            @param output: output format for polygons, "wkt" or "geojson"
+
+            @return: the geometry, or None if not available
+        """
+
+        ktablename = ktable._tablename
+        key = (resource.tablename, ktablename, field, polygons, output)
+
+        geometries = self.geometries.get(key)
+        if geometries is None:
+            geometries = self.geometries[key] = {}
+        elif record_id in geometries:
+            return geometries[record_id]
+
+        ids = set([record_id])
+        rows = resource._rows
+        table = resource.table
+        if rows and field in table.fields:
+            if field != table._id.name:
+                # Must be a direct reference to ktable (not a super-link)
+                ftablename = s3_get_foreign_key(table[field])[0]
+                if ftablename != ktablename:
+                    rows = None
+            if rows:
+                add = ids.add
+                for row in rows:
+                    value = row[field] if field in row else None
+                    if value and value not in geometries:
+                        add(value)
+
+        found = current.gis.get_geometries(ktable,
+                                           ids,
+                                           polygons=polygons,
+                                           output=output)
+        for i in ids:
+            geometries[i] = found.get(i)
+        return geometries[record_id]
+
     # -------------------------------------------------------------------------
     def resource(self,
                  parent,
@@ -2473,6 +2510,36 @@ class S3XML(S3Codec):
             @todo: add a character encoding parameter to skip the guessing
         """
 
+        for tree in cls.csv2trees(source,
+                                  resourcename=resourcename,
+                                  extra_data=extra_data,
+                                  delimiter=delimiter,
+                                  quotechar=quotechar):
+            return tree
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def csv2trees(cls, source,
+                  resourcename=None,
+                  extra_data=None,
+                  delimiter=",",
+                  quotechar='"',
+                  chunk_size=None):
+        """
+            Convert a table-form CSV source row by row into element trees
+            of up to chunk_size rows each (same format as csv2tree)
+
+            @param source: the source (file-like object)
+            @param resourcename: the resource name
+            @param extra_data: dict of extra cols to add to each row
+            @param delimiter: delimiter for values
+            @param quotechar: quotation character
+            @param chunk_size: the maximum number of rows per tree,
+                               None for all rows in one tree
+
+            @return: generator of element trees
+        """
+
         import csv
 
         # Increase field sixe to be able to import WKTs
@@ -2485,9 +2552,11 @@ class S3XML(S3Codec):
         COL = TAG.col
         SubElement = etree.SubElement
 
-        root = etree.Element(TAG.table)
-        if resourcename is not None:
-            root.set(ATTRIBUTE.name, resourcename)
+        def new_root():
+            root = etree.Element(TAG.table)
+            if resourcename is not None:
+                root.set(ATTRIBUTE.name, resourcename)
+            return root
 
         def add_col(row, key, value):
             col = SubElement(row, COL)
@@ -2533,6 +2602,8 @@ class S3XML(S3Codec):
                                     delimiter=delimiter,
                                     quotechar=quotechar)
             ROW = TAG.row
+            root = new_root()
+            count = 0
             for r in reader:
                 row = SubElement(root, ROW)
                 for k in r:
@@ -2541,6 +2612,11 @@ class S3XML(S3Codec):
                     for key in extra_data:
                         if key not in r:
                             add_col(row, key, extra_data[key])
+                count += 1
+                if count == chunk_size:
+                    yield etree.ElementTree(root)
+                    root = new_root()
+                    count = 0
         except csv.Error:
             e = sys.exc_info()[1]
             raise HTTP(400, body=cls.json_message(False, 400, e))
@@ -2548,7 +2624,8 @@ class S3XML(S3Codec):
         # Use this to debug the source tree if needed:
         #print >>sys.stderr, cls.tostring(root, pretty_print=True)
 
-        return  etree.ElementTree(root)
+        if count or not chunk_size:
+            yield etree.ElementTree(root)
 
 # =============================================================================
 class S3XMLFormat(object):
@@ -28,8 +28,15 @@
 """
 
 import sys
+import threading
 import urllib, urllib2
 import traceback
+import Queue
+
+try:
+    from cStringIO import StringIO # Faster, where available
+except:
+    from StringIO import StringIO
 
 try:
     from lxml import etree
@@ -47,7 +54,7 @@ except ImportError:
 
 from gluon import *
 
-from ..s3sync import S3SyncBaseAdapter
+from ..s3sync import S3Sync, S3SyncBaseAdapter
 
 DEBUG = False
 if DEBUG:
@@ -64,6 +71,21 @@ class S3SyncAdapter(S3SyncBaseAdapter):
         API Adapter for Sahana Eden
     """
 
+    def __init__(self, repository):
+        """
+            Constructor
+
+            @param repository: the repository (S3SyncRepository)
+        """
+
+        S3SyncBaseAdapter.__init__(self, repository)
+
+        # Whether the peer accepts gzip-compressed data
+        self.accept_gzip = False
+
+        # Pages fetched in the background, {task_id: generator}
+        self.pages = {}
+
     # -------------------------------------------------------------------------
     def register(self):
         """ Register at the repository """
@@ -181,23 +203,165 @@ class S3SyncAdapter(S3SyncBaseAdapter):
 
         repository = self.repository
         xml = current.xml
-        config = repository.config
         resource_name = task.resource_name
 
         _debug("S3SyncRepository.pull(%s, %s)" % (repository.url, resource_name))
 
-        # Construct the URL
+        last_pull = task.last_pull
+        page_size = current.deployment_settings.get_base_sync_page_size()
+        checkpoint = page_size and \
+                     task.update_policy not in ("THIS", "OTHER")
+
+        # Get the pages (from the background fetch if started)
+        pages = self.pages.pop(task.id, None)
+        if pages is None:
+            pages = self.fetch(self.pull_url(task), page_size)
+
+        # Get import strategy and update policy
+        strategy = task.strategy
+        update_policy = task.update_policy
+        conflict_policy = task.conflict_policy
+
+        resource = current.s3db.resource(resource_name)
+        if onconflict:
+            onconflict_callback = lambda item: onconflict(item,
+                                                          repository,
+                                                          resource)
+        else:
+            onconflict_callback = None
+
+        remote = False
+        output = None
+        received = False
+        result = None
+        message = ""
+        count = 0
+        mtime = None
+        log = repository.log
+
+        try:
+            for error, data in pages:
+
+                if error is not None:
+                    result, remote, output, message = self._error(error)
+                    mtime = None
+                    break
+                received = True
+
+                # Import the data
+                success = True
+                try:
+                    success = resource.import_xml(
+                                    StringIO(data),
+                                    ignore_errors=True,
+                                    strategy=strategy,
+                                    update_policy=update_policy,
+                                    conflict_policy=conflict_policy,
+                                    last_sync=last_pull,
+                                    onconflict=onconflict_callback)
+                    count += resource.import_count
+                except IOError, e:
+                    result = log.FATAL
+                    message = "%s" % e
+                    output = xml.json_message(False, 400, message)
+                except Exception, e:
+                    # If we end up here, an uncaught error during import
+                    # has occured which indicates a code defect! We log it
+                    # and continue here, however - in order to maintain a
+                    # valid sync status, so that developers can restart
+                    # the process more easily after fixing the defect.
+                    result = log.FATAL
+                    message = "Uncaught Exception During Import: %s" % \
+                              traceback.format_exc()
+                    output = xml.json_message(False, 500, sys.exc_info()[1])
+
+                if result == log.FATAL:
+                    mtime = None
+                    break
+
+                # Log all validation errors
+                if resource.error_tree is not None:
+                    result = log.WARNING
+                    message = "%s%s" % (message and "%s, " % message or "",
+                                        resource.error)
+                    for element in resource.error_tree.findall("resource"):
+                        for field in element.findall("data[@error]"):
+                            error_msg = field.get("error", None)
+                            if error_msg:
+                                msg = "(UID: %s) %s.%s=%s: %s" % \
+                                       (element.get("uuid", None),
+                                        element.get("name", None),
+                                        field.get("field", None),
+                                        field.get("value", field.text),
+                                        field.get("error", None))
+                                message = "%s, %s" % (message, msg)
+
+                # Check for failure
+                if not success:
+                    result = log.FATAL
+                    if not message:
+                        message = "%s" % resource.error
+                    output = xml.json_message(False, 400, message)
+                    mtime = None
+                    break
+
+                page_mtime = resource.mtime
+                if page_mtime and (mtime is None or page_mtime > mtime):
+                    mtime = page_mtime
+
+                # Checkpoint after each page, so that an interrupted
+                # pull can resume from here
+                if checkpoint and mtime:
+                    task.update_record(last_pull=mtime)
+                    current.db.commit()
+        finally:
+            pages.close()
+
+        if result is None:
+            if received:
+                # Report success
+                result = log.SUCCESS
+                message = "data imported successfully (%s records)" % count
+            else:
+                # No data received from peer
+                result = log.ERROR
+                remote = True
+                message = "no data received from peer"
+
+        # Log the operation
+        log.write(repository_id=repository.id,
+                  resource_name=task.resource_name,
+                  transmission=log.OUT,
+                  mode=log.PULL,
+                  action=None,
+                  remote=remote,
+                  result=result,
+                  message=message)
+
+        _debug("S3SyncRepository.pull import %s: %s" % (result, message))
+        return (output, mtime)
+
+    # -------------------------------------------------------------------------
+    def pull_url(self, task):
+        """
+            Construct the URL to pull the data for a task
+
+            @param task: the sync_task Row
+        """
+
+        repository = self.repository
+        config = repository.config
+        resource_name = task.resource_name
+
         url = "%s/sync/sync.xml?resource=%s&repository=%s" % \
               (repository.url, resource_name, config.uuid)
         last_pull = task.last_pull
         if last_pull and task.update_policy not in ("THIS", "OTHER"):
-            url += "&msince=%s" % xml.encode_iso_datetime(last_pull)
+            url += "&msince=%s" % current.xml.encode_iso_datetime(last_pull)
         url += "&include_deleted=True"
 
         # Send sync filters to peer
         filters = current.sync.get_filters(task.id)
-        filter_string = None
-        resource_name = task.resource_name
         for tablename in filters:
             prefix = "~" if not tablename or tablename == resource_name \
                             else tablename
@@ -205,7 +369,139 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                 urlfilter = "[%s]%s=%s" % (prefix, k, v)
                 url += "&%s" % urlfilter
 
-        _debug("...pull from URL %s" % url)
+        return url
+
+    # -------------------------------------------------------------------------
+    def fetch(self, url, page_size=None):
+        """
+            Generator to fetch the data from the peer page by page
+
+            @param url: the pull URL
+            @param page_size: the page size, None to fetch all data
+                              with a single request
+
+            @return: generator of tuples (error, data), where error is
+                     the exception if the request failed
+        """
+
+        cursor = ""
+        while True:
+            if page_size:
+                page_url = "%s&limit=%s&cursor=%s" % \
+                           (url, page_size, urllib.quote(cursor))
+            else:
+                page_url = url
+            _debug("...pull from URL %s" % page_url)
+
+            try:
+                f = self.urlopen(page_url)
+                data = self.read(f)
+            except:
+                yield sys.exc_info()[1], None
+                return
+
+            if page_size:
+                cursor = f.info().getheader("X-Sync-Cursor")
+                if cursor is None:
+                    # Peer does not support keyset pagination
+                    # => discard the page and pull all data at once
+                    page_size = None
+                    continue
+
+            yield None, data
+
+            if not page_size or not cursor:
+                break
+
+    # -------------------------------------------------------------------------
+    def prefetch(self, tasks, workers):
+        """
+            Start fetching the data for the pull tasks in background
+            threads, while the data are imported one task after another
+            in the main thread
+
+            @param tasks: the sync_task Rows
+            @param workers: the maximum number of concurrent requests
+        """
+
+        # URLs (and repository config) must be looked up in this thread
+        urls = [(task.id, self.pull_url(task)) for task in tasks]
+        page_size = current.deployment_settings.get_base_sync_page_size()
+
+        semaphore = threading.BoundedSemaphore(workers)
+        for task_id, url in urls:
+            queue = Queue.Queue(maxsize=2)
+            stop = threading.Event()
+            thread = threading.Thread(target=self._fetch,
+                                      args=(self.fetch(url, page_size),
+                                            queue,
+                                            semaphore,
+                                            stop,
+                                            ))
+            thread.daemon = True
+            thread.start()
+            self.pages[task_id] = self._receive(queue, stop)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _fetch(pages, queue, semaphore, stop):
+        """
+            Background thread to fetch pages from the peer
+
+            @param pages: the page generator (see fetch())
+            @param queue: the Queue to put the pages into
+            @param semaphore: semaphore to limit concurrent requests
+            @param stop: Event to stop fetching (set by the consumer)
+        """
+
+        while not stop.is_set():
+            semaphore.acquire()
+            try:
+                item = next(pages, None)
+            finally:
+                semaphore.release()
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=1)
+                except Queue.Full:
+                    continue
+                break
+            if item is None:
+                break
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _receive(queue, stop):
+        """
+            Generator to receive the pages fetched in a background thread
+
+            @param queue: the Queue
+            @param stop: Event to stop the background thread
+        """
+
+        try:
+            while True:
+                item = queue.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            stop.set()
+
+    # -------------------------------------------------------------------------
+    def urlopen(self, url, data=None, headers=None):
+        """
+            Send a request to the peer
+
+            @param url: the URL
+            @param data: the data to send (POST)
+            @param headers: additional request headers, as dict
+
+            @return: the response (file-like object)
+        """
+
+        repository = self.repository
+        config = repository.config
 
         # Figure out the protocol from the URL
         url_split = url.split("://", 1)
@@ -215,7 +511,11 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             protocol, path = "http", None
 
         # Create the request
-        req = urllib2.Request(url=url)
+        req = urllib2.Request(url=url, data=data)
+        req.add_header("Accept-Encoding", "gzip")
+        if headers:
+            for k, v in headers.items():
+                req.add_header(k, v)
         handlers = []
 
         # Proxy handling
@@ -243,23 +543,56 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             auth_handler = urllib2.HTTPBasicAuthHandler(passwd_manager)
             handlers.append(auth_handler)
 
-        # Install all handlers
-        if handlers:
-            opener = urllib2.build_opener(*handlers)
-            urllib2.install_opener(opener)
+        # Use a separate opener (rather than installing it globally),
+        # so that requests can run in parallel threads
+        opener = urllib2.build_opener(*handlers)
+        f = opener.open(req)
 
-        # Execute the request
-        remote = False
-        output = None
-        response = None
-        log = repository.log
-        try:
-            f = urllib2.urlopen(req)
-        except urllib2.HTTPError, e:
+        # Does the peer accept compressed data?
+        accept_encoding = f.info().getheader("Accept-Encoding")
+        if accept_encoding and "gzip" in accept_encoding:
+            self.accept_gzip = True
+
+        return f
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def read(f):
+        """
+            Read the response body, decompress if required
+
+            @param f: the response (file-like object)
+        """
+
+        data = f.read()
+        content_encoding = f.info().getheader("Content-Encoding")
+        if content_encoding and content_encoding.lower() == "gzip":
+            data = S3Sync.decompress(data)
+        return data
+
+    # -------------------------------------------------------------------------
+    def _error(self, error):
+        """
+            Produce result, remote-flag, output and log message for
+            a failed request
+
+            @param error: the exception raised by the request
+        """
+
+        log = self.log
+        xml = current.xml
+
+        if isinstance(error, urllib2.HTTPError):
             result = log.ERROR
             remote = True # Peer error
-            code = e.code
-            message = e.read()
+            code = error.code
+            message = error.read()
+            content_encoding = error.info().getheader("Content-Encoding")
+            if content_encoding and content_encoding.lower() == "gzip":
+                try:
+                    message = S3Sync.decompress(message)
+                except IOError:
+                    pass
             try:
                 # Sahana-Eden would send a JSON message,
                 # try to extract the actual error message:
@@ -280,109 +613,13 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             except etree.XMLSyntaxError:
                 pass
             output = xml.json_message(False, code, message, tree=None)
-        except:
+        else:
             result = log.FATAL
             code = 400
-            message = sys.exc_info()[1]
+            message = error
             output = xml.json_message(False, code, message)
-        else:
-            result = log.SUCCESS
-            response = f
-
-        # Process the response
-        mtime = None
-        if response:
-
-            # Get import strategy and update policy
-            strategy = task.strategy
-            update_policy = task.update_policy
-            conflict_policy = task.conflict_policy
-
-            success = True
-            message = ""
-
-            # Import the data
-            resource = current.s3db.resource(resource_name)
-            if onconflict:
-                onconflict_callback = lambda item: onconflict(item,
-                                                              repository,
-                                                              resource)
-            else:
-                onconflict_callback = None
-            count = 0
-            try:
-                success = resource.import_xml(
-                                response,
-                                ignore_errors=True,
-                                strategy=strategy,
-                                update_policy=update_policy,
-                                conflict_policy=conflict_policy,
-                                last_sync=last_pull,
-                                onconflict=onconflict_callback)
-                count = resource.import_count
-            except IOError, e:
-                result = log.FATAL
-                message = "%s" % e
-                output = xml.json_message(False, 400, message)
-            except Exception, e:
-                # If we end up here, an uncaught error during import
-                # has occured which indicates a code defect! We log it
-                # and continue here, however - in order to maintain a
-                # valid sync status, so that developers can restart
-                # the process more easily after fixing the defect.
-                result = log.FATAL
-                message = "Uncaught Exception During Import: %s" % \
-                          traceback.format_exc()
-                output = xml.json_message(False, 500, sys.exc_info()[1])
-
-            mtime = resource.mtime
-
-            # Log all validation errors
-            if resource.error_tree is not None:
-                result = log.WARNING
-                message = "%s" % resource.error
-                for element in resource.error_tree.findall("resource"):
-                    for field in element.findall("data[@error]"):
-                        error_msg = field.get("error", None)
-                        if error_msg:
-                            msg = "(UID: %s) %s.%s=%s: %s" % \
-                                   (element.get("uuid", None),
-                                    element.get("name", None),
-                                    field.get("field", None),
-                                    field.get("value", field.text),
-                                    field.get("error", None))
-                            message = "%s, %s" % (message, msg)
-
-            # Check for failure
-            if not success:
-                result = log.FATAL
-                if not message:
-                    message = "%s" % resource.error
-                output = xml.json_message(False, 400, message)
-                mtime = None
-
-            # ...or report success
-            elif not message:
-                message = "data imported successfully (%s records)" % count
-
-        elif result == log.SUCCESS:
-            # No data received from peer
-            result = log.ERROR
-            remote = True
-            message = "no data received from peer"
-
-        # Log the operation
-        log.write(repository_id=repository.id,
-                  resource_name=task.resource_name,
-                  transmission=log.OUT,
-                  mode=log.PULL,
-                  action=None,
-                  remote=remote,
-                  result=result,
-                  message=message)
 
-        _debug("S3SyncRepository.pull import %s: %s" % (result, message))
-        return (output, mtime)
+        return result, remote, output, message
 
     # -------------------------------------------------------------------------
     def push(self, task):
@@ -418,74 +655,47 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             last_push = None
         _debug("...push to URL %s" % url)
 
-        # Define the resource
-        resource = current.s3db.resource(resource_name,
-                                         include_deleted=True)
-
         # Apply sync filters for this task
         filters = current.sync.get_filters(task.id)
 
-        # Export the resource as S3XML
-        data = resource.export_xml(filters=filters,
-                                   msince=last_push)
-        count = resource.results or 0
-        mtime = resource.muntil
+        page_size = current.deployment_settings.get_base_sync_page_size()
+        checkpoint = page_size and update_policy not in ("THIS", "OTHER")
 
-        # Transmit the data via HTTP
         remote = False
         output = None
+        count = 0
+        mtime = None
         log = repository.log
-        if data and count:
 
-            # Find the protocol
-            url_split = url.split("://", 1)
-            if len(url_split) == 2:
-                protocol, path = url_split
+        cursor = None
+        while True:
+
+            # Define the resource
+            resource = current.s3db.resource(resource_name,
+                                             include_deleted=True)
+
+            # Export the resource as S3XML
+            if page_size:
+                data, cursor = current.sync.export_page(resource,
+                                                        msince=last_push,
+                                                        cursor=cursor,
+                                                        limit=page_size,
+                                                        filters=filters)
             else:
-                protocol, path = "http", None
-
-            # Generate the request
-            import urllib2
-            req = urllib2.Request(url=url, data=data)
-            req.add_header('Content-Type', "text/xml")
-            handlers = []
-
-            # Proxy handling
-            proxy = repository.proxy or config.proxy or None
-            if proxy:
-                _debug("using proxy=%s" % proxy)
-                proxy_handler = urllib2.ProxyHandler({protocol: proxy})
-                handlers.append(proxy_handler)
-
-            # Authentication
-            username = repository.username
-            password = repository.password
-            if username and password:
-                # send auth credentials unsolicitedly
-                import base64
-                base64string = base64.encodestring('%s:%s' %
-                                                   (username, password))[:-1]
-                req.add_header("Authorization", "Basic %s" % base64string)
-                # Just in case the peer does not accept that
-                # => add a 401 handler:
-                passwd_manager = urllib2.HTTPPasswordMgrWithDefaultRealm()
-                passwd_manager.add_password(realm=None,
-                                            uri=url,
-                                            user=username,
-                                            passwd=password)
-                auth_handler = urllib2.HTTPBasicAuthHandler(passwd_manager)
-                handlers.append(auth_handler)
-
-            # Install all handlers
-            if handlers:
-                opener = urllib2.build_opener(*handlers)
-                urllib2.install_opener(opener)
-
-            # Execute the request
+                data = resource.export_xml(filters=filters,
+                                           msince=last_push)
+            page_count = resource.results or 0
+            if not data or not page_count:
+                break
+
+            # Transmit the data via HTTP
+            headers = {"Content-Type": "text/xml"}
+            if self.accept_gzip:
+                data = S3Sync.compress(data)
+                headers["Content-Encoding"] = "gzip"
             try:
-                f = urllib2.urlopen(req)
+                f = self.urlopen(url, data=data, headers=headers)
             except urllib2.HTTPError, e:
-                result = log.FATAL
                 remote = True # Peer error
                 code = e.code
                 message = e.read()
@@ -497,15 +707,31 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                 except:
                     pass
                 output = xml.json_message(False, code, message)
+                break
             except:
-                result = log.FATAL
                 code = 400
                 message = sys.exc_info()[1]
                 output = xml.json_message(False, code, message)
-            else:
-                result = log.SUCCESS
-                message = "data sent successfully (%s records)" % count
+                break
+
+            count += page_count
+            if resource.muntil:
+                mtime = resource.muntil
 
+            # Checkpoint after each page, so that an interrupted
+            # push can resume from here
+            if checkpoint and mtime:
+                task.update_record(last_push=mtime)
+                current.db.commit()
+
+            if not cursor:
+                break
+
+        if output is not None:
+            result = log.FATAL
+        elif count:
+            result = log.SUCCESS
+            message = "data sent successfully (%s records)" % count
         else:
             # No data to send
             result = log.WARNING
@@ -494,6 +494,31 @@ class S3Config(Storage):
         return self.security.get("strict_ownership", True)
     def get_security_map(self):
         return self.security.get("map", False)
+    def get_security_acl_cache(self):
+        """
+            Cache compiled ACLs across requests:
+                - "ram" for a process-wide cache
+                - name of a web2py cache model (e.g. "disk") to share
+                  the cache between processes
+                - False to disable
+
+            Changes to ACLs, roles or delegations invalidate the cache in
+            all processes (via a generation counter in the database)
+        """
+        return self.security.get("acl_cache", False)
+    def get_security_acl_cache_expire(self):
+        """
+            Time in seconds after which cached ACLs expire (only a
+            safety net for changes made outside of the permission API)
+        """
+        return self.security.get("acl_cache_expire", 300)
+    def get_security_ancestor_index(self):
+        """
+            Look up ancestors and descendants of person entities in the
+            OU hierarchy (realms) in a maintained ancestor index
+            (pr_ancestor) instead of searching the affiliations
+        """
+        return self.security.get("ancestor_index", False)
 
     # -------------------------------------------------------------------------
     # Base settings
@@ -530,6 +555,20 @@ class S3Config(Storage):
         """ Whether to prepopulate the database &, if so, which set of data to use for this """
         return self.base.get("prepopulate", 1)
 
+    def get_base_prepopulate_workers(self):
+        """
+            Number of parallel processes to run independent PrePopulate
+            import tasks (requires a database server, i.e. not SQLite)
+        """
+        return self.base.get("prepopulate_workers", 1)
+
+    def get_base_merge_workers(self):
+        """
+            Number of processes to score candidate pairs when searching
+            for duplicate records (S3DuplicateFinder)
+        """
+        return self.base.get("merge_workers", 1)
+
     def get_base_guided_tour(self):
         """ Whether the guided tours are enabled """
         return self.base.get("guided_tour", False)
@@ -553,12 +592,88 @@ class S3Config(Storage):
         """
         return self.base.get("session_memcache", False)
 
+    def get_base_represent_cache(self):
+        """
+            Cache S3Represent lookups across requests:
+                - False to disable (default)
+                - True or "ram" for a process-wide LRU cache
+                - the name of a web2py cache model to use as backend,
+                  e.g. "disk" to share the cache between processes
+        """
+        return self.base.get("represent_cache", False)
+
+    def get_base_represent_cache_size(self):
+        """
+            Maximum number of entries in the representation cache
+        """
+        return self.base.get("represent_cache_size", 10000)
+
+    def get_base_represent_cache_expire(self):
+        """
+            Time (in seconds) after which representation cache entries
+            expire - limits staleness where records are changed outside
+            of the onaccept/ondelete hooks (e.g. by scripts or direct
+            DB updates)
+        """
+        return self.base.get("represent_cache_expire", 3600)
+
     def get_base_solr_url(self):
         """
             URL to connect to solr server
         """    
         return self.base.get("solr_url", False)
 
+    def get_base_import_batch(self):
+        """
+            Import in batch mode: look up originals and duplicates for the
+            whole import job with few queries, and insert new records with
+            bulk_insert in dependency order
+            NB new records of tables with a per-record deduplicate resolver
+               (but no deduplicate_batch) are inserted before the next new
+               record of the same table gets resolved, so that duplicates
+               within the same job are detected
+        """
+        return self.base.get("import_batch", False)
+
+    def get_base_import_chunk_size(self):
+        """
+            Import XML/CSV sources incrementally in chunks of this number
+            of elements/rows, committing each chunk separately (None to
+            import each source as a whole)
+        """
+        return self.base.get("import_chunk_size", None)
+
+    def get_base_sync_page_size(self):
+        """
+            Pull/push sync data in pages of this number of records,
+            checkpointing the task after each page (None to transmit
+            each resource as a whole)
+        """
+        return self.base.get("sync_page_size", None)
+
+    def get_base_sync_workers(self):
+        """
+            Number of concurrent requests to fetch the data for the
+            pull tasks of a repository (1 to fetch them one by one)
+        """
+        return self.base.get("sync_workers", 1)
+
+    def get_base_profile(self):
+        """
+            Record the time and number of DB queries for model files,
+            model classes, customise-hooks and controllers of each
+            request (see S3Profiler)
+        """
+        return self.base.get("profile", False)
+
+    def get_base_model_registry(self):
+        """
+            Use a registry of the names defined by each model class
+            (persisted on disk) to load models, rather than scanning
+            the model modules
+        """
+        return self.base.get("model_registry", False)
+
     def get_import_callback(self, tablename, callback):
         """
             Lookup callback to use for imports in the following order:
@@ -908,12 +1023,48 @@ class S3Config(Storage):
         """
         return self.gis.get("simplify_tolerance", 0.01)
 
+    def get_gis_simplify_cache(self):
+        """
+            Whether to store simplified Polygons in the database (table
+            gis_simplified) rather than simplifying them for every map load
+        """
+        return self.gis.get("simplify_cache", False)
+
+    def get_gis_simplify_zoom_levels(self):
+        """
+            Zoom levels for which to pre-compute simplified Polygons when
+            Locations are updated (in addition to the default tolerance),
+            e.g. [4, 8, 12]
+        """
+        return self.gis.get("simplify_zoom_levels", [])
+
+    def get_gis_tile_cache_expire(self):
+        """
+            Time (in seconds) to cache the output of the Vector Tile
+            endpoint (0 to disable the cache)
+        """
+        return self.gis.get("tile_cache_expire", 300)
+
     def get_gis_scaleline(self):
         """
             Should the Map display a ScaleLine control?
         """
         return self.gis.get("scaleline", True)
 
+    def get_gis_spatial_index(self):
+        """
+            Use an in-process R-Tree (persisted in the cache folder) to
+            find Locations by bbox or shape if there is no spatial DB
+        """
+        return self.gis.get("spatial_index", False)
+
+    def get_gis_bulk_location_tree(self):
+        """
+            Rebuild the whole Location Tree in bulk (set-based updates
+            level by level) rather than feature by feature
+        """
+        return self.gis.get("bulk_location_tree", True)
+
     def get_gis_spatialdb(self):
         """
             Does the database have Spatial extensions?
@@ -1174,6 +1325,33 @@ class S3Config(Storage):
         """
         return self.ui.get("hide_report_options", True)
 
+    def get_ui_datatables_keyset(self):
+        """
+            Use keyset (seek) pagination for server-side paginated data
+            tables, i.e. select the next page by the sort key of the last
+            record of the previous page rather than with OFFSET (only
+            possible when sorting by non-nullable master table fields)
+            - the cursors expire with datatables_count_expire (or after
+              60 seconds if that is not set)
+        """
+        return self.ui.get("datatables_keyset", False)
+
+    def get_ui_datatables_count_expire(self):
+        """
+            Cache the total number of records for server-side paginated
+            data tables across requests for this number of seconds (per
+            filter query), 0 to disable
+        """
+        return self.ui.get("datatables_count_expire", 0)
+
+    def get_ui_report_db_aggregate(self):
+        """
+            Compute report (pivot table) aggregates with GROUP BY in the
+            database rather than in Python, falls back to Python for
+            virtual fields, list:types and multi-value components
+        """
+        return self.ui.get("report_db_aggregate", False)
+
     def get_ui_interim_save(self):
         """ Render interim-save button in CRUD forms by default """
         return self.ui.get("interim_save", False)
@@ -1376,6 +1554,41 @@ class S3Config(Storage):
         """
         return self.msg.get("notify_renderer", None)
 
+    def get_msg_notify_batch(self):
+        """
+            Notify groups of equivalent subscriptions (same resource,
+            filter and trigger, subscribers with the same roles and
+            language) with a single lookup request, rendering each
+            message only once for the whole group
+            NB subscribers with the same roles are assumed to have
+               access to the same records, which may not be the case
+               where record ownership grants additional permissions
+        """
+        return self.msg.get("notify_batch", False)
+
+    def get_msg_outbox_batch_size(self):
+        """
+            Process the outbox in batches of this number of messages,
+            with bulk lookups of recipients and contacts, persistent
+            SMTP connections and bulk status updates (None to process
+            the outbox message by message)
+        """
+        return self.msg.get("outbox_batch_size", None)
+
+    def get_msg_outbox_workers(self):
+        """
+            Number of concurrent SMTP connections to send emails from
+            the outbox in batch mode
+        """
+        return self.msg.get("outbox_workers", 4)
+
+    def get_msg_outbox_rate(self, contact_method):
+        """
+            Maximum number of messages per second to send from the outbox
+            in batch mode, per contact method, e.g. {"EMAIL": 10, "SMS": 1}
+        """
+        return self.msg.get("outbox_rate", {}).get(contact_method)
+
     # -------------------------------------------------------------------------
     # SMS
     #
@@ -1399,6 +1612,14 @@ class S3Config(Storage):
         """
         return self.search.get("max_results", 200)
 
+    def get_search_key_index(self):
+        """
+            Maintain normalized search keys (S3SearchKey) for the names
+            of organisations and locations, used for autocomplete searches
+            instead of a LIKE-scan of the tables
+        """
+        return self.search.get("key_index", False)
+
     # -------------------------------------------------------------------------
     # Filter Manager Widget
     def get_search_filter_manager(self):
@@ -2076,6 +2297,14 @@ class S3Config(Storage):
         """
         return self.pr.get("lookup_duplicates", False)
 
+    def get_pr_name_index(self):
+        """
+            Maintain a fuzzy name index (phonetic and trigram keys) for
+            person records, used to look up duplicates in the
+            AddPersonWidget2 and during imports
+        """
+        return self.pr.get("name_index", False)
+
     def get_pr_request_dob(self):
         """ Include Date of Birth in the AddPersonWidget[2] """
         return self.pr.get("request_dob", True)
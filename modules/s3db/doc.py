@@ -629,6 +629,9 @@ def doc_document_list_layout(list_id, item_id, resource, rfields, record):
 class doc_DocumentRepresent(S3Represent):
     """ Representation of Documents """
 
+    # link() needs the document row, which is not cached
+    shared_cache = False
+
     # -------------------------------------------------------------------------
     def link(self, k, v, row=None):
         """
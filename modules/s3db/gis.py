@@ -330,6 +330,7 @@ class S3LocationModel(S3Model):
                        list_fields = list_fields,
                        list_orderby = "gis_location.name",
                        onaccept = self.gis_location_onaccept,
+                       ondelete = self.gis_location_ondelete,
                        onvalidation = self.gis_location_onvalidation,
                        )
 
@@ -408,6 +409,9 @@ class S3LocationModel(S3Model):
         vars = form.vars
         id = vars.id
 
+        if current.deployment_settings.get_search_key_index():
+            S3SearchKey.update(current.s3db.gis_location, id, ["name"])
+
         if vars.path and current.response.s3.bulk:
             # Don't import path from foreign sources as IDs won't match
             db = current.db
@@ -420,8 +424,11 @@ class S3LocationModel(S3Model):
             feature = json.dumps(dict(id=id,
                                       level=vars.get("level", False),
                                       ))
+            # (batched, so that repeated updates of the same feature
+            #  are only run once)
             current.s3task.async("gis_update_location_tree",
-                                 args=[feature])
+                                 args=[feature],
+                                 batch=True)
         return
 
     # -------------------------------------------------------------------------
@@ -780,6 +787,16 @@ class S3LocationModel(S3Model):
         else:
             return wkt
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def gis_location_ondelete(row):
+        """
+            On Delete for GIS Locations
+        """
+
+        if current.deployment_settings.get_search_key_index():
+            S3SearchKey.update(current.s3db.gis_location, row.id, ["name"])
+
     # -------------------------------------------------------------------------
     @staticmethod
     def gis_search_ac(r, **attr):
@@ -877,8 +894,13 @@ class S3LocationModel(S3Model):
             response.headers["Content-Type"] = "application/json"
             return output
 
-        query = S3FieldSelector("name").lower().like(value + "%")
         field2 = _vars.get("field2", None)
+
+        if current.deployment_settings.get_search_key_index():
+            # Look up the matching locations by their search keys
+            query = S3SearchKey.query(table, value)
+        else:
+            query = S3FieldSelector("name").lower().like(value + "%")
         if field2:
             # S3LocationSelectorWidget's s3_gis_autocomplete_search
             # addr_street
@@ -916,128 +938,127 @@ class S3LocationModel(S3Model):
             query = (table.parent == int(parent))
             resource.add_filter(query)
 
-        MAX_SEARCH_RESULTS = current.deployment_settings.get_search_max_results()
-        if (not limit or limit > MAX_SEARCH_RESULTS) and \
-           resource.count() > MAX_SEARCH_RESULTS:
-            output = json.dumps([
-                dict(label=str(current.T("There are more than %(max)s results, please input more characters.") % dict(max=MAX_SEARCH_RESULTS)))
-                ], separators=SEPARATORS)
-
-        elif loc_select:
+        if loc_select:
             # LocationSelector
             # @ToDo: Deprecate
-            output = S3Exporter().json(resource,
-                                       start=0,
-                                       limit=limit,
-                                       fields=fields,
-                                       orderby=table.name)
+            rows, message = search_ac_select(resource, fields,
+                                             limit=limit,
+                                             orderby=table.name,
+                                             as_rows=True)
+            if message:
+                output = json.dumps(message, separators=SEPARATORS)
+            else:
+                # Same as S3Exporter().json
+                output = rows.json()
         else:
             # S3LocationAutocompleteWidget
             # Vulnerability Search
-            rows = resource.select(fields=fields,
-                                   start=0,
-                                   limit=limit,
-                                   orderby="gis_location.name")["rows"]
-            if translate:
-                # Lookup Translations
-                s3db = current.s3db
-                l10n_table = s3db.gis_location_name
-                l10n_query = (l10n_table.deleted == False) & \
-                             (l10n_table.language == language)
-                ids = []
-                for row in rows:
-                    path = row["gis_location.path"]
-                    if not path:
-                        path = current.gis.update_location_tree(row["gis_location"])
-                    ids += path.split("/")
-                # Remove Duplicates
-                ids = set(ids)
-                l10n_query &= (l10n_table.location_id.belongs(ids))
-                limitby = (0, len(ids))
-                l10n = current.db(l10n_query).select(l10n_table.location_id,
-                                                     l10n_table.name_l10n,
-                                                     limitby = limitby,
-                                                     ).as_dict(key="location_id")
-            items = []
-            iappend = items.append
-            for row in rows:
-                item = {"id" : row["gis_location.id"],
-                        }
-                level = row.get("gis_location.level", None)
-                if level:
-                    item["level"] = level
+            rows, message = search_ac_select(resource, fields,
+                                             limit=limit,
+                                             orderby="gis_location.name")
+            if message:
+                output = json.dumps(message, separators=SEPARATORS)
+            else:
                 if translate:
-                    path = row["gis_location.path"]
-                    ids = path.split("/")
-                    loc = l10n.get(int(ids.pop()), None) 
-                    if loc:
-                        item["name"] = loc["name_l10n"]
-                    else:
-                        item["name"] = row["gis_location.name"]
-                else:
-                    item["name"] = row["gis_location.name"]
-                L5 = row.get("gis_location.L5", None)
-                if L5 and level != "L5":
+                    # Lookup Translations
+                    s3db = current.s3db
+                    l10n_table = s3db.gis_location_name
+                    l10n_query = (l10n_table.deleted == False) & \
+                                 (l10n_table.language == language)
+                    ids = []
+                    for row in rows:
+                        path = row["gis_location.path"]
+                        if not path:
+                            path = current.gis.update_location_tree(row["gis_location"])
+                        ids += path.split("/")
+                    # Remove Duplicates
+                    ids = set(ids)
+                    l10n_query &= (l10n_table.location_id.belongs(ids))
+                    limitby = (0, len(ids))
+                    l10n = current.db(l10n_query).select(l10n_table.location_id,
+                                                         l10n_table.name_l10n,
+                                                         limitby = limitby,
+                                                         ).as_dict(key="location_id")
+                items = []
+                iappend = items.append
+                for row in rows:
+                    item = {"id" : row["gis_location.id"],
+                            }
+                    level = row.get("gis_location.level", None)
+                    if level:
+                        item["level"] = level
                     if translate:
+                        path = row["gis_location.path"]
+                        ids = path.split("/")
                         loc = l10n.get(int(ids.pop()), None) 
                         if loc:
-                            item["L5"] = loc["name_l10n"]
+                            item["name"] = loc["name_l10n"]
                         else:
-                            item["L5"] = L5
+                            item["name"] = row["gis_location.name"]
                     else:
-                        item["L5"] = L5
-                L4 = row.get("gis_location.L4", None)
-                if L4 and level != "L4":
-                    if translate:
-                        loc = l10n.get(int(ids.pop()), None) 
-                        if loc:
-                            item["L4"] = loc["name_l10n"]
+                        item["name"] = row["gis_location.name"]
+                    L5 = row.get("gis_location.L5", None)
+                    if L5 and level != "L5":
+                        if translate:
+                            loc = l10n.get(int(ids.pop()), None) 
+                            if loc:
+                                item["L5"] = loc["name_l10n"]
+                            else:
+                                item["L5"] = L5
+                        else:
+                            item["L5"] = L5
+                    L4 = row.get("gis_location.L4", None)
+                    if L4 and level != "L4":
+                        if translate:
+                            loc = l10n.get(int(ids.pop()), None) 
+                            if loc:
+                                item["L4"] = loc["name_l10n"]
+                            else:
+                                item["L4"] = L4
                         else:
                             item["L4"] = L4
-                    else:
-                        item["L4"] = L4
-                L3 = row.get("gis_location.L3", None)
-                if L3 and level != "L3":
-                    if translate:
-                        loc = l10n.get(int(ids.pop()), None) 
-                        if loc:
-                            item["L3"] = loc["name_l10n"]
+                    L3 = row.get("gis_location.L3", None)
+                    if L3 and level != "L3":
+                        if translate:
+                            loc = l10n.get(int(ids.pop()), None) 
+                            if loc:
+                                item["L3"] = loc["name_l10n"]
+                            else:
+                                item["L3"] = L3
                         else:
                             item["L3"] = L3
-                    else:
-                        item["L3"] = L3
-                L2 = row.get("gis_location.L2", None)
-                if L2 and level != "L2":
-                    if translate:
-                        loc = l10n.get(int(ids.pop()), None) 
-                        if loc:
-                            item["L2"] = loc["name_l10n"]
+                    L2 = row.get("gis_location.L2", None)
+                    if L2 and level != "L2":
+                        if translate:
+                            loc = l10n.get(int(ids.pop()), None) 
+                            if loc:
+                                item["L2"] = loc["name_l10n"]
+                            else:
+                                item["L2"] = L2
                         else:
                             item["L2"] = L2
-                    else:
-                        item["L2"] = L2
-                L1 = row.get("gis_location.L1", None)
-                if L1 and level != "L1":
-                    if translate:
-                        loc = l10n.get(int(ids.pop()), None) 
-                        if loc:
-                            item["L1"] = loc["name_l10n"]
+                    L1 = row.get("gis_location.L1", None)
+                    if L1 and level != "L1":
+                        if translate:
+                            loc = l10n.get(int(ids.pop()), None) 
+                            if loc:
+                                item["L1"] = loc["name_l10n"]
+                            else:
+                                item["L1"] = L1
                         else:
                             item["L1"] = L1
-                    else:
-                        item["L1"] = L1
-                L0 = row.get("gis_location.L0", None)
-                if L0 and level != "L0":
-                    if translate:
-                        loc = l10n.get(int(ids.pop()), None) 
-                        if loc:
-                            item["L0"] = loc["name_l10n"]
-                    else:
-                        item["L0"] = L0
+                    L0 = row.get("gis_location.L0", None)
+                    if L0 and level != "L0":
+                        if translate:
+                            loc = l10n.get(int(ids.pop()), None) 
+                            if loc:
+                                item["L0"] = loc["name_l10n"]
+                        else:
+                            item["L0"] = L0
 
-                iappend(item)
+                    iappend(item)
 
-            output = json.dumps(items, separators=SEPARATORS)
+                output = json.dumps(items, separators=SEPARATORS)
                                        
         response.headers["Content-Type"] = "application/json"
         return output
@@ -2792,6 +2813,7 @@ class S3MapModel(S3Model):
              "gis_layer_wfs",
              "gis_layer_wms",
              "gis_layer_xyz",
+             "gis_simplified",
              #"gis_style"
              ]
 
@@ -3883,6 +3905,23 @@ class S3MapModel(S3Model):
                                                        "gis_cache")),
                      *s3_meta_fields())
 
+        # Store simplified polygons of Locations & Shapefile Layer data
+        # per tolerance (zoom level) & precision
+        # - to not have to simplify them for every map load
+        # - populated when Locations are updated, or on first use
+        # - one entry per record & key, indexed on (tablename, record_id)
+        #   (see zzz_1st_run.py and static/scripts/tools/indexes.py)
+        #
+        tablename = "gis_simplified"
+        define_table(tablename,
+                     Field("tablename", length=128, notnull=True),
+                     Field("record_id", "integer", notnull=True),
+                     Field("tolerance", "double"),
+                     Field("decimals", "integer"),
+                     Field("output", length=8),
+                     Field("geometry", "text"),
+                     )
+
         # ---------------------------------------------------------------------
         # Below tables are not yet implemented
 
@@ -4240,6 +4279,7 @@ class S3MapModel(S3Model):
             db._migrate_enabled = False
             # Clear old data if-any
             dbtable.truncate()
+            current.gis.clear_simplified(tablename)
             # Populate table with data
             for feature in features:
                 dtable.insert(**feature)
@@ -987,31 +987,27 @@ class S3HRModel(S3Model):
 
         settings = current.deployment_settings
         limit = int(_vars.limit or 0)
-        MAX_SEARCH_RESULTS = settings.get_search_max_results()
-        if (not limit or limit > MAX_SEARCH_RESULTS) and resource.count() > MAX_SEARCH_RESULTS:
-            output = json.dumps([
-                dict(label=str(current.T("There are more than %(max)s results, please input more characters.") % dict(max=MAX_SEARCH_RESULTS)))
-                ], separators=SEPARATORS)
-        else:
-            fields = ["id",
-                      "person_id$first_name",
-                      "person_id$middle_name",
-                      "person_id$last_name",
-                      "job_title_id$name",
-                      ]
-            show_orgs = settings.get_hrm_show_organisation()
-            if show_orgs:
-                fields.append("organisation_id$name")
-
-            if settings.get_pr_reverse_names():
-                orderby = "pr_person.last_name"
-            else:
-                orderby = "pr_person.first_name"
-            rows = resource.select(fields,
-                                   start=0,
-                                   limit=limit,
-                                   orderby=orderby)["rows"]
 
+        fields = ["id",
+                  "person_id$first_name",
+                  "person_id$middle_name",
+                  "person_id$last_name",
+                  "job_title_id$name",
+                  ]
+        show_orgs = settings.get_hrm_show_organisation()
+        if show_orgs:
+            fields.append("organisation_id$name")
+
+        if settings.get_pr_reverse_names():
+            orderby = "pr_person.last_name"
+        else:
+            orderby = "pr_person.first_name"
+        rows, message = search_ac_select(resource, fields,
+                                         limit=limit,
+                                         orderby=orderby)
+        if message:
+            output = json.dumps(message, separators=SEPARATORS)
+        else:
             items = []
             iappend = items.append
             for row in rows:
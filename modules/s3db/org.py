@@ -414,6 +414,9 @@ class S3OrganisationModel(S3Model):
         utablename = auth.settings.table_user_name
         configure(tablename,
                   deduplicate = self.organisation_duplicate,
+                  deduplicate_blocking = {"fields": ["name", "acronym"],
+                                          "key": self.organisation_blocking_key,
+                                          },
                   filter_widgets = filter_widgets,
                   list_fields = ["id",
                                  "name",
@@ -584,6 +587,11 @@ class S3OrganisationModel(S3Model):
             Process injected fields
         """
 
+        if current.deployment_settings.get_search_key_index():
+            S3SearchKey.update(current.s3db.org_organisation,
+                               form.vars.id,
+                               ["name", "acronym"])
+
         newfilename = form.vars.logo_newfilename
         if newfilename:
             s3db = current.s3db
@@ -653,6 +661,11 @@ class S3OrganisationModel(S3Model):
             If an Org is deleted then remove Logo
         """
 
+        if current.deployment_settings.get_search_key_index():
+            S3SearchKey.update(current.s3db.org_organisation,
+                               row.id,
+                               ["name", "acronym"])
+
         db = current.db
         table = db.org_organisation
         deleted_row = db(table.id == row.id).select(table.logo,
@@ -725,6 +738,17 @@ class S3OrganisationModel(S3Model):
                 item.id = duplicate.id
                 item.method = item.METHOD.UPDATE
 
+    # -----------------------------------------------------------------------------
+    @staticmethod
+    def organisation_blocking_key(row):
+        """
+            Blocking key for S3DuplicateFinder: the normalized name
+
+            @param row: the field values
+        """
+
+        return S3DuplicateFinder.normalize(row["name"]) or None
+
     # -----------------------------------------------------------------------------
     @staticmethod
     def organisation_duplicate(item):
@@ -792,36 +816,47 @@ class S3OrganisationModel(S3Model):
                             "Missing option! Require value")
             raise HTTP(400, body=output)
 
-        query = (S3FieldSelector("organisation.name").lower().like(value + "%")) | \
-                (S3FieldSelector("organisation.acronym").lower().like(value + "%"))
-        if use_branches:
-            query |= (S3FieldSelector("parent.name").lower().like(value + "%")) | \
-                     (S3FieldSelector("parent.acronym").lower().like(value + "%"))
-        resource.add_filter(query)
+        max_results = settings.get_search_max_results()
 
-        MAX_SEARCH_RESULTS = settings.get_search_max_results()
-        limit = int(_vars.limit or MAX_SEARCH_RESULTS)
-        if (not limit or limit > MAX_SEARCH_RESULTS) and resource.count() > MAX_SEARCH_RESULTS:
-            output = json.dumps([
-                dict(label=str(current.T("There are more than %(max)s results, please input more characters.") % dict(max=MAX_SEARCH_RESULTS)))
-                ], separators=SEPARATORS)
+        if settings.get_search_key_index():
+            # Look up the matching organisations by their search keys
+            query = S3SearchKey.query(table, value)
+            if use_branches:
+                # Branches of matching organisations
+                ltable = current.s3db.org_organisation_branch
+                parents = S3SearchKey.query(table, value,
+                                            field=ltable.organisation_id)
+                branches = current.db(parents & (ltable.deleted != True))
+                query |= (table.id.belongs(branches._select(ltable.branch_id)))
         else:
-            field = table.name
-            field2 = table.acronym
-
-            # Fields to return
-            fields = ["id",
-                      "name",
-                      "acronym",
-                      ]
+            query = (S3FieldSelector("organisation.name").lower().like(value + "%")) | \
+                    (S3FieldSelector("organisation.acronym").lower().like(value + "%"))
             if use_branches:
-                fields.append("parent.name")
+                query |= (S3FieldSelector("parent.name").lower().like(value + "%")) | \
+                         (S3FieldSelector("parent.acronym").lower().like(value + "%"))
+        resource.add_filter(query)
+
+        limit = int(_vars.limit or max_results)
 
-            rows = resource.select(fields,
-                                   start=0,
-                                   limit=limit,
-                                   orderby=field,
-                                   as_rows=True)
+        field = table.name
+
+        # Fields to return
+        fields = ["id",
+                  "name",
+                  "acronym",
+                  ]
+        if use_branches:
+            fields.append("parent.name")
+
+        rows, message = search_ac_select(resource, fields,
+                                         limit=limit,
+                                         orderby=field,
+                                         as_rows=True)
+        if message:
+            output = json.dumps(message, separators=SEPARATORS)
+        else:
+            normalize = S3SearchKey.normalize
+            key = normalize(value)
             output = []
             append = output.append
             for row in rows:
@@ -844,13 +879,13 @@ class S3OrganisationModel(S3Model):
 
                 # Determine if input is org hit or acronym hit
                 value_len = len(value)
-                orgNameHit = name[:value_len].lower() == value
+                orgNameHit = normalize(name).startswith(key)
                 if orgNameHit:
                     nextString = name[value_len:]
                     if nextString != "":
                         record["matchString"] = name[:value_len]
                         record["nextString"] = nextString
-                else:
+                elif acronym:
                     nextString = acronym[value_len:]
                     if nextString != "":
                         record["matchString"] = acronym[:value_len]
@@ -2459,29 +2494,25 @@ class S3SiteModel(S3Model):
 
         resource.add_filter(query)
 
-        MAX_SEARCH_RESULTS = settings.get_search_max_results()
-        limit = int(_vars.limit or MAX_SEARCH_RESULTS)
-        if (not limit or limit > MAX_SEARCH_RESULTS) and resource.count() > MAX_SEARCH_RESULTS:
-            output = json.dumps([
-                dict(label=str(current.T("There are more than %(max)s results, please input more characters.") % dict(max=MAX_SEARCH_RESULTS)))
-                ], separators=SEPARATORS)
-        else:
-            from s3.s3widgets import set_match_strings
-            s3db = current.s3db
+        limit = int(_vars.limit or settings.get_search_max_results())
 
-            # default fields to return 
-            fields = ["name",
-                      "site_id",
-                      ]
+        # default fields to return 
+        fields = ["name",
+                  "site_id",
+                  ]
 
-            # Add template specific fields to return
-            fields += extra_fields
+        # Add template specific fields to return
+        fields += extra_fields
+
+        rows, message = search_ac_select(resource, fields,
+                                         limit=limit,
+                                         orderby="name",
+                                         as_rows=True)
+        if message:
+            output = json.dumps(message, separators=SEPARATORS)
+        else:
+            from s3.s3widgets import set_match_strings
 
-            rows = resource.select(fields,
-                                   start=0,
-                                   limit=limit,
-                                   orderby="name",
-                                   as_rows=True)
             output = []
             append = output.append
             for row in rows:
@@ -2950,6 +2981,11 @@ class S3FacilityModel(S3Model):
                              },
                   crud_form = crud_form,
                   deduplicate = self.org_facility_duplicate,
+                  deduplicate_blocking = {"fields": ["name",
+                                                     "location_id$L2",
+                                                     ],
+                                          "key": self.org_facility_blocking_key,
+                                          },
                   filter_widgets = filter_widgets,
                   list_fields = list_fields,
                   onaccept = self.org_facility_onaccept,
@@ -3025,6 +3061,21 @@ class S3FacilityModel(S3Model):
 
         org_update_affiliations("org_facility", form.vars)
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def org_facility_blocking_key(row):
+        """
+            Blocking key for S3DuplicateFinder: phonetic key of the
+            name, and the L2 of the location
+
+            @param row: the field values
+        """
+
+        name = S3DuplicateFinder.phonetic(row["name"])
+        if not name:
+            return None
+        return "%s|%s" % (name, row["location_id$L2"] or "")
+
     # -------------------------------------------------------------------------
     @staticmethod
     def org_facility_duplicate(item):
@@ -48,6 +48,7 @@ __all__ = ["S3PersonEntity",
            "pr_RoleRepresent",
            "pr_PersonEntityRepresent",
            "pr_PersonRepresent",
+           "pr_PersonNameIndex",
            "pr_person_phone_represent",
            "pr_person_comment",
            "pr_image_represent",
@@ -79,6 +80,9 @@ __all__ = ["S3PersonEntity",
            # Internal Path Tools
            "pr_rebuild_path",
            "pr_role_rebuild_path",
+           "pr_rebuild_ancestors",
+           "pr_update_ancestors",
+           "pr_check_ancestors",
            # Helpers for ImageLibrary
            "pr_image_modify",
            "pr_image_resize",
@@ -90,6 +94,7 @@ __all__ = ["S3PersonEntity",
 
 import os
 import re
+import unicodedata
 from urllib import urlencode
 
 try:
@@ -111,6 +116,9 @@ from s3layouts import S3AddResourceLink
 OU = 1 # role type which indicates hierarchy, see role_types
 OTHER_ROLE = 9
 
+# Whether the ancestor index has been checked in this process
+ANCESTOR_INDEX = Storage(checked=False)
+
 # Compact JSON encoding
 SEPARATORS = (",", ":")
 
@@ -120,6 +128,7 @@ class S3PersonEntity(S3Model):
 
     names = ["pr_pentity",
              "pr_affiliation",
+             "pr_ancestor",
              "pr_person_user",
              "pr_role",
              "pr_role_types",
@@ -312,6 +321,7 @@ class S3PersonEntity(S3Model):
 
         # Resource configuration
         configure(tablename,
+                  onaccept = self.pr_role_onaccept,
                   onvalidation = self.pr_role_onvalidation,
                   )
 
@@ -365,6 +375,21 @@ class S3PersonEntity(S3Model):
                   ondelete = self.pr_affiliation_ondelete,
                   )
 
+        # ---------------------------------------------------------------------
+        # Ancestor Index
+        # - closure table of the OU hierarchy (all ancestor/descendant
+        #   pairs with their distance), for single-query lookups of
+        #   ancestors and descendants
+        # - maintained by pr_update_ancestors if
+        #   settings.security.ancestor_index is enabled, do not edit
+        #
+        tablename = "pr_ancestor"
+        define_table(tablename,
+                     Field("ancestor_pe_id", "integer"),
+                     Field("descendant_pe_id", "integer"),
+                     Field("depth", "integer"),
+                     )
+
         # ---------------------------------------------------------------------
         # Pass names back to global scope (s3.*)
         #
@@ -568,6 +593,28 @@ class S3PersonEntity(S3Model):
                 current.s3db.pr_role_rebuild_path(role_id, clear=True)
         return
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def pr_role_onaccept(form):
+        """
+            Update the ancestor index for all affiliates of the role
+            (in case the role type has changed)
+
+            @param form: the CRUD form
+        """
+
+        role_id = form.vars.id
+        if not role_id:
+            return
+        db = current.db
+        atable = db.pr_affiliation
+        query = (atable.role_id == role_id) & \
+                (atable.deleted != True)
+        rows = db(query).select(atable.pe_id)
+        if rows:
+            pr_update_ancestors([row.pe_id for row in rows])
+        return
+
     # -------------------------------------------------------------------------
     @staticmethod
     def pr_pentity_onaccept(form):
@@ -681,6 +728,7 @@ class S3PersonModel(S3Model):
     """ Persons and Groups """
 
     names = ["pr_person",
+             "pr_person_name_key",
              "pr_gender",
              "pr_gender_opts",
              "pr_person_id",
@@ -865,6 +913,7 @@ class S3PersonModel(S3Model):
         self.configure(tablename,
                        crud_form = crud_form,
                        deduplicate = self.person_deduplicate,
+                       deduplicate_batch = self.person_deduplicate_batch,
                        filter_widgets = filter_widgets,
                        list_fields = ["id",
                                       "first_name",
@@ -970,6 +1019,17 @@ class S3PersonModel(S3Model):
                        asset_asset="assigned_to_id",
                        )
 
+        # ---------------------------------------------------------------------
+        # Person Name Index
+        # - phonetic and trigram keys of person names for fuzzy searches
+        # - maintained by pr_PersonNameIndex, do not edit
+        #
+        tablename = "pr_person_name_key"
+        define_table(tablename,
+                     Field("person_id", "integer"),
+                     Field("name_key", length=32),
+                     )
+
         # ---------------------------------------------------------------------
         # Pass names back to global scope (s3.*)
         #
@@ -1081,13 +1141,207 @@ class S3PersonModel(S3Model):
                              last_name = vars.last_name,
                              )
 
+        # Update the name index
+        if current.deployment_settings.get_pr_name_index():
+            pr_PersonNameIndex.update(person_id)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def person_deduplicate(item):
         """ Import item deduplication """
 
+        keys = S3PersonModel.person_deduplicate_keys(item)
+        if not keys:
+            # Not enough we can use
+            return
+
+        db = current.db
+        s3db = current.s3db
+
+        ptable = db.pr_person
+        table = s3db.pr_contact
+        etable = table.with_alias("pr_email")
+
+        fname = keys.fname
+        lname = keys.lname
+        if fname and lname:
+            if current.deployment_settings.get_pr_name_index():
+                # Include similar names (to be ranked by other details)
+                matches = pr_PersonNameIndex.search("%s %s" % (fname, lname))
+                query = (ptable.id.belongs([row.id for score, row in matches]))
+            else:
+                query = (ptable.first_name.lower() == fname) & \
+                        (ptable.last_name.lower() == lname)
+        else:
+            query = (ptable.initials.lower() == keys.initials)
+
+        fields = [ptable._id,
+                  ptable.first_name,
+                  ptable.middle_name,
+                  ptable.last_name,
+                  ptable.initials,
+                  etable.value,
+                  ]
+
+        left = [etable.on((etable.pe_id == ptable.pe_id) & \
+                          (etable.contact_method == "EMAIL")),
+                ]
+
+        if keys.dob:
+            fields.append(ptable.date_of_birth)
+
+        if keys.sms:
+            stable = table.with_alias("pr_sms")
+            fields.append(stable.value)
+            left.append(stable.on((stable.pe_id == ptable.pe_id) & \
+                                  (stable.contact_method == "SMS")))
+        if keys.id:
+            itable = s3db.pr_identity
+            fields += [itable.type,
+                       itable.value,
+                       ]
+            left.append(itable.on(itable.person_id == ptable.id))
+
+        candidates = db(query).select(*fields,
+                                      left=left,
+                                      orderby=["pr_person.created_on ASC"])
+
+        S3PersonModel.person_deduplicate_match(item, keys, candidates)
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def person_deduplicate_batch(items):
+        """
+            Import item deduplication for all new pr_person items of an
+            import job (batch import mode), looks up the candidates for
+            all items with one query per chunk of names, and matches the
+            remaining items against the earlier new items of the job
+
+            @param items: the import items
+        """
+
+        # Collect the keys
+        item_keys = []
+        fnames = set()
+        initials = set()
+        for item in items:
+            keys = S3PersonModel.person_deduplicate_keys(item)
+            if not keys:
+                continue
+            item_keys.append((item, keys))
+            if keys.fname and keys.lname:
+                fnames.add(keys.fname)
+            else:
+                initials.add(keys.initials)
+        if not item_keys:
+            return
+
         db = current.db
+        s3db = current.s3db
+
         ptable = db.pr_person
+        table = s3db.pr_contact
+        etable = table.with_alias("pr_email")
+        stable = table.with_alias("pr_sms")
+        itable = s3db.pr_identity
+
+        fields = [ptable._id,
+                  ptable.first_name,
+                  ptable.middle_name,
+                  ptable.last_name,
+                  ptable.initials,
+                  ptable.date_of_birth,
+                  etable.value,
+                  stable.value,
+                  itable.type,
+                  itable.value,
+                  ]
+
+        left = [etable.on((etable.pe_id == ptable.pe_id) & \
+                          (etable.contact_method == "EMAIL")),
+                stable.on((stable.pe_id == ptable.pe_id) & \
+                          (stable.contact_method == "SMS")),
+                itable.on(itable.person_id == ptable.id),
+                ]
+
+        # Look up the candidates
+        by_name = {}
+        by_initials = {}
+        size = 500
+        for values, field, index in ((fnames, ptable.first_name, by_name),
+                                     (initials, ptable.initials, by_initials)):
+            values = list(values)
+            for i in xrange(0, len(values), size):
+                query = field.lower().belongs(values[i:i+size])
+                rows = db(query).select(*fields,
+                                        left=left,
+                                        orderby=["pr_person.created_on ASC"])
+                for row in rows:
+                    person = row.pr_person
+                    if index is by_name:
+                        if not person.first_name or not person.last_name:
+                            continue
+                        key = (person.first_name.lower(),
+                               person.last_name.lower())
+                    else:
+                        if not person.initials:
+                            continue
+                        key = person.initials.lower()
+                    if key in index:
+                        index[key].append(row)
+                    else:
+                        index[key] = [row]
+
+        # Match the items
+        new = {}
+        for item, keys in item_keys:
+            if keys.fname and keys.lname:
+                key = (keys.fname, keys.lname)
+                candidates = by_name.get(key)
+            else:
+                key = keys.initials
+                candidates = by_initials.get(key)
+            if candidates:
+                S3PersonModel.person_deduplicate_match(item, keys, candidates)
+            if item.id:
+                continue
+
+            # Match against the earlier new items of the job
+            candidates = new.get(key)
+            if candidates:
+                S3PersonModel.person_deduplicate_match(item, keys, candidates)
+            if item.duplicate_of is None:
+                # Candidate rows for the record this item will create
+                rows = new.setdefault(key, [])
+                for id_type, id_value in (keys.id.items() or [(None, None)]):
+                    rows.append(Row({"pr_person": Row(id = None,
+                                                      first_name = keys.fname,
+                                                      middle_name = keys.mname,
+                                                      last_name = keys.lname,
+                                                      initials = keys.initials,
+                                                      date_of_birth = keys.dob,
+                                                      item = item,
+                                                      ),
+                                     "pr_email": Row(value = keys.email),
+                                     "pr_sms": Row(value = keys.sms),
+                                     "pr_identity": Row(type = id_type,
+                                                        value = id_value,
+                                                        ),
+                                     }))
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def person_deduplicate_keys(item):
+        """
+            Extract the deduplication keys from a pr_person import item
+
+            @param item: the import item
+
+            @return: Storage of keys, or None if there is not enough
+                     data to deduplicate the item
+        """
 
         # Mandatory data
         data = item.data
@@ -1104,14 +1358,8 @@ class S3PersonModel(S3Model):
         if initials:
             initials = initials.lower()
 
-        if fname and lname:
-            query = (ptable.first_name.lower() == fname) & \
-                    (ptable.last_name.lower() == lname)
-        elif initials:
-            query = (ptable.initials.lower() == initials)
-        else:
-            # Not enough we can use
-            return
+        if not (fname and lname) and not initials:
+            return None
 
         # Optional extra data
         dob = data.get("date_of_birth", None)
@@ -1131,44 +1379,47 @@ class S3PersonModel(S3Model):
                 if id_type and id_value:
                     id[id_type] = id_value
 
-        s3db = current.s3db
-        table = s3db.pr_contact
-        etable = table.with_alias("pr_email")
-
-        fields = [ptable._id,
-                  ptable.first_name,
-                  ptable.middle_name,
-                  ptable.last_name,
-                  ptable.initials,
-                  etable.value,
-                  ]
-
-        left = [etable.on((etable.pe_id == ptable.pe_id) & \
-                          (etable.contact_method == "EMAIL")),
-                ]
-
-        if dob:
-            fields.append(ptable.date_of_birth)
+        return Storage(fname = fname,
+                       mname = mname,
+                       lname = lname,
+                       initials = initials,
+                       dob = dob,
+                       email = email,
+                       sms = sms,
+                       id = id,
+                       )
 
-        if sms:
-            stable = table.with_alias("pr_sms")
-            fields.append(stable.value)
-            left.append(stable.on((stable.pe_id == ptable.pe_id) & \
-                                  (stable.contact_method == "SMS")))
-        if id:
-            itable = s3db.pr_identity
-            fields += [itable.type,
-                       itable.value,
-                       ]
-            left.append(itable.on(itable.person_id == ptable.id))
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def person_deduplicate_match(item, keys, candidates):
+        """
+            Rank the candidates for a pr_person import item and mark
+            the item as update of the best match (if any)
 
-        candidates = db(query).select(*fields,
-                                      left=left,
-                                      orderby=["pr_person.created_on ASC"])
+            @param item: the import item
+            @param keys: the deduplication keys of the item
+            @param candidates: the candidate rows
+        """
 
         if not candidates:
             return
 
+        s3db = current.s3db
+        ptable = s3db.pr_person
+        table = s3db.pr_contact
+        etable = table.with_alias("pr_email")
+        stable = table.with_alias("pr_sms")
+        itable = s3db.pr_identity
+
+        fname = keys.fname
+        mname = keys.mname
+        lname = keys.lname
+        initials = keys.initials
+        dob = keys.dob
+        email = keys.email
+        sms = keys.sms
+        id = keys.id
+
         duplicates = Storage()
 
         def rank(a, b, match, mismatch):
@@ -1237,8 +1488,13 @@ class S3PersonModel(S3Model):
             best_match = max(duplicates.keys())
             if best_match > 0:
                 duplicate = duplicates[best_match]
-                item.id = duplicate[ptable.id]
-                item.method = item.METHOD.UPDATE
+                record_id = duplicate[ptable.id]
+                if record_id is None:
+                    # New item earlier in the same import job (batch mode)
+                    item.duplicate_of = duplicate.pr_person.item
+                else:
+                    item.id = record_id
+                    item.method = item.METHOD.UPDATE
                 for citem in item.components:
                     citem.method = citem.METHOD.UPDATE
         return
@@ -1289,34 +1545,30 @@ class S3PersonModel(S3Model):
 
         settings = current.deployment_settings
         limit = int(_vars.limit or 0)
-        MAX_SEARCH_RESULTS = settings.get_search_max_results()
-        if (not limit or limit > MAX_SEARCH_RESULTS) and resource.count() > MAX_SEARCH_RESULTS:
-            output = json.dumps([
-                dict(label=str(current.T("There are more than %(max)s results, please input more characters.") % dict(max=MAX_SEARCH_RESULTS)))
-                ], separators=SEPARATORS)
-        else:
-            fields = ["id",
-                      "first_name",
-                      "middle_name",
-                      "last_name",
-                      ]
 
-            show_hr = settings.get_pr_search_shows_hr_details()
-            if show_hr:
-                fields.append("human_resource.job_title_id$name")
-                show_orgs = settings.get_hrm_show_organisation()
-                if show_orgs:
-                    fields.append("human_resource.organisation_id$name")
+        fields = ["id",
+                  "first_name",
+                  "middle_name",
+                  "last_name",
+                  ]
 
-            if settings.get_pr_reverse_names():
-                orderby = "pr_person.last_name"
-            else:
-                orderby = "pr_person.first_name"
-            rows = resource.select(fields=fields,
-                                   start=0,
-                                   limit=limit,
-                                   orderby=orderby)["rows"]
+        show_hr = settings.get_pr_search_shows_hr_details()
+        if show_hr:
+            fields.append("human_resource.job_title_id$name")
+            show_orgs = settings.get_hrm_show_organisation()
+            if show_orgs:
+                fields.append("human_resource.organisation_id$name")
 
+        if settings.get_pr_reverse_names():
+            orderby = "pr_person.last_name"
+        else:
+            orderby = "pr_person.first_name"
+        rows, message = search_ac_select(resource, fields,
+                                         limit=limit,
+                                         orderby=orderby)
+        if message:
+            output = json.dumps(message, separators=SEPARATORS)
+        else:
             items = []
             iappend = items.append
             for row in rows:
@@ -1485,14 +1737,11 @@ class S3PersonModel(S3Model):
         home_phone = post_vars.get("hphone", None)
         email = post_vars.get("email", None)
 
-        # https://github.com/derek73/python-nameparser
-        from nameparser import HumanName
-        name = HumanName(name.lower())
+        settings = current.deployment_settings
+        MAX_SEARCH_RESULTS = settings.get_search_max_results()
 
-        # @ToDo: Fuzzy Search
-        # We need to use an Index since we can't read all values in do client-side
-        # e.g. (Double) Metaphone or Levenshtein
-        # Options:
+        # Fuzzy Search using pr_PersonNameIndex (if enabled)
+        # Alternative options for larger databases:
         # * SOLR: http://wiki.apache.org/solr/AnalyzersTokenizersTokenFilters
         #         http://stackoverflow.com/questions/2116832/how-to-use-wildchards-fuzzy-search-with-solr
         #         http://stackoverflow.com/questions/9883151/solr-fuzzy-search-for-similar-words
@@ -1504,11 +1753,21 @@ class S3PersonModel(S3Model):
         #    * http://forums.mysql.com/read.php?20,282935,282935#msg-282935
 
         # Perform Search
-        query = (S3FieldSelector("first_name").lower().like(name.first + "%"))
-        if name.middle:
-            query &= (S3FieldSelector("middle_name").lower().like(name.middle + "%"))
-        if name.last:
-            query &= (S3FieldSelector("last_name").lower().like(name.last + "%"))
+        scores = None
+        if settings.get_pr_name_index():
+            matches = pr_PersonNameIndex.search(name, limit=MAX_SEARCH_RESULTS)
+            scores = dict((row.id, score) for score, row in matches)
+            query = (S3FieldSelector("id").belongs(scores.keys()))
+        else:
+            # https://github.com/derek73/python-nameparser
+            from nameparser import HumanName
+            name = HumanName(name.lower())
+
+            query = (S3FieldSelector("first_name").lower().like(name.first + "%"))
+            if name.middle:
+                query &= (S3FieldSelector("middle_name").lower().like(name.middle + "%"))
+            if name.last:
+                query &= (S3FieldSelector("last_name").lower().like(name.last + "%"))
 
         resource = r.resource
         resource.add_filter(query)
@@ -1523,8 +1782,6 @@ class S3PersonModel(S3Model):
                   "image.image",
                   ]
 
-        settings = current.deployment_settings
-        MAX_SEARCH_RESULTS = settings.get_search_max_results()
         show_hr = settings.get_pr_search_shows_hr_details()
         if show_hr:
             fields.append("human_resource.job_title_id$name")
@@ -1535,6 +1792,11 @@ class S3PersonModel(S3Model):
         rows = resource.select(fields=fields,
                                start=0,
                                limit=MAX_SEARCH_RESULTS)["rows"]
+        if scores:
+            # Best matches first
+            rows = sorted(rows,
+                          key=lambda row: scores.get(row["pr_person.id"], 0),
+                          reverse=True)
 
         # If no results then search other fields
         # @ToDo: Do these searches anyway & merge results together
@@ -4573,6 +4835,222 @@ class pr_PersonRepresent(S3Represent):
                                                  default,
                                                  none)
 
+# =============================================================================
+class pr_PersonNameIndex(object):
+    """
+        Fuzzy name index for person records (phonetic and trigram keys
+        of all name parts in pr_person_name_key), to find candidates
+        for duplicates with a single indexed query, ranked by
+        Jaro-Winkler similarity of the names
+
+        Maintained in pr_person_onaccept if settings.pr.name_index is
+        enabled, use rebuild() to index existing records.
+    """
+
+    # Maximum number of candidates to score per search
+    CANDIDATES = 200
+
+    # Minimum similarity for search results
+    THRESHOLD = 0.8
+
+    # Separators between name tokens
+    SEPARATORS = re.compile(r"[\W_]+", re.U)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tokens(cls, *names):
+        """
+            Normalize names into lowercase tokens without accents
+
+            @param names: the name(s)
+
+            @return: list of tokens
+        """
+
+        tokens = []
+        for name in names:
+            if not name:
+                continue
+            name = unicodedata.normalize("NFKD", s3_unicode(name).lower())
+            name = "".join(c for c in name if not unicodedata.combining(c))
+            tokens.extend(t for t in cls.SEPARATORS.split(name) if t)
+        return tokens
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def keys(tokens):
+        """
+            Get the index keys for name tokens
+
+            @param tokens: the name tokens (from tokens())
+
+            @return: set of keys
+        """
+
+        keys = set()
+        add = keys.add
+        for token in tokens:
+            # Phonetic key (Soundex only works for latin characters)
+            if token.isalpha() and all(c < u"\x80" for c in token):
+                add(str("s:%s" % soundex(token)))
+            # Trigrams (with start/end markers)
+            token = u"$%s$" % token
+            for i in xrange(len(token) - 2):
+                add(("t:%s" % token[i:i+3]).encode("utf-8"))
+        return keys
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def update(cls, person_ids):
+        """
+            Update the index for person records
+
+            @param person_ids: a person record ID or list of IDs
+        """
+
+        if not isinstance(person_ids, (list, tuple, set)):
+            person_ids = [person_ids]
+        if not person_ids:
+            return
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db.pr_person_name_key
+        ptable = s3db.pr_person
+
+        db(table.person_id.belongs(person_ids)).delete()
+
+        query = (ptable.id.belongs(person_ids)) & \
+                (ptable.deleted != True)
+        rows = db(query).select(ptable.id,
+                                ptable.first_name,
+                                ptable.middle_name,
+                                ptable.last_name,
+                                )
+        cls._index(rows)
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def rebuild(cls, chunk_size=1000):
+        """
+            Rebuild the index for all person records
+
+            @param chunk_size: number of records to index per query
+        """
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db.pr_person_name_key
+        ptable = s3db.pr_person
+
+        db(table.id > 0).delete()
+
+        last_id = 0
+        while True:
+            query = (ptable.id > last_id) & \
+                    (ptable.deleted != True)
+            rows = db(query).select(ptable.id,
+                                    ptable.first_name,
+                                    ptable.middle_name,
+                                    ptable.last_name,
+                                    orderby=ptable.id,
+                                    limitby=(0, chunk_size),
+                                    )
+            if not rows:
+                break
+            cls._index(rows)
+            last_id = rows.last().id
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _index(cls, rows):
+        """
+            Write the index keys for person rows
+
+            @param rows: the pr_person rows
+        """
+
+        records = []
+        append = records.append
+        for row in rows:
+            tokens = cls.tokens(row.first_name,
+                                row.middle_name,
+                                row.last_name)
+            for key in cls.keys(tokens):
+                append({"person_id": row.id, "name_key": key})
+        if records:
+            current.s3db.pr_person_name_key.bulk_insert(records)
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def search(cls, name, limit=None, threshold=None):
+        """
+            Find persons with similar names
+
+            @param name: the name to search for (all name parts)
+            @param limit: the maximum number of results
+            @param threshold: the minimum similarity (0.0 to 1.0)
+
+            @return: list of tuples (score, row) with pr_person rows
+                     (id, first_name, middle_name, last_name), best
+                     matches first
+        """
+
+        tokens = cls.tokens(name)
+        keys = cls.keys(tokens)
+        if not keys:
+            return []
+        if threshold is None:
+            threshold = cls.THRESHOLD
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db.pr_person_name_key
+        ptable = s3db.pr_person
+
+        # Candidates with the most keys in common
+        hits = table.id.count()
+        query = (table.name_key.belongs(keys))
+        rows = db(query).select(table.person_id,
+                                hits,
+                                groupby=table.person_id,
+                                orderby=~hits,
+                                limitby=(0, cls.CANDIDATES),
+                                )
+        person_ids = [row[table.person_id] for row in rows]
+        if not person_ids:
+            return []
+
+        query = (ptable.id.belongs(person_ids)) & \
+                (ptable.deleted != True)
+        rows = db(query).select(ptable.id,
+                                ptable.first_name,
+                                ptable.middle_name,
+                                ptable.last_name,
+                                )
+
+        # Rank by Jaro-Winkler similarity (of each search token with
+        # the most similar name part of the candidate)
+        results = []
+        append = results.append
+        for row in rows:
+            names = cls.tokens(row.first_name,
+                               row.middle_name,
+                               row.last_name)
+            if not names:
+                continue
+            score = sum(max(s3_jaro_winkler_similarity(token, n) for n in names)
+                        for token in tokens) / len(tokens)
+            if score >= threshold:
+                append((score, row))
+        results.sort(key=lambda item: item[0], reverse=True)
+        if limit:
+            results = results[:limit]
+        return results
+
 # =============================================================================
 def pr_person_phone_represent(id, show_link=True):
     """
@@ -5359,7 +5837,15 @@ def pr_define_role(pe_id,
             if str(role_type) != str(OU):
                 data["path"] = None
             s3db.pr_role_rebuild_path(duplicate.id, clear=True)
-        duplicate.update_record(**data)
+            duplicate.update_record(**data)
+            # Update the ancestor index for all affiliates
+            atable = s3db.pr_affiliation
+            query = (atable.role_id == duplicate.id) & \
+                    (atable.deleted != True)
+            rows = current.db(query).select(atable.pe_id)
+            pr_update_ancestors([row.pe_id for row in rows])
+        else:
+            duplicate.update_record(**data)
         record_id = duplicate.id
     else:
         record_id = rtable.insert(**data)
@@ -5583,13 +6069,21 @@ def pr_get_ancestors(pe_id):
     """
         Find all ancestor entities of a person entity in the OU hierarchy
         (performs a path lookup where paths are available, otherwise rebuilds
-        paths).
+        paths, or a lookup in the ancestor index if enabled).
 
         @param pe_id: the person entity ID
 
         @return: a list of PE-IDs
     """
 
+    if current.deployment_settings.get_security_ancestor_index():
+        pr_check_ancestors()
+        table = current.s3db.pr_ancestor
+        query = (table.descendant_pe_id == pe_id)
+        rows = current.db(query).select(table.ancestor_pe_id,
+                                        orderby=table.depth)
+        return [str(row.ancestor_pe_id) for row in rows]
+
     s3db = current.s3db
     atable = s3db.pr_affiliation
     rtable = s3db.pr_role
@@ -5617,6 +6111,7 @@ def pr_get_ancestors(pe_id):
 
     return ancestors
 
+
 # =============================================================================
 def pr_realm(entity):
     """
@@ -5628,6 +6123,14 @@ def pr_realm(entity):
     if not entity:
         return []
 
+    if current.deployment_settings.get_security_ancestor_index():
+        pr_check_ancestors()
+        table = current.s3db.pr_ancestor
+        query = (table.descendant_pe_id == entity) & \
+                (table.depth == 1)
+        rows = current.db(query).select(table.ancestor_pe_id)
+        return [row.ancestor_pe_id for row in rows]
+
     s3db = current.s3db
     atable = s3db.pr_affiliation
     rtable = s3db.pr_role
@@ -5640,6 +6143,7 @@ def pr_realm(entity):
     realm = [row.pe_id for row in rows]
     return realm
 
+
 # =============================================================================
 def pr_realm_users(realm, roles=None, role_types=OU):
     """
@@ -5693,7 +6197,7 @@ def pr_realm_users(realm, roles=None, role_types=OU):
 def pr_ancestors(entities):
     """
         Find all ancestor entities of the given entities in the
-        OU hierarchy.
+        OU hierarchy (or looks them up in the ancestor index if enabled).
 
         @param entities:
 
@@ -5703,6 +6207,20 @@ def pr_ancestors(entities):
     if not entities:
         return Storage()
 
+    if current.deployment_settings.get_security_ancestor_index():
+        pr_check_ancestors()
+        table = current.s3db.pr_ancestor
+        query = (table.descendant_pe_id.belongs(entities))
+        rows = current.db(query).select(table.ancestor_pe_id,
+                                        table.descendant_pe_id,
+                                        orderby=table.depth)
+        ancestors = Storage([(pe_id, []) for pe_id in entities])
+        for row in rows:
+            descendant = row.descendant_pe_id
+            if descendant in ancestors:
+                ancestors[descendant].append(str(row.ancestor_pe_id))
+        return ancestors
+
     s3db = current.s3db
     atable = s3db.pr_affiliation
     rtable = s3db.pr_role
@@ -5734,11 +6252,13 @@ def pr_ancestors(entities):
         ancestors[pe_id] = S3MultiPath.all_nodes(ancestors[pe_id])
     return ancestors
 
+
 # =============================================================================
 def pr_descendants(pe_ids, skip=None, root=True):
     """
         Find descendant entities of a person entity in the OU hierarchy
-        (performs a real search, not a path lookup), grouped by root PE
+        (performs a real search, not a path lookup, or a lookup in the
+        ancestor index if enabled), grouped by root PE
 
         @param pe_ids: set/list of pe_ids
         @param skip: list of person entity IDs to skip during
@@ -5748,6 +6268,10 @@ def pr_descendants(pe_ids, skip=None, root=True):
         @return: a dict of lists of descendant PEs per root PE
     """
 
+    if skip is None and root and \
+       current.deployment_settings.get_security_ancestor_index():
+        return pr_index_descendants(pe_ids)
+
     if skip is None:
         skip = set()
 
@@ -5812,11 +6336,13 @@ def pr_descendants(pe_ids, skip=None, root=True):
 
     return result
 
+
 # =============================================================================
 def pr_get_descendants(pe_ids, entity_types=None, skip=None, ids=True):
     """
         Find descendant entities of a person entity in the OU hierarchy
-        (performs a real search, not a path lookup).
+        (performs a real search, not a path lookup, or a lookup in the
+        ancestor index if enabled).
 
         @param pe_ids: person entity ID or list of IDs
         @param entity_types: optional filter to a specific entity_type
@@ -5833,6 +6359,12 @@ def pr_get_descendants(pe_ids, entity_types=None, skip=None, ids=True):
         pe_ids = set(pe_ids) \
                  if isinstance(pe_ids, (list, tuple)) else set([pe_ids])
 
+    if skip is None and \
+       current.deployment_settings.get_security_ancestor_index():
+        return pr_index_get_descendants(pe_ids,
+                                        entity_types=entity_types,
+                                        ids=ids)
+
     db = current.db
     s3db = current.s3db
     etable = s3db.pr_pentity
@@ -5889,6 +6421,103 @@ def pr_get_descendants(pe_ids, entity_types=None, skip=None, ids=True):
     else:
         return result
 
+
+# =============================================================================
+def pr_index_descendants(pe_ids):
+    """
+        Look up descendant entities of person entities in the ancestor
+        index, grouped by root PE (see pr_descendants)
+
+        @param pe_ids: set/list of pe_ids
+
+        @return: a dict of lists of descendant PEs per root PE
+                 (excluding persons)
+    """
+
+    pe_ids = set(pe_ids)
+    if not pe_ids:
+        return {}
+
+    pr_check_ancestors()
+
+    s3db = current.s3db
+    table = s3db.pr_ancestor
+    etable = s3db.pr_pentity
+
+    q = (table.ancestor_pe_id.belongs(pe_ids)) \
+        if len(pe_ids) > 1 else (table.ancestor_pe_id == list(pe_ids)[0])
+
+    query = q & \
+            (etable.pe_id == table.descendant_pe_id) & \
+            (etable.instance_type != "pr_person")
+    rows = current.db(query).select(table.ancestor_pe_id,
+                                    table.descendant_pe_id,
+                                    orderby=table.depth)
+    r = table._tablename
+
+    result = dict()
+    for row in rows:
+        row = row[r]
+        parent = row.ancestor_pe_id
+        child = row.descendant_pe_id
+        if parent not in result:
+            result[parent] = [child]
+        else:
+            result[parent].append(child)
+    return result
+
+# =============================================================================
+def pr_index_get_descendants(pe_ids, entity_types=None, ids=True):
+    """
+        Look up descendant entities of person entities in the ancestor
+        index (see pr_get_descendants)
+
+        @param pe_ids: set of person entity IDs
+        @param entity_types: optional filter to a specific entity_type
+        @param ids: whether to return a list of ids or nodes
+
+        @return: a list of PE-IDs
+    """
+
+    pr_check_ancestors()
+
+    db = current.db
+    s3db = current.s3db
+    table = s3db.pr_ancestor
+
+    if len(pe_ids) > 1:
+        query = (table.ancestor_pe_id.belongs(pe_ids))
+    else:
+        query = (table.ancestor_pe_id == list(pe_ids)[0])
+
+    if entity_types is not None:
+        etable = s3db.pr_pentity
+        query &= (etable.pe_id == table.descendant_pe_id)
+        rows = db(query).select(etable.pe_id,
+                                etable.instance_type,
+                                distinct=True)
+        # We still need to support Py 2.6
+        #result = {(r.pe_id, r.instance_type) for r in rows}
+        result = set((r.pe_id, r.instance_type) for r in rows)
+    else:
+        rows = db(query).select(table.descendant_pe_id, distinct=True)
+        # We still need to support Py 2.6
+        #result = {r.descendant_pe_id for r in rows}
+        result = set(r.descendant_pe_id for r in rows)
+
+    if ids:
+        if entity_types is not None:
+            if type(entity_types) is not set:
+                if not isinstance(entity_types, (tuple, list)):
+                    entity_types = set([entity_types])
+                else:
+                    entity_types = set(entity_types)
+            return [n[0] for n in result if n[1] in entity_types]
+        else:
+            return list(result)
+    else:
+        return result
+
 # =============================================================================
 # Internal Path Tools
 # =============================================================================
@@ -5902,7 +6531,7 @@ def pr_rebuild_path(pe_id, clear=False):
     """
 
     if isinstance(pe_id, Row):
-        pe_id = row.pe_id
+        pe_id = pe_id.pe_id
 
     rtable = current.s3db.pr_role
     query = (rtable.pe_id == pe_id) & \
@@ -5917,6 +6546,9 @@ def pr_rebuild_path(pe_id, clear=False):
     for role in roles:
         if role.path is None:
             pr_role_rebuild_path(role, clear=clear)
+    if clear:
+        # Ancestors have changed
+        pr_update_ancestors(pe_id)
     return
 
 # =============================================================================
@@ -5984,6 +6616,161 @@ def pr_role_rebuild_path(role_id, skip=[], clear=False):
 
     return path
 
+# =============================================================================
+def pr_rebuild_ancestors(pe_ids=None, descendants=True):
+    """
+        Rebuild the ancestor index (closure table of the OU hierarchy)
+        for person entities and all their descendants, to be called
+        whenever OU affiliations of these entities have changed
+
+        @param pe_ids: person entity ID or list of IDs, None to
+                       rebuild the whole index
+        @param descendants: also rebuild the index for all descendants
+                            of the entities
+    """
+
+    db = current.db
+    s3db = current.s3db
+    table = s3db.pr_ancestor
+    atable = s3db.pr_affiliation
+    rtable = s3db.pr_role
+
+    base = (atable.deleted != True) & \
+           (atable.role_id == rtable.id) & \
+           (rtable.deleted != True) & \
+           (rtable.role_type == OU)
+    a = atable._tablename
+    r = rtable._tablename
+
+    # Parents of each entity {child: set(parents)}
+    parents = {}
+    def add_parents(rows):
+        new = set()
+        for row in rows:
+            child = row[a].pe_id
+            parent = row[r].pe_id
+            if child in parents:
+                parents[child].add(parent)
+            else:
+                parents[child] = set([parent])
+            new.add(parent)
+        return new
+
+    if pe_ids is None:
+        # All affiliated entities
+        rows = db(base).select(atable.pe_id, rtable.pe_id)
+        add_parents(rows)
+        nodes = set(parents)
+        db(table.id > 0).delete()
+        ANCESTOR_INDEX.checked = True
+    else:
+        if not isinstance(pe_ids, (list, tuple, set)):
+            pe_ids = [pe_ids]
+        if not pe_ids:
+            return
+        # A partial update must not make an unbuilt index look complete
+        pr_check_ancestors()
+        nodes = set(pe_ids)
+        if descendants:
+            # Descendants inherit the changed ancestry, so re-index them too
+            query = (table.ancestor_pe_id.belongs(nodes))
+            rows = db(query).select(table.descendant_pe_id, distinct=True)
+            nodes.update(row.descendant_pe_id for row in rows)
+
+        # Collect the parents, level by level
+        pending = set(nodes)
+        seen = set()
+        while pending:
+            seen.update(pending)
+            query = base & (atable.pe_id.belongs(pending))
+            rows = db(query).select(atable.pe_id, rtable.pe_id)
+            pending = add_parents(rows) - seen
+        db(table.descendant_pe_id.belongs(nodes)).delete()
+
+    # Find all ancestors with their minimum distance
+    records = []
+    append = records.append
+    for node in nodes:
+        depths = {}
+        level = parents.get(node)
+        depth = 1
+        while level:
+            upper = set()
+            for parent in level:
+                if parent == node or parent in depths:
+                    continue
+                depths[parent] = depth
+                append({"ancestor_pe_id": parent,
+                        "descendant_pe_id": node,
+                        "depth": depth,
+                        })
+                if parent in parents:
+                    upper.update(parents[parent])
+            level = upper
+            depth += 1
+    if records:
+        table.bulk_insert(records)
+    return
+
+# =============================================================================
+def pr_update_ancestors(pe_ids):
+    """
+        Update the ancestor index after OU affiliations of person entities
+        have changed (if enabled): the entities themselves are re-indexed
+        immediately, their descendants asynchronously
+
+        @param pe_ids: person entity ID or list of IDs
+    """
+
+    if not current.deployment_settings.get_security_ancestor_index():
+        return
+    if not isinstance(pe_ids, (list, tuple, set)):
+        pe_ids = [pe_ids]
+    if not pe_ids:
+        return
+
+    pr_rebuild_ancestors(pe_ids, descendants=False)
+
+    # Re-index the descendants (batched, so that repeated changes in
+    # the same subtree are only processed once per batch)
+    pe_ids = json.dumps(sorted(pe_ids))
+    if current.s3task.async("pr_rebuild_ancestors",
+                            args=[pe_ids],
+                            batch=True) is False:
+        # Task not available
+        pr_rebuild_ancestors(json.loads(pe_ids))
+    return
+
+# =============================================================================
+def pr_check_ancestors():
+    """
+        Make sure the ancestor index is built: if the index is empty while
+        there are OU affiliations (e.g. after upgrading an existing
+        database), then rebuild it - checked once per process
+    """
+
+    if ANCESTOR_INDEX.checked:
+        return
+
+    db = current.db
+    s3db = current.s3db
+    table = s3db.pr_ancestor
+
+    if not db(table.id > 0).select(table.id, limitby=(0, 1)).first():
+        atable = s3db.pr_affiliation
+        rtable = s3db.pr_role
+        query = (atable.deleted != True) & \
+                (atable.role_id == rtable.id) & \
+                (rtable.deleted != True) & \
+                (rtable.role_type == OU)
+        if db(query).select(atable.id, limitby=(0, 1)).first():
+            # Sets ANCESTOR_INDEX.checked
+            pr_rebuild_ancestors()
+            return
+
+    ANCESTOR_INDEX.checked = True
+    return
+
 # =============================================================================
 def pr_image_represent(image_name,
                        format = None,
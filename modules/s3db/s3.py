@@ -27,7 +27,11 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
-__all__ = ["S3HierarchyModel"]
+__all__ = ["S3HierarchyModel",
+           "S3DuplicateModel",
+           "S3SearchKeyModel",
+           "S3RepresentCacheModel",
+           ]
 
 from gluon import *
 from ..s3 import *
@@ -36,7 +40,9 @@ from ..s3 import *
 class S3HierarchyModel(S3Model):
     """ Model for stored object hierarchies, experimental """
 
-    names = ["s3_hierarchy"]
+    names = ["s3_hierarchy",
+             "s3_hierarchy_delta",
+             ]
 
     def model(self):
 
@@ -53,6 +59,122 @@ class S3HierarchyModel(S3Model):
                            default=False),
                      Field("hierarchy", "json"),
                      *s3_timestamp())
+
+        # -------------------------------------------------------------------------
+        # Changes of a Stored Object Hierarchy since it was last stored
+        #
+        tablename = "s3_hierarchy_delta"
+        define_table(tablename,
+                     Field("tablename",
+                           length=64),
+                     Field("node_id", "integer"),
+                     Field("parent_id", "integer"),
+                     Field("category", "json"),
+                     Field("removed", "boolean",
+                           default=False),
+                     )
+
+        # ---------------------------------------------------------------------
+        # Return global names to s3.*
+        #
+        return {}
+
+    # -------------------------------------------------------------------------
+    def defaults(self):
+        """ Safe defaults if module is disabled """
+
+        return {}
+
+# =============================================================================
+class S3DuplicateModel(S3Model):
+    """ Candidate pairs of duplicate records, found by S3DuplicateFinder """
+
+    names = ["s3_duplicate",
+             ]
+
+    def model(self):
+
+        # -------------------------------------------------------------------------
+        # Candidate pairs for S3Merge
+        #
+        tablename = "s3_duplicate"
+        self.define_table(tablename,
+                          Field("tablename",
+                                length=64),
+                          Field("original_id", "integer"),
+                          Field("duplicate_id", "integer"),
+                          # Similarity in percent
+                          Field("score", "double"),
+                          # Reviewed and not a duplicate
+                          Field("dismissed", "boolean",
+                                default=False),
+                          *s3_timestamp())
+
+        # ---------------------------------------------------------------------
+        # Return global names to s3.*
+        #
+        return {}
+
+    # -------------------------------------------------------------------------
+    def defaults(self):
+        """ Safe defaults if module is disabled """
+
+        return {}
+
+# =============================================================================
+class S3SearchKeyModel(S3Model):
+    """ Normalized search keys for autocomplete lookups, see S3SearchKey """
+
+    names = ["s3_search_key",
+             ]
+
+    def model(self):
+
+        # -------------------------------------------------------------------------
+        # Search Keys
+        # - maintained by S3SearchKey, do not edit
+        #
+        tablename = "s3_search_key"
+        self.define_table(tablename,
+                          Field("tablename",
+                                length=64),
+                          Field("record_id", "integer"),
+                          Field("search_key",
+                                length=128),
+                          )
+
+        # ---------------------------------------------------------------------
+        # Return global names to s3.*
+        #
+        return {}
+
+    # -------------------------------------------------------------------------
+    def defaults(self):
+        """ Safe defaults if module is disabled """
+
+        return {}
+
+# =============================================================================
+class S3RepresentCacheModel(S3Model):
+    """ Generation counters for the shared representation cache """
+
+    names = ["s3_represent_generation",
+             ]
+
+    def model(self):
+
+        # -------------------------------------------------------------------------
+        # Generation counters per lookup table
+        # - maintained by S3RepresentCache, do not edit
+        #
+        tablename = "s3_represent_generation"
+        self.define_table(tablename,
+                          Field("tablename",
+                                length=64),
+                          Field("generation", "integer",
+                                default=0),
+                          )
+
         # ---------------------------------------------------------------------
         # Return global names to s3.*
         #
@@ -59,6 +59,7 @@ __all__ = ["S3SurveyTemplateModel",
            "survey_save_answers_for_series",
            "survey_updateMetaData",
            "survey_getAllAnswersForQuestionInSeries",
+           "survey_getAnswerColumns",
            "survey_getQstnLayoutRules",
            "survey_getSeries",
            "survey_getSeriesName",
@@ -73,6 +74,8 @@ __all__ = ["S3SurveyTemplateModel",
            "survey_json2list",
           ]
 
+import datetime
+
 try:
     import json # try stdlib (Python 2.6)
 except ImportError:
@@ -91,6 +94,10 @@ from s3survey import survey_question_type, \
                      survey_analysis_type, \
                      _debug
 
+# Seconds to re-read responses modified before the last refresh of
+# the answer columns (to catch responses which have been committed late)
+SURVEY_ANSWER_COLUMN_MARGIN = 300
+
 # =============================================================================
 def json2py(jsonstr):
     """
@@ -2557,6 +2564,7 @@ class S3SurveyCompleteModel(S3Model):
     names = ["survey_complete",
              "survey_complete_id",
              "survey_answer",
+             "survey_answer_column",
              ]
 
     def model(self):
@@ -2649,6 +2657,25 @@ class S3SurveyCompleteModel(S3Model):
                   onaccept = self.answer_onaccept,
                   )
 
+        # ---------------------------------------------------------------------
+        # The survey_answer_column table is a columnar copy of the answers
+        #    of a series, one record per question holding the answers of
+        #    all responses, so that the analysis can read all answers to
+        #    a series in one go (see survey_getAnswerColumns).
+        #    This is maintained automatically - never edit it manually.
+        #    Concurrent refreshes can insert a column twice, which the next
+        #    refresh cleans up (so no unique constraint on series/question)
+
+        tablename = "survey_answer_column"
+        define_table(tablename,
+                     self.survey_series_id(),
+                     self.survey_question_id(),
+                     # JSON [[complete_id, ...], [value, ...]]
+                     Field("answers", "text"),
+                     # Completes modified up to this time are included
+                     Field("complete_mtime", "datetime"),
+                     )
+
         # ---------------------------------------------------------------------
         return dict(survey_complete_id = complete_id)
 
@@ -2733,6 +2760,10 @@ class S3SurveyCompleteModel(S3Model):
         S3Chart.purgeCache(purgePrefix)
         if series_id == None:
             return
+        # Answer columns of this series must be re-read from the store
+        columns = current.response.s3.survey_answer_columns
+        if columns:
+            columns.pop(series_id, None)
         # Save all the answers from answerList in the survey_answer table
         answerList = record.answer_list
         S3SurveyCompleteModel.importAnswers(complete_id, answerList)
@@ -2884,10 +2915,14 @@ class S3SurveyCompleteModel(S3Model):
             value = vars.value
             widgetObj = survey_getWidgetFromQuestion(question_id)
             newValue = widgetObj.onaccept(value)
+            db = current.db
             if newValue != value:
                 query = (atable.question_id == question_id) & \
                         (atable.complete_id == complete_id)
-                current.db(query).update(value = newValue)
+                db(query).update(value = newValue)
+            # Mark the response as modified (to refresh survey_answer_column)
+            ctable = current.s3db.survey_complete
+            db(ctable.id == complete_id).update(modified_on = current.request.utcnow)
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -3028,23 +3063,139 @@ def survey_getAllAnswersForQuestionInSeries(question_id, series_id):
         from with a specified series
     """
 
+    columns = survey_getAnswerColumns(series_id)
+    complete_ids, values = columns.get(int(question_id), ([], []))
+    answers = []
+    append = answers.append
+    for complete_id, value in zip(complete_ids, values):
+        append({"complete_id": complete_id,
+                "value": value,
+                })
+    return answers
+
+# =============================================================================
+def survey_getAnswerColumns(series_id):
+    """
+        Get all answers of a series from the columnar answer store
+        (survey_answer_column), after refreshing the store with the
+        responses which have been modified since the last refresh
+
+        @param series_id: the series ID
+
+        @return: dict {question_id: ([complete_id, ...], [value, ...])}
+                 with the answers of each question ordered by complete_id
+    """
+
+    s3 = current.response.s3
+    cache = s3.survey_answer_columns
+    if cache is None:
+        cache = s3.survey_answer_columns = {}
+    series_id = int(series_id)
+    if series_id in cache:
+        return cache[series_id]
+
+    db = current.db
     s3db = current.s3db
     ctable = s3db.survey_complete
     atable = s3db.survey_answer
-    query = (atable.question_id == question_id) & \
-            (atable.complete_id == ctable.id) & \
-            (ctable.series_id == series_id)
-    rows = current.db(query).select(atable.id,
-                                    atable.value,
-                                    atable.complete_id)
-    answers = []
+    table = s3db.survey_answer_column
+
+    # Read the store
+    rows = db(table.series_id == series_id).select(table.id,
+                                                   table.question_id,
+                                                   table.answers,
+                                                   table.complete_mtime,
+                                                   orderby=table.id,
+                                                   )
+    records = {}
+    stored = {}
+    columns = {}
+    duplicates = []
+    mtime = None
     for row in rows:
-        answer = {}
-        answer["answer_id"] = row.id
-        answer["value"] = row.value
-        answer["complete_id"] = row.complete_id
-        answers.append(answer)
-    return answers
+        question_id = row.question_id
+        if question_id in records:
+            # Inserted twice by concurrent refreshes => keep the first
+            duplicates.append(row.id)
+            continue
+        records[question_id] = row.id
+        stored[question_id] = row.answers
+        complete_ids, values = json.loads(row.answers)
+        columns[question_id] = dict(zip(complete_ids, values))
+        if mtime is None or row.complete_mtime < mtime:
+            mtime = row.complete_mtime
+    if duplicates:
+        db(table.id.belongs(duplicates)).delete()
+
+    # Find the responses modified since the last refresh
+    query = (ctable.series_id == series_id)
+    if mtime is not None:
+        # Re-read responses from a little before the last refresh, to
+        # include responses which have been committed late
+        since = mtime - datetime.timedelta(seconds=SURVEY_ANSWER_COLUMN_MARGIN)
+        query &= (ctable.modified_on >= since)
+    completes = db(query).select(ctable.id,
+                                 ctable.deleted,
+                                 ctable.modified_on,
+                                 )
+    if completes:
+        last_refresh = mtime
+        updated = set()
+        deleted = set()
+        for row in completes:
+            if row.deleted:
+                deleted.add(row.id)
+            else:
+                updated.add(row.id)
+            if mtime is None or row.modified_on > mtime:
+                mtime = row.modified_on
+
+        # Remove the old answers of all modified responses
+        obsolete = updated | deleted
+        for column in columns.values():
+            for complete_id in obsolete:
+                column.pop(complete_id, None)
+
+        # Add the current answers of the updated responses
+        if updated:
+            query = (atable.complete_id == ctable.id) & \
+                    (ctable.series_id == series_id) & \
+                    (ctable.deleted != True)
+            if len(updated) < len(completes) or records:
+                query &= (ctable.id.belongs(updated))
+            rows = db(query).select(atable.question_id,
+                                    atable.complete_id,
+                                    atable.value,
+                                    )
+            for row in rows:
+                question_id = row.question_id
+                column = columns.get(question_id)
+                if column is None:
+                    column = columns[question_id] = {}
+                column[row.complete_id] = row.value
+
+        # Write back the columns which have changed
+        for question_id, column in columns.items():
+            complete_ids = sorted(column.keys())
+            answers = json.dumps([complete_ids,
+                                  [column[i] for i in complete_ids]])
+            record_id = records.get(question_id)
+            if record_id is None:
+                table.insert(series_id=series_id,
+                             question_id=question_id,
+                             answers=answers,
+                             complete_mtime=mtime)
+            elif answers != stored[question_id]:
+                db(table.id == record_id).update(answers=answers)
+        if records and mtime != last_refresh:
+            db(table.series_id == series_id).update(complete_mtime=mtime)
+
+    result = {}
+    for question_id, column in columns.items():
+        complete_ids = sorted(column.keys())
+        result[question_id] = (complete_ids, [column[i] for i in complete_ids])
+    cache[series_id] = result
+    return result
 
 # =============================================================================
 def buildTableFromCompletedList(dataSource):
@@ -29,6 +29,8 @@
 
 import sys
 
+from collections import Counter
+
 try:
     from cStringIO import StringIO    # Faster, where available
 except:
@@ -2856,6 +2858,7 @@ class S3AbstractAnalysis():
                          id, complete_id and value
                          See models/survey.py getAllAnswersForQuestionInSeries()
         valueList      - A list of validated & sanitised values
+        completeIdList - The complete_ids of the values in valueList
         result         - A list of results before formatting
         type           - The question type
         qstnWidget     - The question Widget for this question
@@ -2871,6 +2874,7 @@ class S3AbstractAnalysis():
         self.question_id = question_id
         self.answerList = answerList
         self.valueList = []
+        self.completeIdList = []
         self.result = []
         self.type = type
         self.qstnWidget = survey_question_type[self.type](question_id = question_id)
@@ -2878,13 +2882,18 @@ class S3AbstractAnalysis():
         self.priorityGroups = {"default" : [-1, -0.5, 0, 0.5, 1],
                                "standard" : [-2, -1, 0, 1, 2],
                                }
+        valid = self.valid
+        castRawAnswer = self.castRawAnswer
+        values = self.valueList
+        complete_ids = self.completeIdList
         for answer in self.answerList:
-            if self.valid(answer):
+            if valid(answer):
+                complete_id = answer["complete_id"]
                 try:
-                    cast = self.castRawAnswer(answer["complete_id"],
-                                              answer["value"])
+                    cast = castRawAnswer(complete_id, answer["value"])
                     if cast != None:
-                        self.valueList.append(cast)
+                        values.append(cast)
+                        complete_ids.append(complete_id)
                 except:
                     if DEBUG:
                         raise
@@ -3002,13 +3011,7 @@ class S3AbstractAnalysis():
         """
             Calculate the number of occurances of each value
         """
-        map = {}
-        for answer in self.valueList:
-            if answer in map:
-                map[answer] += 1
-            else:
-                map[answer] = 1
-        return map
+        return dict(Counter(self.valueList))
 
     # -------------------------------------------------------------------------
     def groupData(self, groupAnswer):
@@ -3133,23 +3136,17 @@ class S3NumericAnalysis(S3AbstractAnalysis):
 
     # -------------------------------------------------------------------------
     def basicResults(self):
-        self.cnt = 0
-        if len(self.valueList) == 0:
+        valueList = self.valueList
+        self.cnt = len(valueList)
+        if self.cnt == 0:
             self.sum = None
             self.average = None
             self.max = None
             self.min = None
             return
-        self.sum = 0
-        self.max = self.valueList[0]
-        self.min = self.valueList[0]
-        for answer in self.valueList:
-            self.cnt += 1
-            self.sum += answer
-            if answer > self.max:
-                self.max = answer
-            if answer < self.min:
-                self.min = answer
+        self.sum = sum(valueList)
+        self.max = max(valueList)
+        self.min = min(valueList)
         self.average = self.sum / float(self.cnt)
 
     # -------------------------------------------------------------------------
@@ -3159,18 +3156,12 @@ class S3NumericAnalysis(S3AbstractAnalysis):
         except:
             print >> sys.stderr, "ERROR: S3Survey requires numpy library installed."
 
-        array = array(self.valueList)
-        self.std = array.std()
-        self.mean = array.mean()
-        self.zscore = {}
-        for answer in self.answerList:
-            complete_id = answer["complete_id"]
-            try:
-                value = self.castRawAnswer(complete_id, answer["value"])
-            except:
-                continue
-            if value != None:
-                self.zscore[complete_id] = (value - self.mean) / self.std
+        values = array(self.valueList)
+        self.std = values.std()
+        self.mean = values.mean()
+        # Z-scores of all responses in one go
+        zscores = (values - self.mean) / self.std
+        self.zscore = dict(zip(self.completeIdList, zscores.tolist()))
 
     # -------------------------------------------------------------------------
     def priority(self, complete_id, priorityObj):
@@ -3266,14 +3257,8 @@ class S3OptionAnalysis(S3AbstractAnalysis):
 
     # -------------------------------------------------------------------------
     def basicResults(self):
-        self.cnt = 0
-        self.list = {}
-        for answer in self.valueList:
-            self.cnt += 1
-            if answer in self.list:
-                self.list[answer] += 1
-            else:
-                self.list[answer] = 1
+        self.cnt = len(self.valueList)
+        self.list = dict(Counter(self.valueList))
         self.listp = {}
         if self.cnt != 0:
             for (key, value) in self.list.items():
@@ -4,12 +4,18 @@ from unit_tests.s3.s3crud import *
 from unit_tests.s3.s3datatable import *
 from unit_tests.s3.s3fields import *
 from unit_tests.s3.s3filter import *
+from unit_tests.s3.s3gis import *
+from unit_tests.s3.s3hierarchy import *
 from unit_tests.s3.s3import import *
+from unit_tests.s3.s3merge import *
 from unit_tests.s3.s3model import *
 from unit_tests.s3.s3msg import *
+from unit_tests.s3.s3notify import *
+from unit_tests.s3.s3profiler import *
 from unit_tests.s3.s3resource import *
 from unit_tests.s3.s3rest import *
 from unit_tests.s3.s3sync import *
+from unit_tests.s3.s3task import *
 from unit_tests.s3.s3timeplot import *
 from unit_tests.s3.s3validators import *
 from unit_tests.s3.s3widgets import *
@@ -277,6 +277,115 @@ class S3PerformanceTests(unittest.TestCase):
 
         current.auth.override = False
 
+    def testGISEncode(self):
+        """ Queries per export in S3XML.gis_encode """
+
+        db = current.db
+        s3db = current.s3db
+
+        print ""
+        current.auth.override = True
+
+        table = s3db.gis_location
+        rows = db(table.wkt != None).select(table.id, limitby=(0, 1000))
+        ids = [row.id for row in rows]
+        n = len(ids)
+        if not n:
+            print "S3XML.gis_encode: no polygons to test with"
+            current.auth.override = False
+            return
+
+        # Count the queries
+        adapter = db._adapter
+        execute = adapter.execute
+        queries = [0]
+        def count(*args, **kwargs):
+            queries[0] += 1
+            return execute(*args, **kwargs)
+        adapter.execute = count
+
+        try:
+            # Lookup record by record (as gis_encode did before)
+            get_geometries = current.gis.get_geometries
+            x = lambda: [get_geometries(table, [i], polygons=True)
+                         for i in ids]
+            queries[0] = 0
+            mlt = timeit.Timer(x).timeit(number=1)
+            print "S3XML.gis_encode (per record) = %s queries/export, %s ms (%s records)" % \
+                  (queries[0], mlt * 1000, n)
+
+            # Bulk lookup
+            from lxml import etree
+            resource = s3db.resource("gis_location", id=ids)
+            resource.load(limit=None)
+            records = resource._rows
+            xml = current.xml
+            def encode():
+                xml.geometries = {}
+                for record in records:
+                    element = etree.Element("resource")
+                    xml.gis_encode(resource, record, element, [])
+            queries[0] = 0
+            mlt = timeit.Timer(encode).timeit(number=1)
+            print "S3XML.gis_encode (bulk) = %s queries/export, %s ms (%s records)" % \
+                  (queries[0], mlt * 1000, n)
+            self.assertTrue(queries[0] <= 1)
+        finally:
+            adapter.execute = execute
+            current.auth.override = False
+
+    def testACLCache(self):
+        """ Applicable ACLs with and without shared ACL cache (policy 8) """
+
+        from s3.s3aaa import S3Permission, S3PermissionCache
+
+        db = current.db
+        auth = current.auth
+        settings = current.deployment_settings
+
+        print ""
+        policy = settings.get_security_policy()
+        acl_cache = settings.get_security_acl_cache()
+        settings.security.policy = 8
+
+        # Synthetic realms: 20 roles with 10 realm entities each,
+        # and 10 delegations each
+        gtable = auth.settings.table_group
+        roles = [row.id for row in db(gtable.deleted != True).select(gtable.id)]
+        roles = roles[:20]
+        realms = dict((role, range(role * 10, role * 10 + 10))
+                      for role in roles)
+        delegations = dict((role, {1000 + role: range(10)})
+                           for role in roles)
+        tablenames = ["pr_person", "org_organisation", "hrm_human_resource"]
+
+        def applicable_acls(acl):
+            for tablename in tablenames:
+                for method in ("read", "update", "delete"):
+                    racl = acl.METHODS[method]
+                    acl.applicable_acls(racl,
+                                        realms=realms,
+                                        delegations=delegations,
+                                        c="org",
+                                        f="organisation",
+                                        t=tablename)
+
+        try:
+            settings.security.acl_cache = False
+            x = lambda: applicable_acls(S3Permission(auth))
+            mlt = timeit.Timer(x).timeit(number=100) * 10
+            print "S3Permission.applicable_acls (uncached) = %s ms" % mlt
+
+            settings.security.acl_cache = "ram"
+            S3PermissionCache.invalidate()
+            x = lambda: applicable_acls(S3Permission(auth))
+            mlt = timeit.Timer(x).timeit(number=100) * 10
+            print "S3Permission.applicable_acls (cached) = %s ms" % mlt
+        finally:
+            S3PermissionCache.invalidate()
+            settings.security.acl_cache = acl_cache
+            settings.security.policy = policy
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -9,7 +9,7 @@ import unittest
 
 from gluon import *
 from gluon.storage import Storage
-from s3.s3aaa import S3EntityRoleManager, S3Permission
+from s3.s3aaa import S3EntityRoleManager, S3Permission, S3PermissionCache
 from s3.s3fields import s3_meta_fields
 
 # =============================================================================
@@ -2522,6 +2522,74 @@ class AccessibleQueryTests(unittest.TestCase):
                                    role="TestOrgUnit")
         auth.s3_withdraw_role(user, self.reader, for_pe=self.org[2])
 
+    # -------------------------------------------------------------------------
+    def testPolicy8Cached(self):
+        """ Test accessible query with policy 8 and shared ACL cache """
+
+        s3db = current.s3db
+        auth = current.auth
+        settings = current.deployment_settings
+
+        settings.security.policy = 8
+
+        accessible_query = auth.s3_accessible_query
+        c = "org"
+        f = "permission_test"
+        table = current.s3db.org_permission_test
+        assertEqual = self.assertEqual
+
+        methods = ("read", "update", "delete")
+        def queries():
+            return [accessible_query(method, table, c=c, f=f)
+                    for method in methods]
+
+        # Add the user as staff member (=OU) of org[2] and assign TESTEDITOR
+        auth.s3_impersonate("normaluser@example.com")
+        user_id = auth.user.id
+        user = auth.s3_user_pe_id(user_id)
+        try:
+            s3db.pr_add_affiliation(self.org[2], user, role="TestStaff")
+            auth.s3_assign_role(user_id, self.editor, for_pe=self.org[2])
+
+            # Get the queries without cache
+            settings.security.acl_cache = False
+            auth.permission = S3Permission(auth)
+            expected = queries()
+
+            # Queries with cache must be the same, both when
+            # compiling the ACLs and when using the cached ACLs
+            settings.security.acl_cache = "ram"
+            auth.permission = S3Permission(auth)
+            cache = auth.permission.cache
+            self.assertNotEqual(cache, None)
+            assertEqual(queries(), expected)
+            hits = cache.hits
+            auth.permission = S3Permission(auth)
+            assertEqual(queries(), expected)
+            self.assertTrue(cache.hits > hits)
+
+            # Updating an ACL must invalidate the cache
+            acl = auth.permission
+            acl.update_acl(self.editor,
+                           c="org",
+                           f="permission_test",
+                           uacl=acl.READ,
+                           oacl=acl.READ)
+            auth.permission = S3Permission(auth)
+            cached = queries()
+
+            settings.security.acl_cache = False
+            auth.permission = S3Permission(auth)
+            assertEqual(cached, queries())
+            self.assertNotEqual(cached, expected)
+
+        finally:
+            settings.security.acl_cache = "ram"
+            S3PermissionCache.invalidate()
+            settings.security.acl_cache = False
+            s3db.pr_remove_affiliation(self.org[2], user, role="TestStaff")
+            auth.s3_withdraw_role(user_id, self.editor, for_pe=self.org[2])
+
     ## -------------------------------------------------------------------------
     #def testPerformance(self):
         #""" Test accessible query performance """
@@ -4144,6 +4212,60 @@ class EntityRoleManagerTests(unittest.TestCase):
     def tearDownClass(cls):
         pass
 
+# =============================================================================
+class PermissionCacheTests(unittest.TestCase):
+    """ Test the shared ACL cache """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        settings = current.deployment_settings
+        self.acl_cache = settings.get_security_acl_cache()
+        settings.security.acl_cache = "ram"
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.deployment_settings.security.acl_cache = self.acl_cache
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testInvalidateOtherProcess(self):
+        """ Test invalidation of the cache by another process """
+
+        db = current.db
+        cache = S3PermissionCache.get_cache()
+        self.assertNotEqual(cache, None)
+
+        key = ("PermissionCacheTests",)
+        cache.set(key, "value")
+        self.assertEqual(cache.get(key), "value")
+
+        # Another process increments the generation in the database
+        table = db[S3PermissionCache.TABLENAME]
+        if not db(table.id > 0).update(generation=table.generation + 1):
+            table.insert(generation=1)
+
+        # Still valid within the same request
+        self.assertEqual(cache.get(key), "value")
+
+        # Invalid with the next request
+        current.response.pop(S3PermissionCache.PREFIX, None)
+        self.assertEqual(cache.get(key), None)
+
+    # -------------------------------------------------------------------------
+    def testACLOnaccept(self):
+        """ Test invalidation of the cache by CRUD callbacks """
+
+        cache = S3PermissionCache.get_cache()
+
+        key = ("PermissionCacheTests",)
+        cache.set(key, "value")
+        self.assertEqual(cache.get(key), "value")
+
+        S3Permission.acl_onaccept(Storage(vars=Storage()))
+        self.assertEqual(cache.get(key), None)
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -4172,6 +4294,7 @@ if __name__ == "__main__":
         RealmEntityTests,
         LinkToPersonTests,
         EntityRoleManagerTests,
+        PermissionCacheTests,
     )
 
 # END ========================================================================
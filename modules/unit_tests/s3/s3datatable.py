@@ -94,6 +94,83 @@ class S3DataTableTests(unittest.TestCase):
 
         current.auth.override = False
 
+# =============================================================================
+class S3PivotTableDBAggregateTests(unittest.TestCase):
+    """ Tests for database-side aggregation in S3PivotTable """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+    # -------------------------------------------------------------------------
+    def testCountLayer(self):
+        """ Test count-layer computed in the database """
+
+        s3db = current.s3db
+
+        layers = [("organisation_id", "count")]
+
+        resource = s3db.resource("org_office")
+        expected = resource.pivottable("office_type_id",
+                                       "location_id$L0",
+                                       list(layers),
+                                       db_aggregate=False)
+        self.assertFalse(expected.db_aggregate)
+
+        resource = s3db.resource("org_office")
+        pt = resource.pivottable("office_type_id",
+                                 "location_id$L0",
+                                 list(layers),
+                                 db_aggregate=True)
+        self.assertTrue(pt.db_aggregate)
+
+        self.assertEqual(len(pt), len(expected))
+        self.assertEqual(pt.json(), expected.json())
+
+    # -------------------------------------------------------------------------
+    def testNumericLayers(self):
+        """ Test numeric layers computed in the database """
+
+        s3db = current.s3db
+
+        for method in ("sum", "min", "max", "avg"):
+
+            layers = [("quantity", method)]
+
+            resource = s3db.resource("inv_inv_item")
+            expected = resource.pivottable("site_id", "item_id",
+                                           list(layers),
+                                           db_aggregate=False)
+            resource = s3db.resource("inv_inv_item")
+            pt = resource.pivottable("site_id", "item_id",
+                                     list(layers),
+                                     db_aggregate=True)
+            self.assertTrue(pt.db_aggregate)
+
+            layer = pt.layers[0]
+            self.assertEqual(pt.totals[layer], expected.totals[layer])
+
+            output = pt.json()
+            expected_output = expected.json()
+            for key in ("rows", "cols", "cells", "total"):
+                self.assertEqual(output[key], expected_output[key])
+
+    # -------------------------------------------------------------------------
+    def testFallback(self):
+        """ Test fallback to Python for component fields """
+
+        resource = current.s3db.resource("org_organisation")
+        pt = resource.pivottable("office.name", None,
+                                 [("id", "count")],
+                                 db_aggregate=True)
+        self.assertFalse(pt.db_aggregate)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.auth.override = False
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -111,6 +188,7 @@ if __name__ == "__main__":
 
     run_suite(
         S3DataTableTests,
+        S3PivotTableDBAggregateTests,
     )
 
 # END ========================================================================
\ No newline at end of file
@@ -301,6 +301,149 @@ class S3RepresentTests(unittest.TestCase):
         current.db.rollback()
         current.auth.override = False
         
+# =============================================================================
+class S3RepresentCacheTests(unittest.TestCase):
+    """ Tests for the shared representation cache """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        settings = current.deployment_settings
+        self.represent_cache = settings.get_base_represent_cache()
+        settings.base.represent_cache = "ram"
+
+        s3db = current.s3db
+
+        otable = s3db.org_organisation
+        org = Storage(name="Represent Cache Test Organisation")
+        org_id = otable.insert(**org)
+        org.update(id=org_id)
+        s3db.update_super(otable, org)
+
+        self.org_id = org_id
+        self.name = org.name
+
+    # -------------------------------------------------------------------------
+    def testSharedLookup(self):
+        """ Test sharing of lookups between renderers """
+
+        r = S3Represent(lookup="org_organisation")
+        self.assertEqual(r(self.org_id), self.name)
+        self.assertEqual(r.queries, 1)
+
+        rcache = r.rcache
+        self.assertNotEqual(rcache, None)
+        hits = rcache.stats().hits
+
+        # Same configuration => no query
+        r = S3Represent(lookup="org_organisation")
+        self.assertEqual(r(self.org_id), self.name)
+        self.assertEqual(r.queries, 0)
+        self.assertEqual(rcache.stats().hits, hits + 1)
+
+        # Different configuration => separate entries
+        r = S3Represent(lookup="org_organisation", fields=["name", "acronym"])
+        r(self.org_id)
+        self.assertEqual(r.queries, 1)
+
+        # Translated representations are not cached
+        r = S3Represent(lookup="org_organisation", translate=True)
+        r(self.org_id)
+        r = S3Represent(lookup="org_organisation", translate=True)
+        r(self.org_id)
+        self.assertEqual(r.queries, 1)
+
+    # -------------------------------------------------------------------------
+    def testInvalidation(self):
+        """ Test invalidation by onaccept/ondelete of the lookup table """
+
+        s3db = current.s3db
+
+        r = S3Represent(lookup="org_organisation")
+        self.assertEqual(r(self.org_id), self.name)
+
+        # Callbacks are appended to existing callbacks
+        onaccept = s3db.get_config("org_organisation", "onaccept")
+        self.assertTrue(isinstance(onaccept, list))
+        self.assertTrue(r.rcache.callbacks["org_organisation"] in onaccept)
+
+        # Re-configuring the table preserves the callbacks
+        s3db.configure("org_organisation", ondelete=lambda row: None)
+        ondelete = s3db.get_config("org_organisation", "ondelete")
+        self.assertTrue(r.rcache.callbacks["org_organisation"] in ondelete)
+
+        # Change the record and run the callback
+        db = current.db
+        otable = s3db.org_organisation
+        db(otable.id == self.org_id).update(name="Renamed Organisation")
+        for cb in ondelete:
+            cb(Storage(id=self.org_id))
+
+        r = S3Represent(lookup="org_organisation")
+        self.assertEqual(r(self.org_id), "Renamed Organisation")
+        self.assertEqual(r.queries, 1)
+
+    # -------------------------------------------------------------------------
+    def testInvalidationByOtherProcess(self):
+        """ Test invalidation through the generation counter in the DB """
+
+        db = current.db
+        s3db = current.s3db
+
+        r = S3Represent(lookup="org_organisation")
+        self.assertEqual(r(self.org_id), self.name)
+
+        # Another process changes the record and increments the generation
+        otable = s3db.org_organisation
+        db(otable.id == self.org_id).update(name="Renamed Organisation")
+        table = s3db[S3RepresentCache.TABLENAME]
+        query = (table.tablename == "org_organisation")
+        if not db(query).update(generation=table.generation + 1):
+            table.insert(tablename="org_organisation", generation=1)
+
+        # The generation is looked up only once per request
+        r = S3Represent(lookup="org_organisation")
+        self.assertEqual(r(self.org_id), self.name)
+        self.assertEqual(r.queries, 0)
+
+        # Next request
+        current.response.pop(S3RepresentCache.PREFIX, None)
+        r = S3Represent(lookup="org_organisation")
+        self.assertEqual(r(self.org_id), "Renamed Organisation")
+        self.assertEqual(r.queries, 1)
+
+    # -------------------------------------------------------------------------
+    def testEviction(self):
+        """ Test LRU eviction """
+
+        rcache = S3RepresentCache(maxsize=2)
+        rkey = ("org_organisation", "test")
+
+        rcache.set(rkey, {1: "A", 2: "B"})
+        # Mark 1 as recently used
+        self.assertEqual(rcache.get(rkey, [1]), {1: "A"})
+        rcache.set(rkey, {3: "C"})
+
+        self.assertEqual(rcache.get(rkey, [1, 2, 3]), {1: "A", 3: "C"})
+        stats = rcache.stats()
+        self.assertEqual(stats.size, 2)
+        self.assertEqual(stats.evictions, 1)
+        self.assertEqual(stats.misses, 1)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        rcache = S3RepresentCache.instance
+        if rcache is not None:
+            rcache.clear()
+        current.response.pop(S3RepresentCache.PREFIX, None)
+
+        current.deployment_settings.base.represent_cache = self.represent_cache
+        current.db.rollback()
+        current.auth.override = False
+
 # =============================================================================
 class S3ExtractLazyFKRepresentationTests(unittest.TestCase):
     """ Test lazy representation of foreign keys in datatables """
@@ -1058,6 +1201,7 @@ if __name__ == "__main__":
 
     run_suite(
         S3RepresentTests,
+        S3RepresentCacheTests,
         S3ExtractLazyFKRepresentationTests,
         S3ExportLazyFKRepresentationTests,
     )
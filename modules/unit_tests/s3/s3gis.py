@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+#
+# S3GIS Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3gis.py
+#
+import unittest
+from gluon import current
+from gluon.storage import Storage
+
+from s3.s3gis import GIS, S3MapTile, S3SpatialIndex
+
+# =============================================================================
+class S3MapTileTests(unittest.TestCase):
+    """ Vector Tile endpoint tests """
+
+    # -------------------------------------------------------------------------
+    def testParseTile(self):
+        """ Test parsing of the tile coordinates """
+
+        parse = S3MapTile.parse_tile
+
+        self.assertEqual(parse(Storage(z="3", x="2", y="7")), (3, 2, 7))
+
+        # Missing or invalid coordinates
+        self.assertEqual(parse(Storage(z="3", x="2")), None)
+        self.assertEqual(parse(Storage(z="a", x="2", y="7")), None)
+
+        # Coordinates outside of the zoom level
+        self.assertEqual(parse(Storage(z="3", x="8", y="0")), None)
+        self.assertEqual(parse(Storage(z="3", x="0", y="-1")), None)
+        self.assertEqual(parse(Storage(z="99", x="0", y="0")), None)
+
+    # -------------------------------------------------------------------------
+    def testTileBounds(self):
+        """ Test the bounds of a tile """
+
+        bounds = S3MapTile.tile_bounds
+
+        # The whole world
+        lon_min, lat_min, lon_max, lat_max = bounds(0, 0, 0)
+        self.assertAlmostEqual(lon_min, -180.0)
+        self.assertAlmostEqual(lon_max, 180.0)
+        self.assertAlmostEqual(lat_min, -85.0511, places=4)
+        self.assertAlmostEqual(lat_max, 85.0511, places=4)
+
+        # The North-East quarter
+        lon_min, lat_min, lon_max, lat_max = bounds(1, 1, 0)
+        self.assertAlmostEqual(lon_min, 0.0)
+        self.assertAlmostEqual(lon_max, 180.0)
+        self.assertAlmostEqual(lat_min, 0.0)
+        self.assertAlmostEqual(lat_max, 85.0511, places=4)
+
+    # -------------------------------------------------------------------------
+    def testTileCache(self):
+        """ Test the size limit and expiry of the tile cache """
+
+        cache = S3MapTile.cache
+        size = S3MapTile.CACHE_SIZE
+        cache.clear()
+        try:
+            S3MapTile.CACHE_SIZE = 2
+            cached = S3MapTile.cached
+
+            self.assertEqual(cached("a", lambda: "A", 300), "A")
+            self.assertEqual(cached("b", lambda: "B", 300), "B")
+            # From the cache
+            self.assertEqual(cached("a", lambda: "X", 300), "A")
+
+            # Least recently used tile removed
+            self.assertEqual(cached("c", lambda: "C", 300), "C")
+            self.assertEqual(cache.keys(), ["a", "c"])
+
+            # Expired
+            self.assertEqual(cached("a", lambda: "X", -1), "X")
+        finally:
+            S3MapTile.CACHE_SIZE = size
+            cache.clear()
+
+    # -------------------------------------------------------------------------
+    def testBoundsQuery(self):
+        """ Test the selection of locations by tile bounds """
+
+        db = current.db
+        gtable = current.s3db.gis_location
+
+        try:
+            inside = gtable.insert(name="TileTestInside",
+                                   lat=10.0, lon=10.0,
+                                   lat_min=10.0, lat_max=10.0,
+                                   lon_min=10.0, lon_max=10.0)
+            # A polygon overlapping the tile, with its centroid outside
+            overlapping = gtable.insert(name="TileTestOverlapping",
+                                        lat=-5.0, lon=-5.0,
+                                        lat_min=-10.0, lat_max=1.0,
+                                        lon_min=-10.0, lon_max=1.0)
+            # A point without bounds
+            nobounds = gtable.insert(name="TileTestNoBounds",
+                                     lat=20.0, lon=20.0)
+            outside = gtable.insert(name="TileTestOutside",
+                                    lat=-20.0, lon=-20.0,
+                                    lat_min=-20.0, lat_max=-20.0,
+                                    lon_min=-20.0, lon_max=-20.0)
+
+            bounds = S3MapTile.tile_bounds(1, 1, 0)
+            query = S3MapTile.bounds_query(gtable, bounds) & \
+                    (gtable.name.like("TileTest%"))
+            rows = db(query).select(gtable.id)
+            ids = set(row.id for row in rows)
+            self.assertEqual(ids, set([inside, overlapping, nobounds]))
+            self.assertFalse(outside in ids)
+        finally:
+            db.rollback()
+
+# =============================================================================
+class S3SpatialIndexTests(unittest.TestCase):
+    """ In-process spatial index tests """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        # A grid of 40x40 points, plus one large polygon
+        leaves = []
+        record_id = 0
+        for x in xrange(40):
+            for y in xrange(40):
+                record_id += 1
+                leaves.append((x, y, x, y, record_id))
+        leaves.append((10.5, 10.5, 12.5, 12.5, 9999))
+
+        index = S3SpatialIndex()
+        index.root = S3SpatialIndex.str_pack(leaves, index.NODE_SIZE)
+        index.size = len(leaves)
+        index.loaded = True
+        self.index = index
+
+    # -------------------------------------------------------------------------
+    def testSearch(self):
+        """ Test search by bbox """
+
+        index = self.index
+
+        # All leaves are in the tree
+        self.assertEqual(len(list(index.leaves())), 1601)
+
+        ids = index.search(10.1, 10.1, 11.9, 11.9)
+        # Points (11, 11) and the polygon
+        self.assertEqual(set(ids), set([11 * 40 + 12, 9999]))
+
+        ids = index.search(-5, -5, -1, -1)
+        self.assertEqual(ids, [])
+
+    # -------------------------------------------------------------------------
+    def testUpdate(self):
+        """ Test incremental updates """
+
+        index = self.index
+
+        # Move the polygon, remove a point, add a new point
+        index.update(9999, (30.5, 30.5, 31.5, 31.5))
+        index.update(11 * 40 + 12, None)
+        index.update(10000, (11.5, 11.5, 11.5, 11.5))
+
+        ids = index.search(10.1, 10.1, 11.9, 11.9)
+        self.assertEqual(set(ids), set([10000]))
+        ids = index.search(31.2, 31.2, 31.4, 31.4)
+        self.assertEqual(set(ids), set([9999]))
+
+        # Same results after merging the changes into the tree
+        index.pack()
+        self.assertEqual(index.pending, {})
+        self.assertEqual(index.size, 1601)
+        ids = index.search(10.1, 10.1, 11.9, 11.9)
+        self.assertEqual(set(ids), set([10000]))
+        ids = index.search(31.2, 31.2, 31.4, 31.4)
+        self.assertEqual(set(ids), set([9999]))
+
+# =============================================================================
+class LocationTreeRebuildTests(unittest.TestCase):
+    """ Tests for the bulk rebuild of the Location Tree """
+
+    # -------------------------------------------------------------------------
+    def testRebuild(self):
+        """ Test that the bulk rebuild gives the same results as per feature """
+
+        db = current.db
+        gis = current.gis
+        table = current.s3db.gis_location
+
+        fields = ["path", "L0", "L1", "L2", "L3", "L4", "L5",
+                  "inherited", "lat", "lon"]
+
+        try:
+            L0 = table.insert(name="TreeTestCountry", level="L0",
+                              lat=10.0, lon=10.0)
+            L1 = table.insert(name="TreeTestProvince", level="L1",
+                              parent=L0, lat=11.0, lon=11.0)
+            L2 = table.insert(name="TreeTestDistrict", level="L2",
+                              parent=L1)
+            L3 = table.insert(name="TreeTestVillage", level="L3",
+                              parent=L1, lat=12.0, lon=12.0)
+            site = table.insert(name="TreeTestSite", parent=L2,
+                                inherited=True)
+            ids = (L0, L1, L2, L3, site)
+
+            # Per feature
+            for record_id in ids:
+                gis.update_location_tree({"id": record_id})
+            query = table.id.belongs(ids)
+            expected = dict((row.id, row) for row in
+                            db(query).select(table.id,
+                                             *[table[fn] for fn in fields]))
+
+            # Break the hierarchy
+            db(query).update(path=None, L0=None, L1=None, L2=None)
+
+            gis.rebuild_location_tree()
+            rows = db(query).select(table.id, *[table[fn] for fn in fields])
+            for row in rows:
+                for fn in fields:
+                    self.assertEqual(row[fn], expected[row.id][fn])
+
+            site = rows.find(lambda row: row.id == site).first()
+            self.assertEqual(site.path, "%s/%s/%s/%s" % (L0, L1, L2, site.id))
+            self.assertEqual(site.L1, "TreeTestProvince")
+            # Inherited from the L2, which inherits from the L1
+            self.assertEqual((site.lat, site.lon), (11.0, 11.0))
+        finally:
+            db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testRebuildMixed(self):
+        """
+            Test that the bulk rebuild gives the same results as the rebuild
+            feature by feature for a tree with non-hierarchy parents
+        """
+
+        db = current.db
+        gis = current.gis
+        table = current.s3db.gis_location
+        settings = current.deployment_settings
+
+        fields = ["path", "L0", "L1", "L2", "L3", "L4", "L5",
+                  "inherited", "lat", "lon"]
+        bulk = settings.gis.get("bulk_location_tree")
+
+        try:
+            L0 = table.insert(name="TreeTestCountry", level="L0",
+                              lat=10.0, lon=10.0)
+            L1 = table.insert(name="TreeTestProvince", level="L1",
+                              parent=L0, lat=11.0, lon=11.0)
+            L2 = table.insert(name="TreeTestDistrict", level="L2",
+                              parent=L1)
+            site = table.insert(name="TreeTestSite", parent=L2,
+                                inherited=True)
+
+            # A non-hierarchy location as parent of...
+            specific = table.insert(name="TreeTestSpecific",
+                                    lat=5.0, lon=5.0)
+            # ...an L1 (takes its path and L0 from any parent)
+            L1b = table.insert(name="TreeTestProvince2", level="L1",
+                               parent=specific)
+            # ...an L2 (invalid, so not updated)
+            L2b = table.insert(name="TreeTestDistrict2", level="L2",
+                               parent=specific, lat=6.0, lon=6.0)
+            # ...with an L3 below
+            L3b = table.insert(name="TreeTestVillage2", level="L3",
+                               parent=L2b, lat=7.0, lon=7.0)
+            # ...a specific location (not updated)
+            site2 = table.insert(name="TreeTestSite2", parent=specific,
+                                 lat=8.0, lon=8.0)
+
+            ids = (L0, L1, L2, site, specific, L1b, L2b, L3b, site2)
+            query = table.id.belongs(ids)
+            def tree():
+                rows = db(query).select(table.id,
+                                        *[table[fn] for fn in fields])
+                return dict((row.id, dict((fn, row[fn]) for fn in fields))
+                            for row in rows)
+            initial = tree()
+
+            # Feature by feature
+            settings.gis.bulk_location_tree = False
+            gis.update_location_tree()
+            expected = tree()
+
+            # Reset the records
+            for record_id, values in initial.items():
+                db(table.id == record_id).update(**values)
+
+            # Bulk
+            settings.gis.bulk_location_tree = True
+            gis.update_location_tree()
+            self.assertEqual(tree(), expected)
+
+            # Check some of the expected results
+            self.assertEqual(expected[L1b]["path"], "%s/%s" % (specific, L1b))
+            self.assertEqual(expected[L1b]["L0"], "TreeTestSpecific")
+            self.assertEqual((expected[L1b]["lat"], expected[L1b]["lon"]),
+                             (5.0, 5.0))
+            self.assertEqual(expected[L2b]["path"], None)
+            self.assertEqual(expected[L3b]["path"],
+                             "%s/%s/%s" % (specific, L2b, L3b))
+            self.assertEqual(expected[site2]["path"], None)
+        finally:
+            if bulk is None:
+                settings.gis.pop("bulk_location_tree", None)
+            else:
+                settings.gis.bulk_location_tree = bulk
+            db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testRebuildOrphan(self):
+        """ Test that the geometry is updated even if the parent is invalid """
+
+        db = current.db
+        gis = current.gis
+        table = current.s3db.gis_location
+
+        try:
+            # A non-hierarchy location as parent
+            parent = table.insert(name="TreeTestParent", lat=10.0, lon=10.0)
+            polygon = table.insert(name="TreeTestPolygon",
+                                   parent=parent,
+                                   gis_feature_type=3,
+                                   wkt="POLYGON ((20 20, 21 20, 21 22, 20 22, 20 20))",
+                                   path="TreeTestPath",
+                                   )
+
+            gis.rebuild_location_tree()
+            row = db(table.id == polygon).select(table.path,
+                                                 table.lat_min,
+                                                 table.lat_max,
+                                                 table.lon_min,
+                                                 table.lon_max,
+                                                 limitby=(0, 1)).first()
+            # Path not propagated
+            self.assertEqual(row.path, "TreeTestPath")
+            # Bounds updated
+            self.assertEqual((row.lat_min, row.lat_max), (20.0, 22.0))
+            self.assertEqual((row.lon_min, row.lon_max), (20.0, 21.0))
+        finally:
+            db.rollback()
+
+# =============================================================================
+class SimplifiedStoreTests(unittest.TestCase):
+    """ Tests for the store of simplified polygons """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        settings = current.deployment_settings
+        self.simplify_cache = settings.get_gis_simplify_cache()
+        self.zoom_levels = settings.get_gis_simplify_zoom_levels()
+        settings.gis.simplify_cache = True
+        settings.gis.simplify_zoom_levels = [5]
+
+        table = current.s3db.gis_location
+        self.table = table
+        self.ids = [table.insert(name="SimplifiedTestPolygon%s" % i,
+                                 gis_feature_type=3,
+                                 wkt="POLYGON ((%s 0, %s.5 0, %s.5 0.5, %s 0.5, %s 0))" %
+                                     ((i,) * 5),
+                                 )
+                    for i in (1, 2)]
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        settings = current.deployment_settings
+        settings.gis.simplify_cache = self.simplify_cache
+        settings.gis.simplify_zoom_levels = self.zoom_levels
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def stored(self, ids=None):
+        """ Count the stored entries for the test records """
+
+        stable = current.s3db.gis_simplified
+        query = (stable.tablename == "gis_location") & \
+                (stable.record_id.belongs(ids or self.ids))
+        return current.db(query).count()
+
+    # -------------------------------------------------------------------------
+    def testGetSimplified(self):
+        """ Test that simplified polygons are stored once per key """
+
+        table = self.table
+        ids = self.ids
+
+        first = GIS.get_simplified(table, ids, tolerance=0.01)
+        self.assertEqual(self.stored(), 2)
+
+        # Looked up from the store
+        second = GIS.get_simplified(table, ids, tolerance=0.01)
+        self.assertEqual(second, first)
+        self.assertEqual(self.stored(), 2)
+
+        # Other key
+        GIS.get_simplified(table, ids[:1], tolerance=0.01, output="geojson")
+        self.assertEqual(self.stored(), 3)
+
+    # -------------------------------------------------------------------------
+    def testUpdateSimplified(self):
+        """ Test pre-computing simplified polygons """
+
+        table = self.table
+        ids = self.ids
+
+        # Default tolerance and one zoom level, two output formats
+        GIS.update_simplified(table, ids)
+        self.assertEqual(self.stored(), 8)
+
+        # Skips those already computed
+        GIS.update_simplified(table, ids)
+        self.assertEqual(self.stored(), 8)
+
+        # Not pre-computed when the cache is disabled
+        GIS.clear_simplified("gis_location", ids)
+        current.deployment_settings.gis.simplify_cache = False
+        GIS.update_simplified(table, ids)
+        self.assertEqual(self.stored(), 0)
+
+    # -------------------------------------------------------------------------
+    def testClearSimplified(self):
+        """ Test removing simplified polygons from the store """
+
+        table = self.table
+        ids = self.ids
+
+        GIS.update_simplified(table, ids)
+        GIS.clear_simplified("gis_location", ids[:1])
+        self.assertEqual(self.stored(ids[:1]), 0)
+        self.assertEqual(self.stored(ids[1:]), 4)
+
+        GIS.clear_simplified("gis_location", ids)
+        self.assertEqual(self.stored(), 0)
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3MapTileTests,
+        S3SpatialIndexTests,
+        LocationTreeRebuildTests,
+        SimplifiedStoreTests,
+    )
+
+# END ========================================================================
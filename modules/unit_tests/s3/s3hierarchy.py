@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# S3Hierarchy Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3hierarchy.py
+#
+import unittest
+from gluon import *
+from s3.s3hierarchy import S3Hierarchy
+
+# =============================================================================
+class S3HierarchyTests(unittest.TestCase):
+    """ Tests for incremental hierarchy maintenance """
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        s3db = current.s3db
+        s3db.define_table("hierarchy_test",
+                          Field("name"),
+                          Field("parent", "reference hierarchy_test"),
+                          Field("category"))
+        s3db.configure("hierarchy_test",
+                       hierarchy=("parent", "category"))
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        current.db.hierarchy_test.drop()
+        current.db.commit()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        db = current.db
+        table = db.hierarchy_test
+
+        # A
+        # +-- B
+        # |   +-- D
+        # +-- C
+        ids = self.ids = {}
+        ids["A"] = table.insert(name="A", category="X")
+        ids["B"] = table.insert(name="B", parent=ids["A"], category="Y")
+        ids["C"] = table.insert(name="C", parent=ids["A"], category="Y")
+        ids["D"] = table.insert(name="D", parent=ids["B"], category="Z")
+
+        current.model.hierarchies.pop("hierarchy_test", None)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+        current.model.hierarchies.pop("hierarchy_test", None)
+
+    # -------------------------------------------------------------------------
+    def testFindAll(self):
+        """ Test finding all descendants with the nested-set index """
+
+        ids = self.ids
+        h = S3Hierarchy("hierarchy_test")
+
+        self.assertEqual(h.findall(ids["A"]),
+                         set([ids["B"], ids["C"], ids["D"]]))
+        self.assertEqual(h.findall(ids["A"], inclusive=True),
+                         set([ids["A"], ids["B"], ids["C"], ids["D"]]))
+        self.assertEqual(h.findall(ids["A"], category="Y"),
+                         set([ids["B"], ids["C"]]))
+        self.assertEqual(h.findall(ids["B"], classify=True),
+                         set([(ids["D"], "Z")]))
+        self.assertEqual(h.findall(ids["D"]), set())
+
+    # -------------------------------------------------------------------------
+    def testIncrementalUpdate(self):
+        """ Test incremental updates of the stored hierarchy """
+
+        db = current.db
+        ids = self.ids
+        table = db.hierarchy_test
+
+        # Store the hierarchy
+        h = S3Hierarchy("hierarchy_test")
+        self.assertEqual(h.findall(ids["C"]), set())
+        h.save()
+
+        # Add a node, move a node, remove a node
+        E = table.insert(name="E", parent=ids["C"], category="Z")
+        S3Hierarchy.update_node("hierarchy_test", E)
+        db(table.id == ids["D"]).update(parent=ids["C"])
+        S3Hierarchy.update_node("hierarchy_test", ids["D"])
+        db(table.id == ids["B"]).delete()
+        S3Hierarchy.update_node("hierarchy_test", ids["B"])
+
+        # Patched in memory
+        self.assertEqual(h.findall(ids["C"]), set([ids["D"], E]))
+        self.assertEqual(h.children(ids["A"]), set([ids["C"]]))
+        self.assertFalse(ids["B"] in h.nodes)
+
+        # Stored as delta, not as full hierarchy
+        dtable = current.s3db.s3_hierarchy_delta
+        query = (dtable.tablename == "hierarchy_test")
+        self.assertEqual(db(query).count(), 3)
+
+        # Loaded with the changes applied
+        current.model.hierarchies.pop("hierarchy_test", None)
+        h = S3Hierarchy("hierarchy_test")
+        self.assertEqual(h.findall(ids["C"]), set([ids["D"], E]))
+        self.assertEqual(h.children(ids["A"]), set([ids["C"]]))
+        self.assertEqual(h.category(E), "Z")
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3HierarchyTests,
+    )
+
+# END ========================================================================
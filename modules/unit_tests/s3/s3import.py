@@ -384,6 +384,279 @@ class FailedReferenceTests(unittest.TestCase):
         current.db.rollback()
         current.auth.override = False
 
+# =============================================================================
+class BatchImportTests(unittest.TestCase):
+    """ Test imports in batch mode """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        settings = current.deployment_settings
+        self.batch = settings.get_base_import_batch()
+        settings.base.import_batch = True
+
+        # An existing organisation and person
+        s3db = current.s3db
+        otable = s3db.org_organisation
+        otable.insert(uuid="BITOrganisation1", name="BITOrganisation1")
+        ptable = s3db.pr_person
+        person = {"first_name": "BITFirstName",
+                  "last_name": "BITLastName",
+                  }
+        person_id = ptable.insert(**person)
+        person["id"] = person_id
+        s3db.update_super(ptable, person)
+
+    # -------------------------------------------------------------------------
+    def testBatchImport(self):
+        """ Test batch import with references and deduplication """
+
+        xmlstr = """
+<s3xml>
+    <resource name="org_office">
+        <data field="name">BITOffice1</data>
+        <reference field="organisation_id" resource="org_organisation" tuid="BITORG1"/>
+    </resource>
+    <resource name="org_office">
+        <data field="name">BITOffice2</data>
+        <reference field="organisation_id" resource="org_organisation" tuid="BITORG2"/>
+    </resource>
+    <resource name="org_organisation" tuid="BITORG1" uuid="BITOrganisation1">
+        <data field="name">BITOrganisation1Updated</data>
+    </resource>
+    <resource name="org_organisation" tuid="BITORG2" uuid="BITOrganisation2">
+        <data field="name">BITOrganisation2</data>
+    </resource>
+</s3xml>"""
+
+        from lxml import etree
+        tree = etree.ElementTree(etree.fromstring(xmlstr))
+
+        db = current.db
+        s3db = current.s3db
+
+        resource = s3db.resource("org_office")
+        resource.import_xml(tree)
+        self.assertEqual(resource.error, None)
+        self.assertEqual(resource.import_count, 2)
+        self.assertEqual(len(resource.import_created), 2)
+
+        # Existing organisation updated, new organisation created
+        otable = s3db.org_organisation
+        query = (otable.uuid.belongs(("BITOrganisation1",
+                                      "BITOrganisation2")))
+        rows = db(query).select(otable.id, otable.uuid, otable.name)
+        self.assertEqual(len(rows), 2)
+        organisations = dict((row.uuid, row) for row in rows)
+        self.assertEqual(organisations["BITOrganisation1"].name,
+                         "BITOrganisation1Updated")
+
+        # Offices reference the organisations
+        ftable = s3db.org_office
+        query = (ftable.id.belongs(resource.import_created))
+        rows = db(query).select(ftable.name, ftable.organisation_id)
+        offices = dict((row.name, row.organisation_id) for row in rows)
+        self.assertEqual(offices["BITOffice1"],
+                         organisations["BITOrganisation1"].id)
+        self.assertEqual(offices["BITOffice2"],
+                         organisations["BITOrganisation2"].id)
+
+    # -------------------------------------------------------------------------
+    def testBatchDeduplicate(self):
+        """ Test batch deduplication of persons """
+
+        xmlstr = """
+<s3xml>
+    <resource name="pr_person">
+        <data field="first_name">BITFirstName</data>
+        <data field="last_name">BITLastName</data>
+        <data field="comments">BITUpdated</data>
+    </resource>
+    <resource name="pr_person">
+        <data field="first_name">BITFirstName2</data>
+        <data field="last_name">BITLastName</data>
+    </resource>
+</s3xml>"""
+
+        from lxml import etree
+        tree = etree.ElementTree(etree.fromstring(xmlstr))
+
+        db = current.db
+        s3db = current.s3db
+
+        resource = s3db.resource("pr_person")
+        resource.import_xml(tree)
+        self.assertEqual(resource.error, None)
+        self.assertEqual(len(resource.import_updated), 1)
+        self.assertEqual(len(resource.import_created), 1)
+
+        ptable = s3db.pr_person
+        query = (ptable.last_name == "BITLastName")
+        rows = db(query).select(ptable.first_name, ptable.comments)
+        self.assertEqual(len(rows), 2)
+        for row in rows:
+            if row.first_name == "BITFirstName":
+                self.assertEqual(row.comments, "BITUpdated")
+
+    # -------------------------------------------------------------------------
+    def testBatchDeduplicateInJob(self):
+        """ Test batch deduplication of new records within the same job """
+
+        xmlstr = """
+<s3xml>
+    <resource name="org_organisation" uuid="BITOrganisation3">
+        <data field="name">BITOrganisation3</data>
+    </resource>
+    <resource name="org_organisation" uuid="BITOrganisation3">
+        <data field="name">BITOrganisation3</data>
+        <data field="comments">BITUpdated</data>
+    </resource>
+    <resource name="org_organisation">
+        <data field="name">BITOrganisation4</data>
+    </resource>
+    <resource name="org_organisation">
+        <data field="name">BITOrganisation4</data>
+    </resource>
+</s3xml>"""
+
+        from lxml import etree
+        tree = etree.ElementTree(etree.fromstring(xmlstr))
+
+        db = current.db
+        s3db = current.s3db
+
+        resource = s3db.resource("org_organisation")
+        resource.import_xml(tree)
+        self.assertEqual(resource.error, None)
+
+        # Duplicates by UID and by deduplicate resolver
+        otable = s3db.org_organisation
+        query = (otable.name == "BITOrganisation3")
+        rows = db(query).select(otable.comments)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows.first().comments, "BITUpdated")
+        query = (otable.name == "BITOrganisation4")
+        self.assertEqual(db(query).count(), 1)
+
+        xmlstr = """
+<s3xml>
+    <resource name="pr_person">
+        <data field="first_name">BITNewFirstName</data>
+        <data field="last_name">BITNewLastName</data>
+    </resource>
+    <resource name="pr_person">
+        <data field="first_name">BITNewFirstName</data>
+        <data field="last_name">BITNewLastName</data>
+        <data field="comments">BITUpdated</data>
+    </resource>
+</s3xml>"""
+
+        tree = etree.ElementTree(etree.fromstring(xmlstr))
+
+        # Duplicates by batch deduplicator
+        resource = s3db.resource("pr_person")
+        resource.import_xml(tree)
+        self.assertEqual(resource.error, None)
+
+        ptable = s3db.pr_person
+        query = (ptable.last_name == "BITNewLastName")
+        rows = db(query).select(ptable.comments)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows.first().comments, "BITUpdated")
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+        current.deployment_settings.base.import_batch = self.batch
+
+# =============================================================================
+class BulkImporterTests(unittest.TestCase):
+    """ Tests for the S3BulkImporter task scheduler """
+
+    # -------------------------------------------------------------------------
+    def testTaskDependencies(self):
+        """ Test the dependency graph of import tasks """
+
+        from s3.s3import import S3BulkImporter
+
+        bi = S3BulkImporter()
+        tasks = [[1, "gis", "marker", "marker.csv", "marker.xsl", None],
+                 [1, "gis", "projection", "projection.csv", "projection.xsl", None],
+                 [1, "org", "organisation", "organisation.csv", "organisation.xsl", None],
+                 [1, "org", "office", "office.csv", "office.xsl", None],
+                 [2, "import_role", "auth_roles.csv", None],
+                 [1, "gis", "marker", "marker2.csv", "marker.xsl", None],
+                 ]
+        dependencies = bi.task_dependencies(tasks)
+
+        # Independent tables
+        self.assertEqual(dependencies[0], set())
+        self.assertEqual(dependencies[1], set())
+        # Office references organisation
+        self.assertTrue(2 in dependencies[3])
+        self.assertFalse(0 in dependencies[3])
+        # Specialist tasks are barriers
+        self.assertEqual(dependencies[4], set([0, 1, 2, 3]))
+        self.assertEqual(dependencies[5], set([4]))
+
+        # Task table mapping
+        task = [1, "hrm", "person", "person.csv", "person.xsl", None]
+        self.assertEqual(bi.task_tablename(task), "pr_person")
+
+    # -------------------------------------------------------------------------
+    def testTaskKeys(self):
+        """ Test the checkpoint keys of import tasks """
+
+        from s3.s3import import S3BulkImporter
+
+        task_keys = S3BulkImporter.task_keys
+        tasks = [[2, "gis_set_default_config", None, None],
+                 [1, "org", "organisation", "organisation.csv", "organisation.xsl", None],
+                 [2, "gis_set_default_config", None, None],
+                 ]
+
+        # Identical tasks within the same template
+        keys = task_keys("templates/default", tasks)
+        self.assertEqual(len(set(keys)), 3)
+
+        # Identical tasks in different templates
+        other = task_keys("templates/Demo", tasks)
+        self.assertFalse(set(keys) & set(other))
+
+        # Stable for resume
+        self.assertEqual(task_keys("templates/default", tasks), keys)
+
+    # -------------------------------------------------------------------------
+    def testBlockedTasks(self):
+        """ Test that dependents of failed tasks are not scheduled """
+
+        from s3.s3import import S3BulkImporter
+
+        blocked_tasks = S3BulkImporter.blocked_tasks
+        dependencies = [set(),
+                        set(),
+                        set([0]),
+                        set([2]),
+                        set([1]),
+                        set([0, 1, 2, 3, 4]),
+                        ]
+        pending = [2, 3, 4, 5]
+
+        # Nothing failed
+        self.assertEqual(blocked_tasks(dependencies, pending, set()), [])
+
+        # Direct and transitive dependents of a failed task
+        self.assertEqual(blocked_tasks(dependencies, pending, set([0])),
+                         [2, 3, 5])
+
+        # Independent tasks can still run
+        self.assertEqual(blocked_tasks(dependencies, pending, set([1])),
+                         [4, 5])
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -405,6 +678,8 @@ if __name__ == "__main__":
         ComponentDisambiguationTests,
         PostParseTests,
         FailedReferenceTests,
+        BatchImportTests,
+        BulkImporterTests,
     )
 
 # END ========================================================================
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# Duplicate Finder Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3merge.py
+#
+import unittest
+
+from gluon import *
+
+from s3.s3merge import S3DuplicateFinder
+
+# =============================================================================
+class S3DuplicateFinderTests(unittest.TestCase):
+    """ Tests for S3DuplicateFinder """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+    # -------------------------------------------------------------------------
+    def testBlockingKeys(self):
+        """ Test normalization and phonetic keys for blocking """
+
+        normalize = S3DuplicateFinder.normalize
+        self.assertEqual(normalize(u"M\xe9decins  Sans-Fronti\xe8res"),
+                         u"medecinssansfrontieres")
+        self.assertEqual(normalize(None), "")
+
+        phonetic = S3DuplicateFinder.phonetic
+        self.assertEqual(phonetic("Robert Hospital"), "R163")
+        self.assertEqual(phonetic("Rupert Clinic"), "R163")
+        self.assertEqual(phonetic(""), "")
+
+    # -------------------------------------------------------------------------
+    def testPairs(self):
+        """ Test generation of candidate pairs within blocks """
+
+        finder = S3DuplicateFinder("org_organisation", workers=1)
+
+        blocks = {"a": [(1, ("x",)), (2, ("y",)), (3, ("z",))],
+                  "b": [(4, ("x",))],
+                  }
+        pairs = set((p[0], p[1]) for p in finder.pairs(blocks))
+        self.assertEqual(pairs, set([(1, 2), (1, 3), (2, 3)]))
+
+        # Large blocks are compared within a sliding window
+        size = finder.MAX_BLOCK + 1
+        blocks = {"a": [(i, ("%05d" % i,)) for i in xrange(size)]}
+        pairs = list(finder.pairs(blocks))
+        window = finder.WINDOW
+        expected = sum(min(window - 1, size - i - 1) for i in xrange(size))
+        self.assertEqual(len(pairs), expected)
+
+    # -------------------------------------------------------------------------
+    def testRun(self):
+        """ Test finding, dismissing and merging candidate pairs """
+
+        db = current.db
+        s3db = current.s3db
+
+        otable = s3db.org_organisation
+        org1 = otable.insert(name="Duplicate Finder Test Organisation",
+                             acronym="DFTO")
+        org2 = otable.insert(name="Duplicate-Finder Test Organisation",
+                             acronym="DFTO")
+        org3 = otable.insert(name="Duplicate Finder Test Organisation",
+                             acronym="Something completely different")
+
+        finder = S3DuplicateFinder("org_organisation", workers=1)
+        finder.run()
+
+        table = s3db.s3_duplicate
+        query = (table.tablename == "org_organisation") & \
+                (table.original_id.belongs([org1, org2, org3]))
+        def pairs():
+            rows = db(query & (table.dismissed != True)).select(table.id,
+                                                                table.original_id,
+                                                                table.duplicate_id)
+            return dict(((row.original_id, row.duplicate_id), row.id)
+                        for row in rows)
+
+        found = pairs()
+        self.assertTrue((org1, org2) in found)
+        self.assertFalse((org1, org3) in found)
+
+        # Dismissed pairs are not found again
+        db(table.id == found[(org1, org2)]).update(dismissed=True)
+        finder.run()
+        self.assertFalse((org1, org2) in pairs())
+
+        # Merged records are removed from the candidates
+        db(table.id > 0).update(dismissed=False)
+        S3DuplicateFinder.merged("org_organisation", org2)
+        self.assertFalse((org1, org2) in pairs())
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3DuplicateFinderTests,
+    )
+
+# END ========================================================================
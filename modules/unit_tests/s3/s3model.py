@@ -10,6 +10,7 @@ from gluon import current
 from gluon.dal import Query
 
 from s3.s3fields import s3_meta_fields
+from s3.s3model import S3ModelRegistry
 
 # =============================================================================
 class S3ModelTests(unittest.TestCase):
@@ -227,6 +228,53 @@ class S3SuperEntityTests(unittest.TestCase):
         super_record = super_table[se_id]
         self.assertFalse(super_record.deleted)
 
+# =============================================================================
+class S3ModelRegistryTests(unittest.TestCase):
+    """ Tests for the model registry """
+
+    # -------------------------------------------------------------------------
+    def testBuild(self):
+        """ Test building the registry from the model modules """
+
+        models = current.models
+        mtimes = S3ModelRegistry.modified(models)
+        self.assertTrue("pr" in mtimes)
+
+        registry = S3ModelRegistry.build(models, mtimes)
+
+        # Table names map to the model class defining them
+        prefix, name = registry.lookup("pr_person")
+        self.assertEqual(prefix, "pr")
+        model = models.pr.__dict__[name]
+        self.assertTrue("pr_person" in model.names)
+
+        # Functions map to themselves
+        self.assertEqual(registry.lookup("pr_get_entities"),
+                         ("pr", "pr_get_entities"))
+
+        # Undefined names are not found
+        self.assertEqual(registry.lookup("pr_nonexistent"), None)
+
+    # -------------------------------------------------------------------------
+    def testPersistence(self):
+        """ Test that the registry is invalidated when models change """
+
+        models = current.models
+        mtimes = S3ModelRegistry.modified(models)
+
+        registry = S3ModelRegistry.build(models, mtimes)
+        registry.write()
+
+        stored = S3ModelRegistry.read(mtimes)
+        self.assertNotEqual(stored, None)
+        self.assertEqual(stored.names, registry.names)
+        self.assertEqual(stored.generic, registry.generic)
+
+        # Outdated registry is not used
+        modified = dict(mtimes)
+        modified["pr"] += 1
+        self.assertEqual(S3ModelRegistry.read(modified), None)
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -245,6 +293,7 @@ if __name__ == "__main__":
     run_suite(
         #S3ModelTests,
         S3SuperEntityTests,
+        S3ModelRegistryTests,
     )
 
 # END ========================================================================
@@ -5,6 +5,9 @@
 # To run this script use:
 # python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3model.py
 #
+import asyncore
+import smtpd
+import threading
 import unittest
 import datetime
 from lxml import etree
@@ -325,6 +328,228 @@ class S3OutboxTests(unittest.TestCase):
         current.db.rollback()
         self.msg.send_email = self.save_email
 
+# =============================================================================
+class SMTPStandIn(smtpd.SMTPServer):
+    """ Local stand-in for an SMTP server, records the recipients """
+
+    def __init__(self):
+
+        smtpd.SMTPServer.__init__(self, ("127.0.0.1", 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.received = []
+        self.messages = []
+        self.running = True
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+
+        self.received.extend(rcpttos)
+        self.messages.append(data)
+
+    def serve(self):
+
+        while self.running:
+            asyncore.loop(timeout=0.1, count=1)
+
+# =============================================================================
+class S3BulkOutboxTests(unittest.TestCase):
+    """ Batched outbox processing tests """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        xmlstr = """
+<s3xml>
+    <resource name="pr_person" uuid="MsgBulkTestPerson1">
+        <data field="first_name">MsgBulkTestPerson1</data>
+        <resource name="pr_contact">
+            <data field="contact_method">EMAIL</data>
+            <data field="value">bulk1@example.com</data>
+        </resource>
+    </resource>
+    <resource name="pr_person" uuid="MsgBulkTestPerson2">
+        <data field="first_name">MsgBulkTestPerson2</data>
+        <resource name="pr_contact">
+            <data field="contact_method">EMAIL</data>
+            <data field="value">bulk2@example.com</data>
+        </resource>
+    </resource>
+    <resource name="pr_group" uuid="MsgBulkTestGroup">
+        <data field="name">MsgBulkTestGroup</data>
+        <resource name="pr_group_membership">
+            <reference field="person_id" resource="pr_person" uuid="MsgBulkTestPerson1"/>
+        </resource>
+        <resource name="pr_group_membership">
+            <reference field="person_id" resource="pr_person" uuid="MsgBulkTestPerson2"/>
+        </resource>
+    </resource>
+</s3xml>"""
+        xmltree = etree.ElementTree(etree.fromstring(xmlstr))
+
+        db = current.db
+        s3db = current.s3db
+
+        for tablename in ("pr_person", "pr_group"):
+            resource = s3db.resource(tablename)
+            resource.import_xml(xmltree)
+            self.assertTrue(resource.error is None)
+
+        # Temporarily disable any pending messages, so they
+        # don't interfere with this test
+        outbox = s3db.msg_outbox
+        db(outbox.status == 1).update(status=99)
+
+        # Insert a test email
+        mailbox = s3db.msg_email
+        mail_id = mailbox.insert(subject="Test Email", body="Unit Test")
+        record = db(mailbox.id == mail_id).select(mailbox.id,
+                                                  mailbox.message_id,
+                                                  limitby=(0, 1)).first()
+        s3db.update_super(mailbox, record)
+        self.message_id = record.message_id
+
+        # Start the SMTP stand-in
+        server = SMTPStandIn()
+        thread = threading.Thread(target=server.serve)
+        thread.daemon = True
+        thread.start()
+        self.server = server
+
+        # Configure batch mode, using the SMTP stand-in
+        settings = current.deployment_settings
+        self.mail_settings = dict(settings.mail)
+        self.msg_settings = dict(settings.msg)
+        settings.mail.update(server="127.0.0.1:%s" % server.port,
+                             sender="sender@example.com",
+                             tls=False,
+                             login=False,
+                             limit=None)
+        settings.msg.update(outbox_batch_size=1,
+                            outbox_workers=2)
+
+        # The bulk mailer uses the settings of the web2py mailer
+        mail_settings = current.mail.settings
+        self.mailer_settings = dict(mail_settings)
+        mail_settings.update(server="127.0.0.1:%s" % server.port,
+                             sender="sender@example.com",
+                             tls=False,
+                             login=False)
+
+    # -------------------------------------------------------------------------
+    def testBatchEmailToPersons(self):
+        """ Test batch processing of emails to individual persons """
+
+        db = current.db
+        s3db = current.s3db
+
+        resource = s3db.resource("pr_person", uid=["MsgBulkTestPerson1",
+                                                   "MsgBulkTestPerson2"])
+        rows = resource.select(["pe_id"], as_rows=True)
+
+        outbox = s3db.msg_outbox
+        outbox_ids = [outbox.insert(pe_id=row.pe_id,
+                                    message_id=self.message_id)
+                      for row in rows]
+
+        current.msg.process_outbox()
+
+        received = self.server.received
+        self.assertEqual(len(received), 2)
+        self.assertTrue("bulk1@example.com" in received)
+        self.assertTrue("bulk2@example.com" in received)
+
+        query = (outbox.id.belongs(outbox_ids)) & (outbox.status == 2)
+        self.assertEqual(db(query).count(), 2)
+
+    # -------------------------------------------------------------------------
+    def testBatchEmailToGroup(self):
+        """ Test batch processing of emails to groups """
+
+        s3db = current.s3db
+
+        resource = s3db.resource("pr_group", uid="MsgBulkTestGroup")
+        row = resource.select(["pe_id"], as_rows=True).first()
+
+        outbox = s3db.msg_outbox
+        outbox.insert(pe_id=row.pe_id, message_id=self.message_id)
+
+        current.msg.process_outbox()
+
+        received = self.server.received
+        self.assertEqual(len(received), 2)
+        self.assertTrue("bulk1@example.com" in received)
+        self.assertTrue("bulk2@example.com" in received)
+
+    # -------------------------------------------------------------------------
+    def testBulkMailerSettings(self):
+        """ Test that the bulk mailer uses reply-to and encoding """
+
+        from s3.s3msg import S3BulkMailer
+
+        mailer = S3BulkMailer(reply_to="reply@example.com",
+                              encoding="iso-8859-1")
+        try:
+            results = mailer.send([(1, "bulk1@example.com", "Test", "Test")])
+        finally:
+            mailer.close()
+        self.assertEqual(results, {1: True})
+
+        message = self.server.messages[0]
+        self.assertTrue("Reply-To: reply@example.com" in message)
+        self.assertTrue("iso-8859-1" in message)
+        self.assertEqual(current.session.error, None)
+
+    # -------------------------------------------------------------------------
+    def testBulkMailerErrors(self):
+        """ Test that the bulk mailer reports errors """
+
+        from s3.s3msg import S3BulkMailer
+
+        # No server listening at this port
+        self.server.running = False
+        self.server.close()
+        current.mail.settings.server = "127.0.0.1:%s" % self.server.port
+
+        mailer = S3BulkMailer()
+        results = mailer.send([(1, "bulk1@example.com", "Test", "Test")])
+        self.assertEqual(results, {1: False})
+        self.assertEqual(len(mailer.errors), 1)
+        self.assertNotEqual(current.session.error, None)
+
+    # -------------------------------------------------------------------------
+    def testRateLimiter(self):
+        """ Test the rate limiter """
+
+        from s3.s3msg import S3RateLimiter
+        import time
+
+        limiter = S3RateLimiter(20)
+        start = time.time()
+        for i in xrange(5):
+            limiter.wait()
+        self.assertTrue(time.time() - start >= 0.19)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        self.server.running = False
+        self.server.close()
+
+        settings = current.deployment_settings
+        settings.mail.clear()
+        settings.mail.update(self.mail_settings)
+        settings.msg.clear()
+        settings.msg.update(self.msg_settings)
+
+        mail_settings = current.mail.settings
+        mail_settings.clear()
+        mail_settings.update(self.mailer_settings)
+        current.session.error = None
+
+        current.auth.override = False
+        current.db.rollback()
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -342,6 +567,7 @@ if __name__ == "__main__":
 
     run_suite(
         S3OutboxTests,
+        S3BulkOutboxTests,
     )
 
 # END ========================================================================
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Notifications Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3notify.py
+#
+import unittest
+import datetime
+
+from gluon import *
+from gluon.storage import Storage
+
+from s3.s3notify import S3Notifications
+
+# =============================================================================
+class NotifyGroupsTests(unittest.TestCase):
+    """ Tests for the grouping of subscriptions for batch notification """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        db = current.db
+        s3db = current.s3db
+
+        etable = s3db.pr_pentity
+        stable = s3db.pr_subscription
+        rtable = s3db.pr_subscription_resource
+
+        last_check_time = datetime.datetime(2014, 3, 1, 8, 0, 0)
+
+        resource_ids = {}
+        for name, url, offset in (("A", "req/req", 1),
+                                  ("B", "req/req", 5),
+                                  ("C", "req/req?req.type=1", 1),
+                                  ("D", "req/req", 90),
+                                  ):
+            pe_id = etable.insert(instance_type="pr_person")
+            subscription_id = stable.insert(pe_id=pe_id,
+                                            notify_on=["new"],
+                                            frequency="hourly",
+                                            method=["EMAIL"])
+            check_time = last_check_time + datetime.timedelta(minutes=offset)
+            resource_ids[name] = rtable.insert(subscription_id=subscription_id,
+                                               resource="req_req",
+                                               url=url,
+                                               last_check_time=check_time)
+        self.resource_ids = resource_ids
+
+    # -------------------------------------------------------------------------
+    def testGroups(self):
+        """ Test grouping of equivalent subscriptions """
+
+        resource_ids = self.resource_ids
+        subscriptions = [Storage(id=resource_id)
+                         for resource_id in resource_ids.values()]
+
+        groups = S3Notifications._groups(subscriptions)
+        groups = sorted(sorted(group) for group in groups)
+
+        # A and B share resource, URL, trigger and check interval window
+        expected = [sorted([resource_ids["A"], resource_ids["B"]]),
+                    [resource_ids["C"]],
+                    [resource_ids["D"]],
+                    ]
+        self.assertEqual(groups, sorted(expected))
+
+    # -------------------------------------------------------------------------
+    def testCheckAccess(self):
+        """ Test that subscribers with other permissions get deferred """
+
+        auth = current.auth
+        s3db = current.s3db
+
+        # A subscriber without user account can't share the lookup
+        other = s3db.pr_pentity.insert(instance_type="pr_person")
+
+        auth.s3_impersonate("normaluser@example.com")
+        try:
+            pe_id = auth.user.pe_id
+            subscribers = [{"resource_id": 1, "pe_id": pe_id},
+                           {"resource_id": 2, "pe_id": other},
+                           {"resource_id": 3, "pe_id": pe_id},
+                           ]
+            deferred = S3Notifications._check_access(s3db.req_req,
+                                                     subscribers,
+                                                     pe_id)
+            self.assertEqual(deferred, set([2]))
+
+            # The current user is restored
+            self.assertEqual(auth.user.pe_id, pe_id)
+        finally:
+            auth.s3_impersonate(None)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.auth.override = False
+        current.db.rollback()
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        NotifyGroupsTests,
+    )
+
+# END ========================================================================
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#
+# Request Profiler Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3profiler.py
+#
+import unittest
+import time
+
+from gluon import *
+
+from s3.s3fields import S3RepresentCache
+from s3.s3profiler import S3Profiler
+
+# =============================================================================
+class S3ProfilerTests(unittest.TestCase):
+    """ Tests for S3Profiler """
+
+    def setUp(self):
+
+        self.filename = S3Profiler.FILENAME
+        S3Profiler.FILENAME = "s3profile.test.log"
+        S3Profiler.clear()
+
+    # -------------------------------------------------------------------------
+    def testMeasure(self):
+        """ Test recording of nested calls """
+
+        profiler = S3Profiler(current.db)
+
+        def inner():
+            current.db(current.db.auth_user.id > 0).count()
+            time.sleep(0.01)
+
+        def outer():
+            profiler.measure("model", "inner", inner)
+            time.sleep(0.01)
+            return "result"
+
+        result = profiler.measure("model", "outer", outer)
+        self.assertEqual(result, "result")
+
+        records = dict((r[1], r) for r in profiler.records)
+        self.assertEqual(set(records.keys()), set(["inner", "outer"]))
+
+        category, name, t, s, q, sq = records["outer"]
+        self.assertTrue(t >= 0.02)
+        # Self-time excludes the nested call
+        self.assertTrue(s < t - 0.009)
+        self.assertEqual(q, 1)
+        self.assertEqual(sq, 0)
+
+        category, name, t, s, q, sq = records["inner"]
+        self.assertEqual(t, s)
+        self.assertEqual(q, 1)
+
+    # -------------------------------------------------------------------------
+    def testReport(self):
+        """ Test aggregation of the profile log """
+
+        for i in xrange(2):
+            profiler = S3Profiler()
+            profiler.measure("model", "test", lambda: None)
+            profiler.checkpoint("00_test")
+            profiler.save("test/index")
+        profiler = S3Profiler()
+        profiler.checkpoint("00_test")
+        profiler.save("test/other")
+
+        summary, items = S3Profiler.report()
+        self.assertEqual(summary.requests, 3)
+        items = dict(((item.category, item.name), item) for item in items)
+        self.assertEqual(items[("file", "00_test")].calls, 3)
+        self.assertEqual(items[("model", "test")].calls, 2)
+
+        summary, items = S3Profiler.report(request="test/other")
+        self.assertEqual(summary.requests, 1)
+        self.assertEqual([item.name for item in items], ["00_test"])
+
+        self.assertTrue("00_test" in S3Profiler.render())
+
+    # -------------------------------------------------------------------------
+    def testReportRepresentCache(self):
+        """ Test reporting of the representation cache statistics """
+
+        rcache = S3RepresentCache.instance
+        S3RepresentCache.instance = S3RepresentCache(maxsize=2)
+        try:
+            cache = S3RepresentCache.instance
+            rkey = ("org_organisation", "test")
+            cache.set(rkey, {1: "A", 2: "B", 3: "C"})
+            cache.get(rkey, [1, 2, 3])
+
+            # Only the latest snapshot of each process counts
+            for i in xrange(2):
+                profiler = S3Profiler()
+                profiler.save("test/index")
+        finally:
+            S3RepresentCache.instance = rcache
+
+        summary, items = S3Profiler.report()
+        stats = summary.rcache
+        self.assertEqual(stats.hits, 2)
+        self.assertEqual(stats.misses, 1)
+        self.assertEqual(stats.evictions, 1)
+        self.assertEqual(stats.size, 2)
+
+        self.assertTrue("Represent cache: 2 hits" in S3Profiler.render())
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        S3Profiler.clear()
+        S3Profiler.FILENAME = self.filename
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3ProfilerTests,
+    )
+
+# END ========================================================================
@@ -1611,6 +1611,41 @@ class ResourceDataAccessTests(unittest.TestCase):
         resource.add_filter(query)
         self.assertEqual(resource.count(), 1)
 
+    # -------------------------------------------------------------------------
+    def testIterSelect(self):
+        """ Test batch-wise extraction with iter_select """
+
+        s3db = current.s3db
+
+        list_fields = ["id", "name", "organisation_id$name"]
+
+        resource = s3db.resource("org_office")
+        expected = resource.select(list_fields,
+                                   limit=None,
+                                   orderby="org_office.id")["rows"]
+
+        # Keyset pagination (by primary key)
+        resource = s3db.resource("org_office")
+        rows = list(resource.iter_select(list_fields, batch_size=1))
+        self.assertEqual(rows, expected)
+
+        # Ordered IDs
+        resource = s3db.resource("org_office")
+        rows = list(resource.iter_select(list_fields,
+                                         batch_size=2,
+                                         orderby="org_office.id"))
+        self.assertEqual(rows, expected)
+
+        # Ambiguous filter query
+        query = (S3FieldSelector("office.name").like("DATestOffice%"))
+        resource = s3db.resource("org_organisation")
+        resource.add_filter(query)
+        batches = list(resource.iter_select(["name"],
+                                            batch_size=1,
+                                            as_rows=True))
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0].first().name, "DATestOrg")
+
     # -------------------------------------------------------------------------
     @classmethod
     def tearDownClass(cls):
@@ -1752,7 +1787,80 @@ class ResourceDataTableFilterTests(unittest.TestCase):
                                                             "competency_id"],
                                                             vars)
         self.assertEqual(orderby, "hrm_competency_rating.priority desc")
-        
+
+# =============================================================================
+class ResourceDataTableKeysetTests(unittest.TestCase):
+    """ Test keyset pagination of data tables """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        settings = current.deployment_settings
+        self.keyset = settings.ui.get("datatables_keyset")
+        self.expire = settings.ui.get("datatables_count_expire")
+
+    # -------------------------------------------------------------------------
+    def testKeysetPagination(self):
+        """ Test that keyset pagination gives the same pages as offset """
+
+        s3db = current.s3db
+        settings = current.deployment_settings
+
+        list_fields = ["id", "name", "acronym"]
+        orderby = "org_organisation.name desc"
+
+        resource = s3db.resource("org_organisation")
+        numrows = resource.count()
+        if numrows < 4:
+            return
+        expected = resource.select(list_fields,
+                                   limit=None,
+                                   orderby=["org_organisation.name desc",
+                                            "org_organisation.id"])["rows"]
+        expected = [row["org_organisation.id"] for row in expected]
+
+        settings.ui.datatables_keyset = True
+        settings.ui.datatables_count_expire = 30
+
+        ids = []
+        for start in xrange(0, numrows, 2):
+            resource = s3db.resource("org_organisation")
+            dt, totalrows, x = resource.datatable(fields=list(list_fields),
+                                                  start=start,
+                                                  limit=2,
+                                                  orderby=orderby)
+            self.assertEqual(totalrows, numrows)
+            ids.extend([int(row["org_organisation.id"]) for row in dt.data])
+        self.assertEqual(ids, expected)
+
+    # -------------------------------------------------------------------------
+    def testSeekFields(self):
+        """ Test that keyset pagination is only used with field orderbys """
+
+        resource = current.s3db.resource("org_organisation")
+        table = resource.table
+        seek_fields = resource._S3Resource__seek_fields
+
+        self.assertEqual(seek_fields(~table.id), [(table.id, True)])
+        self.assertEqual(seek_fields("org_organisation.id desc"),
+                         [(table.id, True)])
+
+        # Items which are not fields => fall back to offset pagination
+        self.assertEqual(seek_fields([table.id, "org_organisation.nosuchfield"]), None)
+        self.assertEqual(seek_fields(table.name.lower() | table.id), None)
+        self.assertEqual(seek_fields(~table.name.lower()), None)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        settings = current.deployment_settings
+        settings.ui.datatables_keyset = self.keyset
+        settings.ui.datatables_count_expire = self.expire
+
+        current.auth.override = False
+
 # =============================================================================
 class ResourceExportTests(unittest.TestCase):
     """ Test XML export of resources """
@@ -4470,6 +4578,7 @@ if __name__ == "__main__":
         ResourceDataAccessTests,
         ResourceAxisFilterTests,
         ResourceDataTableFilterTests,
+        ResourceDataTableKeysetTests,
         ResourceGetTests,
         #ResourceInsertTest,
         #ResourceSelectTests,
@@ -5,10 +5,18 @@
 # To run this script use:
 # python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3sync.py
 #
+import BaseHTTPServer
+import datetime
+import threading
 import unittest
+import urlparse
+
 from gluon import current
 from gluon.dal import Query
 from lxml import etree
+
+from s3.s3sync import S3Sync, S3SyncRepository
+
 try:
     import json # try stdlib (Python 2.6)
 except ImportError:
@@ -438,6 +446,139 @@ class ImportMergeWithoutExistingRecords(unittest.TestCase):
         current.auth.override = False
         current.db.rollback()
 
+# =============================================================================
+class SyncStandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Request handler for a local stand-in Eden instance """
+
+    PAGES = {"": ("TESTSYNCPAGEORG1", "PAGE2"),
+             "PAGE2": ("TESTSYNCPAGEORG2", ""),
+             }
+
+    def do_GET(self):
+
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query,
+                                  keep_blank_values=True)
+        accept_encoding = self.headers.getheader("Accept-Encoding")
+        self.server.requests.append((query, accept_encoding))
+
+        cursor = query.get("cursor", [""])[0]
+        uid, next_cursor = self.PAGES[cursor]
+        data = """<s3xml>
+    <resource name="org_organisation" uuid="%(uid)s">
+        <data field="name">%(uid)s</data>
+    </resource>
+</s3xml>""" % dict(uid=uid)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Accept-Encoding", "gzip")
+        self.send_header("X-Sync-Cursor", next_cursor)
+        if accept_encoding and "gzip" in accept_encoding:
+            data = S3Sync.compress(data)
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+
+        pass
+
+# =============================================================================
+class SyncPagingTests(unittest.TestCase):
+    """ Tests for paged and compressed synchronization """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        # Start a local stand-in for the peer repository
+        server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0),
+                                           SyncStandInHandler)
+        server.requests = []
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.server = server
+
+        settings = current.deployment_settings
+        self.page_size = settings.base.get("sync_page_size")
+        settings.base.sync_page_size = 1
+
+    # -------------------------------------------------------------------------
+    def testCursor(self):
+        """ Test encoding/decoding of page cursors """
+
+        mtime = datetime.datetime(2014, 3, 1, 12, 30, 15, 123456)
+        cursor = S3Sync.encode_cursor((mtime, 42))
+        self.assertEqual(S3Sync.decode_cursor(cursor), (mtime, 42))
+        self.assertEqual(S3Sync.encode_cursor(None), "")
+        self.assertEqual(S3Sync.decode_cursor(""), None)
+        self.assertEqual(S3Sync.decode_cursor("invalid"), None)
+
+    # -------------------------------------------------------------------------
+    def testCompression(self):
+        """ Test gzip compression/decompression of sync data """
+
+        data = "<s3xml>%s</s3xml>" % ("x" * 1000)
+        compressed = S3Sync.compress(data)
+        self.assertTrue(len(compressed) < len(data))
+        self.assertEqual(S3Sync.decompress(compressed), data)
+
+    # -------------------------------------------------------------------------
+    def testPagedPull(self):
+        """ Test page-wise pull of compressed data from the peer """
+
+        db = current.db
+        s3db = current.s3db
+
+        rtable = s3db.sync_repository
+        repository_id = rtable.insert(name="TestSyncPaging",
+                                      url="http://127.0.0.1:%s/eden" %
+                                          self.server.server_port,
+                                      apitype="eden")
+        repository = db(rtable.id == repository_id).select().first()
+
+        ttable = s3db.sync_task
+        task_id = ttable.insert(repository_id=repository_id,
+                                resource_name="org_organisation",
+                                mode=1,
+                                update_policy="OTHER")
+        task = db(ttable.id == task_id).select().first()
+
+        connector = S3SyncRepository(repository)
+        output, mtime = connector.pull(task)
+        self.assertEqual(output, None)
+
+        # Two pages requested, the second one with the cursor
+        requests = self.server.requests
+        self.assertEqual(len(requests), 2)
+        query, accept_encoding = requests[0]
+        self.assertEqual(query["limit"], ["1"])
+        self.assertEqual(query["cursor"], [""])
+        self.assertTrue("gzip" in accept_encoding)
+        query, accept_encoding = requests[1]
+        self.assertEqual(query["cursor"], ["PAGE2"])
+
+        # Peer accepts compressed push
+        self.assertTrue(connector.accept_gzip)
+
+        # Both pages imported
+        otable = s3db.org_organisation
+        query = (otable.uuid.belongs(("TESTSYNCPAGEORG1",
+                                      "TESTSYNCPAGEORG2")))
+        self.assertEqual(db(query).count(), 2)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+
+        current.deployment_settings.base.sync_page_size = self.page_size
+
+        current.auth.override = False
+        current.db.rollback()
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -459,7 +600,8 @@ if __name__ == "__main__":
         ImportMergeWithExistingRecords,
         ImportMergeWithExistingOriginal,
         ImportMergeWithExistingDuplicate,
-        ImportMergeWithoutExistingRecords
+        ImportMergeWithoutExistingRecords,
+        SyncPagingTests,
     )
 
 # END ========================================================================
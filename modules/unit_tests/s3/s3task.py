@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# Asynchronous Task Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3task.py
+#
+import unittest
+
+from gluon import *
+
+try:
+    import json # try stdlib (Python 2.6)
+except ImportError:
+    try:
+        import simplejson as json # try external module
+    except:
+        import gluon.contrib.simplejson as json # fallback to pure-Python module
+
+from s3.s3task import S3Task
+
+# =============================================================================
+class TaskBatchTests(unittest.TestCase):
+    """ Tests for batch enqueue and coalescing of task calls """
+
+    def setUp(self):
+
+        self.s3task = S3Task()
+        self.task = "test_task"
+
+        self.calls = []
+        tasks = current.response.s3.tasks
+        self.tasks = tasks
+        tasks[self.task] = lambda *args, **vars: self.calls.append((args, vars))
+
+    # -------------------------------------------------------------------------
+    def testEnqueue(self):
+        """ Test that calls are merged into one queued batch """
+
+        db = current.db
+        table = db.scheduler_task
+        s3task = self.s3task
+
+        task_id = s3task._enqueue(self.task, [([1], {}), ([2], {})], 300, None)
+        self.assertNotEqual(task_id, None)
+
+        # Identical calls are coalesced, others added to the same batch
+        other_id = s3task._enqueue(self.task, [([2], {}), ([3], {})], 300, None)
+        self.assertEqual(other_id, task_id)
+
+        row = db(table.id == task_id).select(table.function_name,
+                                             table.args,
+                                             table.vars,
+                                             table.timeout,
+                                             limitby=(0, 1)).first()
+        self.assertEqual(row.function_name, S3Task.BATCH)
+        self.assertEqual(json.loads(row.args), [self.task])
+        calls = json.loads(row.vars)["calls"]
+        self.assertEqual(calls, [[[1], {}], [[2], {}], [[3], {}]])
+        self.assertEqual(row.timeout, 900)
+
+    # -------------------------------------------------------------------------
+    def testBatchSize(self):
+        """ Test that a new batch is started when the batch is full """
+
+        s3task = self.s3task
+
+        batch_size = S3Task.BATCH_SIZE
+        try:
+            S3Task.BATCH_SIZE = 2
+            calls = [([i], {}) for i in xrange(5)]
+            first_id = s3task._enqueue(self.task, calls[:2], 300, None)
+            last_id = s3task._enqueue(self.task, calls[2:], 300, None)
+        finally:
+            S3Task.BATCH_SIZE = batch_size
+
+        self.assertNotEqual(first_id, last_id)
+
+        db = current.db
+        table = db.scheduler_task
+        query = (table.task_name == "%s:%s" % (S3Task.BATCH, self.task)) & \
+                (table.status == "QUEUED")
+        rows = db(query).select(table.vars, orderby=table.id)
+        self.assertEqual([len(json.loads(row.vars)["calls"]) for row in rows],
+                         [2, 2, 1])
+
+    # -------------------------------------------------------------------------
+    def testBatchTimeout(self):
+        """ Test that the timeout of a batch is limited """
+
+        db = current.db
+        table = db.scheduler_task
+
+        calls = [[[i], {}] for i in xrange(100)]
+        task_id = self.s3task._store_batch(None, self.task, calls, 300, None)
+        row = db(table.id == task_id).select(table.timeout,
+                                             limitby=(0, 1)).first()
+        self.assertEqual(row.timeout, S3Task.BATCH_TIMEOUT)
+
+    # -------------------------------------------------------------------------
+    def testPickedUp(self):
+        """ Test that batches picked up by a worker are not updated """
+
+        db = current.db
+        table = db.scheduler_task
+        s3task = self.s3task
+
+        task_id = s3task._enqueue(self.task, [([1], {})], 300, None)
+        row = db(table.id == task_id).select(table.id,
+                                             table.vars,
+                                             limitby=(0, 1)).first()
+
+        # A worker picks up the batch before it is updated
+        db(table.id == task_id).update(status="RUNNING")
+        calls = [[[1], {}], [[2], {}]]
+        self.assertEqual(s3task._store_batch(row, self.task, calls, 300, None),
+                         None)
+        row = db(table.id == task_id).select(table.vars,
+                                             limitby=(0, 1)).first()
+        self.assertEqual(json.loads(row.vars)["calls"], [[[1], {}]])
+
+        # New calls go into a new batch
+        other_id = s3task._enqueue(self.task, [([2], {})], 300, None)
+        self.assertNotEqual(other_id, task_id)
+
+    # -------------------------------------------------------------------------
+    def testPriority(self):
+        """ Test that prioritised batches are scheduled ahead """
+
+        db = current.db
+        table = db.scheduler_task
+        s3task = self.s3task
+
+        normal_id = s3task._enqueue(self.task, [([1], {})], 300, None)
+        db(table.id == normal_id).update(status="RUNNING")
+        high_id = s3task._enqueue(self.task, [([2], {})], 300,
+                                  S3Task.PRIORITY.HIGH)
+
+        rows = db(table.id.belongs((normal_id, high_id))).select(
+                                                table.id,
+                                                orderby=table.next_run_time)
+        self.assertEqual(rows.first().id, high_id)
+
+    # -------------------------------------------------------------------------
+    def testRunBatch(self):
+        """ Test running a batch of calls """
+
+        result = S3Task.run_batch(self.task, [[[1], {"a": 2}], [[3], {}]])
+
+        self.assertEqual(result["calls"], 2)
+        self.assertEqual(result["failed"], 0)
+        self.assertEqual(self.calls, [((1,), {"a": 2}), ((3,), {})])
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        del self.tasks[self.task]
+        current.db.rollback()
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        TaskBatchTests,
+    )
+
+# END ========================================================================
@@ -178,6 +178,179 @@ class S3DataTableTests(unittest.TestCase):
                                           limit=2)
         self.assertEqual(len(table.rows), 1)
 
+# =============================================================================
+class S3SearchKeyTests(unittest.TestCase):
+    """ Tests for the search keys for autocomplete lookups """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        table = current.s3db.org_organisation
+        self.table = table
+        self.org_id = table.insert(name="Zürich Rescue",
+                                   acronym="ZRSC")
+        S3SearchKey.update(table, self.org_id, ["name", "acronym"])
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+    def lookup(self, prefix):
+        """ Look up the organisation IDs matching a prefix """
+
+        table = self.table
+        query = S3SearchKey.query(table, prefix)
+        rows = current.db(query).select(table.id)
+        return [row.id for row in rows]
+
+    def testNormalize(self):
+        """ Test normalization of search keys """
+
+        normalize = S3SearchKey.normalize
+        self.assertEqual(normalize(" Zürich "), u"zurich")
+        self.assertEqual(normalize(u"S\xe3o Tom\xe9"), u"sao tome")
+        self.assertEqual(normalize(None), u"")
+        self.assertEqual(len(normalize("x" * 200)), S3SearchKey.LENGTH)
+
+    def testQuery(self):
+        """ Test prefix lookups """
+
+        org_id = self.org_id
+        self.assertTrue(org_id in self.lookup("zur"))
+        self.assertTrue(org_id in self.lookup("Züri"))
+        self.assertTrue(org_id in self.lookup("ZURICH R"))
+        self.assertTrue(org_id in self.lookup("zrs"))
+        self.assertFalse(org_id in self.lookup("rescue"))
+
+    def testUpdate(self):
+        """ Test that keys follow updates and deletions of the records """
+
+        table = self.table
+        org_id = self.org_id
+
+        # Renamed
+        current.db(table.id == org_id).update(name="Bern Rescue")
+        S3SearchKey.update(table, org_id, ["name", "acronym"])
+        self.assertFalse(org_id in self.lookup("zur"))
+        self.assertTrue(org_id in self.lookup("bern"))
+        self.assertTrue(org_id in self.lookup("zrs"))
+
+        # Deleted
+        current.db(table.id == org_id).update(deleted=True)
+        S3SearchKey.update(table, org_id, ["name", "acronym"])
+        self.assertFalse(org_id in self.lookup("bern"))
+        self.assertFalse(org_id in self.lookup("zrs"))
+
+    def testRebuild(self):
+        """ Test rebuild of the keys for a table """
+
+        table = self.table
+        org_id = self.org_id
+
+        ktable = current.s3db.s3_search_key
+        current.db(ktable.tablename == "org_organisation").delete()
+        self.assertFalse(org_id in self.lookup("zur"))
+
+        S3SearchKey.rebuild(table, ["name", "acronym"], chunk_size=2)
+        self.assertTrue(org_id in self.lookup("zur"))
+
+# =============================================================================
+class S3JaroWinklerTests(unittest.TestCase):
+    """ Tests for the Jaro-Winkler string similarity functions """
+
+    def testJaroWinkler(self):
+        """ Test the scores of s3_jaro_winkler (used by S3Merge) """
+
+        assertAlmostEqual = self.assertAlmostEqual
+
+        assertAlmostEqual(s3_jaro_winkler("MARTHA", "MARHTA"), 0.96111, 4)
+        assertAlmostEqual(s3_jaro_winkler("DWAYNE", "DUANE"), 0.48, 4)
+        assertAlmostEqual(s3_jaro_winkler("DIXON", "DICKSONX"), 0.50333, 4)
+        assertAlmostEqual(s3_jaro_winkler("john", "jon"), 0.69556, 4)
+        self.assertEqual(s3_jaro_winkler("abc", "abc"), 1.0)
+        self.assertEqual(s3_jaro_winkler("abc", None), 0)
+        self.assertEqual(s3_jaro_winkler("", "abc"), 0.0)
+
+        # List input
+        self.assertEqual(s3_jaro_winkler(["ab", "cd"], ["ab", "ce"]), 1.0)
+
+    def testJaroWinklerSimilarity(self):
+        """ Test the scores of s3_jaro_winkler_similarity (name index) """
+
+        assertAlmostEqual = self.assertAlmostEqual
+
+        similarity = s3_jaro_winkler_similarity
+        assertAlmostEqual(similarity("MARTHA", "MARHTA"), 0.96111, 4)
+        assertAlmostEqual(similarity("DWAYNE", "DUANE"), 0.84, 4)
+        assertAlmostEqual(similarity("DIXON", "DICKSONX"), 0.81333, 4)
+        assertAlmostEqual(similarity("john", "jon"), 0.93333, 4)
+        self.assertEqual(similarity("abc", "abc"), 1.0)
+        self.assertEqual(similarity("abc", None), 0.0)
+        self.assertEqual(similarity("", "abc"), 0.0)
+
+# =============================================================================
+class S3AppendCallbackTests(unittest.TestCase):
+    """ Tests for s3_append_callback """
+
+    TABLENAME = "s3_append_callback_test"
+
+    def tearDown(self):
+
+        current.model.config.pop(self.TABLENAME, None)
+
+    def testAppend(self):
+        """ Test appending a callback to existing callbacks """
+
+        tablename = self.TABLENAME
+        keys = ("onaccept", "create_onaccept", "ondelete")
+
+        first = lambda form: None
+        second = lambda form: None
+        callback = lambda *args, **kwargs: None
+
+        current.s3db.configure(tablename,
+                               onaccept = first,
+                               ondelete = [first, second])
+
+        s3_append_callback(tablename, keys, callback)
+        config = current.model.config[tablename]
+        self.assertEqual(config.onaccept, [first, callback])
+        self.assertEqual(config.ondelete, [first, second, callback])
+        # Not added where there are no type-specific callbacks
+        self.assertEqual(config.get("create_onaccept"), None)
+
+        # Appended only once
+        s3_append_callback(tablename, keys, callback)
+        self.assertEqual(config.onaccept, [first, callback])
+        self.assertEqual(config.ondelete, [first, second, callback])
+
+    def testAdd(self):
+        """ Test adding a callback where there are none """
+
+        tablename = self.TABLENAME
+        callback = lambda *args, **kwargs: None
+
+        s3_append_callback(tablename, ("onaccept", "ondelete"), callback)
+        config = current.model.config[tablename]
+        self.assertTrue(config.onaccept is callback)
+        self.assertTrue(config.ondelete is callback)
+
+    def testComponentCallbacks(self):
+        """ Test appending to per-tablename (component) callbacks """
+
+        tablename = self.TABLENAME
+        first = lambda form: None
+        callback = lambda *args, **kwargs: None
+
+        current.s3db.configure(tablename,
+                               onaccept = {tablename: first})
+
+        s3_append_callback(tablename, ("onaccept",), callback)
+        config = current.model.config[tablename]
+        self.assertEqual(config.onaccept, {tablename: [first, callback]})
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -197,6 +370,9 @@ if __name__ == "__main__":
         S3FKWrappersTests,
         S3SQLTableTests,
         S3DataTableTests,
+        S3SearchKeyTests,
+        S3JaroWinklerTests,
+        S3AppendCallbackTests,
     )
 
 # END ========================================================================
@@ -424,6 +424,64 @@ class TestS3OptionsMatrixWidget(unittest.TestCase):
                          str(expected_result))
 
 
+# =============================================================================
+class SearchACSelectTests(unittest.TestCase):
+    """ Test the single-query match lookup for autocomplete searches """
+
+    def setUp(self):
+
+        current.auth.override = True
+        settings = current.deployment_settings
+        self.max_results = settings.search.get("max_results")
+        settings.search.max_results = 2
+
+        otable = current.s3db.org_organisation
+        for i in xrange(3):
+            otable.insert(name="SACTestOrganisation%s" % i)
+
+    def testSelect(self):
+        """ Test detection of too many results """
+
+        from s3.s3resource import S3FieldSelector
+        from s3.s3widgets import search_ac_select
+
+        s3db = current.s3db
+        name = S3FieldSelector("name")
+
+        # 3 matches, max 2
+        resource = s3db.resource("org_organisation",
+                                 filter=name.like("SACTestOrganisation%"))
+        rows, message = search_ac_select(resource, ["id", "name"],
+                                         as_rows=True)
+        self.assertEqual(rows, None)
+        self.assertEqual(len(message), 1)
+        self.assertTrue("label" in message[0])
+
+        # Explicit limit below max => no check
+        rows, message = search_ac_select(resource, ["id", "name"],
+                                         limit=1,
+                                         as_rows=True)
+        self.assertEqual(message, None)
+        self.assertEqual(len(rows), 1)
+
+        # 2 matches, max 2
+        resource = s3db.resource("org_organisation",
+                                 filter=name.belongs(["SACTestOrganisation0",
+                                                      "SACTestOrganisation1"]))
+        rows, message = search_ac_select(resource, ["id", "name"])
+        self.assertEqual(message, None)
+        self.assertEqual(len(rows), 2)
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+        search = current.deployment_settings.search
+        if self.max_results is None:
+            search.pop("max_results", None)
+        else:
+            search.max_results = self.max_results
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -441,6 +499,7 @@ if __name__ == "__main__":
 
     run_suite(
         TestS3OptionsMatrixWidget,
+        SearchACSelectTests,
     )
 
 # END ========================================================================
@@ -263,6 +263,59 @@ class S3XMLFormatTests(unittest.TestCase):
         self.assertEqual(len(root), 0)
         self.assertEqual(root.text, "Test")
 
+# =============================================================================
+class S3IncrementalParserTests(unittest.TestCase):
+    """ Tests for incremental XML/CSV parsing (chunked imports) """
+
+    # -------------------------------------------------------------------------
+    def testIterParse(self):
+        """ Test incremental parsing of XML sources """
+
+        xml = current.xml
+
+        xmlstr = """<s3xml domain="test">%s</s3xml>""" % \
+                 "".join(["""<resource name="org_organisation">
+                                <data field="name">Org%s</data>
+                             </resource>""" % i for i in xrange(5)])
+
+        chunks = list(xml.iterparse(StringIO(xmlstr), chunk_size=2))
+        self.assertEqual(xml.error, None)
+        self.assertEqual([len(t.getroot()) for t in chunks], [2, 2, 1])
+        for t in chunks:
+            root = t.getroot()
+            self.assertEqual(root.tag, "s3xml")
+            self.assertEqual(root.get("domain"), "test")
+        names = [e.findtext("data") for t in chunks for e in t.getroot()]
+        self.assertEqual(names, ["Org%s" % i for i in xrange(5)])
+
+        # Parser errors
+        chunks = list(xml.iterparse(StringIO("<s3xml><resource>"),
+                                    chunk_size=2))
+        self.assertEqual(chunks, [])
+        self.assertNotEqual(xml.error, None)
+
+    # -------------------------------------------------------------------------
+    def testCSV2Trees(self):
+        """ Test incremental conversion of CSV sources """
+
+        xml = current.xml
+
+        csvstr = "Name,Acronym\n" + \
+                 "".join(["Org%s,O%s\n" % (i, i) for i in xrange(5)])
+
+        chunks = list(xml.csv2trees(StringIO(csvstr),
+                                    resourcename="org_organisation",
+                                    chunk_size=2))
+        self.assertEqual([len(t.getroot()) for t in chunks], [2, 2, 1])
+        for t in chunks:
+            root = t.getroot()
+            self.assertEqual(root.tag, xml.TAG.table)
+            self.assertEqual(root.get("name"), "org_organisation")
+
+        # All rows in one tree
+        tree = xml.csv2tree(StringIO(csvstr))
+        self.assertEqual(len(tree.getroot()), 5)
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -282,6 +335,7 @@ if __name__ == "__main__":
         S3TreeBuilderTests,
         S3JSONMessageTests,
         S3XMLFormatTests,
+        S3IncrementalParserTests,
     )
 
 # END ========================================================================
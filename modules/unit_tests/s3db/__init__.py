@@ -1,3 +1,4 @@
 from pr import *
 from org import *
 from vulnerability import *
+from survey import *
@@ -146,6 +146,257 @@ class PRTests(unittest.TestCase):
         current.db.rollback()
         current.auth.override = False
 
+# =============================================================================
+class AncestorIndexTests(unittest.TestCase):
+    """ Tests for the ancestor index of the OU hierarchy """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+        """ Set up organisation records """
+
+        auth = current.auth
+        s3db = current.s3db
+
+        auth.override = True
+
+        settings = current.deployment_settings
+        self.ancestor_index = settings.security.get("ancestor_index")
+        settings.security.ancestor_index = True
+
+        otable = s3db.org_organisation
+
+        orgs = []
+        for i in xrange(4):
+            org = Storage(name="Test Ancestor Organisation %s" % i)
+            org_id = otable.insert(**org)
+            org.update(id=org_id)
+            s3db.update_super(otable, org)
+            orgs.append(s3db.pr_get_pe_id("org_organisation", org_id))
+        self.orgs = orgs
+
+    # -------------------------------------------------------------------------
+    def testAddRemoveAffiliation(self):
+        """ Test maintenance of the index by adding/removing affiliations """
+
+        s3db = current.s3db
+        assertEqual = self.assertEqual
+
+        org0, org1, org2 = self.orgs[:3]
+
+        # org0 => org1 => org2
+        s3db.pr_add_affiliation(org0, org1, role="TestOrgUnit")
+        s3db.pr_add_affiliation(org1, org2, role="TestOrgUnit")
+
+        assertEqual(s3db.pr_get_ancestors(org2), [str(org1), str(org0)])
+        assertEqual(s3db.pr_get_ancestors(org1), [str(org0)])
+        assertEqual(s3db.pr_realm(org2), [org1])
+        assertEqual(set(s3db.pr_get_descendants(org0)), set([org1, org2]))
+        descendants = s3db.pr_descendants([org0])
+        assertEqual(set(descendants[org0]), set([org1, org2]))
+
+        # Removing org1 from org0 removes org0 from the ancestors of org2
+        s3db.pr_remove_affiliation(org0, org1, role="TestOrgUnit")
+
+        assertEqual(s3db.pr_get_ancestors(org2), [str(org1)])
+        assertEqual(s3db.pr_get_ancestors(org1), [])
+        assertEqual(s3db.pr_get_descendants(org0), [])
+        assertEqual(s3db.pr_get_descendants(org1), [org2])
+
+    # -------------------------------------------------------------------------
+    def testRebuild(self):
+        """ Test full rebuild of the index """
+
+        db = current.db
+        s3db = current.s3db
+
+        org0, org1, org2 = self.orgs[:3]
+
+        # org0 => org1 => org2, and org0 => org2
+        s3db.pr_add_affiliation(org0, org1, role="TestOrgUnit")
+        s3db.pr_add_affiliation(org1, org2, role="TestOrgUnit")
+        s3db.pr_add_affiliation(org0, org2, role="TestOrgUnit")
+
+        table = s3db.pr_ancestor
+        def index():
+            query = (table.descendant_pe_id.belongs(self.orgs[:3]))
+            rows = db(query).select(table.ancestor_pe_id,
+                                    table.descendant_pe_id,
+                                    table.depth)
+            return set((row.ancestor_pe_id,
+                        row.descendant_pe_id,
+                        row.depth) for row in rows)
+
+        expected = set([(org0, org1, 1),
+                        (org1, org2, 1),
+                        (org0, org2, 1),
+                        ])
+        self.assertEqual(index(), expected)
+
+        s3db.pr_rebuild_ancestors()
+        self.assertEqual(index(), expected)
+
+    # -------------------------------------------------------------------------
+    def testBuildEmptyIndex(self):
+        """ Test automatic build of an empty index (existing databases) """
+
+        db = current.db
+        s3db = current.s3db
+
+        from s3db.pr import ANCESTOR_INDEX
+
+        org0, org1, org2 = self.orgs[:3]
+
+        # org0 => org1 => org2
+        s3db.pr_add_affiliation(org0, org1, role="TestOrgUnit")
+        s3db.pr_add_affiliation(org1, org2, role="TestOrgUnit")
+
+        # Index not yet built
+        table = s3db.pr_ancestor
+        db(table.id > 0).delete()
+        ANCESTOR_INDEX.checked = False
+
+        self.assertEqual(s3db.pr_get_ancestors(org2), [str(org1), str(org0)])
+        self.assertTrue(ANCESTOR_INDEX.checked)
+
+    # -------------------------------------------------------------------------
+    def testCompare(self):
+        """ Test that index lookups give the same results as the searches """
+
+        s3db = current.s3db
+        settings = current.deployment_settings
+
+        org0, org1, org2, org3 = self.orgs
+
+        # org0 => org1 => org2 => org3, and org0 => org2
+        s3db.pr_add_affiliation(org0, org1, role="TestOrgUnit")
+        s3db.pr_add_affiliation(org1, org2, role="TestOrgUnit")
+        s3db.pr_add_affiliation(org2, org3, role="TestOrgUnit")
+        s3db.pr_add_affiliation(org0, org2, role="TestOrgUnit")
+
+        # A person in org3
+        ptable = s3db.pr_person
+        person = Storage(first_name="Ancestor", last_name="Tester")
+        person_id = ptable.insert(**person)
+        person.update(id=person_id)
+        s3db.update_super(ptable, person)
+        pe_id = s3db.pr_get_pe_id("pr_person", person_id)
+        s3db.pr_add_affiliation(org3, pe_id, role="TestStaff")
+
+        entities = self.orgs + [pe_id]
+        def lookups():
+            result = {}
+            for entity in entities:
+                result[entity] = (
+                    set(str(a) for a in s3db.pr_get_ancestors(entity)),
+                    set(s3db.pr_realm(entity)),
+                    set(s3db.pr_get_descendants(entity)),
+                    set(s3db.pr_get_descendants(entity,
+                            entity_types="org_organisation")),
+                    )
+            ancestors = s3db.pr_ancestors(entities)
+            result["ancestors"] = dict((k, set(str(a) for a in v))
+                                       for k, v in ancestors.items())
+            descendants = s3db.pr_descendants(entities)
+            result["descendants"] = dict((k, set(v))
+                                         for k, v in descendants.items())
+            return result
+
+        settings.security.ancestor_index = False
+        expected = lookups()
+        settings.security.ancestor_index = True
+        self.assertEqual(lookups(), expected)
+
+        # Check some of the expected results
+        self.assertEqual(expected[org3][0], set([str(org2),
+                                                 str(org1),
+                                                 str(org0)]))
+        self.assertEqual(expected[org3][1], set([org2]))
+        self.assertEqual(expected[org0][2], set([org1, org2, org3, pe_id]))
+        self.assertEqual(expected["descendants"][org0], set([org1, org2, org3]))
+
+    # -------------------------------------------------------------------------
+    def testNotMaintainedWhenDisabled(self):
+        """ Test that the index is not used or written when disabled """
+
+        db = current.db
+        s3db = current.s3db
+
+        org0, org1 = self.orgs[:2]
+
+        current.deployment_settings.security.ancestor_index = False
+        s3db.pr_add_affiliation(org0, org1, role="TestOrgUnit")
+
+        table = s3db.pr_ancestor
+        query = (table.descendant_pe_id == org1)
+        self.assertEqual(db(query).count(), 0)
+        self.assertEqual(s3db.pr_realm(org1), [org0])
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+        current.deployment_settings.security.ancestor_index = \
+            self.ancestor_index
+
+# =============================================================================
+class PersonNameIndexTests(unittest.TestCase):
+    """ Tests for the fuzzy person name index """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+    # -------------------------------------------------------------------------
+    def testKeys(self):
+        """ Test normalization of names and index keys """
+
+        from s3db.pr import pr_PersonNameIndex as index
+
+        tokens = index.tokens(u"Jos\xe9  Mar\xeda", "O'Brien", None)
+        self.assertEqual(tokens, [u"jose", u"maria", u"o", u"brien"])
+
+        keys = index.keys([u"jose"])
+        self.assertTrue("s:J200" in keys)
+        self.assertTrue("t:$jo" in keys)
+        self.assertTrue("t:ose" in keys)
+        self.assertTrue("t:se$" in keys)
+
+    # -------------------------------------------------------------------------
+    def testSearch(self):
+        """ Test fuzzy search in the name index """
+
+        from s3db.pr import pr_PersonNameIndex as index
+
+        table = current.s3db.pr_person
+        person1 = table.insert(first_name="Xaverine",
+                               last_name="Quillfeather")
+        person2 = table.insert(first_name="Xavierine",
+                               last_name="Quilfeather")
+        person3 = table.insert(first_name="John",
+                               last_name="Quillfeather")
+        index.update([person1, person2, person3])
+
+        results = index.search("Xaverine Quillfeather")
+        person_ids = [row.id for score, row in results]
+        self.assertEqual(person_ids[:2], [person1, person2])
+        self.assertEqual(results[0][0], 1.0)
+        self.assertTrue(results[1][0] < 1.0)
+        self.assertFalse(person3 in person_ids)
+
+        # Renamed person is found under the new name only
+        current.db(table.id == person1).update(first_name="Xavier")
+        index.update(person1)
+        person_ids = [row.id for score, row in index.search("Xavier Quillfeather")]
+        self.assertEqual(person_ids[0], person1)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
 # =============================================================================
 class PersonDeduplicateTests(unittest.TestCase):
     """ PR Tests """
@@ -674,6 +925,8 @@ if __name__ == "__main__":
 
     run_suite(
         PRTests,
+        AncestorIndexTests,
+        PersonNameIndexTests,
         PersonDeduplicateTests,
         SavedSearchTests,
         ContactValidationTests,
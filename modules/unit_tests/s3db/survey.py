@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# Survey Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3db/survey.py
+#
+import unittest
+
+from gluon import *
+
+# =============================================================================
+@unittest.skipIf(not current.deployment_settings.has_module("survey"),
+                 "Survey module deactivated")
+class SurveyAnswerColumnTests(unittest.TestCase):
+    """ Tests for the columnar answer store """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        db = current.db
+        s3db = current.s3db
+
+        template_id = s3db.survey_template.insert(name="AnswerColumnTest")
+        self.series_id = s3db.survey_series.insert(name="AnswerColumnTest",
+                                                   template_id=template_id)
+
+        qtable = s3db.survey_question
+        self.q1 = qtable.insert(name="Q1", code="ACT-1", type="Numeric")
+        self.q2 = qtable.insert(name="Q2", code="ACT-2", type="Option")
+
+        self.completes = [self.add_complete(str(i), "Yes" if i % 2 else "No")
+                          for i in xrange(1, 5)]
+
+        current.response.s3.survey_answer_columns = None
+
+    # -------------------------------------------------------------------------
+    def add_complete(self, value1, value2):
+
+        s3db = current.s3db
+        complete_id = s3db.survey_complete.insert(series_id=self.series_id,
+                                                  answer_list="")
+        atable = s3db.survey_answer
+        atable.insert(complete_id=complete_id, question_id=self.q1, value=value1)
+        atable.insert(complete_id=complete_id, question_id=self.q2, value=value2)
+        return complete_id
+
+    # -------------------------------------------------------------------------
+    def testColumns(self):
+        """ Test building and incremental refresh of the answer columns """
+
+        s3db = current.s3db
+        getColumns = s3db.survey_getAnswerColumns
+
+        columns = getColumns(self.series_id)
+        complete_ids, values = columns[self.q1]
+        self.assertEqual(complete_ids, self.completes)
+        self.assertEqual(values, ["1", "2", "3", "4"])
+
+        # Store has been materialized
+        table = s3db.survey_answer_column
+        query = (table.series_id == self.series_id)
+        self.assertEqual(current.db(query).count(), 2)
+
+        # Delete one response, add another
+        ctable = s3db.survey_complete
+        current.db(ctable.id == self.completes[0]).update(deleted=True)
+        new_id = self.add_complete("5", "Yes")
+
+        current.response.s3.survey_answer_columns = None
+        columns = getColumns(self.series_id)
+        complete_ids, values = columns[self.q1]
+        self.assertEqual(complete_ids, self.completes[1:] + [new_id])
+        self.assertEqual(values, ["2", "3", "4", "5"])
+
+        # Same result as the per-question lookup
+        answers = s3db.survey_getAllAnswersForQuestionInSeries(self.q2,
+                                                               self.series_id)
+        self.assertEqual([a["value"] for a in answers],
+                         ["No", "Yes", "No", "Yes"])
+
+    # -------------------------------------------------------------------------
+    def testDuplicateColumns(self):
+        """ Test cleanup of columns inserted twice by concurrent refreshes """
+
+        db = current.db
+        s3db = current.s3db
+        getColumns = s3db.survey_getAnswerColumns
+
+        expected = getColumns(self.series_id)
+
+        # Simulate a concurrent refresh
+        table = s3db.survey_answer_column
+        row = db(table.question_id == self.q1).select(table.ALL,
+                                                      limitby=(0, 1)).first()
+        table.insert(series_id=self.series_id,
+                     question_id=self.q1,
+                     answers=row.answers,
+                     complete_mtime=row.complete_mtime)
+
+        current.response.s3.survey_answer_columns = None
+        self.assertEqual(getColumns(self.series_id), expected)
+
+        query = (table.series_id == self.series_id) & \
+                (table.question_id == self.q1)
+        rows = db(query).select(table.id)
+        self.assertEqual([r.id for r in rows], [row.id])
+
+    # -------------------------------------------------------------------------
+    def testAnalysis(self):
+        """ Test numeric and option analysis on the answer columns """
+
+        from s3survey import survey_analysis_type
+
+        s3db = current.s3db
+        getAnswers = s3db.survey_getAllAnswersForQuestionInSeries
+
+        answers = getAnswers(self.q1, self.series_id)
+        analysis = survey_analysis_type["Numeric"](self.q1, answers)
+        self.assertEqual(analysis.sum, 10.0)
+        self.assertEqual(analysis.min, 1.0)
+        self.assertEqual(analysis.max, 4.0)
+
+        analysis.advancedResults()
+        self.assertEqual(set(analysis.zscore.keys()), set(self.completes))
+        self.assertTrue(analysis.zscore[self.completes[0]] < 0)
+        self.assertTrue(analysis.zscore[self.completes[-1]] > 0)
+
+        answers = getAnswers(self.q2, self.series_id)
+        analysis = survey_analysis_type["Option"](self.q2, answers)
+        self.assertEqual(analysis.list, {"Yes": 2, "No": 2})
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.auth.override = False
+        current.response.s3.survey_answer_columns = None
+        current.db.rollback()
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        SurveyAnswerColumnTests,
+    )
+
+# END ========================================================================
@@ -187,6 +187,54 @@ settings.frontpage.rss = [
 #settings.search.max_results = 200
 # Maximum number of features for a Map Layer
 #settings.gis.max_features = 1000
+# Compute report aggregates in the database (GROUP BY) where possible
+#settings.ui.report_db_aggregate = True
+# Keyset pagination and cached record counts (seconds) for data tables
+#settings.ui.datatables_keyset = True
+#settings.ui.datatables_count_expire = 30
+# Cache representations of foreign keys across requests ("ram" or "disk")
+#settings.base.represent_cache = "ram"
+#settings.base.represent_cache_size = 10000
+# Store simplified polygons (pre-computed for these zoom levels) for maps
+#settings.gis.simplify_cache = True
+#settings.gis.simplify_zoom_levels = [4, 8, 12]
+# Time (in seconds) to cache the output of the Vector Tile endpoint (0 = no caching)
+#settings.gis.tile_cache_expire = 300
+# Use an in-process spatial index for Location lookups if there is no spatial DB
+#settings.gis.spatial_index = True
+# Rebuild the whole Location Tree feature by feature rather than in bulk
+#settings.gis.bulk_location_tree = False
+# Batch mode for imports (bulk lookups of duplicates, bulk inserts of new records)
+#settings.base.import_batch = True
+# Import large XML/CSV files incrementally, committing every this many elements/rows
+#settings.base.import_chunk_size = 1000
+# Number of parallel processes for PrePopulate imports (not with SQLite)
+#settings.base.prepopulate_workers = 4
+# Synchronize in pages of this many records (checkpointing each page)
+#settings.base.sync_page_size = 500
+# Number of concurrent requests to fetch the data for sync pull tasks
+#settings.base.sync_workers = 4
+# Notify groups of equivalent subscriptions with a single lookup
+#settings.msg.notify_batch = True
+# Process the Outbox in batches (bulk lookups, persistent SMTP connections)
+#settings.msg.outbox_batch_size = 500
+#settings.msg.outbox_workers = 4
+#settings.msg.outbox_rate = {"EMAIL": 10, "SMS": 1}
+# Look up models in a registry of model names (rebuilt when the model files change)
+#settings.base.model_registry = True
+# Profile model loading, customise-hooks and controllers (report in cache/s3profile.log)
+#settings.base.profile = True
+# Cache compiled ACLs across requests ("ram" for one process, "disk" to share between processes)
+#settings.security.acl_cache = "disk"
+#settings.security.acl_cache_expire = 300
+# Look up realms and OU descendants in a maintained ancestor index, build with static/scripts/tools/ancestors.py
+#settings.security.ancestor_index = True
+# Fuzzy name index for persons (duplicate checks), rebuild with static/scripts/tools/person_names.py
+#settings.pr.name_index = True
+# Number of processes to score candidate pairs in the duplicate finder task (s3_find_duplicates)
+#settings.base.merge_workers = 4
+# Search keys for organisation and location autocompletes, rebuild with static/scripts/tools/search_keys.py
+#settings.search.key_index = True
 
 # =============================================================================
 # Import the settings from the Template
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Post-migration script to (re-)build the ancestor index (pr_ancestor)
+# of the OU hierarchy from the pr_affiliation/pr_role records, required
+# after enabling settings.security.ancestor_index
+#
+# Execute like: python web2py.py -S eden -M -R applications/eden/static/scripts/tools/ancestors.py
+#
+import sys
+auth.override = True
+
+s3db.pr_rebuild_ancestors()
+
+db.commit()
+auth.override = False
+print >> sys.stderr, "Done."
@@ -37,3 +37,60 @@ try:
 except:
     # Index already present
     pass
+
+tablename = "gis_simplified"
+try:
+    db.executesql("CREATE INDEX simplified__idx on %s(tablename, record_id);" % tablename)
+except:
+    # Index already present
+    pass
+
+tablename = "survey_answer_column"
+try:
+    db.executesql("CREATE INDEX answer_column__idx on %s(series_id, question_id);" % tablename)
+except:
+    # Index already present (or Survey module not enabled)
+    pass
+
+tablename = "pr_ancestor"
+field = "ancestor_pe_id"
+try:
+    db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
+except:
+    # Index already present
+    pass
+field = "descendant_pe_id"
+try:
+    db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
+except:
+    # Index already present
+    pass
+
+tablename = "pr_person_name_key"
+try:
+    db.executesql("CREATE INDEX name_key__idx on %s(name_key, person_id);" % tablename)
+except:
+    # Index already present
+    pass
+try:
+    db.executesql("CREATE INDEX name_key_person_id__idx on %s(person_id);" % tablename)
+except:
+    # Index already present
+    pass
+
+tablename = "s3_search_key"
+if settings.get_database_type() == "postgres":
+    # LIKE-prefix queries need the pattern operator class
+    sql = "CREATE INDEX search_key__idx on %s(tablename, search_key varchar_pattern_ops);"
+else:
+    sql = "CREATE INDEX search_key__idx on %s(tablename, search_key);"
+try:
+    db.executesql(sql % tablename)
+except:
+    # Index already present
+    pass
+try:
+    db.executesql("CREATE INDEX search_key_record__idx on %s(tablename, record_id);" % tablename)
+except:
+    # Index already present
+    pass
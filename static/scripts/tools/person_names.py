@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Script to (re-)build the fuzzy name index (pr_person_name_key) for all
+# person records, required after enabling settings.pr.name_index
+#
+# Execute like: python web2py.py -S eden -M -R applications/eden/static/scripts/tools/person_names.py
+#
+import sys
+auth.override = True
+
+from s3db.pr import pr_PersonNameIndex
+pr_PersonNameIndex.rebuild()
+
+db.commit()
+auth.override = False
+print >> sys.stderr, "Done."
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# Replay a fixed list of URLs against a running instance and report where the
+# request time goes (model files, model classes, customise-hooks, controllers)
+#
+# - requires settings.base.profile = True in the instance being profiled
+#
+# - designed to be run within the web2py environment
+#   cd /path/to/web2py
+#   python web2py.py -S eden -M -R applications/eden/static/scripts/tools/profile_requests.py -A urls.txt [repeat] [cookie]
+#
+#   urls.txt: one URL per line, relative to the application, e.g.
+#       /default/index
+#       /pr/person
+#       # lines starting with # are ignored
+#
+#   repeat: number of times to request each URL (default 10)
+#   cookie: the Cookie header to send (e.g. the session cookie of a logged-in user)
+#
+
+import sys
+import time
+import urllib2
+
+args = sys.argv[1:]
+if not args:
+    print >> sys.stderr, "Usage: profile_requests.py urls.txt [repeat] [cookie]"
+    sys.exit(1)
+
+with open(args[0], "r") as f:
+    urls = [line.strip() for line in f
+            if line.strip() and not line.startswith("#")]
+repeat = int(args[1]) if len(args) > 1 else 10
+cookie = args[2] if len(args) > 2 else None
+
+base_url = "%s/%s" % (settings.get_base_public_url(), appname)
+
+S3Profiler = s3base.S3Profiler
+S3Profiler.clear()
+
+timings = []
+for url in urls:
+    durations = []
+    for i in xrange(repeat):
+        req = urllib2.Request("%s%s" % (base_url, url))
+        if cookie:
+            req.add_header("Cookie", cookie)
+        start = time.time()
+        try:
+            urllib2.urlopen(req).read()
+        except urllib2.URLError, e:
+            print >> sys.stderr, "%s: %s" % (url, e)
+            break
+        durations.append(time.time() - start)
+    if durations:
+        durations.sort()
+        timings.append((url,
+                        sum(durations) / len(durations),
+                        durations[len(durations) / 2],
+                        durations[-1],
+                        ))
+
+print "%-50s %10s %10s %10s" % ("URL", "Mean ms", "Median ms", "Max ms")
+for url, mean, median, maximum in timings:
+    print "%-50s %10.1f %10.1f %10.1f" % (url[:50],
+                                          mean * 1000,
+                                          median * 1000,
+                                          maximum * 1000)
+print
+print S3Profiler.render()
+
+# END =========================================================================
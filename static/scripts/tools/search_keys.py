@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Script to (re-)build the search keys (s3_search_key) for all organisation
+# and location records, required after enabling settings.search.key_index
+#
+# Execute like: python web2py.py -S eden -M -R applications/eden/static/scripts/tools/search_keys.py
+#
+import sys
+auth.override = True
+
+from s3.s3utils import S3SearchKey
+S3SearchKey.rebuild(s3db.org_organisation, ["name", "acronym"])
+S3SearchKey.rebuild(s3db.gis_location, ["name"])
+
+db.commit()
+auth.override = False
+print >> sys.stderr, "Done."